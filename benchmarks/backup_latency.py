@@ -0,0 +1,187 @@
+"""
+Влияние резервного копирования на задержку запросов работающего приложения.
+
+Запускает main.py или v0.6.0 на копии базы (как load_test.py) и гоняет
+смешанный трафик load_test.py фазами по --phase секунд: сначала без копий
+(baseline), затем для каждого способа из --methods копии снимаются подряд,
+пока идет фаза (с паузой --interval между ними). Способы:
+- backup — online backup API шагами по BACKUP_PAGES_PER_STEP страниц;
+- vacuum — VACUUM INTO;
+- single — backup API одним шагом: база заблокирована для записи на все
+  время копирования (так ведет себя копирование файла под блокировкой).
+По каждой фазе — число снятых копий, их средняя длительность и
+p50/p95/p99/max всех запросов и отдельно записи (POST /api/orders).
+--journal-mode переводит копию базы в режим WAL или DELETE до запуска.
+
+Запуск из корня репозитория:
+    python benchmarks/generate_dataset.py --app v0.6.0 --orders 100000 --database /tmp/v06_100k.db
+    python benchmarks/backup_latency.py --app v0.6.0 --database /tmp/v06_100k.db --phase 20
+    python benchmarks/backup_latency.py --app main --database /tmp/main_100k.db --journal-mode wal
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from load_test import APPS, ROOT_DIR, V06_DIR, BENCHMARKS_DIR, dataset_context, start_server, wait_ready, \
+    virtual_user, summarize
+
+# Настройки резервного копирования (переменные окружения) для каждого способа
+METHOD_ENV = {
+    "backup": {"BACKUP_METHOD": "backup"},
+    "vacuum": {"BACKUP_METHOD": "vacuum"},
+    "single": {"BACKUP_METHOD": "backup", "BACKUP_PAGES_PER_STEP": "-1"},
+}
+
+
+# Снятие копий подряд в отдельном процессе, пока не появится стоп-файл: приложение импортируется один раз,
+# и запуск интерпретатора не отнимает процессор у сервера. Печатает длительность каждой копии
+HELPER = {
+    "main": """
+import json, os, sys, time
+import main
+while not os.path.exists(sys.argv[1]):
+    print(json.dumps(main.create_backup()["seconds"]), flush=True)
+    time.sleep(float(sys.argv[2]))
+""",
+    "v0.6.0": """
+import json, os, sys, time
+from config import BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP
+from core import configure_backup, create_backup
+from database import current_tenant
+configure_backup(BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP)
+tenant = current_tenant()
+while not os.path.exists(sys.argv[1]):
+    print(json.dumps(create_backup(tenant.hot_path, tenant.archive_path)["seconds"]), flush=True)
+    time.sleep(float(sys.argv[2]))
+""",
+}
+
+
+def start_backups(args, run_dir, method):
+    """Процесс снятия копий той базы, с которой работает сервер; возвращает процесс и путь стоп-файла"""
+    stop_path = os.path.join(run_dir, f"stop-{method}")
+    env = dict(os.environ, BACKUP_DIR=os.path.join(run_dir, "backups"), BACKUP_KEEP="2", **METHOD_ENV[method])
+    if args.app == "main":
+        cwd = run_dir
+        env["PYTHONPATH"] = ROOT_DIR
+    else:
+        cwd = V06_DIR
+        env["DATABASE_URL"] = f"sqlite:///{run_dir}/load.db"
+    process = subprocess.Popen([sys.executable, "-c", HELPER[args.app], stop_path, str(args.interval)], cwd=cwd,
+                               env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return process, stop_path
+
+
+def run_phase(args, port, ctx, run_dir, method):
+    backups = None
+    if method != "baseline":
+        backups, stop_path = start_backups(args, run_dir, method)
+    started = time.perf_counter()
+    deadline = started + args.phase
+    samples = []
+    users = [threading.Thread(target=virtual_user, args=(index, args, port, ctx, deadline, started, samples))
+             for index in range(args.concurrency)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    measured = time.perf_counter() - started
+    durations, failed = [], False
+    if backups:
+        open(stop_path, "w").close()
+        output, errors = backups.communicate()
+        durations = [float(line) for line in output.split()]
+        failed = backups.returncode != 0
+        if failed:
+            print(f"{method}: копия не снята:\n{errors[-1500:]}", file=sys.stderr)
+    routes = summarize(samples, measured)
+    writes = [sample for sample in samples if sample[0].startswith("POST")]
+    return {
+        "backups": len(durations),
+        "backup_failed": failed,
+        "backup_mean_s": sum(durations) / len(durations) if durations else 0.0,
+        "all": routes["ИТОГО"],
+        "writes": summarize(writes, measured)["ИТОГО"] if writes else None,
+    }
+
+
+def prepare_database(args, run_dir):
+    """Копия базы в нужном режиме журнала; сервер затем копирует ее себе"""
+    database = os.path.join(run_dir, "source.db")
+    shutil.copyfile(args.database, database)
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute(f"PRAGMA journal_mode = {args.journal_mode}")
+    finally:
+        conn.close()
+    return database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "v0.6.0"], default="v0.6.0")
+    parser.add_argument("--database", help="база generate_dataset.py (используется копия)")
+    parser.add_argument("--orders", type=int, default=20000, help="размер новой базы, если --database не задан")
+    parser.add_argument("--journal-mode", choices=["delete", "wal"], default="delete")
+    parser.add_argument("--methods", default="backup,vacuum,single", help="способы через запятую")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--phase", type=float, default=15, help="секунд на фазу")
+    parser.add_argument("--warmup", type=float, default=3, help="секунд прогрева перед первой фазой")
+    parser.add_argument("--interval", type=float, default=0.5, help="пауза между копиями, с")
+    parser.add_argument("--timeout", type=float, default=30, help="таймаут одного запроса, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+    args.server, args.workers = "uvicorn", 1
+    methods = [method.strip() for method in args.methods.split(",") if method.strip()]
+    unknown = set(methods) - set(METHOD_ENV)
+    if unknown:
+        parser.error(f"неизвестные способы: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        if not args.database:
+            args.database = os.path.join(run_dir, "dataset.db")
+            subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, "generate_dataset.py"), "--app", args.app,
+                            "--orders", str(args.orders), "--seed", str(args.seed), "--database", args.database],
+                           check=True)
+        ctx = dataset_context(args.database)
+        database = prepare_database(args, run_dir)
+        process, port = start_server(args, run_dir, database)
+        results = {}
+        try:
+            wait_ready(process, port, APPS[args.app]["ready"], run_dir)
+            run_phase(argparse.Namespace(**{**vars(args), "phase": args.warmup}), port, ctx, run_dir, "baseline")
+            for phase in ["baseline"] + methods:
+                results[phase] = run_phase(args, port, ctx, run_dir, phase)
+                print(f"фаза {phase}: {results[phase]['all']['requests']} запросов, копий {results[phase]['backups']}",
+                      file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+
+    print(f"\n{args.app}, journal_mode={args.journal_mode}, заказов {ctx['orders']}, {args.concurrency} пользователей")
+    print(f"{'фаза':<10}{'копий':>7}{'копия, с':>10}{'RPS':>8}{'p50, мс':>9}{'p95, мс':>9}{'p99, мс':>9}"
+          f"{'max, мс':>9}{'ошибки':>8}{'запись p99':>12}")
+    base_p99 = results["baseline"]["all"]["p99_ms"]
+    for phase, result in results.items():
+        stats = result["all"]
+        write_p99 = f"{result['writes']['p99_ms']:.1f}" if result["writes"] else "-"
+        print(f"{phase:<10}{result['backups']:>7}{result['backup_mean_s']:>10.2f}{stats['rps']:>8.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}"
+              f"{stats['error_rate']:>8.2%}{write_p99:>12}"
+              + (f"  p99 {stats['p99_ms'] / base_p99 - 1:+.0%}" if phase != "baseline" and base_p99 else ""))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": {key: value for key, value in vars(args).items()}, "phases": results}, f,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Сравнение форматов экспорта заказов main.py: CSV, parquet и arrow.
+
+Заполняет временную базу N заказами, выгружает их в каждом формате и
+измеряет время выгрузки, размер файла и время загрузки в pandas.
+Требуется pyarrow.
+
+Запуск из корня репозитория:
+    python benchmarks/columnar_export.py --orders 100000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INSERT_BATCH_SIZE = 10000
+
+
+def seed(main, count):
+    from sqlalchemy import insert
+
+    main.Base.metadata.create_all(bind=main.current_tenant().engine)
+    db = main.SessionLocal()
+    try:
+        db.execute(insert(main.Employee), [
+            {"name": f"Менеджер {i}", "phone": "79990000000", "employee_type": "менеджер",
+             "base_salary": 30000, "order_rate": 500, "commission_rate": 5}
+            for i in range(5)
+        ] + [
+            {"name": f"Монтажник {i}", "phone": "79990000000", "employee_type": "монтажник",
+             "order_rate": 1500, "commission_rate": 0}
+            for i in range(10)
+        ])
+        db.execute(insert(main.Client), [
+            {"name": f"Клиент {i}", "phone": f"7999{i:07d}", "source": "Авито"}
+            for i in range(5000)
+        ])
+        db.execute(insert(main.Service), [
+            {"name": f"Услуга {i}", "category": "Монтаж", "material_cost": 100 * i, "price": 1000 + 100 * i}
+            for i in range(20)
+        ])
+
+        statuses = ["новый", "в работе", "завершен", "отменен"]
+        for start in range(1, count + 1, INSERT_BATCH_SIZE):
+            ids = range(start, min(start + INSERT_BATCH_SIZE, count + 1))
+            db.execute(insert(main.Order), [{
+                "id": i,
+                "client_id": 1 + i % 5000,
+                "service_id": 1 + i % 20,
+                "one_employee_id": 6 + i % 10,
+                "two_employee_id": None if i % 2 else 6 + (i + 1) % 10,
+                "manager_id": 1 + i % 5,
+                "order_date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+                "completion_date": None if i % 3 else f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 18:00",
+                "status": statuses[i % 4],
+                "notes": None if i % 5 else "Позвонить за час"
+            } for i in ids])
+            db.execute(insert(main.OrderService), [
+                {"order_id": i, "service_id": 1 + (i * 7) % 20} for i in ids if i % 2
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # main.py открывает ./test.db и монтирует ./static относительно текущего каталога
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(ROOT_DIR, name), os.path.join(tmp_dir, name))
+        os.chdir(tmp_dir)
+        sys.path.insert(0, ROOT_DIR)
+        import main as app_main
+
+        seed(app_main, args.orders)
+        filters = {name: None for name in (
+            "status", "client_name", "date_from", "date_to", "client_source",
+            "service_category", "employee_type", "employee_active"
+        )}
+
+        exporters = {
+            "csv": lambda: app_main.stream_export_csv("orders", filters),
+            "parquet": lambda: app_main.stream_export_arrow("orders", filters, "parquet"),
+            "arrow": lambda: app_main.stream_export_arrow("orders", filters, "arrow"),
+        }
+        readers = {
+            "csv": pd.read_csv,
+            "parquet": pd.read_parquet,
+            "arrow": pd.read_feather,
+        }
+
+        print(f"{'формат':<10}{'выгрузка, с':>14}{'размер, МБ':>13}{'pandas, с':>12}")
+        for name, export in exporters.items():
+            started = time.perf_counter()
+            data = b"".join(export())
+            export_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            frame = readers[name](io.BytesIO(data))
+            read_seconds = time.perf_counter() - started
+            assert len(frame) == args.orders, f"{name}: {len(frame)} строк вместо {args.orders}"
+
+            print(f"{name:<10}{export_seconds:>14.2f}{len(data) / (1024 * 1024):>13.2f}{read_seconds:>12.3f}")
+
+        os.chdir(ROOT_DIR)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Проверка экспорта заказов v0.6.0 на большом объеме.
+
+Создает временную базу с N заказами (по умолчанию 200 000), выгружает их
+через ExportService.export_orders и проверяет, что:
+- в файле ровно N строк и все ID заказов присутствуют без повторов;
+- рост пикового RSS при экспорте не превышает --max-rss-mb.
+
+Экспорт выполняется в отдельном процессе, чтобы заполнение базы не
+влияло на замер памяти. Код возврата 1 — проверка не пройдена.
+
+Запуск из корня репозитория:
+    python benchmarks/export_orders_check.py --orders 200000
+    python benchmarks/export_orders_check.py --orders 50000 --format xlsx
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+V06_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "v0.6.0")
+
+INSERT_BATCH_SIZE = 10000
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def seed(count):
+    """Заполнение базы: справочники и count заказов с услугой и монтажником"""
+    from sqlalchemy import insert
+    from database import SessionLocal, init_db
+    from models import Client, Employee, Service, Order, OrderEmployee, OrderService
+
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(insert(Employee), [
+            {"name": f"Менеджер {i}", "phone": "79990000000", "employee_type": "менеджер", "base_salary": 30000}
+            for i in range(5)
+        ] + [
+            {"name": f"Монтажник {i}", "phone": "79990000000", "employee_type": "монтажник"}
+            for i in range(10)
+        ])
+        db.execute(insert(Client), [
+            {"name": f"Клиент {i}", "phone": f"7999{i:07d}", "source": "Авито"}
+            for i in range(5000)
+        ])
+        db.execute(insert(Service), [
+            {"name": f"Услуга {i}", "category": "Доп услуга", "selling_price": 1000 + i * 100}
+            for i in range(20)
+        ])
+
+        statuses = ["новый", "в работе", "завершен", "отменен"]
+        for start in range(1, count + 1, INSERT_BATCH_SIZE):
+            ids = range(start, min(start + INSERT_BATCH_SIZE, count + 1))
+            db.execute(insert(Order), [{
+                "id": i,
+                "client_id": 1 + i % 5000,
+                "manager_id": 1 + i % 5,
+                "order_date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+                "status": statuses[i % 4],
+                "notes": None if i % 3 else "Позвонить за час",
+                "mount_price": 10000,
+                "owner_commission": 1500,
+                "created_at": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}"
+            } for i in ids])
+            db.execute(insert(OrderEmployee), [
+                {"order_id": i, "employee_id": 6 + i % 10, "employee_type": "монтажник", "base_payment": 1500}
+                for i in ids
+            ])
+            db.execute(insert(OrderService), [
+                {"order_id": i, "service_id": 1 + i % 20, "selling_price": 1000 + (i % 20) * 100, "sold_by_id": 1 + i % 5}
+                for i in ids
+            ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_export(export_format):
+    """Экспорт всех заказов; возвращает ID из файла и прирост пикового RSS"""
+    from database import SessionLocal
+    from services import ExportService
+
+    db = SessionLocal()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        result = ExportService.export_orders(db, export_format)
+        ids = []
+        if export_format == "csv":
+            header_seen = False
+            for block in result["data"]:
+                for row in csv.reader(io.StringIO(block.decode("utf-8"))):
+                    if not header_seen:
+                        header_seen = True
+                        continue
+                    ids.append(int(row[0]))
+        else:
+            import openpyxl
+            output = tempfile.TemporaryFile()
+            for block in result["data"]:
+                output.write(block)
+            output.seek(0)
+            workbook = openpyxl.load_workbook(output, read_only=True)
+            for row in workbook.active.iter_rows(min_row=2, max_col=1, values_only=True):
+                ids.append(row[0])
+            workbook.close()
+    finally:
+        db.close()
+
+    return {
+        "ids": ids,
+        "seconds": round(time.perf_counter() - started, 1),
+        "rss_growth_mb": round(peak_rss_mb() - baseline, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--max-rss-mb", type=float, default=150)
+    parser.add_argument("--step", choices=["seed", "export"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step:
+        sys.path.insert(0, V06_DIR)
+        if args.step == "seed":
+            seed(args.orders)
+        else:
+            print(json.dumps(run_export(args.format)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_dir}/check.db")
+        command = [sys.executable, os.path.abspath(__file__), "--orders", str(args.orders), "--format", args.format]
+
+        started = time.perf_counter()
+        subprocess.run(command + ["--step", "seed"], env=env, check=True)
+        print(f"База заполнена: {args.orders} заказов за {time.perf_counter() - started:.1f} с")
+
+        output = subprocess.run(command + ["--step", "export"], env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+    ids = result["ids"]
+    errors = []
+    if len(ids) != args.orders:
+        errors.append(f"в файле {len(ids)} строк вместо {args.orders}")
+    if len(set(ids)) != len(ids):
+        errors.append(f"повторяющихся ID: {len(ids) - len(set(ids))}")
+    if set(ids) != set(range(1, args.orders + 1)):
+        errors.append("набор ID не совпадает с заказами в базе")
+    if result["rss_growth_mb"] > args.max_rss_mb:
+        errors.append(f"прирост RSS {result['rss_growth_mb']} МБ больше {args.max_rss_mb} МБ")
+
+    print(f"Экспорт {args.format}: {len(ids)} строк за {result['seconds']} с, прирост пикового RSS {result['rss_growth_mb']} МБ")
+    if errors:
+        print("Проверка не пройдена: " + "; ".join(errors))
+        sys.exit(1)
+    print("Проверка пройдена")
+
+
+if __name__ == "__main__":
+    main()
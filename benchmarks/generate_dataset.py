@@ -0,0 +1,509 @@
+"""
+Генератор синтетической базы с сезонностью для нагрузочных тестов.
+
+Создает новую базу SQLite по схеме main.py или v0.6.0 и заполняет ее
+правдоподобными объемами:
+- клиенты по источникам (Авито, Яндекс услуги, ВК...), часть — повторные;
+- каталог услуг по категориям и мощностям (7/9/12/18 БТЮ);
+- заказы с летним пиком монтажей и ростом год к году, один-два монтажника,
+  кондиционеры, монтажные комплекты и доп. услуги;
+- ежемесячные авансы, зарплаты и штрафы, расходы (закупка кондиционеров,
+  материалы, бензин, аренда, налоги);
+- для v0.6.0 — финансовые транзакции и баланс компании.
+Результат детерминирован: одинаковые параметры и --seed дают одинаковую базу.
+
+Строки вставляются пачками по --batch-size в одной транзакции без журнала,
+индексы строятся после загрузки, поэтому 1 млн заказов собирается за минуты.
+Рассчитано на объемы от 1 тыс. до 10 млн заказов.
+
+Запуск из корня репозитория:
+    python benchmarks/generate_dataset.py --app main --orders 100000 --database /tmp/main_100k.db
+    python benchmarks/generate_dataset.py --app v0.6.0 --orders 1000000 --database /tmp/v06_1m.db
+"""
+import argparse
+import calendar
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+V06_DIR = os.path.join(ROOT_DIR, "v0.6.0")
+
+# Относительный спрос по месяцам: пик монтажей кондиционеров в июне-июле
+MONTH_WEIGHTS = [0.35, 0.35, 0.5, 0.8, 1.5, 2.4, 2.6, 2.0, 1.0, 0.5, 0.35, 0.4]
+# Рост спроса за год
+YEARLY_GROWTH = 0.2
+# Получасовых слотов в рабочем дне (9:00-20:00)
+DAY_SLOTS = 22
+
+CLIENT_SOURCES = {"Авито": 35, "Яндекс услуги": 20, "ВК": 15, "Рекомендации": 15, "Листовки": 10, "Другое": 5}
+# Доля заказов от уже обращавшихся клиентов
+REPEAT_CLIENT_SHARE = 0.15
+
+# Доли мощностей в заказах; закупка и продажа кондиционера, цена монтажа, комплект
+POWER_TYPES = {"7 БТЮ": 25, "9 БТЮ": 35, "12 БТЮ": 25, "18 БТЮ": 15}
+AC_PRICES = {"7 БТЮ": (19000, 27000), "9 БТЮ": (22000, 31000), "12 БТЮ": (29000, 40000), "18 БТЮ": (41000, 56000)}
+MOUNT_PRICES = {"7 БТЮ": 10000, "9 БТЮ": 10000, "12 БТЮ": 12000, "18 БТЮ": 12000}
+KIT_PRICES = {"7 БТЮ": (1500, 3000), "9 БТЮ": (1500, 3000), "12 БТЮ": (2200, 4000), "18 БТЮ": (2800, 5000)}
+AC_BRANDS = ["Ballu", "Haier", "Midea", "Royal Clima"]
+
+# Доп. услуги: название, себестоимость, цена, вес
+ADDONS = [
+    ("Дополнительная трасса, 1 м", 600, 1500, 30),
+    ("Штробление стены", 0, 2500, 10),
+    ("Дренажная помпа", 2500, 5000, 8),
+    ("Чистка кондиционера", 300, 3000, 12),
+    ("Монтаж на высоте", 0, 3000, 6),
+]
+ADDON_COUNTS = {0: 50, 1: 30, 2: 15, 3: 5}
+
+AC_SHARE = 0.65  # Кондиционер куплен у нас
+KIT_SHARE = 0.7  # Монтажный комплект
+VIBRO_SHARE = 0.3  # Виброопора (v0.6.0)
+DISMANTLE_SHARE = 0.08  # Демонтаж старого кондиционера
+FREON_SHARE = 0.05  # Дозаправка фреоном (main.py)
+SECOND_INSTALLER_SHARE = 0.45
+OWNER_ON_MOUNT_SHARE = 0.05  # Владелец выезжает на монтаж (v0.6.0)
+UPSELL_SHARE = 0.1  # Монтаж продан дороже стандартной цены
+FINE_SHARE = 0.04  # Вероятность штрафа сотруднику за месяц
+
+INITIAL_BALANCE = 500000
+MONTHLY_RENT = 45000
+TAX_RATE = 0.06
+
+FIRST_NAMES = ["Александр", "Алексей", "Андрей", "Анна", "Дмитрий", "Екатерина", "Елена", "Иван", "Ирина",
+               "Максим", "Мария", "Наталья", "Никита", "Ольга", "Сергей", "Татьяна", "Юлия"]
+LAST_NAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров"]
+NOTES = ["Позвонить за час", "Домофон не работает", "Оплата картой", "Частный дом", "Нужен пропуск"]
+FINES = ["Штраф: опоздание на объект", "Штраф: жалоба клиента", "Штраф: порча имущества"]
+
+
+class BulkWriter:
+    """Буферы строк по таблицам: явные id и вставка пачками по batch_size"""
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = defaultdict(list)
+        self.next_ids = defaultdict(lambda: 1)
+        self.counts = defaultdict(int)
+
+    def add(self, table, row):
+        row["id"] = row_id = self.next_ids[table.name]
+        self.next_ids[table.name] = row_id + 1
+        buffer = self.buffers[table.name]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+        return row_id
+
+    def flush(self, table):
+        buffer = self.buffers[table.name]
+        if buffer:
+            # Кортежи напрямую в executemany драйвера: компиляция параметров SQLAlchemy
+            # на миллионах строк занимала около трети времени загрузки
+            columns = list(buffer[0])
+            statement = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            self.conn.exec_driver_sql(statement, [tuple(row[column] for column in columns) for row in buffer])
+            self.counts[table.name] += len(buffer)
+            buffer.clear()
+
+    def close(self, tables):
+        for table in tables:
+            self.flush(table)
+
+
+def month_plan(start, months, orders):
+    """Число заказов по месяцам: сезонный вес, рост год к году, точная сумма"""
+    weights = []
+    for index in range(months):
+        year, month = divmod(start.month - 1 + index, 12)
+        weights.append(MONTH_WEIGHTS[month] * (1 + YEARLY_GROWTH) ** (index / 12))
+    total = sum(weights)
+    raw = [orders * weight / total for weight in weights]
+    counts = [int(value) for value in raw]
+    # Остаток распределяется по месяцам с наибольшей дробной частью
+    for index in sorted(range(months), key=lambda i: raw[i] - counts[i], reverse=True)[:orders - sum(counts)]:
+        counts[index] += 1
+    plan = []
+    for index, count in enumerate(counts):
+        year, month = divmod(start.month - 1 + index, 12)
+        plan.append((date(start.year + year, month + 1, 1), count))
+    return plan
+
+
+def weighted(rng, options):
+    """Случайный ключ словаря {значение: вес}"""
+    return rng.choices(list(options), weights=list(options.values()))[0]
+
+
+def add_services(app, tables, writer, created_at):
+    """Каталог услуг; возвращает справочник {роль: [(id, себестоимость, цена), ...]}"""
+    services = tables["services"]
+    catalog = defaultdict(list)
+
+    def add(role, name, category, cost, price, power_type=None, manager_bonus=False):
+        if app == "main":
+            row = {"name": name, "category": category, "material_cost": cost, "price": price}
+        else:
+            row = {"name": name, "category": category, "power_type": power_type, "purchase_price": cost,
+                   "selling_price": price, "default_price": price if category == "Монтаж" else None,
+                   "is_manager_bonus": manager_bonus, "installer_bonus_fixed": 250,
+                   "profit_margin_percent": 0.3}
+        row["created_at"] = created_at
+        catalog[role].append((writer.add(services, row), cost, price))
+
+    for mount_power in ("7-9", "12-18"):
+        mount_price = MOUNT_PRICES[mount_power.split("-")[0] + " БТЮ"]
+        cost = 1500 if app == "main" else 0
+        add(f"mount {mount_power}", f"Монтаж {mount_power} БТЮ", "Монтаж", cost, mount_price)
+    for power, (purchase, selling) in AC_PRICES.items():
+        for shift, brand in enumerate(AC_BRANDS):
+            add(f"ac {power}", f"Кондиционер {brand} {power}", "Кондиционер",
+                purchase + 1000 * shift, selling + 1500 * shift, power, True)
+    if app == "main":
+        add("dismantle", "Демонтаж кондиционера", "Демонтаж", 0, 3000)
+        add("freon", "Дозаправка фреоном", "Фреон", 800, 2500)
+    else:
+        for power, (purchase, selling) in KIT_PRICES.items():
+            add(f"kit {power}", f"Монтажный комплект {power}", "Монтажный комплект", purchase, selling, power)
+        add("vibro", "Виброопора", "Виброопора", 400, 1200)
+        add("dismantle", "Демонтаж кондиционера", "Доп услуга", 0, 3000, manager_bonus=True)
+    for name, cost, price, _ in ADDONS:
+        add("addon", name, "Доп услуга", cost, price, manager_bonus=True)
+    return catalog
+
+
+def add_employees(app, tables, writer, rng, orders, hired):
+    """Менеджеры и монтажники (и владелец для v0.6.0), штат растет с объемом заказов"""
+    employees = tables["employees"]
+    staff = {"менеджер": [], "монтажник": [], "владелец": []}
+    counts = {"менеджер": max(2, orders // 10000), "монтажник": max(4, orders // 2000)}
+    if app != "main":
+        counts["владелец"] = 1
+    for employee_type, count in counts.items():
+        for _ in range(count):
+            row = {"name": f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}",
+                   "phone": f"79{rng.randrange(10 ** 9):09d}", "employee_type": employee_type,
+                   "base_salary": 30000 if employee_type == "менеджер" else None, "active": 1,
+                   "created_at": hired}
+            if app == "main":
+                row["order_rate"] = 500 if employee_type == "менеджер" else 1500
+                row["commission_rate"] = 5 if employee_type == "менеджер" else 10
+            staff[employee_type].append(writer.add(employees, row))
+    return staff
+
+
+def order_status(rng, days_left):
+    """Статус по давности заказа относительно конца периода"""
+    if days_left < 3:
+        return rng.choice(["новый", "в работе"])
+    if days_left < 10:
+        return weighted(rng, {"в работе": 30, "завершен": 60, "отменен": 10})
+    return weighted(rng, {"завершен": 92, "отменен": 8})
+
+
+def generate(app, tables, writer, rng, orders, start, months):
+    """Все данные периода: справочники, затем заказы, выплаты и расходы по месяцам"""
+    plan = month_plan(start, months, orders)
+    end = plan[-1][0] + timedelta(days=calendar.monthrange(plan[-1][0].year, plan[-1][0].month)[1] - 1)
+    start_day = start.isoformat()
+
+    catalog = add_services(app, tables, writer, start_day)
+    staff = add_employees(app, tables, writer, rng, orders, start_day)
+    managers, installers = staff["менеджер"], staff["монтажник"]
+    addon_weights = [weight for *_, weight in ADDONS]
+    ac_ids = {service_id for role, entries in catalog.items() if role.startswith("ac ") for service_id, _, _ in entries}
+
+    transactions = tables.get("financial_transactions")
+    balance = {"amount": INITIAL_BALANCE, "last_id": None, "last_type": None}
+
+    def transaction(day, amount, transaction_type, source_type, source_id, description):
+        if transactions is None:
+            return
+        balance["amount"] += amount if transaction_type == "доход" else -amount
+        balance["last_id"] = writer.add(transactions, {
+            "transaction_date": day, "amount": amount, "transaction_type": transaction_type,
+            "source_type": source_type, "source_id": source_id, "description": description, "created_at": day
+        })
+        balance["last_type"] = transaction_type
+
+    transaction(start_day, INITIAL_BALANCE, "доход", "вклад владельца", None, "Начальный капитал")
+
+    clients = 0
+    for month_start, count in plan:
+        days_in_month = calendar.monthrange(month_start.year, month_start.month)[1]
+        accrued = defaultdict(float)
+        stats = {"completed": 0, "revenue": 0.0, "ac_units": 0, "ac_purchase": 0.0}
+
+        for slot in sorted(rng.randrange(days_in_month * DAY_SLOTS) for _ in range(count)):
+            day = month_start + timedelta(days=slot // DAY_SLOTS)
+            minutes = 9 * 60 + 30 * (slot % DAY_SLOTS)
+            day_str = day.isoformat()
+            order_date = f"{day_str} {minutes // 60:02d}:{minutes % 60:02d}"
+
+            if clients and rng.random() < REPEAT_CLIENT_SHARE:
+                client_id = rng.randint(1, clients)
+            else:
+                client_id = writer.add(tables["clients"], {
+                    "name": f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}",
+                    "phone": f"79{rng.randrange(10 ** 9):09d}", "source": weighted(rng, CLIENT_SOURCES),
+                    "created_at": day_str
+                })
+                clients += 1
+
+            status = order_status(rng, (end - day).days)
+            completion_date = None
+            if status == "завершен":
+                completion_date = (day + timedelta(days=rng.choice([0, 0, 1, 1, 2, 3]))).isoformat() + " 18:00"
+            power = weighted(rng, POWER_TYPES)
+            manager_id = rng.choice(managers)
+            crew = [rng.choice(installers)]
+            if rng.random() < SECOND_INSTALLER_SHARE:
+                second = rng.choice(installers)
+                if second != crew[0]:
+                    crew.append(second)
+            mount_id, mount_cost, mount_price = catalog["mount 7-9" if power in ("7 БТЮ", "9 БТЮ") else "mount 12-18"][0]
+            if rng.random() < UPSELL_SHARE:
+                mount_price += rng.choice([1000, 2000, 3000])
+
+            # Проданные услуги: (запись каталога, кто продал)
+            sold = []
+            if rng.random() < AC_SHARE:
+                sold.append((rng.choice(catalog[f"ac {power}"]), manager_id))
+            if app != "main" and rng.random() < KIT_SHARE:
+                sold.append((catalog[f"kit {power}"][0], manager_id))
+            if app != "main" and rng.random() < VIBRO_SHARE:
+                sold.append((catalog["vibro"][0], crew[0]))
+            if rng.random() < DISMANTLE_SHARE:
+                sold.append((catalog["dismantle"][0], crew[0]))
+            if app == "main" and rng.random() < FREON_SHARE:
+                sold.append((catalog["freon"][0], crew[0]))
+            for entry in rng.choices(catalog["addon"], weights=addon_weights, k=weighted(rng, ADDON_COUNTS)):
+                sold.append((entry, rng.choice([manager_id, crew[0]])))
+
+            notes = rng.choice(NOTES) if rng.random() < 0.2 else None
+            if app == "main":
+                order_id = writer.add(tables["orders"], {
+                    "client_id": client_id, "service_id": mount_id, "one_employee_id": crew[0],
+                    "two_employee_id": crew[1] if len(crew) > 1 else None, "manager_id": manager_id,
+                    "order_date": order_date, "completion_date": completion_date, "notes": notes,
+                    "status": status, "created_at": day_str
+                })
+                for (service_id, _, _), _ in sold:
+                    writer.add(tables["order_services"], {"order_id": order_id, "service_id": service_id})
+            else:
+                order_id = writer.add(tables["orders"], {
+                    "client_id": client_id, "manager_id": manager_id, "order_date": order_date,
+                    "completion_date": completion_date, "notes": notes, "status": status,
+                    "mount_price": mount_price, "owner_commission": 1500, "created_at": day_str
+                })
+                if rng.random() < OWNER_ON_MOUNT_SHARE:
+                    crew.append(staff["владелец"][0])
+                for employee_id in crew:
+                    writer.add(tables["order_employees"], {
+                        "order_id": order_id, "employee_id": employee_id,
+                        "employee_type": "владелец_на_монтаже" if employee_id in staff["владелец"] else "монтажник",
+                        "base_payment": 1500, "created_at": day_str
+                    })
+                for (service_id, _, price), sold_by_id in sold:
+                    writer.add(tables["order_services"], {
+                        "order_id": order_id, "service_id": service_id, "selling_price": price,
+                        "sold_by_id": sold_by_id, "created_at": day_str
+                    })
+
+            if status != "завершен":
+                continue
+            # Начисления за месяц — основа для авансов и зарплат
+            total = mount_price + sum(price for (_, _, price), _ in sold)
+            stats["completed"] += 1
+            stats["revenue"] += total
+            accrued[manager_id] += 250
+            for employee_id in crew:
+                accrued[employee_id] += 1500
+            for (service_id, cost, price), sold_by_id in sold:
+                is_ac = service_id in ac_ids
+                if sold_by_id == manager_id:
+                    accrued[manager_id] += (0.2 if is_ac else 0.3) * (price - cost)
+                else:
+                    accrued[sold_by_id] += 250
+                if is_ac:
+                    stats["ac_units"] += 1
+                    stats["ac_purchase"] += cost
+            transaction(completion_date[:10], total, "доход", "заказ", order_id, f"Заказ №{order_id} - завершен")
+
+        add_month_payments(tables, writer, rng, month_start, days_in_month, end, managers, installers,
+                           accrued, transaction)
+        add_month_expenses(app, tables, writer, rng, month_start, days_in_month, stats, transaction)
+
+    if transactions is not None:
+        writer.add(tables["company_balance"], {
+            "balance": balance["amount"], "initial_balance": INITIAL_BALANCE,
+            "last_transaction_id": balance["last_id"], "last_transaction_type": balance["last_type"],
+            "created_at": start_day, "updated_at": end.isoformat()
+        })
+    else:
+        writer.add(tables["company_balance"], {
+            "balance": INITIAL_BALANCE, "initial_balance": INITIAL_BALANCE, "updated_at": end.isoformat()
+        })
+
+
+def add_month_payments(tables, writer, rng, month_start, days_in_month, end, managers, installers, accrued,
+                       transaction):
+    """Аванс 20-го, зарплата 5-го числа следующего месяца и редкие штрафы"""
+    payments = tables["payments"]
+    stamped = "created_at" in payments.c
+    month = month_start.strftime("%Y-%m")
+    advance_day = month_start.replace(day=20)
+    salary_day = month_start + timedelta(days=days_in_month + 4)
+    manager_ids = set(managers)
+
+    for employee_id in managers + installers:
+        total = accrued[employee_id] + (30000 if employee_id in manager_ids else 0)
+        entries = []
+        if total > 0:
+            advance = round(total * 0.4, -2)
+            entries += [(advance_day, advance, f"Аванс за {month}"), (salary_day, round(total - advance), f"Зарплата за {month}")]
+        if rng.random() < FINE_SHARE:
+            entries.append((month_start.replace(day=rng.randint(1, days_in_month)), -rng.choice([500, 1000, 3000]),
+                            rng.choice(FINES)))
+        for day, amount, description in entries:
+            if day > end:
+                continue
+            row = {"employee_id": employee_id, "amount": amount, "payment_date": day.isoformat(),
+                   "description": description}
+            if stamped:
+                row["created_at"] = day.isoformat()
+            payment_id = writer.add(payments, row)
+            # Штрафы не уменьшают баланс компании
+            if amount > 0:
+                transaction(day.isoformat(), amount, "расход", "выплата", payment_id, f"Выплата: {description}")
+
+
+def add_month_expenses(app, tables, writer, rng, month_start, days_in_month, stats, transaction):
+    """Закупка кондиционеров партиями, материалы и бензин по неделям, аренда и налоги"""
+    entries = [("Прочее" if app == "main" else "Аренда", MONTHLY_RENT, "Аренда офиса и склада", 1, "операционный")]
+    lots = -(-stats["ac_units"] // 20)
+    for _ in range(lots):
+        entries.append(("Закупка кондиционеров", round(stats["ac_purchase"] / lots), "Партия кондиционеров",
+                        rng.randint(1, days_in_month), "закупка товара"))
+    for week in range(4):
+        day = min(days_in_month, 7 * week + rng.randint(1, 7))
+        entries.append(("Материалы", round(stats["completed"] * 700 / 4), "Трасса, кабель, крепеж", day, "операционный"))
+        entries.append(("Бензин", round(stats["completed"] * 400 / 4), None, day, "операционный"))
+    if app != "main":
+        entries.append(("Налоги", round(stats["revenue"] * TAX_RATE), "УСН 6%", days_in_month, "налоги"))
+
+    for category, amount, description, day_number, expense_type in entries:
+        if amount <= 0:
+            continue
+        day = month_start.replace(day=day_number).isoformat()
+        row = {"category": category, "amount": amount, "description": description, "expense_date": day,
+               "created_at": day}
+        if app != "main":
+            row.update({"expense_type": expense_type, "related_order_id": None, "related_service_id": None})
+        expense_id = writer.add(tables["expenses"], row)
+        transaction(day, amount, "расход", "расход", expense_id, f"Расход: {category} - {description or ''}")
+
+
+def load_tables(app, tmp_dir):
+    """Метаданные моделей выбранной схемы и таблицы по ролям (приложение не запускается)"""
+    roles = ["Client", "Employee", "Service", "Order", "OrderService", "Payment", "Expense", "CompanyBalance"]
+    if app == "main":
+        # main.py монтирует ./static и ./templates относительно текущего каталога
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(ROOT_DIR, name), os.path.join(tmp_dir, name))
+        os.chdir(tmp_dir)
+        sys.path.insert(0, ROOT_DIR)
+        import main as models
+        os.chdir(ROOT_DIR)
+    else:
+        sys.path.insert(0, V06_DIR)
+        import models
+        roles += ["OrderEmployee", "FinancialTransaction"]
+
+    # В v0.6.0 имена таблиц другие (orderservices, companybalances), генератор обращается по ролям
+    names = {
+        "Client": "clients", "Employee": "employees", "Service": "services", "Order": "orders",
+        "OrderService": "order_services", "OrderEmployee": "order_employees", "Payment": "payments",
+        "Expense": "expenses", "CompanyBalance": "company_balance", "FinancialTransaction": "financial_transactions",
+    }
+    tables = {names[role]: getattr(models, role).__table__ for role in roles}
+    return tables["orders"].metadata, tables
+
+
+def build_dataset(engine, app, metadata, tables, orders, seed=42, start=date(2023, 1, 1), months=36,
+                  batch_size=10000):
+    """
+    Схема и данные в пустой базе engine. Возвращает число строк по таблицам
+    и время загрузки и построения индексов. Используется и другими
+    бенчмарками (например, с базой в памяти).
+    """
+    from sqlalchemy.schema import CreateTable
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        # База собирается с нуля: журнал и fsync не нужны, при сбое файл просто создается заново
+        conn.exec_driver_sql("PRAGMA journal_mode=OFF")
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        conn.exec_driver_sql("PRAGMA cache_size=-262144")
+        for table in metadata.sorted_tables:
+            conn.execute(CreateTable(table))
+
+        writer = BulkWriter(conn, batch_size)
+        generate(app, tables, writer, random.Random(seed), orders, start, months)
+        writer.close(tables.values())
+        loaded = time.perf_counter()
+
+        # Индексы дешевле построить один раз после загрузки, чем обновлять при каждой вставке
+        for table in metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                index.create(conn)
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+    return dict(writer.counts), loaded - started, time.perf_counter() - loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "v0.6.0"], default="main")
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--database", required=True, help="путь к создаваемому файлу SQLite")
+    parser.add_argument("--force", action="store_true", help="перезаписать существующий файл")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", default="2023-01", help="первый месяц периода, YYYY-MM")
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+
+    database = os.path.abspath(args.database)
+    if os.path.exists(database):
+        if not args.force:
+            parser.error(f"{database} уже существует, для перезаписи укажите --force")
+        os.remove(database)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metadata, tables = load_tables(args.app, tmp_dir)
+
+    engine = create_engine(f"sqlite:///{database}")
+    counts, load_seconds, index_seconds = build_dataset(
+        engine, args.app, metadata, tables, args.orders, args.seed, date.fromisoformat(f"{args.start}-01"),
+        args.months, args.batch_size
+    )
+    engine.dispose()
+
+    for name, count in sorted(counts.items()):
+        print(f"{name:<26}{count:>12}")
+    print(f"\nзагрузка {load_seconds:.1f} с, индексы {index_seconds:.1f} с, "
+          f"размер {os.path.getsize(database) / (1024 * 1024):.1f} МБ: {database}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Сериализация и сжатие JSON-ответов main.py.
+
+Заполняет временную базу N заказами, получает реальные ответы
+/api/orders/list, /api/finance/orders и /api/export/preview и сравнивает:
+- прежний путь FastAPI (jsonable_encoder + json.dumps) и orjson;
+- размер ответа без сжатия, с gzip и brotli на уровнях, пригодных для
+  сжатия на каждый запрос.
+Требуются orjson и brotli.
+
+Запуск из корня репозитория:
+    python benchmarks/json_responses.py --orders 20000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from columnar_export import seed
+
+ENDPOINTS = [
+    "/api/orders/list?limit=100",
+    "/api/finance/orders?limit=100",
+    "/api/export/preview?export_type=orders&limit=500",
+]
+
+
+def best_time(function, repeat):
+    """Минимальное время из repeat запусков, мс"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    import brotli
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+
+    def encode_default(content):
+        # То же, что FastAPI + starlette JSONResponse до перехода на orjson
+        return json.dumps(
+            jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    compressors = {
+        "gzip-6": lambda body: gzip.compress(body, compresslevel=6),
+        "br-4": lambda body: brotli.compress(body, quality=4),
+        "br-5": lambda body: brotli.compress(body, quality=5),
+        "br-6": lambda body: brotli.compress(body, quality=6),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # main.py открывает ./test.db и монтирует ./static относительно текущего каталога
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(ROOT_DIR, name), os.path.join(tmp_dir, name))
+        os.chdir(tmp_dir)
+        sys.path.insert(0, ROOT_DIR)
+        import main as app_main
+
+        seed(app_main, args.orders)
+        client = TestClient(app_main.app)
+
+        for endpoint in ENDPOINTS:
+            content = client.get(endpoint, headers={"accept-encoding": "identity"}).json()
+            default_body = encode_default(content)
+            orjson_body = orjson.dumps(content)
+            assert json.loads(default_body) == json.loads(orjson_body)
+
+            print(endpoint)
+            print(f"  {'сериализация':<26}{'мс':>8}")
+            print(f"  {'jsonable_encoder + json':<26}{best_time(lambda: encode_default(content), args.repeat):>8.2f}")
+            print(f"  {'orjson':<26}{best_time(lambda: orjson.dumps(content), args.repeat):>8.2f}")
+            print(f"  {'сжатие':<26}{'мс':>8}{'байт':>10}{'экономия':>10}")
+            print(f"  {'без сжатия':<26}{0:>8.2f}{len(orjson_body):>10}{'':>10}")
+            for name, compress in compressors.items():
+                size = len(compress(orjson_body))
+                milliseconds = best_time(lambda: compress(orjson_body), args.repeat)
+                print(f"  {name:<26}{milliseconds:>8.2f}{size:>10}{1 - size / len(orjson_body):>10.1%}")
+
+        os.chdir(ROOT_DIR)
+
+
+if __name__ == "__main__":
+    main()
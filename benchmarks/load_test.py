@@ -0,0 +1,474 @@
+"""
+Нагрузочный тест HTTP: смешанный трафик против локально запущенного приложения.
+
+run — копирует базу, собранную generate_dataset.py (или собирает новую на
+--orders заказов), запускает main.py или v0.6.0 под uvicorn или gunicorn
+и --duration секунд гоняет --concurrency виртуальных пользователей.
+Каждый пользователь держит keep-alive соединение и по весам сценариев
+выбирает запрос: создание заказа, списки и карточки, дашборд и финансовые
+сводки, расчет зарплат, выгрузки. Параметры (id, месяцы) берутся из базы.
+По каждому маршруту в отчет попадают p50/p95/p99, пропускная способность и
+доля ошибок (код >= 400 или обрыв соединения). Отчет сохраняется в JSON и
+HTML рядом (--output report.json -> report.html).
+
+compare — сравнивает два JSON-отчета по маршрутам. Регрессия: p95 вырос
+больше чем на --threshold процентов (и хотя бы на --min-ms), либо доля
+ошибок выросла больше чем на 1 п.п. Код возврата 1 при регрессии — перед
+выкладкой прогон сравнивается с отчетом предыдущей версии.
+
+Запуск из корня репозитория:
+    python benchmarks/generate_dataset.py --app main --orders 100000 --database /tmp/main_100k.db
+    python benchmarks/load_test.py run --app main --database /tmp/main_100k.db --concurrency 16 --duration 60 --output base.json
+    python benchmarks/load_test.py run --app main --database /tmp/main_100k.db --server gunicorn --workers 4 --output new.json
+    python benchmarks/load_test.py compare base.json new.json --threshold 20
+"""
+import argparse
+import html
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlencode
+
+from startup import free_port
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+V06_DIR = os.path.join(ROOT_DIR, "v0.6.0")
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Рост доли ошибок, который считается регрессией (в долях)
+ERROR_RATE_TOLERANCE = 0.01
+
+# Начала фамилий для поиска клиентов (как в generate_dataset.py)
+SEARCH_PREFIXES = ["Ива", "Смир", "Кузн", "Поп", "Петр", "Соко", "Нов", "Мор"]
+
+
+def month_range(month):
+    return {"date_from": f"{month}-01", "date_to": f"{month}-31"}
+
+
+def main_order(rng, ctx):
+    return {
+        "client_id": rng.randint(1, ctx["clients"]),
+        "service_id": rng.choice(ctx["mount_services"]),
+        "one_employee_id": rng.choice(ctx["installers"]),
+        "two_employee_id": rng.choice(ctx["installers"] + [None]),
+        "manager_id": rng.choice(ctx["managers"]),
+        "order_date": f"{ctx['months'][0]}-15 10:00",
+        "notes": "Нагрузочный тест",
+        "additional_services": rng.sample(ctx["extra_services"], rng.randint(0, 2)),
+    }
+
+
+def v06_order(rng, ctx):
+    return {
+        "client_id": rng.randint(1, ctx["clients"]),
+        "manager_id": rng.choice(ctx["managers"]),
+        "order_date": f"{ctx['months'][0]}-15 10:00",
+        "notes": "Нагрузочный тест",
+        "services": [{"service_id": service_id, "selling_price": 3000}
+                     for service_id in rng.sample(ctx["extra_services"], rng.randint(1, 3))],
+        "employees": [{"employee_id": rng.choice(ctx["installers"]), "employee_type": "монтажник",
+                       "base_payment": 1500}],
+    }
+
+
+# Сценарии: вес, маршрут (ключ отчета), метод, построитель (rng, ctx) -> (путь, параметры, тело)
+SCENARIOS = {
+    "main": [
+        (20, "GET /api/orders/list", "GET", lambda rng, ctx: (
+            "/api/orders/list", {"page": rng.randint(1, 50), **rng.choice([{}, {"status": "завершен"}])}, None)),
+        (10, "GET /api/orders/{order_id}", "GET", lambda rng, ctx: (
+            f"/api/orders/{rng.randint(1, ctx['orders'])}", {}, None)),
+        (8, "GET /api/clients/list", "GET", lambda rng, ctx: (
+            "/api/clients/list", {"page": rng.randint(1, 20)}, None)),
+        (6, "GET /api/lookup/{entity}", "GET", lambda rng, ctx: (
+            "/api/lookup/clients", {"q": rng.choice(SEARCH_PREFIXES)}, None)),
+        (3, "GET /api/services/list", "GET", lambda rng, ctx: ("/api/services/list", {}, None)),
+        (10, "GET /api/dashboard", "GET", lambda rng, ctx: (
+            "/api/dashboard", {"month": rng.choice(ctx["months"])}, None)),
+        (6, "GET /api/finance/summary", "GET", lambda rng, ctx: (
+            "/api/finance/summary", month_range(rng.choice(ctx["months"])), None)),
+        (5, "GET /api/finance/employees", "GET", lambda rng, ctx: (
+            "/api/finance/employees", month_range(rng.choice(ctx["months"])), None)),
+        (5, "GET /api/employees/list", "GET", lambda rng, ctx: (
+            "/api/employees/list", {"month": rng.choice(ctx["months"])}, None)),
+        (6, "GET /api/employees/{employee_id}/salary", "GET", lambda rng, ctx: (
+            f"/api/employees/{rng.choice(ctx['employees'])}/salary", {"month": rng.choice(ctx["months"])}, None)),
+        (8, "POST /api/orders", "POST", lambda rng, ctx: ("/api/orders", {}, main_order(rng, ctx))),
+        (2, "GET /api/export", "GET", lambda rng, ctx: (
+            "/api/export", {"export_type": "orders", "format": "csv", **month_range(rng.choice(ctx["months"]))},
+            None)),
+    ],
+    "v0.6.0": [
+        (20, "GET /api/orders", "GET", lambda rng, ctx: (
+            "/api/orders", {"page": rng.randint(1, 50), **rng.choice([{}, {"status": "завершен"}])}, None)),
+        (10, "GET /api/orders/{order_id}", "GET", lambda rng, ctx: (
+            f"/api/orders/{rng.randint(1, ctx['orders'])}", {}, None)),
+        (8, "GET /api/clients", "GET", lambda rng, ctx: (
+            "/api/clients", {"page": rng.randint(1, 20), **rng.choice([{}, {"search": rng.choice(SEARCH_PREFIXES)}])},
+            None)),
+        (3, "GET /api/services", "GET", lambda rng, ctx: ("/api/services", {}, None)),
+        (4, "GET /api/clients/stats/by-source", "GET", lambda rng, ctx: ("/api/clients/stats/by-source", {}, None)),
+        (8, "GET /api/finance/summary", "GET", lambda rng, ctx: (
+            "/api/finance/summary", month_range(rng.choice(ctx["months"])), None)),
+        (4, "GET /api/finance/balance", "GET", lambda rng, ctx: ("/api/finance/balance", {}, None)),
+        (4, "GET /api/finance/transactions", "GET", lambda rng, ctx: (
+            "/api/finance/transactions", {"page": rng.randint(1, 20)}, None)),
+        (5, "GET /api/employees/list", "GET", lambda rng, ctx: (
+            "/api/employees/list", {"month": rng.choice(ctx["months"])}, None)),
+        (6, "GET /api/employees/{employee_id}/salary", "GET", lambda rng, ctx: (
+            f"/api/employees/{rng.choice(ctx['employees'])}/salary", {"month": rng.choice(ctx["months"])}, None)),
+        (8, "POST /api/orders", "POST", lambda rng, ctx: ("/api/orders", {}, v06_order(rng, ctx))),
+        (2, "GET /api/export/orders", "GET", lambda rng, ctx: (
+            "/api/export/orders", {"format": "csv", **month_range(rng.choice(ctx["months"]))}, None)),
+    ],
+}
+
+# Модуль приложения и легкий эндпоинт для проверки готовности
+APPS = {
+    "main": {"module": "main:app", "ready": "/api/balance"},
+    "v0.6.0": {"module": "app:app", "ready": "/api/finance/balance"},
+}
+
+
+def dataset_context(database):
+    """Диапазоны id и месяцы с данными — из них строятся параметры запросов"""
+    conn = sqlite3.connect(database)
+    try:
+        def column(sql):
+            return [row[0] for row in conn.execute(sql)]
+
+        ctx = {
+            "orders": conn.execute("SELECT max(id) FROM orders").fetchone()[0],
+            "clients": conn.execute("SELECT max(id) FROM clients").fetchone()[0],
+            "employees": column("SELECT id FROM employees WHERE active = 1"),
+            "managers": column("SELECT id FROM employees WHERE employee_type = 'менеджер'"),
+            "installers": column("SELECT id FROM employees WHERE employee_type = 'монтажник'"),
+            "mount_services": column("SELECT id FROM services WHERE category = 'Монтаж'"),
+            "extra_services": column("SELECT id FROM services WHERE category != 'Монтаж'"),
+            # Последние полгода с заказами — их чаще всего и открывают
+            "months": column("SELECT DISTINCT substr(order_date, 1, 7) FROM orders ORDER BY 1 DESC LIMIT 6"),
+        }
+    finally:
+        conn.close()
+    if not ctx["orders"] or not ctx["managers"] or not ctx["installers"]:
+        raise SystemExit(f"{database}: нет заказов или сотрудников, база собрана generate_dataset.py?")
+    return ctx
+
+
+def start_server(args, run_dir, database):
+    """Запуск приложения на копии базы; возвращает процесс и порт"""
+    port = free_port()
+    env = dict(os.environ, METRICS_DIR=os.path.join(run_dir, "metrics"), QUERY_BUDGET_CHECK="0")
+    if args.app == "main":
+        # main.py открывает ./test.db и монтирует ./static относительно текущего каталога
+        cwd = run_dir
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(ROOT_DIR, name), os.path.join(run_dir, name))
+        shutil.copyfile(database, os.path.join(run_dir, "test.db"))
+        env["PYTHONPATH"] = ROOT_DIR
+    else:
+        cwd = V06_DIR
+        shutil.copyfile(database, os.path.join(run_dir, "load.db"))
+        env["DATABASE_URL"] = f"sqlite:///{run_dir}/load.db"
+        env["STATIC_BUILD_DIR"] = os.path.join(run_dir, "static_build")
+
+    module = APPS[args.app]["module"]
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-k", "uvicorn.workers.UvicornWorker",
+                   module, "-b", f"127.0.0.1:{port}", "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    log = open(os.path.join(run_dir, "server.log"), "wb")
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return process, port
+
+
+def wait_ready(process, port, path, run_dir, timeout=60):
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", path)
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            time.sleep(0.1)
+    with open(os.path.join(run_dir, "server.log"), encoding="utf-8", errors="replace") as f:
+        log = f.read()[-3000:]
+    raise SystemExit(f"Сервер не ответил на {path} за {timeout} с:\n{log}")
+
+
+def virtual_user(index, args, port, ctx, deadline, warmup_until, samples):
+    """Один пользователь: запросы подряд по своему keep-alive соединению до deadline"""
+    rng = random.Random(args.seed * 1000 + index)
+    scenarios = SCENARIOS[args.app]
+    weights = [scenario[0] for scenario in scenarios]
+    headers_json = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.timeout)
+
+    while time.perf_counter() < deadline:
+        _, route, method, build = rng.choices(scenarios, weights=weights)[0]
+        path, params, body = build(rng, ctx)
+        url = f"{path}?{urlencode(params)}" if params else path
+        payload = json.dumps(body).encode() if body is not None else None
+        started = time.perf_counter()
+        try:
+            conn.request(method, url, body=payload, headers=headers_json)
+            response = conn.getresponse()
+            size = len(response.read())
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=args.timeout)
+            size, status = 0, 0
+        finished = time.perf_counter()
+        if started >= warmup_until:
+            samples.append((route, finished - started, status, size))
+    conn.close()
+
+
+def percentile(sorted_values, share):
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(share * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, seconds):
+    """Сводка по маршрутам и итог по всем запросам"""
+    groups = defaultdict(list)
+    for sample in samples:
+        groups[sample[0]].append(sample)
+    groups["ИТОГО"] = samples
+
+    routes = {}
+    for route, items in groups.items():
+        latencies = sorted(item[1] * 1000 for item in items)
+        errors = sum(1 for item in items if not 200 <= item[2] < 400)
+        statuses = defaultdict(int)
+        for item in items:
+            statuses[str(item[2])] += 1
+        routes[route] = {
+            "requests": len(items),
+            "errors": errors,
+            "error_rate": errors / len(items) if items else 0.0,
+            "rps": len(items) / seconds,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1] if latencies else 0.0,
+            "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+            "mean_bytes": sum(item[3] for item in items) / len(items) if items else 0.0,
+            "statuses": dict(statuses),
+        }
+    return routes
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+ROUTE_COLUMNS = [("requests", "запросов", "{:.0f}"), ("rps", "RPS", "{:.1f}"), ("p50_ms", "p50, мс", "{:.1f}"),
+                 ("p95_ms", "p95, мс", "{:.1f}"), ("p99_ms", "p99, мс", "{:.1f}"), ("max_ms", "max, мс", "{:.1f}"),
+                 ("error_rate", "ошибки", "{:.2%}"), ("mean_bytes", "ответ, Б", "{:.0f}")]
+
+HTML_PAGE = """<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th:first-child, td:first-child {{ text-align: left; }}
+tr.total {{ font-weight: bold; }}
+td.bad {{ background: #f8d7da; }}
+td.good {{ background: #d4edda; }}
+</style></head><body>
+<h1>{title}</h1>
+{meta}
+{table}
+</body></html>
+"""
+
+
+def render_table(headers, rows):
+    """rows: [(css-класс строки, [(текст, css-класс ячейки), ...]), ...]"""
+    head = "".join(f"<th>{html.escape(header)}</th>" for header in headers)
+    body = "".join(
+        f'<tr class="{row_class}">' + "".join(f'<td class="{cell_class}">{html.escape(text)}</td>'
+                                              for text, cell_class in cells) + "</tr>"
+        for row_class, cells in rows
+    )
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def render_meta(meta):
+    items = "".join(f"<li>{html.escape(str(key))}: {html.escape(str(value))}</li>" for key, value in meta.items())
+    return f"<ul>{items}</ul>"
+
+
+def write_run_html(report, path):
+    rows = []
+    for route, stats in sorted(report["routes"].items(), key=lambda item: (item[0] == "ИТОГО", item[0])):
+        cells = [(route, "")] + [(fmt.format(stats[key]), "bad" if key == "error_rate" and stats[key] else "")
+                                 for key, _, fmt in ROUTE_COLUMNS]
+        rows.append(("total" if route == "ИТОГО" else "", cells))
+    table = render_table(["маршрут"] + [title for _, title, _ in ROUTE_COLUMNS], rows)
+    title = f"Нагрузочный тест {report['meta']['app']} ({report['meta']['started_at']})"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HTML_PAGE.format(title=html.escape(title), meta=render_meta(report["meta"]), table=table))
+
+
+def print_routes(routes):
+    print(f"{'маршрут':<42}" + "".join(f"{title:>11}" for _, title, _ in ROUTE_COLUMNS))
+    for route, stats in sorted(routes.items(), key=lambda item: (item[0] == "ИТОГО", item[0])):
+        print(f"{route:<42}" + "".join(f"{fmt.format(stats[key]):>11}" for key, _, fmt in ROUTE_COLUMNS))
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as run_dir:
+        database = args.database
+        if not database:
+            database = os.path.join(run_dir, "dataset.db")
+            subprocess.run([sys.executable, os.path.join(BENCHMARKS_DIR, "generate_dataset.py"), "--app", args.app,
+                            "--orders", str(args.orders), "--seed", str(args.seed), "--database", database],
+                           check=True)
+        ctx = dataset_context(database)
+
+        process, port = start_server(args, run_dir, database)
+        try:
+            wait_ready(process, port, APPS[args.app]["ready"], run_dir)
+            started_at = datetime.now().isoformat(timespec="seconds")
+            started = time.perf_counter()
+            warmup_until = started + args.warmup
+            deadline = warmup_until + args.duration
+            samples = []  # list.append атомарен, общий список без блокировок
+            threads = [
+                threading.Thread(target=virtual_user, args=(index, args, port, ctx, deadline, warmup_until, samples))
+                for index in range(args.concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            measured = time.perf_counter() - warmup_until
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "meta": {
+            "app": args.app, "server": args.server, "workers": args.workers, "concurrency": args.concurrency,
+            "duration_s": round(measured, 1), "warmup_s": args.warmup, "orders": ctx["orders"], "seed": args.seed,
+            "dataset": args.database or f"generate_dataset.py --orders {args.orders}",
+            "git": git_revision(), "python": platform.python_version(), "started_at": started_at,
+        },
+        "routes": summarize(samples, measured),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    html_path = os.path.splitext(args.output)[0] + ".html"
+    write_run_html(report, html_path)
+
+    print_routes(report["routes"])
+    print(f"\nотчет: {args.output}, {html_path}")
+
+
+def compare(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    rows, regressions = [], []
+    print(f"{'маршрут':<42}{'p95 было':>10}{'p95 стало':>11}{'изм.':>9}{'RPS было':>10}{'RPS стало':>11}"
+          f"{'ошибки было':>13}{'ошибки стало':>14}")
+    for route in sorted(set(base["routes"]) | set(new["routes"]), key=lambda name: (name == "ИТОГО", name)):
+        before, after = base["routes"].get(route), new["routes"].get(route)
+        if not before or not after:
+            print(f"{route:<42}  есть только в {'новом' if after else 'базовом'} отчете")
+            continue
+        change = (after["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        slower = change * 100 > args.threshold and after["p95_ms"] - before["p95_ms"] > args.min_ms
+        more_errors = after["error_rate"] - before["error_rate"] > ERROR_RATE_TOLERANCE
+        if slower or more_errors:
+            regressions.append(route)
+        print(f"{route:<42}{before['p95_ms']:>10.1f}{after['p95_ms']:>11.1f}{change:>+9.0%}{before['rps']:>10.1f}"
+              f"{after['rps']:>11.1f}{before['error_rate']:>13.2%}{after['error_rate']:>14.2%}"
+              f"{'  РЕГРЕССИЯ' if slower or more_errors else ''}")
+        rows.append(("total" if route == "ИТОГО" else "", [
+            (route, ""),
+            (f"{before['p95_ms']:.1f}", ""), (f"{after['p95_ms']:.1f}", ""),
+            (f"{change:+.0%}", "bad" if slower else "good" if change < 0 else ""),
+            (f"{before['rps']:.1f}", ""), (f"{after['rps']:.1f}", ""),
+            (f"{before['error_rate']:.2%}", ""), (f"{after['error_rate']:.2%}", "bad" if more_errors else ""),
+        ]))
+
+    if args.html:
+        table = render_table(["маршрут", "p95 было, мс", "p95 стало, мс", "изм.", "RPS было", "RPS стало",
+                              "ошибки было", "ошибки стало"], rows)
+        meta = {"базовый": f"{args.base} ({base['meta'].get('git')}, {base['meta'].get('started_at')})",
+                "новый": f"{args.new} ({new['meta'].get('git')}, {new['meta'].get('started_at')})",
+                "порог p95": f"{args.threshold}% и {args.min_ms} мс"}
+        with open(args.html, "w", encoding="utf-8") as f:
+            f.write(HTML_PAGE.format(title="Сравнение нагрузочных тестов", meta=render_meta(meta), table=table))
+
+    if regressions:
+        print(f"\nРегрессии: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nРегрессий нет")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="прогнать нагрузку и сохранить отчет")
+    run_parser.add_argument("--app", choices=["main", "v0.6.0"], default="main")
+    run_parser.add_argument("--database", help="база generate_dataset.py (используется копия)")
+    run_parser.add_argument("--orders", type=int, default=10000, help="размер новой базы, если --database не задан")
+    run_parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--duration", type=float, default=30, help="секунд измерения")
+    run_parser.add_argument("--warmup", type=float, default=5, help="секунд прогрева, не входят в отчет")
+    run_parser.add_argument("--timeout", type=float, default=30, help="таймаут одного запроса, с")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", default="load_report.json")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="сравнить два отчета")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=20, help="допустимый рост p95, %%")
+    compare_parser.add_argument("--min-ms", type=float, default=5, help="рост p95 меньше этого не считается")
+    compare_parser.add_argument("--html", help="сохранить сравнение в HTML")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
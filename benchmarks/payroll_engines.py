@@ -0,0 +1,208 @@
+"""
+Микробенчмарки расчетов: зарплата, прибыль заказа, финансовая сводка.
+
+Для каждого масштаба (--scales, по умолчанию 1000,10000,100000 заказов)
+generate_dataset.py собирает базу SQLite в памяти, затем каждая функция
+вызывается --rounds раз на одних и тех же данных (новая сессия на вызов,
+чтобы не мерить кэш identity map):
+- main.py: calculate_salary за самый загруженный месяц;
+- v0.6.0: EmployeeService.calculate_salary (менеджер и монтажник),
+  OrderService.calculate_order_profit (пачка завершенных заказов месяца),
+  FinanceService.get_finance_summary за месяц и за весь период.
+Печатаются минимум и медиана времени вызова и число SQL-запросов.
+
+--save сохраняет результаты как базовые, --baseline сравнивает с ними:
+регрессия — рост минимального времени больше --threshold процентов или рост числа
+запросов, код возврата 1. Число запросов от машины не зависит, время
+сравнимо только с базовыми замерами на той же машине.
+
+Запуск из корня репозитория:
+    python benchmarks/payroll_engines.py --save benchmarks/baselines/payroll_engines.json
+    python benchmarks/payroll_engines.py --baseline benchmarks/baselines/payroll_engines.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from generate_dataset import build_dataset, load_tables
+
+# Заказов в пачке для calculate_order_profit: один вызов слишком короткий для замера
+PROFIT_BATCH = 100
+
+# Рост времени меньше этого (мс) не считается регрессией — шум таймера на быстрых вызовах
+MIN_REGRESSION_MS = 0.5
+
+
+def memory_engine():
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    # Одно соединение на всю базу в памяти: иначе каждое новое соединение видит пустую базу
+    return create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+
+def busiest_month(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(
+            "SELECT substr(order_date, 1, 7) FROM orders GROUP BY 1 ORDER BY count(*) DESC, 1 LIMIT 1"
+        ).scalar()
+
+
+def first_id(engine, sql, *params):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(sql, params).scalar()
+
+
+def main_cases(engine):
+    """Функции main.py: имя -> вызов с сессией"""
+    main = sys.modules["main"]
+    month = busiest_month(engine)
+    loop = asyncio.new_event_loop()
+    return {
+        f"main.calculate_salary({month})": lambda db: loop.run_until_complete(main.calculate_salary(db, month)),
+    }
+
+
+def v06_cases(engine):
+    """Функции v0.6.0: имя -> вызов с сессией"""
+    from services.employee_service import EmployeeService
+    from services.finance_service import FinanceService
+    from services.order_service import OrderService
+
+    month = busiest_month(engine)
+    manager_id = first_id(engine, "SELECT id FROM employees WHERE employee_type = 'менеджер' ORDER BY id")
+    installer_id = first_id(engine, "SELECT id FROM employees WHERE employee_type = 'монтажник' ORDER BY id")
+    with engine.connect() as conn:
+        order_ids = [row[0] for row in conn.exec_driver_sql(
+            "SELECT id FROM orders WHERE status = 'завершен' AND order_date LIKE ? ORDER BY id LIMIT ?",
+            (f"{month}%", PROFIT_BATCH)
+        )]
+
+    def profits(db):
+        for order_id in order_ids:
+            result = OrderService.calculate_order_profit(db, order_id)
+            if "error" in result:
+                raise RuntimeError(f"calculate_order_profit({order_id}): {result['error']}")
+
+    return {
+        f"EmployeeService.calculate_salary(менеджер, {month})":
+            lambda db: EmployeeService.calculate_salary(db, manager_id, month),
+        f"EmployeeService.calculate_salary(монтажник, {month})":
+            lambda db: EmployeeService.calculate_salary(db, installer_id, month),
+        f"OrderService.calculate_order_profit x{len(order_ids)}": profits,
+        f"FinanceService.get_finance_summary({month})":
+            lambda db: FinanceService.get_finance_summary(db, f"{month}-01", f"{month}-31"),
+        "FinanceService.get_finance_summary(весь период)":
+            lambda db: FinanceService.get_finance_summary(db, None, None),
+    }
+
+
+def measure(engine, call, rounds, max_seconds):
+    """
+    Минимум и медиана времени вызова (мс) и число SQL-запросов одного вызова.
+    Медленные функции вызываются меньше rounds раз: новые раунды не начинаются
+    после max_seconds (как max_time в pytest-benchmark), но хотя бы один будет.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    queries = []
+    listener = lambda *args: queries.append(1)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", listener)
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    try:
+        for _ in range(rounds):
+            if timings and time.perf_counter() > deadline:
+                break
+            queries.clear()
+            db = Session(bind=engine)
+            try:
+                started = time.perf_counter()
+                call(db)
+                timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return {"min_ms": min(timings), "median_ms": statistics.median(timings), "queries": len(queries),
+            "rounds": len(timings)}
+
+
+def compare(results, baseline, threshold):
+    """Строки сравнения и список регрессий"""
+    regressions = []
+    print(f"\n{'сравнение с базовыми':<72}{'мин. было':>14}{'стало':>10}{'изм.':>8}{'SQL было':>10}{'стало':>7}")
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before:
+            print(f"{key:<72}  нет в базовых замерах")
+            continue
+        # Минимум устойчивее к фоновой нагрузке машины, чем медиана
+        change = (result["min_ms"] - before["min_ms"]) / before["min_ms"] if before["min_ms"] else 0.0
+        slower = change * 100 > threshold and result["min_ms"] - before["min_ms"] > MIN_REGRESSION_MS
+        more_queries = result["queries"] > before["queries"]
+        if slower or more_queries:
+            regressions.append(key)
+        print(f"{key:<72}{before['min_ms']:>14.2f}{result['min_ms']:>10.2f}{change:>+8.0%}"
+              f"{before['queries']:>10}{result['queries']:>7}{'  РЕГРЕССИЯ' if slower or more_queries else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "v0.6.0", "all"], default="all")
+    parser.add_argument("--scales", default="1000,10000,100000", help="число заказов через запятую")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=10, help="не начинать новые раунды функции после, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="сохранить результаты как базовые (JSON)")
+    parser.add_argument("--baseline", help="сравнить с базовыми результатами (JSON)")
+    parser.add_argument("--threshold", type=float, default=25, help="допустимый рост минимального времени, %%")
+    args = parser.parse_args()
+
+    apps = ["main", "v0.6.0"] if args.app == "all" else [args.app]
+    builders = {"main": main_cases, "v0.6.0": v06_cases}
+    scales = [int(scale) for scale in args.scales.split(",")]
+
+    results = {}
+    print(f"{'функция':<72}{'мин, мс':>10}{'медиана, мс':>13}{'SQL':>7}{'раундов':>9}")
+    for app in apps:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metadata, tables = load_tables(app, tmp_dir)
+        for scale in scales:
+            engine = memory_engine()
+            build_dataset(engine, app, metadata, tables, scale, args.seed)
+            for name, call in builders[app](engine).items():
+                key = f"{scale}/{name}"
+                results[key] = measure(engine, call, args.rounds, args.max_seconds)
+                print(f"{key:<72}{results[key]['min_ms']:>10.2f}{results[key]['median_ms']:>13.2f}"
+                      f"{results[key]['queries']:>7}{results[key]['rounds']:>9}")
+            engine.dispose()
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                                "rounds": args.rounds, "seed": args.seed},
+                       "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nбазовые результаты: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nРегрессии: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Проверка бюджетов SQL-запросов и поиск N+1 во всех GET-маршрутах.
+
+Заполняет временную базу, включает QUERY_BUDGET_CHECK и вызывает каждый
+GET-маршрут приложения — API, страницы и административные маршруты (с
+ADMIN_TOKEN); параметры пути — 1 или PATH_PARAMS, month — месяц с данными.
+Для каждого маршрута печатает число SQL-запросов и бюджет; формы запросов,
+повторенные с разными параметрами, выводятся как N+1. Код возврата 1, если
+хотя бы один маршрут превысил бюджет или выполнил N+1 — скрипт можно запускать
+в CI. Потоковые выгрузки (@query_budget(None)) не проверяются.
+
+Запуск из корня репозитория:
+    python benchmarks/query_budgets.py --app main
+    python benchmarks/query_budgets.py --app v0.6.0
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+V06_DIR = os.path.join(ROOT_DIR, "v0.6.0")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Месяц, на который приходится часть сгенерированных заказов
+SEED_MONTH = "2025-05"
+
+# Значения параметров пути; остальные параметры пути получают 1
+PATH_PARAMS = {"entity": "clients"}
+
+# Параметры запроса для всех маршрутов (лишние FastAPI игнорирует)
+QUERY_PARAMS = {"month": SEED_MONTH, "export_type": "orders", "q": "Кли"}
+
+# Токен административных маршрутов: без него они отвечают 404, не выполнив ни одного запроса
+ADMIN_TOKEN = "query-budget-check"
+
+
+def seed_v06(count):
+    """Заказы v0.6.0 с услугами, монтажниками, транзакциями, расходами и выплатами"""
+    from sqlalchemy import insert
+    from database import SessionLocal, init_db
+    from models import (
+        Client, CompanyBalance, Employee, Expense, FinancialTransaction, Order, OrderEmployee, OrderService,
+        Payment, Service
+    )
+
+    init_db()
+    db = SessionLocal()
+    try:
+        categories = ["Монтаж", "Кондиционер", "Монтажный комплект", "Виброопора", "Доп услуга"]
+        db.execute(insert(Service), [
+            {"name": f"Услуга {i}", "category": categories[i % 5], "purchase_price": 100 * i,
+             "selling_price": 1000 + 100 * i, "is_manager_bonus": i % 4 == 0}
+            for i in range(15)
+        ])
+        db.execute(insert(Employee), [
+            {"name": f"Менеджер {i}", "phone": "79990000000", "employee_type": "менеджер", "base_salary": 30000}
+            for i in range(3)
+        ] + [
+            {"name": f"Монтажник {i}", "phone": "79990000000", "employee_type": "монтажник"} for i in range(5)
+        ] + [
+            {"name": "Владелец", "phone": "79990000000", "employee_type": "владелец"}
+        ])
+        db.execute(insert(Client), [
+            {"name": f"Клиент {i}", "phone": f"7999{i:07d}", "source": "Авито"} for i in range(100)
+        ])
+        db.add(CompanyBalance(balance=100000, initial_balance=100000))
+        statuses = ["новый", "в работе", "завершен", "отменен"]
+        db.execute(insert(Order), [
+            {"id": i, "client_id": 1 + i % 100, "manager_id": 1 + i % 3, "order_date": f"2025-{1 + i % 12:02d}-10 10:00",
+             "status": statuses[i % 4], "mount_price": 10000, "owner_commission": 1500}
+            for i in range(1, count + 1)
+        ])
+        db.execute(insert(OrderService), [
+            {"order_id": i, "service_id": 1 + (i + j) % 15, "selling_price": 2000}
+            for i in range(1, count + 1) for j in range(i % 3)
+        ])
+        db.execute(insert(OrderEmployee), [
+            {"order_id": i, "employee_id": 4 + i % 5, "employee_type": "монтажник", "base_payment": 1500}
+            for i in range(1, count + 1)
+        ])
+        db.execute(insert(FinancialTransaction), [
+            {"transaction_date": f"2025-{1 + i % 12:02d}-10", "amount": 10000, "transaction_type": "доход",
+             "source_type": "заказ", "source_id": i}
+            for i in range(1, count + 1)
+        ])
+        db.execute(insert(Expense), [
+            {"category": "Бензин", "amount": 500, "expense_date": f"2025-{1 + i % 12:02d}-11", "expense_type": "операционный"}
+            for i in range(count // 5)
+        ])
+        db.execute(insert(Payment), [
+            {"employee_id": 1 + i % 9, "amount": 1000, "payment_date": f"{SEED_MONTH}-05"} for i in range(20)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_app(name, tmp_dir, count):
+    """Импорт приложения с базой во временном каталоге и заполнение данными"""
+    os.environ["QUERY_BUDGET_CHECK"] = "1"
+    os.environ["ADMIN_TOKEN"] = ADMIN_TOKEN
+    if name == "main":
+        # main.py открывает ./test.db и монтирует ./static относительно текущего каталога
+        for directory in ("static", "templates"):
+            os.symlink(os.path.join(ROOT_DIR, directory), os.path.join(tmp_dir, directory))
+        os.chdir(tmp_dir)
+        sys.path.insert(0, ROOT_DIR)
+        import main as app_main
+        from columnar_export import seed
+
+        app_main.migrate()
+        seed(app_main, count)
+        return app_main.app, app_main.current_tenant().engine, app_main.query_budget_violations, app_main.DEFAULT_QUERY_BUDGET
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/budget.db"
+    os.environ["STATIC_BUILD_DIR"] = os.path.join(tmp_dir, "static_build")
+    os.chdir(V06_DIR)
+    sys.path.insert(0, V06_DIR)
+    seed_v06(count)
+    from app import app
+    from config import DEFAULT_QUERY_BUDGET
+    from core import query_budget_violations
+    from database import current_tenant
+    return app, current_tenant().engine, query_budget_violations, DEFAULT_QUERY_BUDGET
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "v0.6.0"], default="main")
+    parser.add_argument("--orders", type=int, default=200)
+    args = parser.parse_args()
+
+    from fastapi.routing import APIRoute
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    # Отчеты печатаются ниже, предупреждения детектора в логе не дублируются
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app, engine, violations, default_budget = load_app(args.app, tmp_dir, args.orders)
+        client = TestClient(app, raise_server_exceptions=False, headers={"X-Admin-Token": ADMIN_TOKEN})
+
+        # Число SQL-запросов каждого вызова (TestClient выполняет запросы по одному)
+        executed = []
+        event.listen(engine, "before_cursor_execute", lambda *args: executed.append(1))
+
+        failed = []
+        print(f"{'маршрут':<50}{'код':>5}{'SQL':>6}{'бюджет':>8}")
+        for route in app.routes:
+            if not isinstance(route, APIRoute) or "GET" not in route.methods:
+                continue
+            url = re.sub(r"\{([^}]+)\}", lambda match: PATH_PARAMS.get(match.group(1), "1"), route.path)
+            violations.clear()
+            executed.clear()
+            response = client.get(url, params=QUERY_PARAMS)
+            report = violations[-1] if violations else None
+            budget = getattr(route.endpoint, "query_budget", default_budget)
+            print(f"{route.path:<50}{response.status_code:>5}{len(executed):>6}{'—' if budget is None else budget:>8}")
+            if report:
+                for item in report["repeated"][:3]:
+                    print(f"    N+1 x{item['count']}: {item['statement'][:110]}")
+                if report["over_budget"] or report["repeated"]:
+                    failed.append(report)
+
+        os.chdir(ROOT_DIR)
+
+    if failed:
+        print(f"\nБюджет превышен или найден N+1: {', '.join(report['route'] for report in failed)}")
+        sys.exit(1)
+    print("\nВсе маршруты в пределах бюджета")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Списки v0.6.0: ORM-объекты против строк Core.
+
+Для клиентов, сотрудников и транзакций сравнивается чтение страницы
+одними и теми же колонками двумя способами:
+- «ORM»: db.query(Model) + копирование атрибутов в словарь (прежний путь);
+- «строки»: db.query(*колонки) через fetch_rows, сразу в словари.
+Для каждого способа выводятся процессорное время на вызов и пик выделенной
+памяти (tracemalloc). В конце — время вызовов сервисов целиком.
+
+Запуск из корня репозитория:
+    python benchmarks/row_queries.py --rows 50000 --page 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+V06_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "v0.6.0")
+
+
+def seed(count):
+    from sqlalchemy import insert
+    from database import SessionLocal, init_db
+    from models import Client, Employee, FinancialTransaction, Order
+
+    init_db()
+    db = SessionLocal()
+    try:
+        db.execute(insert(Client), [
+            {"name": f"Клиент {i}", "phone": f"7999{i:07d}", "source": "Авито", "created_at": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}"}
+            for i in range(count)
+        ])
+        db.execute(insert(Employee), [
+            {"name": f"Сотрудник {i}", "phone": "79990000000", "employee_type": "монтажник" if i % 5 else "менеджер",
+             "base_salary": None if i % 5 else 30000}
+            for i in range(count // 10)
+        ])
+        db.execute(insert(FinancialTransaction), [
+            {"transaction_date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}", "amount": 1000 + i % 500,
+             "transaction_type": "доход" if i % 3 else "расход", "source_type": "заказ", "source_id": i,
+             "description": None if i % 4 else "Оплата заказа"}
+            for i in range(count)
+        ])
+        db.execute(insert(Order), [
+            {"client_id": 1 + i % count, "manager_id": 1, "order_date": "2025-05-01 10:00", "status": "завершен"}
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def measure(function, repeat):
+    """Процессорное время на вызов (мс, минимум из repeat) и пик памяти (КБ)"""
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        function()
+        timings.append(time.process_time() - started)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1000, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+        sys.path.insert(0, V06_DIR)
+        from core import fetch_rows
+        from database import SessionLocal
+        from models import Client, Employee, FinancialTransaction
+        from services import ClientService, EmployeeService, FinanceService
+
+        seed(args.rows)
+        db = SessionLocal()
+
+        tables = {
+            "clients": (Client, ["id", "name", "phone", "source", "created_at", "updated_at"]),
+            "employees": (Employee, ["id", "name", "phone", "employee_type", "base_salary", "active", "created_at", "updated_at"]),
+            "transactions": (FinancialTransaction, ["id", "transaction_date", "amount", "transaction_type", "source_type",
+                                                    "source_id", "description", "created_at", "updated_at"]),
+        }
+
+        print(f"Страница {args.page} строк")
+        print(f"{'таблица':<14}{'способ':<9}{'CPU, мс':>10}{'пик, КБ':>10}")
+        for name, (model, fields) in tables.items():
+            columns = [getattr(model, field) for field in fields]
+
+            def orm_page():
+                rows = db.query(model).limit(args.page).all()
+                result = [{field: getattr(row, field) for field in fields} for row in rows]
+                db.expunge_all()
+                return result
+
+            def row_page():
+                return fetch_rows(db, db.query(*columns).limit(args.page))
+
+            assert orm_page() == row_page()
+            for label, function in (("ORM", orm_page), ("строки", row_page)):
+                cpu_ms, peak_kb = measure(function, args.repeat)
+                print(f"{name:<14}{label:<9}{cpu_ms:>10.2f}{peak_kb:>10.0f}")
+
+        print()
+        print(f"{'вызов сервиса (limit 100)':<40}{'CPU, мс':>10}{'пик, КБ':>10}")
+        calls = {
+            "ClientService.get_clients": lambda: ClientService.get_clients(db, limit=100),
+            "EmployeeService.get_employees": lambda: EmployeeService.get_employees(db, limit=100),
+            "FinanceService.get_transaction_history": lambda: FinanceService.get_transaction_history(db, limit=100),
+        }
+        for name, function in calls.items():
+            cpu_ms, peak_kb = measure(function, args.repeat)
+            print(f"{name:<40}{cpu_ms:>10.2f}{peak_kb:>10.0f}")
+
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
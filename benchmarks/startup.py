@@ -0,0 +1,124 @@
+"""
+Замер холодного старта main.py и v0.6.0.
+
+Для каждого приложения в отдельном процессе измеряются:
+- время импорта модуля приложения и RSS процесса после импорта;
+- время от запуска uvicorn до первого успешного ответа легкого эндпоинта
+  и RSS воркера в этот момент.
+
+Перед замером схема базы создается командой миграции приложения, поэтому
+в измерение попадает только запуск воркера.
+
+Запуск из корня репозитория:
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+V06_DIR = os.path.join(ROOT_DIR, "v0.6.0")
+
+IMPORT_SNIPPET = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure_import(app):
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=app["module"])],
+        cwd=app["cwd"], env=app["env"], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_first_response(app, timeout=30):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}{app['endpoint']}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{app['module']}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app["cwd"], env=app["env"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"{app['name']}: uvicorn завершился с кодом {process.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    response.read()
+                return {"seconds": time.perf_counter() - started, "rss_mb": process_rss_mb(process.pid)}
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"{app['name']}: нет ответа от {url} за {timeout} с")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def prepare_apps(tmp_dir):
+    # main.py открывает ./test.db и монтирует ./static относительно текущего каталога
+    main_dir = os.path.join(tmp_dir, "main")
+    os.makedirs(main_dir)
+    for name in ("static", "templates"):
+        os.symlink(os.path.join(ROOT_DIR, name), os.path.join(main_dir, name))
+    main_env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+    subprocess.run([sys.executable, os.path.join(ROOT_DIR, "main.py"), "migrate"],
+                   cwd=main_dir, env=main_env, check=True, capture_output=True)
+
+    v06_env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_dir}/v06.db")
+    subprocess.run([sys.executable, "migrate.py"], cwd=V06_DIR, env=v06_env, check=True, capture_output=True)
+
+    return [
+        {"name": "main.py", "module": "main", "cwd": main_dir, "env": main_env, "endpoint": "/api/balance"},
+        {"name": "v0.6.0", "module": "app", "cwd": V06_DIR, "env": v06_env, "endpoint": "/api/finance/balance"},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        apps = prepare_apps(tmp_dir)
+        print(f"{'приложение':<12}{'импорт, с':>11}{'RSS, МБ':>10}{'1-й ответ, с':>15}{'RSS воркера, МБ':>18}")
+        for app in apps:
+            imports = [measure_import(app) for _ in range(args.runs)]
+            responses = [measure_first_response(app) for _ in range(args.runs)]
+            print(
+                f"{app['name']:<12}"
+                f"{statistics.median(r['seconds'] for r in imports):>11.2f}"
+                f"{statistics.median(r['rss_mb'] for r in imports):>10.1f}"
+                f"{statistics.median(r['seconds'] for r in responses):>15.2f}"
+                f"{statistics.median(r['rss_mb'] for r in responses):>18.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
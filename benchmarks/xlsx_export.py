@@ -0,0 +1,138 @@
+"""
+Бенчмарк экспорта XLSX из v0.6.0 ExportService.
+
+Сравнивает прежний способ (книга целиком в памяти, ширина столбцов по всем
+ячейкам, BytesIO + getvalue) с потоковой записью write-only
+(ExportService._build_xlsx). Каждый режим запускается в отдельном процессе,
+чтобы пиковый RSS не смешивался.
+
+Запуск из корня репозитория:
+    python benchmarks/xlsx_export.py --rows 100000
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+V06_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "v0.6.0")
+
+HEADERS = [
+    "ID", "Клиент", "Телефон", "Менеджер", "Монтажники",
+    "Дата заказа", "Дата завершения", "Статус", "Стоимость монтажа (₽)",
+    "Услуги", "Общая сумма (₽)", "Примечания"
+]
+
+
+def generate_rows(count):
+    """Синтетические строки в формате экспорта заказов"""
+    for i in range(1, count + 1):
+        yield [
+            i,
+            f"Клиент {i % 5000}",
+            f"+7999{i:07d}",
+            f"Менеджер {i % 7}",
+            f"Монтажник {i % 11}, Монтажник {(i + 3) % 11}",
+            f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+            "-" if i % 3 else f"2025-{1 + i % 12:02d}-{1 + i % 28:02d} 18:00",
+            "завершен",
+            10000 + (i % 5) * 1000,
+            "Кондиционер 9 БТЮ, Монтажный комплект",
+            25000.0 + i % 1000,
+            "-" if i % 4 else "Позвонить за час до приезда"
+        ]
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_in_memory(count):
+    """Прежняя реализация: Workbook() + проход по всем ячейкам для ширины"""
+    import openpyxl
+    from openpyxl.styles import Font
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Заказы"
+    sheet.append(HEADERS)
+    for cell in sheet[1]:
+        cell.font = Font(bold=True)
+    for row in generate_rows(count):
+        sheet.append(row)
+
+    for column in sheet.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
+            if cell.value and len(str(cell.value)) > max_length:
+                max_length = len(str(cell.value))
+        sheet.column_dimensions[column_letter].width = max_length + 2
+
+    output = io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return len(output.getvalue())
+
+
+def run_write_only(count):
+    """Новая реализация: write-only лист, временный файл, отдача блоками"""
+    sys.path.insert(0, V06_DIR)
+    from services.export_service import ExportService
+
+    size = 0
+    for block in ExportService._build_xlsx([("Заказы", HEADERS, generate_rows(count))]):
+        size += len(block)
+    return size
+
+
+MODES = {
+    "in-memory": run_in_memory,
+    "write-only": run_write_only,
+}
+
+
+def run_child(mode, count):
+    started = time.perf_counter()
+    size = MODES[mode](count)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "mode": mode,
+        "rows": count,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(count / elapsed),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "file_mb": round(size / (1024 * 1024), 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--mode", choices=sorted(MODES), help="запустить один режим в текущем процессе")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_child(args.mode, args.rows)
+        return
+
+    results = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--rows", str(args.rows)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'режим':<12}{'строк':>10}{'сек':>10}{'строк/с':>12}{'пик RSS, МБ':>14}{'файл, МБ':>11}")
+    for r in results:
+        print(f"{r['mode']:<12}{r['rows']:>10}{r['seconds']:>10}{r['rows_per_sec']:>12}{r['peak_rss_mb']:>14}{r['file_mb']:>11}")
+
+
+if __name__ == "__main__":
+    main()
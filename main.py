@@ -1,14 +1,15 @@
-from fastapi import FastAPI, Depends, Form, Request, HTTPException, Query, Path
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
+from fastapi import FastAPI, Depends, Form, Request, HTTPException, Query, Path, Header
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, ORJSONResponse, PlainTextResponse, Response, FileResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, func, desc, and_
+from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Index, func, desc, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy import or_
+from sqlalchemy import or_, event, select, union
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import make_url
 from typing import List, Optional, Dict, Any
-import pandas as pd
 from io import BytesIO
 from datetime import datetime, date, timedelta
 import re
@@ -16,17 +17,1059 @@ import io
 import csv
 from pydantic import BaseModel, validator, constr, confloat
 import json
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.encoders import jsonable_encoder
+from starlette.datastructures import Headers, MutableHeaders
+from urllib.parse import parse_qs
+from starlette.concurrency import run_in_threadpool
+import gzip
+import threading
+import logging
+import asyncio
+import functools
+import hmac
+import sqlite3
+import sys
+from bisect import bisect_left
+from collections import deque, defaultdict
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from contextvars import ContextVar
+from contextlib import contextmanager
 
-app = FastAPI(title="CRM Система", description="CRM для компании по установке кондиционеров")
+# Server-Timing: каждый ответ несет заголовок с разбивкой времени — db (SQL: время и число запросов),
+# render (шаблоны Jinja), ser (сериализация JSON), app (остальной Python: эндпоинт и расчеты), total.
+# Время копится в словаре запроса (контекстная переменная), заголовок ставит ServerTimingMiddleware;
+# его видно в DevTools браузера (Network → Timing) для каждого fetch. SERVER_TIMING=0 отключает
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+@contextmanager
+def server_timing(name: str):
+    """Учет времени блока в Server-Timing текущего запроса (вне запроса — без учета)"""
+    timings = request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+class TimedTemplates(Jinja2Templates):
+    """Шаблоны Jinja с учетом времени рендеринга (шаблон рендерится при создании ответа)"""
+    
+    def TemplateResponse(self, *args, **kwargs):
+        with server_timing("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+# JSON-ответы сериализуются orjson, если он установлен (в несколько раз быстрее стандартного json)
+try:
+    import orjson
+    BaseAPIResponse = ORJSONResponse
+except ImportError:
+    BaseAPIResponse = JSONResponse
+
+class APIResponse(BaseAPIResponse):
+    def render(self, content) -> bytes:
+        with server_timing("ser"):
+            return super().render(content)
+
+app = FastAPI(
+    title="CRM Система",
+    description="CRM для компании по установке кондиционеров",
+    default_response_class=APIResponse
+)
+
+# Сжатие ответов по Accept-Encoding (brotli, если установлен, иначе gzip). Сжимаются только ответы,
+# отданные одним блоком, не меньше COMPRESSION_MINIMUM_SIZE байт и текстовых типов; потоковые
+# выгрузки, ответы на Range и уже сжатая статика передаются как есть
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def choose_response_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбор кодировки сжатия из Accept-Encoding; кодировки с q=0 не используются"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+    
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+class CompressionMiddleware:
+    """ASGI-middleware сжатия ответов целиком"""
+    
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        encoding = choose_response_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # Заголовки придерживаются до первого блока тела: только тогда известно, сжимать ли ответ
+        start_message = None
+        
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or start["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_CONTENT_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+            
+            if encoding == "br":
+                body = brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+            else:
+                body = gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+        
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+templates = TimedTemplates(directory="templates")
 
 # Настройки базы данных
 DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Филиалы (города): у каждого своя база. TENANTS — коды через запятую ("msk,spb"), база филиала —
+# TENANT_DATABASE_URL с подстановкой {tenant}; без TENANTS филиал один ("default") с базой DATABASE_URL.
+# Филиал запроса — заголовок X-Tenant (для API) или первая часть имени хоста (spb.crm.example.ru),
+# иначе DEFAULT_TENANT; неизвестный филиал в заголовке — 404, запрос к базе без филиала — 400.
+# Движок базы филиала с пулом до TENANT_POOL_SIZE соединений создается при первом обращении к филиалу.
+# Фоновые задачи работают от имени своего филиала (tenant_scope), CLI — филиала из переменной TENANT
+SINGLE_TENANT = "default"
+TENANTS = [name.strip().lower() for name in os.getenv("TENANTS", "").split(",") if name.strip()]
+TENANT_DATABASE_URL = os.getenv("TENANT_DATABASE_URL", "sqlite:///./test_{tenant}.db")
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant").lower()
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT") or (None if TENANTS else SINGLE_TENANT)
+TENANT_POOL_SIZE = int(os.getenv("TENANT_POOL_SIZE", "5"))
+current_tenant_name: ContextVar[Optional[str]] = ContextVar("tenant", default=None)
+
+class TenantDatabase:
+    """Базы филиала: основная, архив закрытых заказов и движок истории; движки создаются при первом обращении"""
+    
+    def __init__(self, name: str, url: str, archive_path: Optional[str] = None, label: Optional[str] = None):
+        self.name = name
+        # Код филиала в метках метрик и именах файлов состояния; None — база единственная, имена прежние
+        self.label = label
+        self.url = url
+        self.hot_path = os.path.abspath(make_url(url).database)
+        self.archive_path = archive_path or f"{os.path.splitext(self.hot_path)[0]}_archive.db"
+        # Граница архива из его метаданных; перечитывается, когда меняется файл архива
+        self.archive_state = {"mtime": None, "archived_before": None}
+        self.lock = threading.Lock()
+        self._engine = None
+        self._history_engine = None
+    
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.lock:
+                if self._engine is None:
+                    engine = create_engine(self.url, pool_size=TENANT_POOL_SIZE, connect_args={"check_same_thread": False})
+                    event.listen(engine, "before_cursor_execute", metrics_before_cursor_execute)
+                    event.listen(engine, "after_cursor_execute", metrics_after_cursor_execute)
+                    self._engine = engine
+        return self._engine
+    
+    @property
+    def history_engine(self):
+        """Пустая база в памяти, к которой подключены основная база и архив филиала"""
+        if self._history_engine is None:
+            with self.lock:
+                if self._history_engine is None:
+                    engine = create_engine("sqlite://", poolclass=QueuePool, connect_args={"check_same_thread": False})
+                    event.listen(engine, "connect", self.create_history_views)
+                    event.listen(engine, "before_cursor_execute", metrics_before_cursor_execute)
+                    event.listen(engine, "after_cursor_execute", metrics_after_cursor_execute)
+                    self._history_engine = engine
+        return self._history_engine
+    
+    def create_history_views(self, dbapi_connection, connection_record):
+        """Временные представления с именами таблиц: имена без схемы ищутся сначала во временной схеме"""
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("ATTACH DATABASE ? AS hot", (self.hot_path,))
+            cursor.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            hot_tables = [row[0] for row in cursor.execute(
+                "SELECT name FROM hot.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )]
+            archived = {row[0] for row in cursor.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+            for table in hot_tables:
+                select = f'SELECT * FROM hot."{table}"'
+                if table in archived:
+                    select += f' UNION ALL SELECT * FROM archive."{table}"'
+                cursor.execute(f'CREATE TEMP VIEW "{table}" AS {select}')
+        finally:
+            cursor.close()
+    
+    def archived_before(self) -> Optional[str]:
+        """Дата (YYYY-MM-DD), раньше которой закрытые заказы и выплаты могут лежать в архиве; None без архива"""
+        try:
+            mtime = os.stat(self.archive_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self.archive_state["mtime"]:
+            value = None
+            try:
+                with sqlite3.connect(f"file:{self.archive_path}?mode=ro", uri=True) as conn:
+                    row = conn.execute("SELECT value FROM archive_meta WHERE key = 'archived_before'").fetchone()
+                    value = row[0] if row else None
+            except sqlite3.Error:
+                pass
+            self.archive_state.update(mtime=mtime, archived_before=value)
+        return self.archive_state["archived_before"]
+
+if TENANTS:
+    tenants = {name: TenantDatabase(name, TENANT_DATABASE_URL.format(tenant=name), label=name) for name in TENANTS}
+else:
+    tenants = {SINGLE_TENANT: TenantDatabase(SINGLE_TENANT, DATABASE_URL, os.getenv("ARCHIVE_DATABASE_PATH"))}
+if DEFAULT_TENANT is not None and DEFAULT_TENANT not in tenants:
+    raise ValueError(f"DEFAULT_TENANT={DEFAULT_TENANT} нет среди филиалов TENANTS")
+
+def active_tenant() -> Optional[str]:
+    """Филиал текущего запроса или задачи; None — не выбран"""
+    return current_tenant_name.get() or DEFAULT_TENANT
+
+def current_tenant() -> TenantDatabase:
+    name = active_tenant()
+    if name is None:
+        raise HTTPException(status_code=400, detail="Не указан филиал: заголовок X-Tenant или поддомен")
+    return tenants[name]
+
+@contextmanager
+def tenant_scope(name: Optional[str]):
+    """Работа от имени филиала вне запроса: фоновые задачи, сводные отчеты, CLI"""
+    token = current_tenant_name.set(name)
+    try:
+        yield
+    finally:
+        current_tenant_name.reset(token)
+
+class TenantSession(Session):
+    """Сессия базы филиала текущего запроса"""
+    
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or current_tenant().engine, **kwargs)
+
+class HistorySession(Session):
+    """Сессия истории (основная база и архив) филиала текущего запроса; только для чтения"""
+    
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or current_tenant().history_engine, **kwargs)
+
+SessionLocal = sessionmaker(class_=TenantSession, autocommit=False, autoflush=False)
+HistorySessionLocal = sessionmaker(class_=HistorySession, autocommit=False, autoflush=False)
+
+# Метрики /metrics в текстовом формате Prometheus: HTTP-запросы по шаблону маршрута, их длительность,
+# запросы в работе, размер ответа (после сжатия), SQL-запросы и время в базе на запрос, попадания в кэши.
+# Каждый воркер gunicorn считает в памяти и, если задан METRICS_DIR, раз в METRICS_FLUSH_SECONDS
+# атомарно сбрасывает снимок в worker-<pid>.json; /metrics суммирует снимки всех воркеров
+# (gauge — только живых процессов). Снимки прошлого запуска удаляет `python main.py migrate`
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS = {
+    "http_requests_total": ("counter", "Число HTTP-запросов", None),
+    "http_request_duration_seconds": ("histogram", "Длительность HTTP-запроса, с", METRICS_LATENCY_BUCKETS),
+    "http_requests_in_progress": ("gauge", "HTTP-запросы в работе", None),
+    "http_response_size_bytes": ("histogram", "Размер тела ответа (после сжатия), байт",
+                                 (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+    "db_queries_per_request": ("histogram", "Число SQL-запросов на HTTP-запрос", (1, 2, 5, 10, 20, 50, 100, 200, 500)),
+    "db_query_seconds_per_request": ("histogram", "Суммарное время SQL-запросов на HTTP-запрос, с", METRICS_LATENCY_BUCKETS),
+    "db_queries_total": ("counter", "Число SQL-запросов", None),
+    "cache_requests_total": ("counter", "Обращения к кэшам по результату (hit/miss)", None),
+    "heavy_report_requests_total": ("counter", "Запросы тяжелых отчетов: рассчитан, объединен с таким же, отклонен (503)", None),
+    "db_maintenance_duration_seconds": ("histogram", "Длительность шагов обслуживания базы, с",
+                                        (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)),
+    "db_maintenance_runs_total": ("counter", "Шаги обслуживания базы по результату (ok/error)", None),
+    "db_maintenance_freed_pages_total": ("counter", "Страницы, возвращенные файловой системе очисткой базы", None),
+    "db_maintenance_last_success_timestamp_seconds": ("gauge", "Время последнего успешного обслуживания базы (unix)", None),
+    "db_pages": ("gauge", "Страницы файла базы: всего (total) и свободные (free)", None),
+    "db_page_size_bytes": ("gauge", "Размер страницы базы, байт", None),
+    "db_backup_duration_seconds": ("histogram", "Длительность снятия резервной копии базы, с",
+                                   (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)),
+    "db_backups_total": ("counter", "Резервные копии по результату (ok/error)", None),
+    "db_backup_sets": ("gauge", "Число хранимых наборов резервных копий", None),
+    "db_backup_last_success_timestamp_seconds": ("gauge", "Время последней резервной копии (unix)", None),
+    "db_backup_last_size_bytes": ("gauge", "Размер последнего набора резервных копий (сжатого), байт", None),
+}
+metrics_lock = threading.Lock()
+# Значения счетчиков и gauge; у гистограмм — счетчики по корзинам (последняя — +Inf), сумма и количество
+metrics_values: Dict[tuple, float] = {}
+metrics_histograms: Dict[tuple, List[float]] = {}
+metrics_flusher_pid: Optional[int] = None
+# SQL-статистика текущего HTTP-запроса [число, секунды, формы запросов или None, все запросы с временем
+# (только при профилировании) или None]; список изменяемый,
+# поэтому запросы из потоков пула (копия контекста) видны middleware
+request_db_stats: ContextVar[Optional[List[Any]]] = ContextVar("request_db_stats", default=None)
+# scope текущего HTTP-запроса: эндпоинт для журнала медленных запросов
+request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+# Бюджет SQL-запросов на HTTP-запрос: эндпоинт объявляет его декоратором @query_budget(n), остальным
+# достается DEFAULT_QUERY_BUDGET; потоковые выгрузки (@query_budget(None)) не проверяются — число запросов растет
+# с объемом данных, а пачки по ключу повторяют одну форму с разными параметрами. При QUERY_BUDGET_CHECK=1 запоминается каждый запрос (текст с плейсхолдерами
+# и параметры); превышения бюджета и формы, повторенные с разными параметрами (N+1), пишутся в лог
+# и в query_budget_violations — их проверяет benchmarks/query_budgets.py
+QUERY_BUDGET_CHECK = os.getenv("QUERY_BUDGET_CHECK", "0") == "1"
+DEFAULT_QUERY_BUDGET = int(os.getenv("DEFAULT_QUERY_BUDGET", "20"))
+N_PLUS_ONE_MIN_REPEATS = 3
+query_budget_violations: deque = deque(maxlen=1000)
+query_budget_logger = logging.getLogger("query_budget")
+
+def query_budget(limit: Optional[int]):
+    """Декоратор эндпоинта: не больше limit SQL-запросов на HTTP-запрос (None — без проверки; ставится под @app.get)"""
+    def decorator(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorator
+
+# Тяжелые отчеты (@heavy_report() под @app.get): одинаковые запросы в работе (тот же эндпоинт и параметры) ждут
+# один общий расчет; одновременно считается не больше HEAVY_REPORT_CONCURRENCY отчетов эндпоинта, следующие
+# ждут в очереди до HEAVY_REPORT_QUEUE запросов и HEAVY_REPORT_QUEUE_TIMEOUT секунд, сверх — 503 с Retry-After.
+# Синхронный обработчик считается в пуле потоков, поэтому цикл событий продолжает обслуживать остальные запросы.
+# Общий расчет открывает свои сессии (тот же класс и та же база, что у сессий запроса) и закрывает их сам —
+# отключение клиента, начавшего расчет, не ломает его остальным; SQL-статистика расчета ведется отдельно
+# и добавляется каждому запросу, получившему результат (метрики, Server-Timing, бюджет запросов)
+HEAVY_REPORT_CONCURRENCY = int(os.getenv("HEAVY_REPORT_CONCURRENCY", "2"))
+HEAVY_REPORT_QUEUE = int(os.getenv("HEAVY_REPORT_QUEUE", "8"))
+HEAVY_REPORT_QUEUE_TIMEOUT = float(os.getenv("HEAVY_REPORT_QUEUE_TIMEOUT", "30"))
+HEAVY_REPORT_RETRY_AFTER = int(os.getenv("HEAVY_REPORT_RETRY_AFTER", "5"))
+# Отчеты в работе: ключ (филиал, эндпоинт и параметры) -> задача расчета
+heavy_reports_in_flight: Dict[tuple, asyncio.Future] = {}
+
+def heavy_report(limit: Optional[int] = None):
+    """Декоратор тяжелого отчета: объединение одинаковых запросов и лимит одновременных расчетов с очередью"""
+    def decorator(endpoint):
+        report = endpoint.__name__
+        semaphore: List[Optional[asyncio.Semaphore]] = [None]
+        waiting = [0]
+        
+        def reject(reason: str):
+            metrics_inc("heavy_report_requests_total", (("report", report), ("result", "rejected")))
+            raise HTTPException(status_code=503, detail=f"Сервер занят расчетом отчетов ({reason}), повторите запрос позже",
+                                headers={"Retry-After": str(HEAVY_REPORT_RETRY_AFTER)})
+        
+        def call(params: dict, sessions: dict):
+            opened = {name: open_session() for name, open_session in sessions.items()}
+            try:
+                return endpoint(**params, **opened)
+            finally:
+                for db in opened.values():
+                    db.close()
+        
+        async def compute(params: dict, sessions: dict):
+            if semaphore[0] is None:
+                semaphore[0] = asyncio.Semaphore(limit or HEAVY_REPORT_CONCURRENCY)
+            if semaphore[0].locked() and waiting[0] >= HEAVY_REPORT_QUEUE:
+                reject("очередь заполнена")
+            waiting[0] += 1
+            try:
+                await asyncio.wait_for(semaphore[0].acquire(), HEAVY_REPORT_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                reject("истекло время ожидания в очереди")
+            finally:
+                waiting[0] -= 1
+            metrics_inc("heavy_report_requests_total", (("report", report), ("result", "computed")))
+            # Своя статистика в контексте задачи расчета (запрос, начавший расчет, ее не видит)
+            stats = [0, 0.0, {} if QUERY_BUDGET_CHECK else None, []]
+            request_db_stats.set(stats)
+            try:
+                if asyncio.iscoroutinefunction(endpoint):
+                    opened = {name: open_session() for name, open_session in sessions.items()}
+                    try:
+                        return await endpoint(**params, **opened), stats
+                    finally:
+                        for db in opened.values():
+                            db.close()
+                return await run_in_threadpool(call, params, sessions), stats
+            finally:
+                semaphore[0].release()
+        
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            params = tuple(sorted((name, repr(value)) for name, value in kwargs.items()
+                                  if not isinstance(value, (Session, Request))))
+            # Отчеты разных филиалов считаются по разным базам и не объединяются
+            key = (active_tenant(), report, params)
+            task = heavy_reports_in_flight.get(key)
+            if task is None:
+                # Вместо сессий запроса — фабрики своих сессий расчета того же класса на той же базе
+                sessions = {name: functools.partial(type(value), bind=value.get_bind(), autoflush=False)
+                            for name, value in kwargs.items() if isinstance(value, Session)}
+                call_kwargs = {name: value for name, value in kwargs.items() if name not in sessions}
+                task = heavy_reports_in_flight[key] = asyncio.ensure_future(compute(call_kwargs, sessions))
+                task.add_done_callback(
+                    lambda done: heavy_reports_in_flight.pop(key) if heavy_reports_in_flight.get(key) is done else None
+                )
+            else:
+                metrics_inc("heavy_report_requests_total", (("report", report), ("result", "coalesced")))
+            # shield: отмена одного из ожидающих запросов не прерывает общий расчет
+            result, shared = await asyncio.shield(task)
+            stats = request_db_stats.get()
+            if stats is not None:
+                stats[0] += shared[0]
+                stats[1] += shared[1]
+                if stats[2] is not None and shared[2] is not None:
+                    for statement, (count, statement_params) in shared[2].items():
+                        entry = stats[2].setdefault(statement, [0, set()])
+                        entry[0] += count
+                        entry[1] |= statement_params
+                if stats[3] is not None:
+                    stats[3].extend(shared[3])
+            return result
+        
+        return wrapper
+    return decorator
+
+def record_statement(statements: Dict[str, list], statement: str, parameters):
+    """Число выполнений формы запроса и различные наборы ее параметров"""
+    entry = statements.get(statement)
+    if entry is None:
+        entry = statements[statement] = [0, set()]
+    entry[0] += 1
+    try:
+        entry[1].add(hash(repr(parameters)))
+    except TypeError:
+        pass
+
+def check_query_budget(endpoint, method: str, route: str, query_count: int, statements: Dict[str, list]):
+    """Отчет о запросах HTTP-запроса, если бюджет превышен или найден N+1, иначе None"""
+    budget = getattr(endpoint, "query_budget", DEFAULT_QUERY_BUDGET)
+    if budget is None:
+        return None
+    repeated = [
+        {"statement": " ".join(statement.split())[:300], "count": count, "distinct_params": len(params)}
+        for statement, (count, params) in statements.items()
+        if count >= N_PLUS_ONE_MIN_REPEATS and len(params) > 1
+    ]
+    if query_count <= budget and not repeated:
+        return None
+    
+    repeated.sort(key=lambda item: item["count"], reverse=True)
+    report = {
+        "method": method,
+        "route": route,
+        "queries": query_count,
+        "budget": budget,
+        "over_budget": query_count > budget,
+        "repeated": repeated
+    }
+    query_budget_violations.append(report)
+    query_budget_logger.warning(
+        "%s %s: %d SQL-запросов при бюджете %d%s", method, route, query_count, budget,
+        "".join(f"\n  N+1 ({item['count']} раз): {item['statement']}" for item in repeated[:3])
+    )
+    return report
+
+# Журнал медленных SQL-запросов: каждый запрос приводится к форме (литералы и списки IN заменены плейсхолдерами),
+# по формам копятся число выполнений, суммарное и максимальное время (входят в снимок метрик воркера,
+# GET /api/admin/slow-queries показывает самые дорогие формы всех воркеров). Запрос дольше SLOW_QUERY_MS
+# пишется JSON-строкой с параметрами, эндпоинтом и планом EXPLAIN QUERY PLAN в ротируемый SLOW_QUERY_LOG;
+# SLOW_QUERY_MS=0 отключает журнал. Время — до получения первых строк результата (как у метрик)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "./logs/slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+SLOW_QUERY_MAX_SHAPES = 2000
+slow_query_lock = threading.Lock()
+# Форма -> [выполнений, секунд всего, максимум, медленных, план, эндпоинты]
+slow_query_shapes: Dict[str, list] = {}
+slow_query_plans: Dict[str, List[str]] = {}
+slow_query_log = logging.getLogger("slow_queries")
+slow_query_log.propagate = False
+if SLOW_QUERY_MS > 0:
+    os.makedirs(os.path.dirname(os.path.abspath(SLOW_QUERY_LOG)), exist_ok=True)
+    slow_query_handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                                             backupCount=SLOW_QUERY_LOG_BACKUPS, encoding="utf-8", delay=True)
+    slow_query_handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_query_log.addHandler(slow_query_handler)
+    slow_query_log.setLevel(logging.INFO)
+
+@lru_cache(maxsize=4096)
+def normalize_sql(statement: str) -> str:
+    """Форма запроса: строки и числа заменены на ?, списки IN (?, ?, ...) — на IN (...)"""
+    text = re.sub(r"'(?:[^']|'')*'", "?", " ".join(statement.split()))
+    text = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", text)
+    return re.sub(r"IN \((?:\?, )+\?\)", "IN (...)", text, flags=re.IGNORECASE)
+
+def explain_query_plan(conn, statement: str, parameters) -> List[str]:
+    """План SQLite в виде дерева строк; прямой курсор драйвера, мимо событий движка, кэш по тексту запроса"""
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+        return []
+    if statement in slow_query_plans:
+        return slow_query_plans[statement]
+    if isinstance(parameters, list):
+        parameters = parameters[0] if parameters else ()
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+    except Exception as e:
+        return [f"EXPLAIN QUERY PLAN не выполнен: {e}"]
+    finally:
+        cursor.close()
+    depth = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    if len(slow_query_plans) < SLOW_QUERY_MAX_SHAPES:
+        slow_query_plans[statement] = plan
+    return plan
+
+def record_query(conn, statement: str, parameters, elapsed: float):
+    """Учет запроса в сводке по формам; медленный запрос — еще и в журнал с планом"""
+    shape = normalize_sql(statement)
+    with slow_query_lock:
+        entry = slow_query_shapes.get(shape)
+        if entry is None and len(slow_query_shapes) < SLOW_QUERY_MAX_SHAPES:
+            entry = slow_query_shapes[shape] = [0, 0.0, 0.0, 0, None, []]
+        if entry is not None:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+    if SLOW_QUERY_MS <= 0 or elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    
+    scope = request_scope.get()
+    endpoint, path = None, None
+    if scope is not None:
+        handler = scope.get("endpoint")
+        endpoint = f"{scope['method']} {handler.__name__ if handler is not None else scope['path']}"
+        path = scope["path"] + (f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else "")
+    plan = explain_query_plan(conn, statement, parameters)
+    if entry is not None:
+        with slow_query_lock:
+            entry[3] += 1
+            entry[4] = plan
+            if endpoint and endpoint not in entry[5] and len(entry[5]) < 5:
+                entry[5].append(endpoint)
+    slow_query_log.info(json.dumps({
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ms": round(elapsed * 1000, 3),
+        "shape": shape,
+        "sql": " ".join(statement.split()),
+        "params": repr(parameters)[:500],
+        "endpoint": endpoint,
+        "path": path,
+        "plan": plan
+    }, ensure_ascii=False))
+
+def slow_statements_snapshot() -> list:
+    with slow_query_lock:
+        return [[shape, *entry[:4], entry[4], entry[5][:]] for shape, entry in slow_query_shapes.items()]
+
+def metrics_inc(name: str, labels: tuple = (), value: float = 1.0):
+    with metrics_lock:
+        metrics_values[(name, labels)] = metrics_values.get((name, labels), 0.0) + value
+
+def metrics_observe(name: str, labels: tuple, value: float):
+    buckets = METRICS[name][2]
+    with metrics_lock:
+        state = metrics_histograms.get((name, labels))
+        if state is None:
+            state = metrics_histograms[(name, labels)] = [0.0] * (len(buckets) + 3)
+        state[bisect_left(buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+def record_cache(cache: str, hit: bool):
+    """Учет обращения к кэшу: доля попаданий = hit / (hit + miss)"""
+    metrics_inc("cache_requests_total", (("cache", cache), ("result", "hit" if hit else "miss")))
+
+def metrics_snapshot() -> dict:
+    with metrics_lock:
+        return {
+            "pid": os.getpid(),
+            "values": [[name, list(labels), value] for (name, labels), value in metrics_values.items()],
+            "histograms": [[name, list(labels), state[:]] for (name, labels), state in metrics_histograms.items()],
+            "statements": slow_statements_snapshot(),
+        }
+
+def flush_metrics():
+    """Снимок воркера в METRICS_DIR: временный файл и os.replace, чтобы не прочитать его наполовину"""
+    path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump(metrics_snapshot(), file)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def start_metrics_flusher():
+    """Фоновый поток сброса снимков; запускается при первом запросе в каждом воркере (после fork)"""
+    global metrics_flusher_pid
+    if not METRICS_DIR or metrics_flusher_pid == os.getpid():
+        return
+    metrics_flusher_pid = os.getpid()
+    
+    def flush_loop():
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            flush_metrics()
+    
+    threading.Thread(target=flush_loop, name="metrics-flush", daemon=True).start()
+
+def reset_metrics_dir():
+    """Удаление снимков прошлого запуска, иначе счетчики продолжатся с прошлых значений"""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.startswith("worker-"):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+def process_alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def format_metric_labels(labels) -> str:
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def collect_metrics_snapshots() -> List[dict]:
+    """Снимок текущего процесса и сохраненные снимки остальных воркеров"""
+    own = metrics_snapshot()
+    snapshots = [own]
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if not (name.startswith("worker-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("pid") != own["pid"]:
+                snapshot["alive"] = process_alive(snapshot.get("pid"))
+                snapshots.append(snapshot)
+    return snapshots
+
+def render_metrics() -> str:
+    """Сумма снимков текущего и остальных воркеров в текстовом формате Prometheus"""
+    values: Dict[tuple, float] = {}
+    histograms: Dict[tuple, List[float]] = {}
+    for snapshot in collect_metrics_snapshots():
+        for name, labels, value in snapshot["values"]:
+            if name not in METRICS or (METRICS[name][0] == "gauge" and not snapshot.get("alive", True)):
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            values[key] = values.get(key, 0.0) + value
+        for name, labels, state in snapshot["histograms"]:
+            if name not in METRICS or len(state) != len(METRICS[name][2]) + 3:
+                continue
+            total = histograms.setdefault((name, tuple(tuple(pair) for pair in labels)), [0.0] * len(state))
+            for index, value in enumerate(state):
+                total[index] += value
+    # Размер файла базы одинаков для всех воркеров: читается в момент запроса и не суммируется
+    try:
+        values.update(database_file_metrics())
+        values.update(backup_metrics())
+    except Exception:
+        pass
+    
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (metric, labels), state in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(list(buckets) + ["+Inf"], state[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', str(bound)),))} {format_metric_value(cumulative)}")
+                lines.append(f"{name}_sum{format_metric_labels(labels)} {format_metric_value(state[-2])}")
+                lines.append(f"{name}_count{format_metric_labels(labels)} {format_metric_value(state[-1])}")
+        else:
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_metric_labels(labels)} {format_metric_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def metrics_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def metrics_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    metrics_inc("db_queries_total")
+    record_query(conn, statement, parameters, elapsed)
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+        if stats[2] is not None:
+            record_statement(stats[2], statement, parameters)
+        if stats[3] is not None:
+            stats[3].append((statement, parameters, elapsed))
+
+class MetricsMiddleware:
+    """ASGI-middleware учета HTTP-запросов; подключается последним (внешним), чтобы видеть размер после сжатия"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.route_paths: Optional[Dict[int, str]] = None
+    
+    def route_label(self, scope) -> str:
+        """Шаблон пути маршрута (/api/orders/{order_id}) по обработчику, который роутер записал в scope"""
+        if self.route_paths is None:
+            self.route_paths = {}
+            for route in app.routes:
+                handler = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                if handler is not None:
+                    self.route_paths.setdefault(id(handler), route.path)
+        endpoint = scope.get("endpoint")
+        return self.route_paths.get(id(endpoint), "unmatched") if endpoint is not None else "unmatched"
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        started = time.perf_counter()
+        db_stats = [0, 0.0, {} if QUERY_BUDGET_CHECK else None, None]
+        token = request_db_stats.set(db_stats)
+        scope_token = request_scope.set(scope)
+        status_code = 500
+        response_size = 0
+        
+        async def send_with_metrics(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+        
+        start_metrics_flusher()
+        metrics_inc("http_requests_in_progress", (("method", method),))
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            metrics_inc("http_requests_in_progress", (("method", method),), -1)
+            request_db_stats.reset(token)
+            request_scope.reset(scope_token)
+            route = self.route_label(scope)
+            labels = (("method", method), ("route", route))
+            metrics_inc("http_requests_total", labels + (("status", str(status_code)),))
+            metrics_observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            metrics_observe("http_response_size_bytes", labels, response_size)
+            metrics_observe("db_queries_per_request", labels, db_stats[0])
+            metrics_observe("db_query_seconds_per_request", labels, db_stats[1])
+            if db_stats[2] is not None:
+                check_query_budget(scope.get("endpoint"), method, route, db_stats[0], db_stats[2])
+
+# Профилирование запроса по требованию: запрос с заголовком X-Profile-Token (или ?profile=) со значением
+# PROFILE_TOKEN выполняется под сэмплирующим профилировщиком (поток раз в PROFILE_INTERVAL секунд снимает
+# стеки занятых потоков процесса). В PROFILE_DIR сохраняются <id>.speedscope.json (flamegraph для
+# https://www.speedscope.app) и <id>.sql.json (SQL-запросы с параметрами и временем), ссылки — в заголовках
+# X-Profile-Url и X-Profile-Sql-Url, скачивание — с тем же токеном. Без PROFILE_TOKEN middleware не подключается
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_KEEP = 200
+PROFILE_KINDS = ("speedscope.json", "sql.json")
+# Файлы, в которых поток ждет (блокировки, select цикла событий, очередь пула) — такие стеки пропускаются
+PROFILE_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+profile_logger = logging.getLogger("profiling")
+
+def check_profile_token(value: Optional[str]) -> bool:
+    """Совпадает ли токен с PROFILE_TOKEN (сравнение за постоянное время)"""
+    if not PROFILE_TOKEN or not value:
+        return False
+    return hmac.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+def requested_profile_token(scope) -> Optional[str]:
+    """Токен из заголовка X-Profile-Token или параметра ?profile="""
+    for name, value in scope["headers"]:
+        if name == b"x-profile-token":
+            return value.decode("latin-1")
+    query = scope.get("query_string", b"")
+    if b"profile=" in query:
+        values = parse_qs(query.decode("latin-1")).get("profile")
+        if values:
+            return values[0]
+    return None
+
+class StackSampler:
+    """Поток, снимающий стеки остальных потоков раз в interval секунд; вес сэмпла — время с прошлого снимка"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Dict[int, list] = {}
+        self.thread_names: Dict[int, str] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    
+    def run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_filename.endswith(PROFILE_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append((frame.f_code.co_name, frame.f_code.co_filename, frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(thread_id, []).append((tuple(stack), weight))
+
+def speedscope_document(name: str, sampler: StackSampler) -> dict:
+    """Профиль в формате speedscope: по одному сэмплированному профилю на поток, самый загруженный первым"""
+    frames, frame_indexes, profiles = [], {}, []
+    for thread_id, samples in sampler.samples.items():
+        stacks, weights = [], []
+        for stack, weight in samples:
+            indexes = []
+            for key in stack:
+                if key not in frame_indexes:
+                    frame_indexes[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                indexes.append(frame_indexes[key])
+            stacks.append(indexes)
+            weights.append(round(weight * 1000, 3))
+        profiles.append({"type": "sampled", "name": sampler.thread_names.get(thread_id, str(thread_id)),
+                         "unit": "milliseconds", "startValue": 0, "endValue": round(sum(weights), 3),
+                         "samples": stacks, "weights": weights})
+    profiles.sort(key=lambda profile: profile["endValue"], reverse=True)
+    return {"$schema": "https://www.speedscope.app/file-format-schema.json", "name": name, "exporter": "aircon-crm",
+            "activeProfileIndex": 0, "shared": {"frames": frames}, "profiles": profiles}
+
+def sql_profile_document(name: str, status_code: int, seconds: float, statements: list) -> dict:
+    """SQL-запросы по порядку и сводка по формам запроса (самые дорогие первыми)"""
+    shapes: Dict[str, list] = {}
+    executed = []
+    for statement, parameters, elapsed in statements:
+        text = " ".join(statement.split())
+        executed.append({"sql": text, "params": repr(parameters)[:500], "ms": round(elapsed * 1000, 3)})
+        shape = shapes.setdefault(text, [0, 0.0])
+        shape[0] += 1
+        shape[1] += elapsed
+    return {
+        "request": name,
+        "status": status_code,
+        "duration_ms": round(seconds * 1000, 3),
+        "sql_count": len(executed),
+        "sql_ms": round(sum(elapsed for _, _, elapsed in statements) * 1000, 3),
+        "by_shape": [{"sql": text, "count": count, "total_ms": round(total * 1000, 3)}
+                     for text, (count, total) in sorted(shapes.items(), key=lambda item: item[1][1], reverse=True)],
+        "statements": executed,
+    }
+
+def save_profile(profile_id: str, name: str, status_code: int, seconds: float, sampler: StackSampler, statements: list):
+    """Запись файлов профиля (временный файл и os.replace) и удаление самых старых сверх PROFILE_KEEP"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    documents = {
+        "speedscope.json": speedscope_document(name, sampler),
+        "sql.json": sql_profile_document(name, status_code, seconds, statements),
+    }
+    for kind, document in documents.items():
+        path = os.path.join(PROFILE_DIR, f"{profile_id}.{kind}")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+    profiles = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".speedscope.json"))
+    for old in profiles[:-PROFILE_KEEP]:
+        for kind in PROFILE_KINDS:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old.replace("speedscope.json", kind)))
+            except FileNotFoundError:
+                pass
+    profile_logger.info("Профиль %s: %s, %.0f мс", profile_id, name, seconds * 1000)
+
+class ProfilingMiddleware:
+    """ASGI-middleware профилирования по токену; подключается внутри MetricsMiddleware (берет его SQL-статистику)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith("/api/profiles")
+                or not check_profile_token(requested_profile_token(scope))):
+            await self.app(scope, receive, send)
+            return
+        
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        name = f"{scope['method']} {scope['path']}"
+        # Токен из ?profile= не попадает в имя профиля, которое сохраняется в файлах профиля
+        query = "&".join(part for part in scope.get("query_string", b"").decode("latin-1").split("&")
+                         if part and part.split("=", 1)[0] != "profile")
+        if query:
+            name += f"?{query}"
+        status_code = 500
+        
+        async def send_with_links(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Url"] = f"/api/profiles/{profile_id}/speedscope.json"
+                headers["X-Profile-Sql-Url"] = f"/api/profiles/{profile_id}/sql.json"
+            await send(message)
+        
+        stats = request_db_stats.get()
+        statements = []
+        if stats is not None:
+            stats[3] = statements
+        sampler = StackSampler(PROFILE_INTERVAL)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_links)
+        finally:
+            sampler.stop()
+            seconds = time.perf_counter() - started
+            await run_in_threadpool(save_profile, profile_id, name, status_code, seconds, sampler, statements)
+
+if PROFILE_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+class ServerTimingMiddleware:
+    """ASGI-middleware заголовка Server-Timing; подключается внутри MetricsMiddleware (берет его SQL-статистику)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        timings: Dict[str, float] = {}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - started
+                stats = request_db_stats.get() or [0, 0.0]
+                parts = [f'db;dur={stats[1] * 1000:.1f};desc="{stats[0]} queries"']
+                spent = stats[1]
+                for name, description in (("render", "jinja"), ("ser", "json")):
+                    if name in timings:
+                        parts.append(f'{name};dur={timings[name] * 1000:.1f};desc="{description}"')
+                        spent += timings[name]
+                parts.append(f'app;dur={max(total - spent, 0.0) * 1000:.1f};desc="python"')
+                parts.append(f"total;dur={total * 1000:.1f}")
+                MutableHeaders(scope=message).append("Server-Timing", ", ".join(parts))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
+class TenantMiddleware:
+    """ASGI-middleware выбора филиала запроса: заголовок X-Tenant или поддомен; неизвестный филиал в заголовке — 404"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        name = headers.get(TENANT_HEADER)
+        if name is not None:
+            name = name.strip().lower()
+            if name not in tenants:
+                await JSONResponse({"detail": "Филиал не найден"}, status_code=404)(scope, receive, send)
+                return
+        else:
+            subdomain = headers.get("host", "").split(":", 1)[0].split(".", 1)[0].lower()
+            name = subdomain if subdomain in tenants else None
+        with tenant_scope(name):
+            await self.app(scope, receive, send)
+
+# Внутри MetricsMiddleware: ответ 404 на неизвестный филиал тоже учитывается в метриках
+app.add_middleware(TenantMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Модели SQLAlchemy
 Base = declarative_base()
@@ -95,6 +1138,8 @@ class Order(Base):
     status = Column(String, default="новый")  # Статус: новый, в работе, завершен, отменен
     created_at = Column(String, default=lambda: datetime.now().strftime("%Y-%m-%d"))
     updated_at = Column(String, onupdate=lambda: datetime.now().strftime("%Y-%m-%d"))
+    # Выгрузка заказов читается пачками по ключу (order_date, id), новые первыми
+    __table_args__ = (Index("ix_orders_order_date_id", "order_date", "id"),)
     
     # Отношения
     client = relationship("Client", back_populates="orders")
@@ -136,8 +1181,8 @@ class OrderUpdate(BaseModel):
 class Client(Base):
     __tablename__ = "clients"
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    phone = Column(String, nullable=False)
+    name = Column(String, index=True, nullable=False)
+    phone = Column(String, index=True, nullable=False)
     source = Column(String, nullable=False)
     created_at = Column(String, default=lambda: datetime.now().strftime("%Y-%m-%d"))
     updated_at = Column(String, onupdate=lambda: datetime.now().strftime("%Y-%m-%d"))
@@ -152,8 +1197,603 @@ class CompanyBalance(Base):
     initial_balance = Column(Float, nullable=False)  # Начальный баланс
     updated_at = Column(String, default=lambda: datetime.now().strftime("%Y-%m-%d"))
 
-# Инициализация базы данных
-Base.metadata.create_all(bind=engine)
+def migrate():
+    """
+    Создание недостающих таблиц в базах всех филиалов. Выполняется один раз перед запуском воркеров
+    (python main.py migrate), а не при импорте модуля в каждом воркере.
+    """
+    reset_metrics_dir()
+    for tenant in tenants.values():
+        # Новая база сразу создается с incremental vacuum (у существующей режим меняет только VACUUM)
+        with tenant.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        Base.metadata.create_all(bind=tenant.engine)
+        # create_all не добавляет индексы в уже существующие таблицы
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=tenant.engine, checkfirst=True)
+
+# Архив закрытых заказов: завершенные и отмененные заказы старше ARCHIVE_HORIZON_MONTHS месяцев вместе
+# с услугами заказа и выплаты старше той же границы переносятся в отдельный файл SQLite
+# (`python main.py archive [YYYY-MM-DD]`, по умолчанию test_archive.db рядом с базой филиала).
+# Повседневные запросы работают только с основной базой. Отчеты за период раньше границы архива получают
+# сессию истории: в ней каждая таблица — временное представление UNION ALL основной и архивной,
+# поэтому запросы отчетов не меняются. Клиенты, сотрудники, услуги и расходы остаются в основной базе
+ARCHIVE_HORIZON_MONTHS = int(os.getenv("ARCHIVE_HORIZON_MONTHS", "24"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Таблицы архива в порядке переноса и закрытые статусы заказа
+ARCHIVED_TABLES = ("orders", "order_services", "payments")
+CLOSED_ORDER_STATUSES = ("завершен", "отменен")
+
+def archived_before() -> Optional[str]:
+    """Граница архива филиала текущего запроса; None без архива"""
+    return current_tenant().archived_before()
+
+def needs_archive(period_start: Optional[str]) -> bool:
+    """Нужен ли архив для периода с period_start (None — весь период)"""
+    boundary = archived_before()
+    return boundary is not None and (period_start is None or period_start < boundary)
+
+def get_db_since(date_from: Optional[str] = Query(None)):
+    """Сессия отчета за период с date_from: история, если период начинается раньше границы архива"""
+    db = HistorySessionLocal() if needs_archive(date_from) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_db_if_archived(date_from: Optional[str] = Query(None)):
+    """Сессия рабочего списка: история — только если date_from явно задан раньше границы архива"""
+    db = HistorySessionLocal() if date_from and needs_archive(date_from) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_db_for_month(month: Optional[str] = Query(None)):
+    """Сессия отчета за месяц (YYYY-MM, по умолчанию текущий): история — для месяцев до границы архива"""
+    db = HistorySessionLocal() if month and needs_archive(f"{month}-01") else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@contextmanager
+def session_with_archive(db: Session):
+    """Сессия проверки ссылок перед удалением клиента или услуги: история, если есть архив (иначе
+    удалилась бы запись, на которую ссылаются только архивные заказы, и отчеты потеряли бы ее выручку)"""
+    if archived_before() is None:
+        yield db
+        return
+    history_db = HistorySessionLocal()
+    try:
+        yield history_db
+    finally:
+        history_db.close()
+
+def export_session(filters: Dict[str, Any]) -> Session:
+    """Сессия выгрузки: история, если период выгрузки захватывает архив"""
+    return HistorySessionLocal() if needs_archive(filters.get("date_from")) else SessionLocal()
+
+def archive_closed_orders(before: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Перенос в архив закрытых заказов с датой раньше before вместе с их услугами и выплат раньше before.
+    Пачка — одна транзакция на обе базы (в режиме журнала rollback SQLite фиксирует ее атомарно).
+    Строки с наибольшим id остаются в основной базе: без AUTOINCREMENT SQLite выдал бы их id новым записям
+    """
+    started = time.perf_counter()
+    tenant = current_tenant()
+    # Явные транзакции: ATTACH нельзя выполнить внутри транзакции
+    conn = tenant.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (tenant.archive_path,))
+    try:
+        conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS archive.archive_meta (key TEXT PRIMARY KEY, value TEXT)")
+        for table in ARCHIVED_TABLES:
+            for (sql,) in conn.exec_driver_sql(
+                "SELECT sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type DESC", (table,)
+            ).fetchall():
+                # Таблица, затем ее индексы — в схеме archive
+                conn.exec_driver_sql(re.sub(
+                    r"^CREATE (TABLE|UNIQUE INDEX|INDEX)\s+(\"?\w+\"?)",
+                    lambda match: f"CREATE {match.group(1)} IF NOT EXISTS archive.{match.group(2)}", sql
+                ))
+        # Граница записывается до переноса: отчеты за старый период сразу читают обе базы
+        boundary = conn.exec_driver_sql("SELECT value FROM archive.archive_meta WHERE key = 'archived_before'").scalar()
+        conn.exec_driver_sql("INSERT OR REPLACE INTO archive.archive_meta (key, value) VALUES ('archived_before', ?)",
+                             (max(boundary or before, before),))
+
+        guard = {table: conn.exec_driver_sql(f"SELECT coalesce(max(id), 0) FROM main.{table}").scalar()
+                 for table in ARCHIVED_TABLES}
+        kept_orders = {guard["orders"], conn.exec_driver_sql(
+            "SELECT order_id FROM main.order_services WHERE id = ?", (guard["order_services"],)
+        ).scalar() or 0}
+        statuses = ", ".join(f"'{status}'" for status in CLOSED_ORDER_STATUSES)
+        conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+        batch = "SELECT id FROM temp.archive_batch"
+        # Пачки: выборка id и условия строк каждой таблицы
+        selections = [
+            (f"SELECT id FROM main.orders WHERE status IN ({statuses}) AND order_date < ? "
+             f"AND id NOT IN ({', '.join(map(str, kept_orders))}) ORDER BY id LIMIT ?",
+             [("orders", f"id IN ({batch})"), ("order_services", f"order_id IN ({batch})")]),
+            (f"SELECT id FROM main.payments WHERE payment_date < ? AND id <> {guard['payments']} ORDER BY id LIMIT ?",
+             [("payments", f"id IN ({batch})")]),
+        ]
+        counts = dict.fromkeys(ARCHIVED_TABLES, 0)
+        for select_ids, moves in selections:
+            while True:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                conn.exec_driver_sql("DELETE FROM temp.archive_batch")
+                if not conn.exec_driver_sql(f"INSERT INTO temp.archive_batch {select_ids}", (before, batch_size)).rowcount:
+                    conn.exec_driver_sql("COMMIT")
+                    break
+                for table, where in moves:
+                    counts[table] += conn.exec_driver_sql(
+                        f"INSERT OR REPLACE INTO archive.{table} SELECT * FROM main.{table} WHERE {where}"
+                    ).rowcount
+                for table, where in reversed(moves):
+                    conn.exec_driver_sql(f"DELETE FROM main.{table} WHERE {where}")
+                conn.exec_driver_sql("COMMIT")
+        conn.exec_driver_sql("INSERT OR REPLACE INTO archive.archive_meta (key, value) VALUES ('archived_at', ?)",
+                             (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        conn.exec_driver_sql("ANALYZE archive")
+    except Exception:
+        if conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("ROLLBACK")
+        raise
+    finally:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.archive_batch")
+        conn.exec_driver_sql("DETACH DATABASE archive")
+        conn.close()
+    return {"before": before, "archive_path": tenant.archive_path, **counts,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+def default_archive_before() -> str:
+    """Первое число месяца ARCHIVE_HORIZON_MONTHS месяцев назад: месяцы архивируются целиком"""
+    today = date.today()
+    month_index = today.year * 12 + today.month - 1 - ARCHIVE_HORIZON_MONTHS
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}-01"
+
+# Обслуживание файла базы: раз в сутки в окно тихих часов MAINTENANCE_WINDOW (местное время, "03:00-05:00";
+# пустое значение отключает) фоновый поток воркера выполняет ANALYZE (или PRAGMA optimize, если статистика
+# уже есть), PRAGMA incremental_vacuum шагами по MAINTENANCE_VACUUM_PAGES страниц и checkpoint WAL.
+# Файл без auto_vacuum=INCREMENTAL один раз переводится в этот режим полным VACUUM. Из нескольких воркеров
+# обслуживает тот, кто создал файл блокировки; итоги последнего запуска — в MAINTENANCE_STATE_PATH
+# и GET /api/admin/maintenance. Вручную: `python main.py maintenance`. Базы филиалов обслуживаются по очереди,
+# у каждой свои файлы состояния и блокировки (maintenance-spb.json) и метка tenant в метриках
+MAINTENANCE_WINDOW = os.getenv("MAINTENANCE_WINDOW", "03:00-05:00")
+MAINTENANCE_CHECK_SECONDS = float(os.getenv("MAINTENANCE_CHECK_SECONDS", "300"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "2000"))
+MAINTENANCE_STATE_PATH = os.getenv("MAINTENANCE_STATE_PATH", "./logs/maintenance.json")
+MAINTENANCE_MIN_INTERVAL = 12 * 60 * 60
+MAINTENANCE_LOCK_TIMEOUT = 60 * 60
+maintenance_logger = logging.getLogger("maintenance")
+maintenance_scheduler_pid: Optional[int] = None
+
+def maintenance_state_path(tenant: TenantDatabase) -> str:
+    if tenant.label is None:
+        return MAINTENANCE_STATE_PATH
+    root, ext = os.path.splitext(MAINTENANCE_STATE_PATH)
+    return f"{root}-{tenant.label}{ext}"
+
+def tenant_labels(tenant: TenantDatabase) -> tuple:
+    return (("tenant", tenant.label),) if tenant.label else ()
+
+def read_maintenance_state(tenant: TenantDatabase) -> Dict[str, Any]:
+    try:
+        with open(maintenance_state_path(tenant), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_maintenance_state(tenant: TenantDatabase, state: Dict[str, Any]):
+    path = maintenance_state_path(tenant)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def database_file_stats(cursor) -> Dict[str, Any]:
+    return {name: cursor.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("page_size", "page_count", "freelist_count", "auto_vacuum", "journal_mode")}
+
+def database_file_pages(path: str) -> Optional[tuple]:
+    """Размер страницы, число страниц (по размеру файла) и свободных страниц (из заголовка) без соединения с базой;
+    страницы в WAL до контрольной точки не учитываются. None, если файла нет или это не база SQLite"""
+    try:
+        with open(path, "rb") as database_file:
+            header = database_file.read(100)
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if len(header) < 100 or not header.startswith(b"SQLite format 3\x00"):
+        return None
+    page_size = int.from_bytes(header[16:18], "big")
+    if page_size == 1:
+        page_size = 65536
+    return page_size, size // page_size, int.from_bytes(header[36:40], "big")
+
+def database_file_metrics() -> Dict[tuple, float]:
+    """Показания /metrics: страницы файлов баз филиалов и время последнего успешного обслуживания.
+    Читаются из файлов, а не через соединение: сбор метрик не создает движки филиалов"""
+    values = {}
+    for tenant in tenants.values():
+        labels = tenant_labels(tenant)
+        pages = database_file_pages(tenant.hot_path)
+        if pages is not None:
+            page_size, page_count, freelist = pages
+            values[("db_pages", (("kind", "total"),) + labels)] = page_count
+            values[("db_pages", (("kind", "free"),) + labels)] = freelist
+            values[("db_page_size_bytes", labels)] = page_size
+        last_success = read_maintenance_state(tenant).get("last_success")
+        if last_success is not None:
+            values[("db_maintenance_last_success_timestamp_seconds", labels)] = last_success
+    return values
+
+def maintenance_analyze(cursor) -> Dict[str, Any]:
+    has_stats = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'").fetchone()
+    # Статистика по выборке до 1000 строк на индекс, а не по всей таблице
+    cursor.execute("PRAGMA analysis_limit = 1000")
+    if has_stats:
+        # 0x10002: проверить все таблицы, а не только прочитанные этим соединением
+        cursor.execute("PRAGMA optimize = 0x10002").fetchall()
+        return {"mode": "optimize"}
+    cursor.execute("ANALYZE")
+    return {"mode": "analyze"}
+
+def maintenance_vacuum(cursor) -> Dict[str, Any]:
+    pages = cursor.execute("PRAGMA page_count").fetchone()[0]
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Режим auto_vacuum меняется только полным VACUUM; выполняется один раз
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        mode = "full"
+    else:
+        # Короткие шаги: между ними другие соединения успевают писать
+        mode = "incremental"
+        freelist = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        while freelist:
+            cursor.execute(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES})").fetchall()
+            remaining = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= freelist:
+                break
+            freelist = remaining
+    return {"mode": mode, "freed_pages": pages - cursor.execute("PRAGMA page_count").fetchone()[0]}
+
+def maintenance_checkpoint(cursor) -> Dict[str, Any]:
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        return {"mode": "skipped"}
+    busy, log_frames, checkpointed = cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"mode": "truncate", "busy": busy, "log_frames": log_frames, "checkpointed_frames": checkpointed}
+
+def run_maintenance(tenant: TenantDatabase) -> Dict[str, Any]:
+    """Шаги analyze, vacuum, checkpoint; ошибка шага (база занята дольше таймаута) не прерывает остальные"""
+    started_at = time.time()
+    labels = tenant_labels(tenant)
+    result: Dict[str, Any] = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "tasks": {}}
+    connection = tenant.engine.raw_connection()
+    # Без неявных транзакций драйвера: VACUUM внутри транзакции невозможен
+    dbapi_connection = connection.dbapi_connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    try:
+        result["before"] = database_file_stats(cursor)
+        for task, step in (("analyze", maintenance_analyze), ("vacuum", maintenance_vacuum),
+                           ("checkpoint", maintenance_checkpoint)):
+            task_started = time.perf_counter()
+            try:
+                details, status = step(cursor), "ok"
+            except Exception as e:
+                maintenance_logger.warning("Обслуживание базы: шаг %s не выполнен: %s", task, e)
+                details, status = {"error": str(e)}, "error"
+            seconds = time.perf_counter() - task_started
+            result["tasks"][task] = {"result": status, "seconds": round(seconds, 3), **details}
+            metrics_observe("db_maintenance_duration_seconds", (("task", task),) + labels, seconds)
+            metrics_inc("db_maintenance_runs_total", (("task", task), ("result", status)) + labels)
+            if details.get("freed_pages"):
+                metrics_inc("db_maintenance_freed_pages_total", labels, details["freed_pages"])
+        result["after"] = database_file_stats(cursor)
+    finally:
+        cursor.close()
+        dbapi_connection.isolation_level = isolation_level
+        connection.close()
+    result["seconds"] = round(time.time() - started_at, 3)
+    result["ok"] = all(task["result"] == "ok" for task in result["tasks"].values())
+    state = read_maintenance_state(tenant)
+    state["last_run"] = result
+    if result["ok"]:
+        state["last_success"] = started_at
+    write_maintenance_state(tenant, state)
+    return result
+
+def maintenance_due(tenant: TenantDatabase) -> bool:
+    """Идет окно тихих часов и успешного обслуживания не было MAINTENANCE_MIN_INTERVAL"""
+    if not MAINTENANCE_WINDOW:
+        return False
+    start, end = [int(part.split(":")[0]) * 60 + int(part.split(":")[1]) for part in MAINTENANCE_WINDOW.split("-")]
+    now = datetime.now()
+    minute = now.hour * 60 + now.minute
+    if not (start <= minute < end if start <= end else minute >= start or minute < end):
+        return False
+    last_success = read_maintenance_state(tenant).get("last_success")
+    return last_success is None or time.time() - last_success >= MAINTENANCE_MIN_INTERVAL
+
+def run_maintenance_if_due(tenant: TenantDatabase):
+    if not maintenance_due(tenant):
+        return
+    # Файл блокировки создается атомарно (O_EXCL); оставшийся от упавшего процесса снимается по возрасту
+    lock_path = f"{maintenance_state_path(tenant)}.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lock_path) >= MAINTENANCE_LOCK_TIMEOUT:
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+        return
+    os.close(fd)
+    try:
+        # Другой воркер мог закончить обслуживание, пока этот проверял расписание
+        if maintenance_due(tenant):
+            run_maintenance(tenant)
+    finally:
+        os.remove(lock_path)
+
+@app.on_event("startup")
+def start_maintenance_scheduler():
+    """Поток проверки расписания раз в MAINTENANCE_CHECK_SECONDS, один на процесс (после fork воркера)"""
+    global maintenance_scheduler_pid
+    if not MAINTENANCE_WINDOW or maintenance_scheduler_pid == os.getpid():
+        return
+    maintenance_scheduler_pid = os.getpid()
+
+    def scheduler_loop():
+        while True:
+            time.sleep(MAINTENANCE_CHECK_SECONDS)
+            for tenant in tenants.values():
+                try:
+                    run_maintenance_if_due(tenant)
+                except Exception:
+                    maintenance_logger.exception("Ошибка обслуживания базы филиала %s", tenant.name)
+
+    threading.Thread(target=scheduler_loop, name="db-maintenance", daemon=True).start()
+
+# Резервные копии без остановки приложения: снимок средствами SQLite, а не копированием файла под записью.
+# BACKUP_METHOD: backup — online backup API шагами по BACKUP_PAGES_PER_STEP страниц (блокировка чтения только
+# на шаг; если базу изменили, SQLite копирует заново, после BACKUP_MAX_RESTARTS перезапусков — одним шагом),
+# vacuum — VACUUM INTO одной транзакцией чтения (в режиме WAL не мешает писателям), auto — vacuum для WAL,
+# иначе backup. Копии базы и архива проверяются PRAGMA integrity_check, сжимаются gzip, SHA-256 пишется
+# в манифест набора <имя>.json (пишется последним). В BACKUP_DIR хранятся BACKUP_KEEP последних наборов каждой
+# базы филиала (имя набора начинается с имени файла базы, ротация и список — по базе-источнику).
+# `python main.py backup [list | verify <имя> | restore <имя>]`, GET/POST /api/admin/backups
+BACKUP_DIR = os.getenv("BACKUP_DIR", "./backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "14"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") == "1"
+BACKUP_METHOD = os.getenv("BACKUP_METHOD", "auto")
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "20"))
+BACKUP_BUSY_TIMEOUT = 30.0
+backup_logger = logging.getLogger("backup")
+
+class BackupError(Exception):
+    """Копию нельзя снять, проверить или восстановить"""
+
+def backup_snapshot(database_path: str, target_path: str) -> Dict[str, Any]:
+    source = sqlite3.connect(database_path, timeout=BACKUP_BUSY_TIMEOUT)
+    try:
+        journal_mode = source.execute("PRAGMA journal_mode").fetchone()[0].lower()
+        method = BACKUP_METHOD if BACKUP_METHOD != "auto" else "vacuum" if journal_mode == "wal" else "backup"
+        details: Dict[str, Any] = {"method": method, "source_journal_mode": journal_mode}
+        if method == "vacuum":
+            source.execute("VACUUM INTO ?", (target_path,))
+        else:
+            target = sqlite3.connect(target_path)
+            state = {"restarts": 0, "remaining": None}
+
+            def progress(status, remaining, total):
+                # Перезапуск копирования заметен по росту числа оставшихся страниц
+                if state["remaining"] is not None and remaining > state["remaining"]:
+                    state["restarts"] += 1
+                    if state["restarts"] > BACKUP_MAX_RESTARTS:
+                        raise BackupError("слишком много перезапусков")
+                state["remaining"] = remaining
+                # Пауза между шагами: блокировка чтения снята, писатели успевают зафиксировать транзакции
+                time.sleep(BACKUP_STEP_SLEEP)
+
+            try:
+                source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+            except BackupError:
+                source.backup(target, pages=-1)
+                details["single_step"] = True
+            finally:
+                target.close()
+            details["restarts"] = state["restarts"]
+    finally:
+        source.close()
+    # Копия — самостоятельный файл без журнала WAL рядом
+    copy = sqlite3.connect(target_path)
+    try:
+        copy.execute("PRAGMA journal_mode = DELETE")
+        integrity = copy.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        copy.close()
+    if integrity != "ok":
+        raise BackupError(f"Копия {database_path} не прошла проверку целостности: {integrity}")
+    return details
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def list_backups(database_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Завершенные наборы копий (с манифестом; только базы database_path, если задана), новые первыми"""
+    manifests = []
+    if os.path.isdir(BACKUP_DIR):
+        for file_name in os.listdir(BACKUP_DIR):
+            if file_name.endswith(".json"):
+                try:
+                    with open(os.path.join(BACKUP_DIR, file_name), encoding="utf-8") as f:
+                        manifests.append(json.load(f))
+                except (OSError, ValueError):
+                    backup_logger.warning("Поврежденный манифест копии %s", file_name)
+    if database_path is not None:
+        manifests = [manifest for manifest in manifests
+                     if any(item["role"] == "main" and os.path.abspath(item["source"]) == os.path.abspath(database_path)
+                            for item in manifest["files"])]
+    return sorted(manifests, key=lambda manifest: (manifest["timestamp"], manifest["name"]), reverse=True)
+
+def rotate_backups(database_path: str) -> List[str]:
+    removed = []
+    for manifest in list_backups(database_path)[max(BACKUP_KEEP, 1):]:
+        for file_name in [item["file"] for item in manifest["files"]] + [f"{manifest['name']}.json"]:
+            try:
+                os.remove(os.path.join(BACKUP_DIR, file_name))
+            except FileNotFoundError:
+                pass
+        removed.append(manifest["name"])
+    return removed
+
+def create_backup(label: Optional[str] = None, rotate: bool = True) -> Dict[str, Any]:
+    """Набор копий основной базы и архива (если он есть) филиала текущего запроса; возвращает манифест"""
+    started = time.perf_counter()
+    tenant = current_tenant()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    created_at = datetime.now()
+    base_name = f"{os.path.splitext(os.path.basename(tenant.hot_path))[0]}-{created_at.strftime('%Y%m%d-%H%M%S')}"
+    name = base_name + (f"-{label}" if label else "")
+    suffix = 2
+    while os.path.exists(os.path.join(BACKUP_DIR, f"{name}.json")):
+        name = f"{base_name}{f'-{label}' if label else ''}~{suffix}"
+        suffix += 1
+    sources = [("main", tenant.hot_path)] + ([("archive", tenant.archive_path)] if os.path.exists(tenant.archive_path) else [])
+    files, result = [], "error"
+    try:
+        with tempfile.TemporaryDirectory(dir=BACKUP_DIR, prefix=".tmp-") as tmp_dir:
+            for role, path in sources:
+                snapshot_path = os.path.join(tmp_dir, f"{role}.db")
+                details = backup_snapshot(path, snapshot_path)
+                file_name = f"{name}-{role}.db" + (".gz" if BACKUP_COMPRESS else "")
+                stored_path = os.path.join(BACKUP_DIR, file_name)
+                with open(snapshot_path, "rb") as src, open(f"{stored_path}.tmp", "wb") as raw:
+                    out = gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=6, mtime=0) if BACKUP_COMPRESS else raw
+                    for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                        out.write(chunk)
+                    if BACKUP_COMPRESS:
+                        out.close()
+                os.replace(f"{stored_path}.tmp", stored_path)
+                files.append({"role": role, "file": file_name, "source": path, "sha256": file_sha256(stored_path),
+                              "size": os.path.getsize(stored_path), "db_size": os.path.getsize(snapshot_path),
+                              "integrity": "ok", **details})
+        manifest = {"name": name, "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    "timestamp": created_at.timestamp(), "compressed": BACKUP_COMPRESS,
+                    "seconds": round(time.perf_counter() - started, 3), "files": files}
+        manifest_path = os.path.join(BACKUP_DIR, f"{name}.json")
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        result = "ok"
+    except Exception:
+        for item in files:
+            try:
+                os.remove(os.path.join(BACKUP_DIR, item["file"]))
+            except FileNotFoundError:
+                pass
+        raise
+    finally:
+        metrics_observe("db_backup_duration_seconds", (), time.perf_counter() - started)
+        metrics_inc("db_backups_total", (("result", result),))
+    manifest["removed"] = rotate_backups(tenant.hot_path) if rotate else []
+    return manifest
+
+def extract_backup(name: str, tmp_dir: str) -> Dict[str, str]:
+    """Проверка набора (SHA-256 файлов и целостность распакованных баз); пути распакованных баз по ролям"""
+    if not re.fullmatch(r"[\w-][\w.~-]*", name):
+        raise BackupError(f"Недопустимое имя копии: {name}")
+    try:
+        with open(os.path.join(BACKUP_DIR, f"{name}.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f"Копия {name} не найдена в {BACKUP_DIR}")
+    extracted = {}
+    for item in manifest["files"]:
+        stored_path = os.path.join(BACKUP_DIR, item["file"])
+        if not os.path.exists(stored_path):
+            raise BackupError(f"Файл копии {stored_path} не найден")
+        if file_sha256(stored_path) != item["sha256"]:
+            raise BackupError(f"Контрольная сумма {stored_path} не совпадает с манифестом")
+        target_path = os.path.join(tmp_dir, f"{item['role']}.db")
+        with (gzip.open(stored_path, "rb") if manifest.get("compressed") else open(stored_path, "rb")) as src, \
+                open(target_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        conn = sqlite3.connect(target_path)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if integrity != "ok":
+            raise BackupError(f"Копия {item['file']} не прошла проверку целостности: {integrity}")
+        extracted[item["role"]] = target_path
+    return extracted
+
+def verify_backup(name: str, database_path: Optional[str] = None) -> Dict[str, Any]:
+    """Проверка набора (только набора базы database_path, если она задана: чужой набор считается ненайденным)"""
+    started = time.perf_counter()
+    if database_path is not None and name not in {manifest["name"] for manifest in list_backups(database_path)}:
+        raise BackupError(f"Копия {name} не найдена в {BACKUP_DIR}")
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=BACKUP_DIR, prefix=".tmp-") as tmp_dir:
+        roles = sorted(extract_backup(name, tmp_dir))
+    return {"name": name, "ok": True, "files": roles, "seconds": round(time.perf_counter() - started, 3)}
+
+def restore_backup(name: str, safety_copy: bool = True) -> Dict[str, Any]:
+    """
+    Восстановление набора в файлы базы и архива филиала тем же backup API (файл не подменяется под открытой базой).
+    Текущее состояние сначала сохраняется копией pre-restore; архив, которого нет в наборе, удаляется,
+    иначе отчеты сложили бы восстановленные строки с архивными
+    """
+    started = time.perf_counter()
+    tenant = current_tenant()
+    result: Dict[str, Any] = {"name": name, "restored": []}
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=BACKUP_DIR, prefix=".tmp-") as tmp_dir:
+        extracted = extract_backup(name, tmp_dir)
+        if safety_copy and os.path.exists(tenant.hot_path):
+            # Без ротации: восстанавливаемый набор может оказаться самым старым
+            result["safety_copy"] = create_backup(label="pre-restore", rotate=False)["name"]
+        for role, target_path in (("main", tenant.hot_path), ("archive", tenant.archive_path)):
+            if role not in extracted:
+                if os.path.exists(target_path):
+                    os.remove(target_path)
+                    result["removed"] = target_path
+                continue
+            source = sqlite3.connect(extracted[role])
+            target = sqlite3.connect(target_path, timeout=BACKUP_BUSY_TIMEOUT)
+            try:
+                source.backup(target, pages=-1)
+            finally:
+                target.close()
+                source.close()
+            result["restored"].append(role)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+def backup_metrics() -> Dict[tuple, float]:
+    """Показания /metrics по последнему набору копий базы каждого филиала (в том числе снятому из cron)"""
+    values = {}
+    for tenant in tenants.values():
+        backups = list_backups(tenant.hot_path)
+        labels = tenant_labels(tenant)
+        values[("db_backup_sets", labels)] = len(backups)
+        if backups:
+            values[("db_backup_last_success_timestamp_seconds", labels)] = backups[0]["timestamp"]
+            values[("db_backup_last_size_bytes", labels)] = sum(item["size"] for item in backups[0]["files"])
+    return values
 
 # Pydantic модели для валидации
 class ExpenseCreate(BaseModel):
@@ -284,104 +1924,242 @@ def get_db():
     finally:
         db.close()
 
+def fetch_rows(db: Session, query) -> List[Dict[str, Any]]:
+    """Выполнение запроса по колонкам и преобразование строк Core в словари без создания ORM-объектов"""
+    result = db.execute(query.statement)
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
 async def get_order_details(order_id: int, db: Session):
     """Получить детали заказа с учетом всех связанных данных"""
     order = db.query(Order).filter(Order.id == order_id).first()
     if not order:
         return None
-        
-    # Получаем основную услугу
-    main_service = db.query(Service).filter(Service.id == order.service_id).first()
-    
-    # Получаем дополнительные услуги
-    additional_services = []
-    order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-    for os in order_services:
-        service = db.query(Service).filter(Service.id == os.service_id).first()
+    return get_orders_details_bulk([order], db)[0]
+
+def get_orders_details_bulk(orders: List[Order], db: Session) -> List[Dict[str, Any]]:
+    """Детали для пачки заказов за фиксированное число запросов (формат как у get_order_details)"""
+    if not orders:
+        return []
+
+    order_ids = [order.id for order in orders]
+
+    # Дополнительные услуги всех заказов пачки одним запросом
+    order_services = db.query(OrderService.order_id, OrderService.service_id).filter(
+        OrderService.order_id.in_(order_ids)
+    ).order_by(OrderService.id).all()
+
+    # Все нужные услуги, сотрудники и клиенты — по одному запросу на таблицу
+    service_ids = {order.service_id for order in orders} | {link.service_id for link in order_services}
+    services = {s.id: s for s in db.query(Service).filter(Service.id.in_(service_ids)).all()}
+
+    employee_ids = set()
+    for order in orders:
+        employee_ids.update(filter(None, (order.manager_id, order.one_employee_id, order.two_employee_id)))
+    employees = {e.id: e for e in db.query(Employee).filter(Employee.id.in_(employee_ids)).all()}
+
+    client_ids = {order.client_id for order in orders}
+    clients = {c.id: c for c in db.query(Client).filter(Client.id.in_(client_ids)).all()}
+
+    additional_by_order: Dict[int, List[Dict[str, Any]]] = {order_id: [] for order_id in order_ids}
+    for link in order_services:
+        service = services.get(link.service_id)
         if service:
-            additional_services.append({
+            additional_by_order[link.order_id].append({
                 "id": service.id,
                 "name": service.name,
                 "price": service.price,
                 "category": service.category
             })
-    
-    # Получаем исполнителей
-    manager = db.query(Employee).filter(Employee.id == order.manager_id).first()
-    first_installer = db.query(Employee).filter(Employee.id == order.one_employee_id).first()
-    second_installer = None
-    if order.two_employee_id:
-        second_installer = db.query(Employee).filter(Employee.id == order.two_employee_id).first()
-    
-    # Получаем клиента
-    client = db.query(Client).filter(Client.id == order.client_id).first()
-    
-    # Рассчитываем общую стоимость заказа
-    total_price = main_service.price if main_service else 0
-    for service in additional_services:
-        total_price += service["price"]
-    
-    return {
-        "id": order.id,
-        "status": order.status,
-        "order_date": order.order_date,
-        "completion_date": order.completion_date,
-        "notes": order.notes,
-        "client": {
-            "id": client.id,
-            "name": client.name,
-            "phone": client.phone
-        } if client else None,
-        "main_service": {
-            "id": main_service.id,
-            "name": main_service.name,
-            "price": main_service.price,
-            "category": main_service.category
-        } if main_service else None,
-        "additional_services": additional_services,
-        "manager": {
-            "id": manager.id,
-            "name": manager.name
-        } if manager else None,
-        "first_installer": {
-            "id": first_installer.id,
-            "name": first_installer.name
-        } if first_installer else None,
-        "second_installer": {
-            "id": second_installer.id,
-            "name": second_installer.name
-        } if second_installer else None,
-        "total_price": total_price
-    }
+
+    def employee_ref(employee_id):
+        employee = employees.get(employee_id) if employee_id else None
+        return {"id": employee.id, "name": employee.name} if employee else None
+
+    details = []
+    for order in orders:
+        main_service = services.get(order.service_id)
+        client = clients.get(order.client_id)
+        additional_services = additional_by_order[order.id]
+
+        total_price = main_service.price if main_service else 0
+        for service in additional_services:
+            total_price += service["price"]
+
+        details.append({
+            "id": order.id,
+            "status": order.status,
+            "order_date": order.order_date,
+            "completion_date": order.completion_date,
+            "notes": order.notes,
+            "client": {
+                "id": client.id,
+                "name": client.name,
+                "phone": client.phone
+            } if client else None,
+            "main_service": {
+                "id": main_service.id,
+                "name": main_service.name,
+                "price": main_service.price,
+                "category": main_service.category
+            } if main_service else None,
+            "additional_services": additional_services,
+            "manager": employee_ref(order.manager_id),
+            "first_installer": employee_ref(order.one_employee_id),
+            "second_installer": employee_ref(order.two_employee_id),
+            "total_price": total_price
+        })
+
+    return details
+
+# Справочные данные страниц (статусы, источники, категории, услуги, активные сотрудники).
+# Кэшируются в процессе воркера; изменения услуг и сотрудников сбрасывают кэш своего воркера,
+# остальные воркеры увидят их не позже чем через REFERENCE_DATA_TTL_SECONDS
+REFERENCE_DATA_TTL_SECONDS = int(os.getenv("REFERENCE_DATA_TTL_SECONDS", "60"))
+ORDER_STATUSES = ["новый", "в работе", "завершен", "отменен"]
+CLIENT_SOURCES = ["Авито", "ВК", "Яндекс услуги", "Листовки", "Рекомендации", "Другое"]
+SERVICE_CATEGORIES = ["Монтаж", "Демонтаж", "Кондиционер", "Фреон", "Доп услуга"]
+# Справочники у каждого филиала свои: кэш по коду филиала
+reference_data_cache: Dict[str, Dict[str, Any]] = {}
+
+def get_reference_data(db: Session) -> Dict[str, Any]:
+    """Справочники для оболочек страниц: два легких запроса раз в TTL вместо загрузки полных таблиц"""
+    now = time.time()
+    cache = reference_data_cache.setdefault(current_tenant().name, {"data": None, "loaded_at": 0.0})
+    expired = cache["data"] is None or now - cache["loaded_at"] > REFERENCE_DATA_TTL_SECONDS
+    record_cache("reference_data", not expired)
+    if expired:
+        services = db.query(Service.id, Service.name, Service.category, Service.price).order_by(Service.name).all()
+        employees = db.query(Employee.id, Employee.name, Employee.employee_type).filter(
+            Employee.active == 1
+        ).order_by(Employee.name).all()
+        cache["data"] = {
+            "statuses": ORDER_STATUSES,
+            "sources": CLIENT_SOURCES,
+            "categories": SERVICE_CATEGORIES,
+            "services": [
+                {"id": s.id, "name": s.name, "category": s.category, "price": s.price}
+                for s in services
+            ],
+            "employees": [
+                {"id": e.id, "name": e.name, "employee_type": e.employee_type}
+                for e in employees
+            ]
+        }
+        cache["loaded_at"] = now
+    return cache["data"]
+
+def invalidate_reference_data():
+    """Сброс кэша справочников филиала после изменения услуг или сотрудников"""
+    reference_data_cache.pop(current_tenant().name, None)
+
+def get_orders_totals(db: Session, *filters):
+    """Выручка и себестоимость заказов по фильтрам: основная и доп. услуги двумя агрегатными запросами"""
+    totals = (func.coalesce(func.sum(Service.price), 0), func.coalesce(func.sum(Service.material_cost), 0))
+    
+    main_revenue, main_costs = db.query(*totals).select_from(Order).join(
+        Service, Service.id == Order.service_id
+    ).filter(*filters).one()
+    additional_revenue, additional_costs = db.query(*totals).select_from(OrderService).join(
+        Order, Order.id == OrderService.order_id
+    ).join(
+        Service, Service.id == OrderService.service_id
+    ).filter(*filters).one()
+    
+    return main_revenue + additional_revenue, main_costs + additional_costs
+
+def get_completed_orders_totals(db: Session, month: str):
+    """Выручка и себестоимость завершенных заказов за месяц"""
+    return get_orders_totals(db, Order.order_date.like(f"{month}%"), Order.status == "завершен")
+
+def get_completed_orders_totals_by_month(db: Session, months: List[str]) -> Dict[str, tuple]:
+    """Выручка и себестоимость завершенных заказов по месяцам (YYYY-MM): два агрегатных запроса на все месяцы"""
+    month_of_order = func.substr(Order.order_date, 1, 7)
+    filters = (month_of_order.in_(months), Order.status == "завершен")
+    totals = (month_of_order, func.coalesce(func.sum(Service.price), 0), func.coalesce(func.sum(Service.material_cost), 0))
+    
+    result: Dict[str, tuple] = {}
+    main_rows = db.query(*totals).select_from(Order).join(
+        Service, Service.id == Order.service_id
+    ).filter(*filters).group_by(month_of_order).all()
+    additional_rows = db.query(*totals).select_from(OrderService).join(
+        Order, Order.id == OrderService.order_id
+    ).join(
+        Service, Service.id == OrderService.service_id
+    ).filter(*filters).group_by(month_of_order).all()
+    for month, revenue, costs in main_rows + additional_rows:
+        month_revenue, month_costs = result.get(month, (0, 0))
+        result[month] = (month_revenue + revenue, month_costs + costs)
+    return result
+
+def get_orders_material_costs(orders: List[Order], db: Session) -> Dict[int, float]:
+    """Себестоимость материалов заказов пачки (основная и доп. услуги) двумя запросами"""
+    if not orders:
+        return {}
+    
+    order_services = db.query(OrderService.order_id, OrderService.service_id).filter(
+        OrderService.order_id.in_([order.id for order in orders])
+    ).order_by(OrderService.id).all()
+    service_ids = {order.service_id for order in orders} | {link.service_id for link in order_services}
+    material_costs = dict(db.query(Service.id, Service.material_cost).filter(Service.id.in_(service_ids)).all())
+    
+    costs = {order.id: material_costs.get(order.service_id, 0) for order in orders}
+    for link in order_services:
+        costs[link.order_id] += material_costs.get(link.service_id, 0)
+    return costs
 
 async def calculate_salary(db: Session, month: Optional[str] = None):
+    """Расчет зарплаты для асинхронных эндпоинтов; синхронные (тяжелые отчеты в пуле потоков) вызывают compute_salary"""
+    return compute_salary(db, month)
+
+def compute_salary(db: Session, month: Optional[str] = None):
     """Расчет зарплаты сотрудников с улучшенной логикой"""
     # Если месяц не указан, используем текущий
     if not month:
         month = datetime.now().strftime("%Y-%m")
+    return compute_salaries(db, [month])[month]
+
+def compute_salaries(db: Session, months: List[str]) -> Dict[str, dict]:
+    """Расчет зарплаты за несколько месяцев (YYYY-MM): данные всех месяцев загружаются одними и теми же пятью запросами"""
+    month_of_order = func.substr(Order.order_date, 1, 7)
     
     # Получаем данные из базы с минимальным количеством запросов
     employees = db.query(Employee).filter(Employee.active == 1).all()
     
-    # Получаем только заказы за указанный месяц и только завершенные
+    # Получаем только заказы за указанные месяцы и только завершенные
     orders = db.query(Order).filter(
-        Order.order_date.like(f"{month}%"), 
+        month_of_order.in_(months),
         Order.status == "завершен"
     ).all()
     
-    # Получаем все доп. услуги для заказов этого месяца
+    # Получаем все доп. услуги для заказов этих месяцев
     order_ids = [order.id for order in orders]
     if order_ids:  # Проверка на пустой список
         order_services = db.query(OrderService).filter(OrderService.order_id.in_(order_ids)).all()
     else:
         order_services = []
     
-    # Получаем все платежи за указанный месяц
-    payments = db.query(Payment).filter(Payment.payment_date.like(f"{month}%")).all()
+    # Получаем все платежи за указанные месяцы
+    payments = db.query(Payment).filter(func.substr(Payment.payment_date, 1, 7).in_(months)).all()
     
     # Получаем все услуги
     all_services = {service.id: service for service in db.query(Service).all()}
     
+    month_by_order = {order.id: order.order_date[:7] for order in orders}
+    return {
+        month: calculate_month_salary(
+            employees,
+            [order for order in orders if order.order_date[:7] == month],
+            [order_service for order_service in order_services if month_by_order[order_service.order_id] == month],
+            [payment for payment in payments if payment.payment_date[:7] == month],
+            all_services
+        )
+        for month in months
+    }
+
+def calculate_month_salary(employees: List[Employee], orders: List[Order], order_services: List[OrderService],
+                           payments: List[Payment], all_services: Dict[int, Service]) -> dict:
+    """Зарплата сотрудников за месяц по уже загруженным заказам, доп. услугам и выплатам месяца"""
     # Подготовка результатов
     result = {
         "salary": {},       # Зарплата к выплате
@@ -496,7 +2274,7 @@ async def calculate_salary(db: Session, month: Optional[str] = None):
     return result
 
 # Новый эндпоинт для установки начального баланса
-@app.post("/api/balance/initial", response_class=JSONResponse)
+@app.post("/api/balance/initial")
 async def set_initial_balance(balance_data: InitialBalanceCreate, db: Session = Depends(get_db)):
     try:
         # Проверяем, есть ли уже запись о балансе
@@ -518,7 +2296,7 @@ async def set_initial_balance(balance_data: InitialBalanceCreate, db: Session =
         return {"message": f"Ошибка при установке начального баланса: {str(e)}", "status": "error"}
 
 # Новый эндпоинт для получения текущего баланса
-@app.get("/api/balance", response_class=JSONResponse)
+@app.get("/api/balance")
 async def get_balance(db: Session = Depends(get_db)):
     balance = db.query(CompanyBalance).first()
     if not balance:
@@ -530,9 +2308,21 @@ async def get_balance(db: Session = Depends(get_db)):
         "updated_at": balance.updated_at
     }
 
-# Эндпоинт для API дашборда
-@app.get("/api/dashboard", response_class=JSONResponse)
-async def get_dashboard_data(month: str = None, db: Session = Depends(get_db)):
+# Эндпоинт для API дашборда: показатели месяца и график за 12 месяцев — постоянное число агрегатных запросов.
+# Тяжелый отчет: синхронный обработчик считается в пуле потоков под лимитом heavy_report
+def get_dashboard_db(month: Optional[str] = Query(None)):
+    """Сессия дашборда: график охватывает 12 месяцев до выбранного, история — если они заходят за границу архива"""
+    current_date = datetime.strptime(month, "%Y-%m") if month else datetime.now()
+    chart_start = (current_date - timedelta(days=30 * 11)).strftime("%Y-%m-01")
+    db = HistorySessionLocal() if needs_archive(chart_start) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+@app.get("/api/dashboard")
+@heavy_report()
+def get_dashboard_data(month: str = None, db: Session = Depends(get_dashboard_db)):
     if not month:
         month = datetime.now().strftime("%Y-%m")
     
@@ -548,101 +2338,47 @@ async def get_dashboard_data(month: str = None, db: Session = Depends(get_db)):
         Order.status == "в работе"
     ).count()
     
-    # Рассчитываем выручку и прибыль
-    orders = db.query(Order).filter(
-        Order.order_date.like(f"{month}%"),
-        Order.status == "завершен"
-    ).all()
-    
-    total_revenue = 0
-    total_costs = 0
-    for order in orders:
-        service = db.query(Service).filter(Service.id == order.service_id).first()
-        if service:
-            total_revenue += service.price
-            total_costs += service.material_cost
-        
-        order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-        for os in order_services:
-            additional_service = db.query(Service).filter(Service.id == os.service_id).first()
-            if additional_service:
-                total_revenue += additional_service.price
-                total_costs += additional_service.material_cost
-    
-    salary_data = await calculate_salary(db, month)
-    total_salary = sum(salary_data["salary"].values())
-    total_expenses = total_costs + total_salary
-    total_profit = total_revenue - total_expenses
-    
-    # Популярные услуги
-    categories = ["Монтаж", "Демонтаж", "Кондиционер", "Фреон", "Доп услуга"]
-    popular_services = []
-    for category in categories:
-        main_services_count = db.query(Order).join(Service).filter(
-            Service.category == category,
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        ).count()
-        
-        additional_services_count = db.query(OrderService).join(Service).filter(
-            Service.category == category
-        ).join(Order).filter(
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        ).count()
-        
-        total_count = main_services_count + additional_services_count
-        if total_count > 0:
-            popular_services.append({"name": category, "count": total_count})
-    
+    # Популярные услуги: основные и доп. услуги завершенных заказов месяца по категориям, два агрегатных запроса
+    month_completed = (Order.order_date.like(f"{month}%"), Order.status == "завершен")
+    category_counts = defaultdict(int)
+    for category, count in db.query(Service.category, func.count(Order.id)).select_from(Order).join(
+        Service, Service.id == Order.service_id
+    ).filter(*month_completed).group_by(Service.category):
+        category_counts[category] += count
+    for category, count in db.query(Service.category, func.count(OrderService.id)).select_from(OrderService).join(
+        Service, Service.id == OrderService.service_id
+    ).join(Order, Order.id == OrderService.order_id).filter(*month_completed).group_by(Service.category):
+        category_counts[category] += count
+    
+    popular_services = [
+        {"name": category, "count": category_counts[category]}
+        for category in SERVICE_CATEGORIES if category_counts[category] > 0
+    ]
     popular_services.sort(key=lambda x: x["count"], reverse=True)
     popular_services = popular_services[:5]  # Топ-5
     
-    # Топ монтажников
-    top_installers = []
-    employees = db.query(Employee).filter(Employee.active == 1, Employee.employee_type == "монтажник").all()
-    for emp in employees:
-        orders_count = db.query(Order).filter(
-            or_(
-                Order.one_employee_id == emp.id,
-                Order.two_employee_id == emp.id
-            ),
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        ).count()
-        if orders_count > 0:
-            top_installers.append({"name": emp.name, "orders": orders_count})
+    # Топ монтажников: завершенные заказы месяца, где монтажник первый или второй, одним запросом
+    installer_orders = union(
+        select(Order.id.label("order_id"), Order.one_employee_id.label("employee_id")).where(*month_completed),
+        select(Order.id.label("order_id"), Order.two_employee_id.label("employee_id")).where(*month_completed)
+    ).subquery()
+    installers = db.query(Employee.name, func.count(installer_orders.c.order_id)).join(
+        installer_orders, installer_orders.c.employee_id == Employee.id
+    ).filter(Employee.active == 1, Employee.employee_type == "монтажник").group_by(Employee.id).all()
+    top_installers = [{"name": name, "orders": orders_count} for name, orders_count in installers]
     
     top_installers.sort(key=lambda x: x["orders"], reverse=True)
     top_installers = top_installers[:5]  # Топ-5
     
-    # Данные для графика (выручка и прибыль по месяцам за последний год)
-    monthly_data = []
+    # Данные для графика (выручка и прибыль по месяцам за последний год): все 12 месяцев — одними запросами
     current_date = datetime.strptime(month, "%Y-%m")
-    for i in range(12):
-        past_month = (current_date - timedelta(days=30 * i)).strftime("%Y-%m")
-        past_orders = db.query(Order).filter(
-            Order.order_date.like(f"{past_month}%"),
-            Order.status == "завершен"
-        ).all()
-        
-        month_revenue = 0
-        month_costs = 0
-        for order in past_orders:
-            service = db.query(Service).filter(Service.id == order.service_id).first()
-            if service:
-                month_revenue += service.price
-                month_costs += service.material_cost
-            
-            order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-            for os in order_services:
-                additional_service = db.query(Service).filter(Service.id == os.service_id).first()
-                if additional_service:
-                    month_revenue += additional_service.price
-                    month_costs += additional_service.material_cost
-        
-        month_salary_data = await calculate_salary(db, past_month)
-        month_salary = sum(month_salary_data["salary"].values())
+    chart_months = [(current_date - timedelta(days=30 * i)).strftime("%Y-%m") for i in range(12)]
+    totals_by_month = get_completed_orders_totals_by_month(db, chart_months)
+    salaries_by_month = compute_salaries(db, chart_months)
+    monthly_data = []
+    for past_month in chart_months:
+        month_revenue, month_costs = totals_by_month.get(past_month, (0, 0))
+        month_salary = sum(salaries_by_month[past_month]["salary"].values())
         month_expenses = month_costs + month_salary
         month_profit = month_revenue - month_expenses
         
@@ -652,6 +2388,10 @@ async def get_dashboard_data(month: str = None, db: Session = Depends(get_db)):
             "profit": month_profit
         })
     
+    # Первая точка ряда — запрошенный месяц: выручка и прибыль берутся из нее, а не считаются повторно
+    total_revenue = monthly_data[0]["revenue"]
+    total_profit = monthly_data[0]["profit"]
+    
     monthly_data.sort(key=lambda x: x["month"])  # Сортируем по дате
     
     return {
@@ -664,184 +2404,32 @@ async def get_dashboard_data(month: str = None, db: Session = Depends(get_db)):
         "monthly_data": monthly_data
     }
 
-# Главная страница с дашбордом
+# Главная страница с дашбордом: только оболочка, показатели загружаются из /api/dashboard
 @app.get("/", response_class=HTMLResponse)
-async def read_dashboard(
-    request: Request, 
-    month: str = None, 
-    db: Session = Depends(get_db)
-):
-    # Если месяц не указан, используем текущий
-    if not month:
-        month = datetime.now().strftime("%Y-%m")
-    
-    # Получаем только завершенные заказы за указанный месяц
-    orders = db.query(Order).filter(
-        Order.order_date.like(f"{month}%"),
-        Order.status == "завершен"
-    ).all()
-    
-    # Общее количество заказов, включая все статусы
-    all_orders = db.query(Order).filter(
-        Order.order_date.like(f"{month}%")
-    ).all()
-    
-    # Получаем количество клиентов за указанный месяц
-    new_clients_count = db.query(Client).filter(
-        Client.created_at.like(f"{month}%")
-    ).count()
-    
-    # Рассчитываем выручку, себестоимость и прибыль с JOIN для оптимизации
-    total_revenue = 0
-    total_costs = 0
-    
-    for order in orders:
-        # Основная услуга
-        service = db.query(Service).filter(Service.id == order.service_id).first()
-        if service:
-            total_revenue += service.price
-            total_costs += service.material_cost
-        
-        # Дополнительные услуги
-        order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-        for os in order_services:
-            additional_service = db.query(Service).filter(Service.id == os.service_id).first()
-            if additional_service:
-                total_revenue += additional_service.price
-                total_costs += additional_service.material_cost
-    
-    # Получаем информацию о сотрудниках, услугах и клиентах для отображения
-    services = db.query(Service).all()
-    employees = db.query(Employee).filter(Employee.active == 1).all()
-    clients = db.query(Client).all()
-    
-    # Загружаем данные о зарплатах для этого месяца
-    salary_data = await calculate_salary(db, month)
-    total_salary = sum(salary_data["salary"].values())
-    
-    # Общие расходы включают зарплаты и себестоимость материалов
-    total_expenses = total_costs + total_salary
-    
-    # Чистая прибыль
-    total_profit = total_revenue - total_expenses
-    
-    # Статистика по источникам клиентов
-    sources = ["Авито", "ВК", "Яндекс услуги", "Листовки", "Рекомендации", "Другое"]
-    client_sources = {}
-    for source in sources:
-        client_sources[source] = db.query(Client).filter(
-            Client.source == source,
-            Client.created_at.like(f"{month}%")
-        ).count()
-    
-    # Статистика по категориям услуг
-    categories = ["Монтаж", "Демонтаж", "Кондиционер", "Фреон", "Доп услуга"]
-    service_categories = {}
-    for category in categories:
-        # Считаем количество основных услуг по категории
-        main_services_count = db.query(Order).join(Service).filter(
-            Service.category == category,
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        ).count()
-        
-        # Считаем количество доп. услуг по категории
-        additional_services_count = db.query(OrderService).join(Service).filter(
-            Service.category == category
-        ).join(Order).filter(
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        ).count()
-        
-        service_categories[category] = main_services_count + additional_services_count
-    
-    # Получаем данные по статусам заказов
-    statuses = ["новый", "в работе", "завершен", "отменен"]
-    order_statuses = {}
-    for status in statuses:
-        order_statuses[status] = db.query(Order).filter(
-            Order.status == status,
-            Order.order_date.like(f"{month}%")
-        ).count()
-    
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "services": services,
-        "employees": employees,
-        "orders": orders,
-        "all_orders_count": len(all_orders),
-        "completed_orders_count": len(orders),
-        "clients": clients,
-        "new_clients_count": new_clients_count,
-        "total_revenue": total_revenue,
-        "total_expenses": total_expenses,
-        "total_profit": total_profit,
-        "current_month": month,
-        "client_sources": client_sources,
-        "service_categories": service_categories,
-        "order_statuses": order_statuses
-    })
+async def read_dashboard(request: Request, month: str = None):
+    return templates.TemplateResponse(
+        "index.html",
+        {
+            "request": request,
+            "current_month": month or datetime.now().strftime("%Y-%m")
+        }
+    )
 
-# Страница для заказов с пагинацией и фильтрацией
+# Страница для заказов: оболочка со справочниками, список загружается из /api/orders/list
 @app.get("/orders", response_class=HTMLResponse)
 async def read_orders(
-    request: Request, 
-    page: int = Query(1, ge=1),
-    limit: int = Query(10, ge=1, le=100),
+    request: Request,
     status: str = None,
     client_name: str = None,
     date_from: str = None,
     date_to: str = None,
     db: Session = Depends(get_db)
 ):
-    # Базовый запрос
-    query = db.query(Order).order_by(desc(Order.created_at))
-    
-    # Применяем фильтры
-    if status:
-        query = query.filter(Order.status == status)
-    if client_name:
-        query = query.filter(Order.client.has(name=client_name))
-    if date_from:
-        query = query.filter(Order.order_date >= date_from)
-    if date_to:
-        query = query.filter(Order.order_date <= date_to)
-    
-    # Получаем общее количество записей
-    total_count = query.count()
-    
-    # Применяем пагинацию
-    orders = query.offset((page - 1) * limit).limit(limit).all()
-    
-    # Получаем дополнительные данные для отображения
-    statuses = ["новый", "в работе", "завершен", "отменен"]
-    clients = db.query(Client).all()
-    services = db.query(Service).all()
-    employees = db.query(Employee).filter(Employee.active == 1).all()
-    
-    # Вычисляем общее количество страниц
-    total_pages = (total_count + limit - 1) // limit
-    
-    # Получаем детали для каждого заказа
-    order_details = []
-    for order in orders:
-        detail = await get_order_details(order.id, db)
-        if detail:
-            order_details.append(detail)
-    
     return templates.TemplateResponse(
         "orders.html",
         {
             "request": request,
-            "orders": order_details,
-            "clients": clients,
-            "services": services,
-            "employees": employees,
-            "statuses": statuses,
-            "current_page": page,
-            "total_pages": total_pages,
-            "total_count": total_count,
-            "limit": limit,
+            "reference_data": get_reference_data(db),
             "status_filter": status,
             "client_name_filter": client_name,
             "date_from_filter": date_from,
@@ -849,31 +2437,13 @@ async def read_orders(
         }
     )
 
-# Страница для услуг
+# Страница для услуг: оболочка, список и статистика загружаются из /api/services/list
 @app.get("/services", response_class=HTMLResponse)
-async def read_services(request: Request, db: Session = Depends(get_db)):
-    services = db.query(Service).all()
-    categories = ["Монтаж", "Демонтаж", "Кондиционер", "Фреон", "Доп услуга"]
-    
-    # Статистика по категориям услуг
-    category_stats = {}
-    for category in categories:
-        count = db.query(Service).filter(Service.category == category).count()
-        avg_price = db.query(func.avg(Service.price)).filter(Service.category == category).scalar() or 0
-        category_stats[category] = {
-            "count": count,
-            "avg_price": round(avg_price, 2)
-        }
-    
-    return templates.TemplateResponse("services.html", {
-        "request": request, 
-        "services": services, 
-        "categories": categories,
-        "category_stats": category_stats
-    })
+async def read_services(request: Request):
+    return templates.TemplateResponse("services.html", {"request": request})
 
 # API-эндпоинт для получения списка услуг с фильтрацией
-@app.get("/api/services/list", response_class=JSONResponse)
+@app.get("/api/services/list")
 async def get_services_list(
     search: str = Query("", alias="search"),
     category: str = Query(None, alias="category"),
@@ -893,24 +2463,35 @@ async def get_services_list(
     # Получаем список услуг
     services = query.all()
     
-    # Подсчет статистики по категориям
+    # Подсчет статистики по категориям одним сгруппированным запросом
     categories = ["Монтаж", "Демонтаж", "Кондиционер", "Фреон", "Доп услуга"]
+    category_stats = {
+        category: (count, avg_price)
+        for category, count, avg_price in db.query(
+            Service.category, func.count(Service.id), func.avg(Service.price)
+        ).filter(Service.category.in_(categories)).group_by(Service.category).all()
+    }
     stats = {}
     for cat in categories:
-        count = db.query(Service).filter(Service.category == cat).count()
-        avg_price = db.query(func.avg(Service.price)).filter(Service.category == cat).scalar() or 0
+        count, avg_price = category_stats.get(cat, (0, None))
         stats[cat] = {
             "count": count,
-            "avg_price": round(avg_price, 2)
+            "avg_price": round(avg_price or 0, 2)
         }
     
+    # Использование услуг в заказах: основная и доп. услуги двумя сгруппированными запросами
+    service_ids = [service.id for service in services]
+    main_usage = dict(db.query(Order.service_id, func.count(Order.id)).filter(
+        Order.service_id.in_(service_ids)
+    ).group_by(Order.service_id).all()) if service_ids else {}
+    additional_usage = dict(db.query(OrderService.service_id, func.count(OrderService.id)).filter(
+        OrderService.service_id.in_(service_ids)
+    ).group_by(OrderService.service_id).all()) if service_ids else {}
+    
     # Формируем список услуг
     services_list = []
     for service in services:
-        # Подсчет использования услуги в заказах
-        main_usage = db.query(Order).filter(Order.service_id == service.id).count()
-        additional_usage = db.query(OrderService).filter(OrderService.service_id == service.id).count()
-        total_usage = main_usage + additional_usage
+        total_usage = main_usage.get(service.id, 0) + additional_usage.get(service.id, 0)
         
         services_list.append({
             "id": service.id,
@@ -929,69 +2510,24 @@ async def get_services_list(
         "categories": categories
     }
 
-# Страница для сотрудников
+# Страница для сотрудников: оболочка, зарплаты загружаются из /api/employees/list
 @app.get("/employees", response_class=HTMLResponse)
-async def read_employees(
-    request: Request, 
-    month: str = None,
-    db: Session = Depends(get_db)
-):
-    # Если месяц не указан, используем текущий
-    if not month:
-        month = datetime.now().strftime("%Y-%m")
-    
-    # Получаем только активных сотрудников
-    employees = db.query(Employee).filter(Employee.active == 1).all()
-    
-    # Получаем данные о зарплате
-    salary_data = await calculate_salary(db, month)
-    
-    # Статистика для инфо-блоков
-    total_employees = len(employees)
-    total_to_pay = sum(salary_data["salary"].get(emp.name, 0) - salary_data["paid"].get(emp.name, 0) for emp in employees)
-    total_paid = sum(salary_data["paid"].get(emp.name, 0) for emp in employees)
-    
-    # Типы сотрудников
-    employee_types = ["Менеджер", "Монтажник"]
-    
-    # Получаем все данные о выплатах за месяц
-    payments = db.query(Payment).filter(Payment.payment_date.like(f"{month}%")).all()
-    
-    # Группируем выплаты по сотрудникам
-    payment_history = {}
-    for payment in payments:
-        employee = db.query(Employee).filter(Employee.id == payment.employee_id).first()
-        if employee:
-            if employee.name not in payment_history:
-                payment_history[employee.name] = []
-            payment_history[employee.name].append({
-                "id": payment.id,
-                "date": payment.payment_date,
-                "amount": payment.amount,
-                "description": payment.description or ("Штраф" if payment.amount < 0 else "Выплата")
-            })
-    
+async def read_employees(request: Request, month: str = None):
     return templates.TemplateResponse(
         "employees.html",
         {
             "request": request,
-            "employees": employees,
-            "salary_data": salary_data,
-            "total_employees": total_employees,
-            "total_to_pay": total_to_pay,
-            "total_paid": total_paid,
-            "employee_types": employee_types,
-            "payment_history": payment_history,
-            "current_month": month
+            "current_month": month or datetime.now().strftime("%Y-%m")
         }
     )
 
-# Новый API-эндпоинт для получения списка сотрудников с фильтрацией
-@app.get("/api/employees/list", response_class=JSONResponse)
-async def get_employees_list(
+# Новый API-эндпоинт для получения списка сотрудников с фильтрацией (тяжелый отчет: зарплата всех сотрудников)
+@app.get("/api/employees/list")
+@heavy_report()
+def get_employees_list(
     employee_type: str = Query(None, alias="type"),
     month: str = Query(None, alias="month"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_for_month)
 ):
     # Если месяц не указан, используем текущий
     if not month:
@@ -1008,40 +2544,42 @@ async def get_employees_list(
     employees = query.all()
     
     # Получаем данные о зарплате
-    salary_data = await calculate_salary(db, month)
+    salary_data = compute_salary(db, month)
+    
+    # Завершенные заказы месяца одним запросом: менеджеру засчитываются заказы, где он менеджер,
+    # монтажнику — где он первый или второй монтажник (заказ считается один раз)
+    managed_counts: Dict[int, int] = {}
+    installed_counts: Dict[int, int] = {}
+    for manager_id, one_employee_id, two_employee_id in db.query(
+        Order.manager_id, Order.one_employee_id, Order.two_employee_id
+    ).filter(Order.order_date.like(f"{month}%"), Order.status == "завершен").all():
+        managed_counts[manager_id] = managed_counts.get(manager_id, 0) + 1
+        for installer_id in {one_employee_id, two_employee_id} - {None}:
+            installed_counts[installer_id] = installed_counts.get(installer_id, 0) + 1
+    
+    # История платежей за месяц всех сотрудников списка одним запросом
+    payments_by_employee: Dict[int, List[Payment]] = {employee.id: [] for employee in employees}
+    if employees:
+        for payment in db.query(Payment).filter(
+            Payment.employee_id.in_(list(payments_by_employee)),
+            Payment.payment_date.like(f"{month}%")
+        ).order_by(Payment.id).all():
+            payments_by_employee[payment.employee_id].append(payment)
     
     # Формируем список сотрудников
     employees_list = []
     for employee in employees:
-        # Подсчет количества заказов
-        orders_count = 0
         if employee.employee_type == "менеджер":
-            orders_count = db.query(Order).filter(
-                Order.manager_id == employee.id,
-                Order.order_date.like(f"{month}%"),
-                Order.status == "завершен"
-            ).count()
+            orders_count = managed_counts.get(employee.id, 0)
         else:
-            orders_count = db.query(Order).filter(
-                or_(
-                    Order.one_employee_id == employee.id,
-                    Order.two_employee_id == employee.id
-                ),
-                Order.order_date.like(f"{month}%"),
-                Order.status == "завершен"
-            ).count()
+            orders_count = installed_counts.get(employee.id, 0)
         
-        # Получаем историю платежей за месяц
-        payments = db.query(Payment).filter(
-            Payment.employee_id == employee.id,
-            Payment.payment_date.like(f"{month}%")
-        ).all()
         payment_history = [{
             "id": payment.id,
             "date": payment.payment_date,
             "amount": payment.amount,
             "description": payment.description or ("Штраф" if payment.amount < 0 else "Выплата")
-        } for payment in payments]
+        } for payment in payments_by_employee[employee.id]]
         
         employees_list.append({
             "id": employee.id,
@@ -1073,76 +2611,21 @@ async def get_employees_list(
         "month": month
     }
 
-# Страница для клиентов с поиском и пагинацией
+# Страница для клиентов: оболочка, список и статистика загружаются из /api/clients/list
 @app.get("/clients", response_class=HTMLResponse)
-async def read_clients(
-    request: Request, 
-    search: str = "",
-    page: int = Query(1, ge=1),
-    limit: int = Query(20, ge=1, le=100),
-    source: str = None,
-    db: Session = Depends(get_db)
-):
-    # Базовый запрос
-    query = db.query(Client).order_by(desc(Client.created_at))
-    
-    # Фильтрация по имени или телефону
-    if search:
-        query = query.filter(
-            or_(
-                Client.name.ilike(f"%{search}%"),
-                Client.phone.ilike(f"%{search}%")
-            )
-        )
-    
-    # Фильтрация по источнику
-    if source and source != "Все":
-        query = query.filter(Client.source == source)
-    
-    # Получаем общее количество записей
-    total_count = query.count()
-    
-    # Применяем пагинацию
-    clients = query.offset((page - 1) * limit).limit(limit).all()
-    
-    # Подсчет статистики по источникам
-    sources = ["Авито", "ВК", "Яндекс услуги", "Листовки", "Рекомендации", "Другое"]
-    stats = {}
-    for src in sources:
-        stats[src] = db.query(Client).filter(Client.source == src).count()
-    
-    # Статистика заказов по клиентам
-    client_ids = [client.id for client in clients]
-    client_orders = {}
-    
-    if client_ids:
-        # Получаем количество заказов для каждого клиента
-        for client_id in client_ids:
-            order_count = db.query(Order).filter(Order.client_id == client_id).count()
-            client_orders[client_id] = order_count
-    
-    # Вычисляем общее количество страниц
-    total_pages = (total_count + limit - 1) // limit
-    
+async def read_clients(request: Request, search: str = "", source: str = None):
     return templates.TemplateResponse(
         "clients.html",
         {
             "request": request,
-            "clients": clients,
-            "stats": stats,
-            "sources": sources,
+            "sources": CLIENT_SOURCES,
             "search": search,
-            "current_page": page,
-            "total_pages": total_pages,
-            "total_count": total_count,
-            "limit": limit,
-            "source_filter": source,
-            "client_orders": client_orders
+            "source_filter": source
         }
     )
 
 # API-эндпоинт для получения списка клиентов с пагинацией и фильтрацией
-@app.get("/api/clients/list", response_class=JSONResponse)
+@app.get("/api/clients/list")
 async def get_clients_list(
     search: str = Query("", alias="search"),
     page: int = Query(1, ge=1),
@@ -1172,10 +2655,14 @@ async def get_clients_list(
     # Применяем пагинацию
     clients = query.offset((page - 1) * limit).limit(limit).all()
     
-    # Подсчет количества заказов для каждого клиента
+    # Количество заказов для всей страницы одним сгруппированным запросом
+    order_counts = dict(db.query(Order.client_id, func.count(Order.id)).filter(
+        Order.client_id.in_([client.id for client in clients])
+    ).group_by(Order.client_id).all()) if clients else {}
+    
     client_list = []
     for client in clients:
-        order_count = db.query(Order).filter(Order.client_id == client.id).count()
+        order_count = order_counts.get(client.id, 0)
         client_list.append({
             "id": client.id,
             "name": client.name,
@@ -1190,9 +2677,10 @@ async def get_clients_list(
     
     # Подсчет статистики по источникам
     sources = ["Авито", "ВК", "Яндекс услуги", "Листовки", "Рекомендации", "Другое"]
-    stats = {}
-    for src in sources:
-        stats[src] = db.query(Client).filter(Client.source == src).count()
+    source_counts = dict(db.query(Client.source, func.count(Client.id)).filter(
+        Client.source.in_(sources)
+    ).group_by(Client.source).all())
+    stats = {src: source_counts.get(src, 0) for src in sources}
     
     return {
         "clients": client_list,
@@ -1203,13 +2691,70 @@ async def get_clients_list(
         "stats": stats
     }
 
+# Подсказки для полей выбора (typeahead): только id и подпись первых совпадений
+LOOKUP_LIMIT = 20
+LOOKUP_MAX_LIMIT = 50
+
+def prefix_filter(column, prefix: str):
+    """
+    Поиск по префиксу диапазоном column >= prefix AND column < prefix + U+FFFF:
+    в отличие от ILIKE такой запрос использует индекс по колонке.
+    Регистр учитывается, поэтому проверяются варианты «как введено», «строчными» и «С заглавной».
+    """
+    variants = {prefix, prefix.lower(), prefix[:1].upper() + prefix[1:].lower()}
+    return or_(*[and_(column >= variant, column < variant + "\uffff") for variant in variants])
+
+@app.get("/api/lookup/{entity}")
+async def lookup_entities(
+    entity: str = Path(..., description="Справочник: clients, employees или services"),
+    q: str = Query("", description="Начало имени (для клиентов — также начало телефона)"),
+    type: Optional[str] = Query(None, description="Тип сотрудника (для employees)"),
+    category: Optional[str] = Query(None, description="Категория услуги (для services)"),
+    limit: int = Query(LOOKUP_LIMIT, ge=1, le=LOOKUP_MAX_LIMIT),
+    db: Session = Depends(get_db)
+):
+    q = q.strip()
+    if entity == "clients":
+        query = db.query(Client.id, Client.name, Client.phone)
+        phone_prefix = re.sub(r"[\s()+-]", "", q)
+        if phone_prefix.isdigit():
+            # Телефоны хранятся как введены — с «+» и без него, поэтому ищутся оба варианта
+            query = query.filter(
+                or_(prefix_filter(Client.phone, phone_prefix), prefix_filter(Client.phone, "+" + phone_prefix))
+            ).order_by(Client.phone)
+        else:
+            if q:
+                query = query.filter(prefix_filter(Client.name, q))
+            query = query.order_by(Client.name)
+        rows = query.limit(limit).all()
+        items = [{"id": row.id, "label": f"{row.name} ({row.phone})"} for row in rows]
+    elif entity == "employees":
+        query = db.query(Employee.id, Employee.name).filter(Employee.active == 1)
+        if type:
+            query = query.filter(Employee.employee_type == type)
+        if q:
+            query = query.filter(prefix_filter(Employee.name, q))
+        rows = query.order_by(Employee.name).limit(limit).all()
+        items = [{"id": row.id, "label": row.name} for row in rows]
+    elif entity == "services":
+        query = db.query(Service.id, Service.name, Service.price)
+        if category:
+            query = query.filter(Service.category == category)
+        if q:
+            query = query.filter(prefix_filter(Service.name, q))
+        rows = query.order_by(Service.name).limit(limit).all()
+        items = [{"id": row.id, "label": f"{row.name} ({row.price} ₽)"} for row in rows]
+    else:
+        raise HTTPException(status_code=404, detail="Неизвестный справочник. Допустимые значения: clients, employees, services")
+    
+    return {"items": items}
+
 # Страница финансов
 @app.get("/finance", response_class=HTMLResponse)
 async def read_finance(
     request: Request,
     date_from: Optional[str] = Query(None),
-    date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    date_to: Optional[str] = Query(None)
 ):
     return templates.TemplateResponse(
         "finance.html",
@@ -1221,11 +2766,11 @@ async def read_finance(
     )
 
 # API для расчета зарплаты конкретного сотрудника
-@app.get("/api/employees/{employee_id}/salary", response_class=JSONResponse)
+@app.get("/api/employees/{employee_id}/salary")
 async def get_employee_salary(
     employee_id: int = Path(...),
     month: str = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_for_month)
 ):
     if not month:
         month = datetime.now().strftime("%Y-%m")
@@ -1265,8 +2810,7 @@ async def read_export(
     client_source: Optional[str] = Query(None),
     service_category: Optional[str] = Query(None),
     employee_type: Optional[str] = Query(None),
-    employee_active: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    employee_active: Optional[int] = Query(None)
 ):
     return templates.TemplateResponse(
         "export.html",
@@ -1287,7 +2831,7 @@ async def read_export(
 # API-эндпоинты для создания, обновления и удаления сущностей
 
 # Добавление новой услуги
-@app.post("/api/services", response_class=JSONResponse)
+@app.post("/api/services")
 async def create_service_api(service: ServiceCreate, db: Session = Depends(get_db)):
     try:
         new_service = Service(
@@ -1299,13 +2843,14 @@ async def create_service_api(service: ServiceCreate, db: Session = Depends(get_d
         db.add(new_service)
         db.commit()
         db.refresh(new_service)
+        invalidate_reference_data()
         return {"id": new_service.id, "message": "Услуга успешно добавлена", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при добавлении услуги: {str(e)}", "status": "error"}
 
 # Обновление услуги
-@app.put("/api/services/{service_id}", response_class=JSONResponse)
+@app.put("/api/services/{service_id}")
 async def update_service_api(
     service_id: int, 
     service: ServiceCreate, 
@@ -1323,35 +2868,38 @@ async def update_service_api(
         db_service.updated_at = datetime.now().strftime("%Y-%m-%d")
         
         db.commit()
+        invalidate_reference_data()
         return {"message": "Услуга успешно обновлена", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при обновлении услуги: {str(e)}", "status": "error"}
 
 # Удаление услуги
-@app.delete("/api/services/{service_id}", response_class=JSONResponse)
+@app.delete("/api/services/{service_id}")
 async def delete_service_api(service_id: int, db: Session = Depends(get_db)):
     try:
         service = db.query(Service).filter(Service.id == service_id).first()
         if not service:
             return {"message": "Услуга не найдена", "status": "error"}
         
-        # Проверяем, используется ли услуга в заказах
-        used_in_orders = db.query(Order).filter(Order.service_id == service_id).first()
-        used_in_additional = db.query(OrderService).filter(OrderService.service_id == service_id).first()
+        # Проверяем, используется ли услуга в заказах (в том числе перенесенных в архив)
+        with session_with_archive(db) as orders_db:
+            used_in_orders = orders_db.query(Order.id).filter(Order.service_id == service_id).first()
+            used_in_additional = orders_db.query(OrderService.id).filter(OrderService.service_id == service_id).first()
         
         if used_in_orders or used_in_additional:
             return {"message": "Нельзя удалить услугу, она используется в заказах", "status": "error"}
         
         db.delete(service)
         db.commit()
+        invalidate_reference_data()
         return {"message": "Услуга успешно удалена", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при удалении услуги: {str(e)}", "status": "error"}
 
 # Добавление нового сотрудника
-@app.post("/api/employees", response_class=JSONResponse)
+@app.post("/api/employees")
 async def create_employee_api(employee: EmployeeCreate, db: Session = Depends(get_db)):
     try:
         new_employee = Employee(
@@ -1365,13 +2913,14 @@ async def create_employee_api(employee: EmployeeCreate, db: Session = Depends(ge
         db.add(new_employee)
         db.commit()
         db.refresh(new_employee)
+        invalidate_reference_data()
         return {"id": new_employee.id, "message": "Сотрудник успешно добавлен", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при добавлении сотрудника: {str(e)}", "status": "error"}
 
 # Обновление сотрудника
-@app.put("/api/employees/{employee_id}", response_class=JSONResponse)
+@app.put("/api/employees/{employee_id}")
 async def update_employee_api(
     employee_id: int, 
     employee: EmployeeCreate, 
@@ -1391,13 +2940,14 @@ async def update_employee_api(
         db_employee.updated_at = datetime.now().strftime("%Y-%m-%d")
         
         db.commit()
+        invalidate_reference_data()
         return {"message": "Сотрудник успешно обновлен", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при обновлении сотрудника: {str(e)}", "status": "error"}
 
 # Деактивация сотрудника (вместо удаления)
-@app.put("/api/employees/{employee_id}/deactivate", response_class=JSONResponse)
+@app.put("/api/employees/{employee_id}/deactivate")
 async def deactivate_employee_api(employee_id: int, db: Session = Depends(get_db)):
     try:
         employee = db.query(Employee).filter(Employee.id == employee_id).first()
@@ -1408,13 +2958,14 @@ async def deactivate_employee_api(employee_id: int, db: Session = Depends(get_db
         employee.updated_at = datetime.now().strftime("%Y-%m-%d")
         
         db.commit()
+        invalidate_reference_data()
         return {"message": "Сотрудник деактивирован", "status": "success"}
     except Exception as e:
         db.rollback()
         return {"message": f"Ошибка при деактивации сотрудника: {str(e)}", "status": "error"}
 
 # Выплата сотруднику
-@app.post("/api/employees/{employee_id}/pay", response_class=JSONResponse)
+@app.post("/api/employees/{employee_id}/pay")
 async def pay_employee_api(
     employee_id: int, 
     amount: float = Form(...),
@@ -1443,7 +2994,7 @@ async def pay_employee_api(
         return {"message": f"Ошибка при выплате: {str(e)}", "status": "error"}
 
 # Штраф сотруднику
-@app.post("/api/employees/{employee_id}/fine", response_class=JSONResponse)
+@app.post("/api/employees/{employee_id}/fine")
 async def fine_employee_api(
     employee_id: int, 
     amount: float = Form(...),
@@ -1472,7 +3023,7 @@ async def fine_employee_api(
         return {"message": f"Ошибка при наложении штрафа: {str(e)}", "status": "error"}
 
 # Добавление нового клиента
-@app.post("/api/clients", response_class=JSONResponse)
+@app.post("/api/clients")
 async def create_client_api(client: ClientCreate, db: Session = Depends(get_db)):
     try:
         # Проверяем, существует ли клиент с таким телефоном
@@ -1494,7 +3045,7 @@ async def create_client_api(client: ClientCreate, db: Session = Depends(get_db))
         return {"message": f"Ошибка при добавлении клиента: {str(e)}", "status": "error"}
 
 # Обновление клиента
-@app.put("/api/clients/{client_id}", response_class=JSONResponse)
+@app.put("/api/clients/{client_id}")
 async def update_client_api(
     client_id: int, 
     client: ClientCreate, 
@@ -1527,15 +3078,16 @@ async def update_client_api(
         return {"message": f"Ошибка при обновлении клиента: {str(e)}", "status": "error"}
 
 # Удаление клиента
-@app.delete("/api/clients/{client_id}", response_class=JSONResponse)
+@app.delete("/api/clients/{client_id}")
 async def delete_client_api(client_id: int, db: Session = Depends(get_db)):
     try:
         client = db.query(Client).filter(Client.id == client_id).first()
         if not client:
             return {"message": "Клиент не найден", "status": "error"}
         
-        # Проверяем, есть ли у клиента заказы
-        has_orders = db.query(Order).filter(Order.client_id == client_id).first()
+        # Проверяем, есть ли у клиента заказы (в том числе перенесенные в архив)
+        with session_with_archive(db) as orders_db:
+            has_orders = orders_db.query(Order.id).filter(Order.client_id == client_id).first()
         if has_orders:
             return {"message": "Нельзя удалить клиента с существующими заказами", "status": "error"}
         
@@ -1546,79 +3098,9 @@ async def delete_client_api(client_id: int, db: Session = Depends(get_db)):
         db.rollback()
         return {"message": f"Ошибка при удалении клиента: {str(e)}", "status": "error"}
 
-async def get_order_details(order_id: int, db: Session):
-    """Получить детали заказа с учетом всех связанных данных"""
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
-        return None
-        
-    # Получаем основную услугу
-    main_service = db.query(Service).filter(Service.id == order.service_id).first()
-    
-    # Получаем дополнительные услуги
-    additional_services = []
-    order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-    for os in order_services:
-        service = db.query(Service).filter(Service.id == os.service_id).first()
-        if service:
-            additional_services.append({
-                "id": service.id,
-                "name": service.name,
-                "price": service.price,
-                "category": service.category
-            })
-    
-    # Получаем исполнителей
-    manager = db.query(Employee).filter(Employee.id == order.manager_id).first()
-    first_installer = db.query(Employee).filter(Employee.id == order.one_employee_id).first()
-    second_installer = None
-    if order.two_employee_id:
-        second_installer = db.query(Employee).filter(Employee.id == order.two_employee_id).first()
-    
-    # Получаем клиента
-    client = db.query(Client).filter(Client.id == order.client_id).first()
-    
-    # Рассчитываем общую стоимость заказа
-    total_price = main_service.price if main_service else 0
-    for service in additional_services:
-        total_price += service["price"]
-    
-    return {
-        "id": order.id,
-        "status": order.status,
-        "order_date": order.order_date,
-        "completion_date": order.completion_date,
-        "notes": order.notes,
-        "client": {
-            "id": client.id,
-            "name": client.name,
-            "phone": client.phone
-        } if client else None,
-        "main_service": {
-            "id": main_service.id,
-            "name": main_service.name,
-            "price": main_service.price,
-            "category": main_service.category
-        } if main_service else None,
-        "additional_services": additional_services,
-        "manager": {
-            "id": manager.id,
-            "name": manager.name
-        } if manager else None,
-        "first_installer": {
-            "id": first_installer.id,
-            "name": first_installer.name
-        } if first_installer else None,
-        "second_installer": {
-            "id": second_installer.id,
-            "name": second_installer.name
-        } if second_installer else None,
-        "total_price": total_price
-    }
-
 # API-эндпоинт для создания расхода
 # Обновленный эндпоинт для создания расхода (с обновлением баланса)
-@app.post("/api/expenses", response_class=JSONResponse)
+@app.post("/api/expenses")
 async def create_expense_api(expense: ExpenseCreate, db: Session = Depends(get_db)):
     try:
         new_expense = Expense(
@@ -1643,7 +3125,7 @@ async def create_expense_api(expense: ExpenseCreate, db: Session = Depends(get_d
         return {"message": f"Ошибка при добавлении расхода: {str(e)}", "status": "error"}
     
 # API-эндпоинт для получения списка расходов
-@app.get("/api/expenses", response_class=JSONResponse)
+@app.get("/api/expenses")
 async def get_expenses_list(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
@@ -1652,7 +3134,10 @@ async def get_expenses_list(
     category: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Expense).order_by(desc(Expense.expense_date))
+    query = db.query(
+        Expense.id, Expense.category, Expense.amount, Expense.description,
+        Expense.expense_date, Expense.created_at, Expense.updated_at
+    ).order_by(desc(Expense.expense_date))
     
     if date_from:
         query = query.filter(Expense.expense_date >= date_from)
@@ -1662,22 +3147,12 @@ async def get_expenses_list(
         query = query.filter(Expense.category == category)
     
     total_count = query.count()
-    expenses = query.offset((page - 1) * limit).limit(limit).all()
+    expenses_list = fetch_rows(db, query.offset((page - 1) * limit).limit(limit))
+    for expense in expenses_list:
+        expense["description"] = expense["description"] or "-"
     
     total_pages = (total_count + limit - 1) // limit
     
-    expenses_list = [
-        {
-            "id": expense.id,
-            "category": expense.category,
-            "amount": expense.amount,
-            "description": expense.description or "-",
-            "expense_date": expense.expense_date,
-            "created_at": expense.created_at,
-            "updated_at": expense.updated_at
-        } for expense in expenses
-    ]
-    
     return {
         "expenses": expenses_list,
         "total_count": total_count,
@@ -1687,7 +3162,7 @@ async def get_expenses_list(
     }
 
 # API-эндпоинт для обновления расхода
-@app.put("/api/expenses/{expense_id}", response_class=JSONResponse)
+@app.put("/api/expenses/{expense_id}")
 async def update_expense_api(
     expense_id: int,
     expense: ExpenseCreate,
@@ -1711,7 +3186,7 @@ async def update_expense_api(
         return {"message": f"Ошибка при обновлении расхода: {str(e)}", "status": "error"}
 
 # API-эндпоинт для удаления расхода
-@app.delete("/api/expenses/{expense_id}", response_class=JSONResponse)
+@app.delete("/api/expenses/{expense_id}")
 async def delete_expense_api(expense_id: int, db: Session = Depends(get_db)):
     try:
         expense = db.query(Expense).filter(Expense.id == expense_id).first()
@@ -1725,75 +3200,8 @@ async def delete_expense_api(expense_id: int, db: Session = Depends(get_db)):
         db.rollback()
         return {"message": f"Ошибка при удалении расхода: {str(e)}", "status": "error"}
 
-# Страница для заказов с пагинацией и фильтрацией
-@app.get("/orders", response_class=HTMLResponse)
-async def read_orders(
-    request: Request, 
-    page: int = Query(1, ge=1),
-    limit: int = Query(10, ge=1, le=100),
-    status: str = None,
-    client_name: str = None,
-    date_from: str = None,
-    date_to: str = None,
-    db: Session = Depends(get_db)
-):
-    # Базовый запрос
-    query = db.query(Order).order_by(desc(Order.created_at))
-    
-    # Применяем фильтры
-    if status:
-        query = query.filter(Order.status == status)
-    if client_name:
-        query = query.filter(Order.client.has(name=client_name))
-    if date_from:
-        query = query.filter(Order.order_date >= date_from)
-    if date_to:
-        query = query.filter(Order.order_date <= date_to)
-    
-    # Получаем общее количество записей
-    total_count = query.count()
-    
-    # Применяем пагинацию
-    orders = query.offset((page - 1) * limit).limit(limit).all()
-    
-    # Получаем дополнительные данные для отображения
-    statuses = ["новый", "в работе", "завершен", "отменен"]
-    clients = db.query(Client).all()
-    services = db.query(Service).all()
-    employees = db.query(Employee).filter(Employee.active == 1).all()
-    
-    # Вычисляем общее количество страниц
-    total_pages = (total_count + limit - 1) // limit
-    
-    # Получаем детали для каждого заказа
-    order_details = []
-    for order in orders:
-        detail = await get_order_details(order.id, db)
-        if detail:
-            order_details.append(detail)
-    
-    return templates.TemplateResponse(
-        "orders.html",
-        {
-            "request": request,
-            "orders": order_details,
-            "clients": clients,
-            "services": services,
-            "employees": employees,
-            "statuses": statuses,
-            "current_page": page,
-            "total_pages": total_pages,
-            "total_count": total_count,
-            "limit": limit,
-            "status_filter": status,
-            "client_name_filter": client_name,
-            "date_from_filter": date_from,
-            "date_to_filter": date_to
-        }
-    )
-
 # API-эндпоинт для получения списка заказов с пагинацией и фильтрацией
-@app.get("/api/orders/list", response_class=JSONResponse)
+@app.get("/api/orders/list")
 async def get_orders_list(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
@@ -1801,7 +3209,7 @@ async def get_orders_list(
     client_name: str = Query(None, alias="client_name"),
     date_from: str = Query(None, alias="date_from"),
     date_to: str = Query(None, alias="date_to"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_if_archived)
 ):
     # Базовый запрос
     query = db.query(Order).order_by(desc(Order.created_at))
@@ -1822,34 +3230,35 @@ async def get_orders_list(
     # Применяем пагинацию
     orders = query.offset((page - 1) * limit).limit(limit).all()
     
-    # Получаем детали для каждого заказа
-    order_details = []
-    for order in orders:
-        detail = await get_order_details(order.id, db)
-        if detail:
-            order_details.append(detail)
+    # Детали всей страницы за фиксированное число запросов
+    order_details = get_orders_details_bulk(orders, db)
     
     # Вычисляем общее количество страниц
     total_pages = (total_count + limit - 1) // limit
     
-    return {
+    # Большой список из простых типов: ответ отдается напрямую, минуя jsonable_encoder
+    return APIResponse({
         "orders": order_details,
         "total_count": total_count,
         "total_pages": total_pages,
         "current_page": page,
         "limit": limit
-    }
+    })
 
 # Получение деталей заказа в формате JSON
-@app.get("/api/orders/{order_id}", response_class=JSONResponse)
+@app.get("/api/orders/{order_id}")
 async def get_order_api(order_id: int = Path(...), db: Session = Depends(get_db)):
     order_details = await get_order_details(order_id, db)
+    if not order_details and archived_before():
+        # Закрытый заказ мог быть перенесен в архив
+        with HistorySessionLocal() as history_db:
+            order_details = await get_order_details(order_id, history_db)
     if not order_details:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     return order_details
 
 # Добавление нового заказа
-@app.post("/api/orders", response_class=JSONResponse)
+@app.post("/api/orders")
 async def create_order_api(order: OrderCreate, db: Session = Depends(get_db)):
     try:
         new_order = Order(
@@ -1892,7 +3301,7 @@ async def create_order_api(order: OrderCreate, db: Session = Depends(get_db)):
         return {"message": f"Ошибка при создании заказа: {str(e)}", "status": "error"}
     
 # Обновление заказа
-@app.put("/api/orders/{order_id}", response_class=JSONResponse)
+@app.put("/api/orders/{order_id}")
 async def update_order_api(
     order_id: int, 
     order: OrderUpdate, 
@@ -1974,41 +3383,21 @@ async def update_order_api(
         return {"message": f"Ошибка при обновлении заказа: {str(e)}", "status": "error"}
     
 # Обновленный API-эндпоинт для финансовой сводки
-@app.get("/api/finance/summary", response_class=JSONResponse)
+@app.get("/api/finance/summary")
 async def get_finance_summary(
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_since)
 ):
-    # Базовый запрос на заказы
-    orders_query = db.query(Order)
-    
-    # Фильтрация по датам
+    # Фильтрация заказов по датам
+    order_filters = []
     if date_from:
-        orders_query = orders_query.filter(Order.order_date >= date_from)
+        order_filters.append(Order.order_date >= date_from)
     if date_to:
-        orders_query = orders_query.filter(Order.order_date <= date_to)
+        order_filters.append(Order.order_date <= date_to)
     
-    # Получаем заказы
-    orders = orders_query.all()
-    
-    # Рассчитываем доходы
-    total_revenue = 0
-    for order in orders:
-        order_details = await get_order_details(order.id, db)
-        total_revenue += order_details["total_price"]
-    
-    # Рассчитываем расходы на материалы из заказов
-    total_material_cost = 0
-    for order in orders:
-        main_service = db.query(Service).filter(Service.id == order.service_id).first()
-        if main_service:
-            total_material_cost += main_service.material_cost
-        order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-        for os in order_services:
-            additional_service = db.query(Service).filter(Service.id == os.service_id).first()
-            if additional_service:
-                total_material_cost += additional_service.material_cost
+    # Доходы и расходы на материалы по заказам периода — агрегатными запросами, без загрузки заказов
+    total_revenue, total_material_cost = get_orders_totals(db, *order_filters)
     
     # Рассчитываем дополнительные расходы из таблицы expenses
     expenses_query = db.query(Expense)
@@ -2069,13 +3458,13 @@ async def get_finance_summary(
     }
 
 # API-эндпоинт для получения финансовых данных по заказам
-@app.get("/api/finance/orders", response_class=JSONResponse)
+@app.get("/api/finance/orders")
 async def get_finance_orders(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_if_archived)
 ):
     # Базовый запрос на заказы
     query = db.query(Order).order_by(Order.order_date.desc())
@@ -2092,102 +3481,60 @@ async def get_finance_orders(
     # Применяем пагинацию
     orders = query.offset((page - 1) * limit).limit(limit).all()
     
-    # Получаем детали для каждого заказа
-    order_details = []
-    for order in orders:
-        detail = await get_order_details(order.id, db)
-        # Добавляем расходы на материалы
-        material_cost = 0
-        main_service = db.query(Service).filter(Service.id == order.service_id).first()
-        if main_service:
-            material_cost += main_service.material_cost
-        order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
-        for os in order_services:
-            additional_service = db.query(Service).filter(Service.id == os.service_id).first()
-            if additional_service:
-                material_cost += additional_service.material_cost
-        detail["material_cost"] = material_cost
-        order_details.append(detail)
+    # Детали и расходы на материалы для всей страницы за фиксированное число запросов
+    order_details = get_orders_details_bulk(orders, db)
+    material_costs = get_orders_material_costs(orders, db)
+    for detail in order_details:
+        detail["material_cost"] = material_costs[detail["id"]]
     
     # Вычисляем общее количество страниц
     total_pages = (total_count + limit - 1) // limit
     
-    return {
+    # Большой список из простых типов: ответ отдается напрямую, минуя jsonable_encoder
+    return APIResponse({
         "orders": order_details,
         "total_count": total_count,
         "total_pages": total_pages,
         "current_page": page,
         "limit": limit
-    }
+    })
 
 # API-эндпоинт для получения данных о зарплатах сотрудников
-@app.get("/api/finance/employees", response_class=JSONResponse)
+@app.get("/api/finance/employees")
 async def get_finance_employees(
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_since)
 ):
     employees = db.query(Employee).filter(Employee.active == 1).all()
-    employee_details = []
     
+    # Неотмененные заказы периода одним запросом: менеджеру засчитываются заказы, где он менеджер,
+    # монтажнику — где он первый или второй монтажник (заказ считается один раз)
+    orders_query = db.query(Order.manager_id, Order.one_employee_id, Order.two_employee_id).filter(
+        Order.status != "отменен"
+    )
+    if date_from:
+        orders_query = orders_query.filter(Order.order_date >= date_from)
+    if date_to:
+        orders_query = orders_query.filter(Order.order_date <= date_to)
+    managed_counts: Dict[int, int] = {}
+    installed_counts: Dict[int, int] = {}
+    for manager_id, one_employee_id, two_employee_id in orders_query.all():
+        managed_counts[manager_id] = managed_counts.get(manager_id, 0) + 1
+        for installer_id in {one_employee_id, two_employee_id} - {None}:
+            installed_counts[installer_id] = installed_counts.get(installer_id, 0) + 1
+    
+    employee_details = []
     for employee in employees:
         # Фиксированная зарплата
         base_salary = employee.base_salary or 0
         
-        # Комиссии от заказов
-        commission = 0
-        order_count = 0
-        
-        # Заказы, где сотрудник был менеджером
-        managed_orders = db.query(Order).filter(
-            Order.manager_id == employee.id,
-            Order.status != "отменен"
-        )
-        if date_from:
-            managed_orders = managed_orders.filter(Order.order_date >= date_from)
-        if date_to:
-            managed_orders = managed_orders.filter(Order.order_date <= date_to)
-        managed_orders = managed_orders.all()
-        
-        # Заказы, где сотрудник был первым монтажником
-        first_installer_orders = db.query(Order).filter(
-            Order.one_employee_id == employee.id,
-            Order.status != "отменен"
-        )
-        if date_from:
-            first_installer_orders = first_installer_orders.filter(Order.order_date >= date_from)
-        if date_to:
-            first_installer_orders = first_installer_orders.filter(Order.order_date <= date_to)
-        first_installer_orders = first_installer_orders.all()
-        
-        # Заказы, где сотрудник был вторым монтажником
-        second_installer_orders = db.query(Order).filter(
-            Order.two_employee_id == employee.id,
-            Order.status != "отменен"
-        )
-        if date_from:
-            second_installer_orders = second_installer_orders.filter(Order.order_date >= date_from)
-        if date_to:
-            second_installer_orders = second_installer_orders.filter(Order.order_date <= date_to)
-        second_installer_orders = second_installer_orders.all()
-        
-        # Рассчитываем комиссии
+        # Комиссии от заказов: фиксированная ставка за заказ
         if employee.employee_type == "менеджер":
-            # Для менеджеров: процент от стоимости заказа
-            for order in managed_orders:
-                order_details = await get_order_details(order.id, db)
-                commission += employee.order_rate
-                order_count += 1
+            order_count = managed_counts.get(employee.id, 0)
         else:
-            # Для монтажников: фиксированная ставка за заказ
-            for order in first_installer_orders:
-                commission += employee.order_rate
-                order_count += 1
-            for order in second_installer_orders:
-                # Убедимся, что не дублируем заказы
-                if order not in first_installer_orders:
-                    commission += employee.order_rate
-                    order_count += 1
+            order_count = installed_counts.get(employee.id, 0)
+        commission = employee.order_rate * order_count if order_count else 0
         
         total_salary = base_salary + commission
         employee_details.append({
@@ -2202,12 +3549,16 @@ async def get_finance_employees(
     
     return {"employees": employee_details}
 
-# Вспомогательная функция для расчета финансов сотрудника за период
-async def calculate_employee_earnings(employee, date_from: Optional[str], date_to: Optional[str], db: Session):
-    # Фиксированная зарплата
-    base_salary = employee.base_salary or 0
-    
-    # Корректируем фиксированную зарплату пропорционально периоду
+# Пакетный расчет заработка сотрудников за период (для экспорта)
+def calculate_employees_earnings_bulk(employees: List[Employee], date_from: Optional[str], date_to: Optional[str], db: Session):
+    """Заработок пачки сотрудников за фиксированное число запросов: начислено, выплачено, остаток и число заказов"""
+    if not employees:
+        return {}
+
+    employee_ids = [employee.id for employee in employees]
+
+    # Коэффициент периода для фиксированной зарплаты
+    period_ratio = 1
     if date_from and date_to:
         try:
             start_date = datetime.strptime(date_from, "%Y-%m-%d")
@@ -2217,89 +3568,142 @@ async def calculate_employee_earnings(employee, date_from: Optional[str], date_t
                 period_days = 1
             days_in_month = 30  # Усредненное значение
             period_ratio = period_days / days_in_month
-            base_salary = base_salary * period_ratio
         except ValueError:
             pass
-    
-    # Комиссии от заказов
-    commission = 0
-    order_count = 0
-    
-    # Заказы, где сотрудник был менеджером
-    managed_orders = db.query(Order).filter(
-        Order.manager_id == employee.id,
-        Order.status != "отменен"
-    )
-    if date_from:
-        managed_orders = managed_orders.filter(Order.order_date >= date_from)
-    if date_to:
-        managed_orders = managed_orders.filter(Order.order_date <= date_to)
-    managed_orders = managed_orders.all()
-    
-    # Заказы, где сотрудник был первым монтажником
-    first_installer_orders = db.query(Order).filter(
-        Order.one_employee_id == employee.id,
-        Order.status != "отменен"
-    )
-    if date_from:
-        first_installer_orders = first_installer_orders.filter(Order.order_date >= date_from)
-    if date_to:
-        first_installer_orders = first_installer_orders.filter(Order.order_date <= date_to)
-    first_installer_orders = first_installer_orders.all()
-    
-    # Заказы, где сотрудник был вторым монтажником
-    second_installer_orders = db.query(Order).filter(
-        Order.two_employee_id == employee.id,
-        Order.status != "отменен"
-    )
+
+    def period_filters(query):
+        query = query.filter(Order.status != "отменен")
+        if date_from:
+            query = query.filter(Order.order_date >= date_from)
+        if date_to:
+            query = query.filter(Order.order_date <= date_to)
+        return query
+
+    # Менеджеры: количество заказов и их общая стоимость (основная услуга + доп. услуги)
+    managed_counts = dict(period_filters(
+        db.query(Order.manager_id, func.count(Order.id))
+    ).filter(Order.manager_id.in_(employee_ids)).group_by(Order.manager_id).all())
+
+    managed_totals: Dict[int, float] = {}
+    main_totals = period_filters(
+        db.query(Order.manager_id, func.sum(Service.price)).join(Service, Service.id == Order.service_id)
+    ).filter(Order.manager_id.in_(employee_ids)).group_by(Order.manager_id).all()
+    additional_totals = period_filters(
+        db.query(Order.manager_id, func.sum(Service.price))
+        .select_from(OrderService)
+        .join(Order, Order.id == OrderService.order_id)
+        .join(Service, Service.id == OrderService.service_id)
+    ).filter(Order.manager_id.in_(employee_ids)).group_by(Order.manager_id).all()
+    for manager_id, amount in list(main_totals) + list(additional_totals):
+        managed_totals[manager_id] = managed_totals.get(manager_id, 0) + (amount or 0)
+
+    # Монтажники: заказ учитывается один раз, даже если сотрудник указан дважды
+    installer_counts: Dict[int, int] = {}
+    installer_rows = period_filters(
+        db.query(Order.one_employee_id, Order.two_employee_id)
+    ).filter(or_(Order.one_employee_id.in_(employee_ids), Order.two_employee_id.in_(employee_ids))).all()
+    for one_employee_id, two_employee_id in installer_rows:
+        for employee_id in {one_employee_id, two_employee_id}:
+            if employee_id is not None:
+                installer_counts[employee_id] = installer_counts.get(employee_id, 0) + 1
+
+    # Выплаты и штрафы за период
+    payments_query = db.query(Payment.employee_id, func.sum(Payment.amount)).filter(Payment.employee_id.in_(employee_ids))
     if date_from:
-        second_installer_orders = second_installer_orders.filter(Order.order_date >= date_from)
+        payments_query = payments_query.filter(Payment.payment_date >= date_from)
     if date_to:
-        second_installer_orders = second_installer_orders.filter(Order.order_date <= date_to)
-    second_installer_orders = second_installer_orders.all()
-    
-    # Рассчитываем комиссии
-    if employee.employee_type == "менеджер":
-        for order in managed_orders:
-            order_details = await get_order_details(order.id, db)
-            commission += order_details["total_price"] * (employee.commission_rate / 100)
-            order_count += 1
-    else:
-        for order in first_installer_orders:
-            commission += employee.order_rate
-            order_count += 1
-        for order in second_installer_orders:
-            if order not in first_installer_orders:
-                commission += employee.order_rate
-                order_count += 1
-    
-    total_earned = base_salary + commission
-    paid_amount = employee.paid_amount or 0  # Предполагаем, что это поле есть в модели
-    remaining_to_pay = total_earned - paid_amount
-    
-    return {
-        "total_earned": round(total_earned, 2),
-        "paid_amount": round(paid_amount, 2),
-        "remaining_to_pay": round(remaining_to_pay, 2),
-        "order_count": order_count
-    }
+        payments_query = payments_query.filter(Payment.payment_date <= date_to)
+    paid = dict(payments_query.group_by(Payment.employee_id).all())
 
-# API-эндпоинт для предпросмотра данных
-@app.get("/api/export/preview", response_class=JSONResponse)
-async def preview_data(
-    export_type: str = Query(..., description="Тип данных для экспорта: orders, clients, services, employees"),
-    status: Optional[str] = Query(None),
-    client_name: Optional[str] = Query(None),
-    date_from: Optional[str] = Query(None),
-    date_to: Optional[str] = Query(None),
-    client_source: Optional[str] = Query(None),
-    service_category: Optional[str] = Query(None),
-    employee_type: Optional[str] = Query(None),
-    employee_active: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    result = {}
+    for employee in employees:
+        base_salary = (employee.base_salary or 0) * period_ratio
+        if employee.employee_type == "менеджер":
+            order_count = managed_counts.get(employee.id, 0)
+            commission = managed_totals.get(employee.id, 0) * (employee.commission_rate / 100)
+        else:
+            order_count = installer_counts.get(employee.id, 0)
+            commission = order_count * employee.order_rate
+
+        total_earned = base_salary + commission
+        paid_amount = paid.get(employee.id) or 0
+        result[employee.id] = {
+            "total_earned": round(total_earned, 2),
+            "paid_amount": round(paid_amount, 2),
+            "remaining_to_pay": round(total_earned - paid_amount, 2),
+            "order_count": order_count
+        }
+
+    return result
+
+# Размер пачки строк при потоковом экспорте
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_TYPES_ERROR = "Неверный тип экспорта. Допустимые значения: orders, clients, services, employees"
+
+# Заголовки файлов экспорта
+EXPORT_HEADERS = {
+    "orders": [
+        "ID", "Клиент", "Основная услуга", "Дополнительные услуги", "Сумма (₽)",
+        "Менеджер", "Первый монтажник", "Второй монтажник", "Дата заказа",
+        "Дата завершения", "Статус", "Примечания"
+    ],
+    "clients": ["ID", "Имя", "Телефон", "Источник", "Дата создания", "Дата обновления"],
+    "services": ["ID", "Название", "Категория", "Стоимость материалов (₽)", "Цена (₽)", "Дата создания", "Дата обновления"],
+    "employees": [
+        "ID", "Имя", "Телефон", "Тип сотрудника", "Базовая зарплата (₽)",
+        "Ставка за заказ", "Комиссия (%)", "Активен", "Заработано за период (₽)",
+        "Выплачено (₽)", "Осталось выплатить (₽)", "Количество заказов",
+        "Дата создания", "Дата обновления"
+    ]
+}
+
+# Колонки типизированного экспорта (parquet, arrow): имя и тип в порядке EXPORT_HEADERS
+EXPORT_COLUMNS = {
+    "orders": [
+        ("id", "int64"), ("client", "string"), ("main_service", "string"),
+        ("additional_services", "string"), ("total_price", "float64"), ("manager", "string"),
+        ("first_installer", "string"), ("second_installer", "string"), ("order_date", "timestamp"),
+        ("completion_date", "timestamp"), ("status", "string"), ("notes", "string")
+    ],
+    "clients": [
+        ("id", "int64"), ("name", "string"), ("phone", "string"), ("source", "string"),
+        ("created_at", "timestamp"), ("updated_at", "timestamp")
+    ],
+    "services": [
+        ("id", "int64"), ("name", "string"), ("category", "string"), ("material_cost", "float64"),
+        ("price", "float64"), ("created_at", "timestamp"), ("updated_at", "timestamp")
+    ],
+    "employees": [
+        ("id", "int64"), ("name", "string"), ("phone", "string"), ("employee_type", "string"),
+        ("base_salary", "float64"), ("order_rate", "float64"), ("commission_rate", "float64"),
+        ("active", "bool"), ("total_earned", "float64"), ("paid_amount", "float64"),
+        ("remaining_to_pay", "float64"), ("order_count", "int64"), ("created_at", "timestamp"),
+        ("updated_at", "timestamp")
+    ]
+}
+
+# Строк в одной группе parquet (в одном пакете arrow)
+ARROW_ROW_GROUP_SIZE = 64 * 1024
+
+# Размер файла экспорта в памяти, после которого он сбрасывается на диск
+EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+def build_export_query(
+    db: Session,
+    export_type: str,
+    status: Optional[str] = None,
+    client_name: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    client_source: Optional[str] = None,
+    service_category: Optional[str] = None,
+    employee_type: Optional[str] = None,
+    employee_active: Optional[int] = None
 ):
+    """Запрос с фильтрами экспорта, модель и колонка сортировки (без ORDER BY)"""
     if export_type == "orders":
-        query = db.query(Order).order_by(Order.order_date.desc())
+        query = db.query(Order)
         if status:
             query = query.filter(Order.status == status)
         if client_name:
@@ -2308,58 +3712,676 @@ async def preview_data(
             query = query.filter(Order.order_date >= date_from)
         if date_to:
             query = query.filter(Order.order_date <= date_to)
-        
-        orders = query.all()
-        order_details = []
-        for order in orders:
-            detail = await get_order_details(order.id, db)
-            order_details.append(detail)
-        
-        return {"orders": order_details}
+        return query, Order, Order.order_date, True
 
     elif export_type == "clients":
-        query = db.query(Client).order_by(Client.name)
+        query = db.query(Client)
         if client_name:
             query = query.filter(Client.name.ilike(f"%{client_name}%"))
         if client_source:
             query = query.filter(Client.source == client_source)
-        
-        clients = query.all()
-        return {"clients": [client.__dict__ for client in clients]}
+        return query, Client, Client.name, False
 
     elif export_type == "services":
-        query = db.query(Service).order_by(Service.name)
+        query = db.query(Service)
         if service_category:
             query = query.filter(Service.category == service_category)
-        
-        services = query.all()
-        return {"services": [service.__dict__ for service in services]}
+        return query, Service, Service.name, False
 
     elif export_type == "employees":
-        query = db.query(Employee).order_by(Employee.name)
+        query = db.query(Employee)
         if employee_type:
             query = query.filter(Employee.employee_type == employee_type)
         if employee_active is not None:
             query = query.filter(Employee.active == employee_active)
-        
-        employees = query.all()
-        employee_details = []
-        for employee in employees:
-            earnings = await calculate_employee_earnings(employee, date_from, date_to, db)
-            employee_dict = employee.__dict__
-            employee_dict.update(earnings)
-            employee_details.append(employee_dict)
-        
-        return {"employees": employee_details}
+        return query, Employee, Employee.name, False
+
+    raise HTTPException(status_code=400, detail=EXPORT_TYPES_ERROR)
+
+def iter_keyset_chunks(query, model, sort_column, descending: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Чтение запроса пачками по ключу (sort_column, id) без OFFSET и без загрузки всего результата"""
+    last_value = last_id = None
+    while True:
+        chunk_query = query
+        if last_id is not None:
+            if descending:
+                chunk_query = chunk_query.filter(or_(
+                    sort_column < last_value,
+                    and_(sort_column == last_value, model.id < last_id)
+                ))
+            else:
+                chunk_query = chunk_query.filter(or_(
+                    sort_column > last_value,
+                    and_(sort_column == last_value, model.id > last_id)
+                ))
+
+        if descending:
+            chunk_query = chunk_query.order_by(sort_column.desc(), model.id.desc())
+        else:
+            chunk_query = chunk_query.order_by(sort_column, model.id)
+
+        chunk = chunk_query.limit(chunk_size).all()
+        if not chunk:
+            return
+
+        last_value = getattr(chunk[-1], sort_column.key)
+        last_id = chunk[-1].id
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        # Не держим уже выгруженные объекты в identity map сессии
+        query.session.expunge_all()
+
+def iter_export_records(db: Session, export_type: str, filters: Dict[str, Any], chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Пачки записей экспорта со значениями как в базе (в порядке EXPORT_COLUMNS):
+    отсутствующие значения — None, признак активности — bool
+    """
+    query, model, sort_column, descending = build_export_query(db, export_type, **filters)
+
+    for chunk in iter_keyset_chunks(query, model, sort_column, descending, chunk_size):
+        if export_type == "orders":
+            records = []
+            for order in get_orders_details_bulk(chunk, db):
+                additional_services = ", ".join([s["name"] for s in order["additional_services"]]) if order["additional_services"] else None
+                records.append([
+                    order["id"],
+                    order["client"]["name"] if order["client"] else None,
+                    order["main_service"]["name"] if order["main_service"] else None,
+                    additional_services,
+                    order["total_price"],
+                    order["manager"]["name"] if order["manager"] else None,
+                    order["first_installer"]["name"] if order["first_installer"] else None,
+                    order["second_installer"]["name"] if order["second_installer"] else None,
+                    order["order_date"] or None,
+                    order["completion_date"] or None,
+                    order["status"],
+                    order["notes"] or None
+                ])
+            yield records
+
+        elif export_type == "clients":
+            yield [[
+                client.id,
+                client.name,
+                client.phone,
+                client.source,
+                client.created_at,
+                client.updated_at or None
+            ] for client in chunk]
+
+        elif export_type == "services":
+            yield [[
+                service.id,
+                service.name,
+                service.category,
+                service.material_cost,
+                service.price,
+                service.created_at,
+                service.updated_at or None
+            ] for service in chunk]
+
+        elif export_type == "employees":
+            earnings = calculate_employees_earnings_bulk(chunk, filters.get("date_from"), filters.get("date_to"), db)
+            yield [[
+                employee.id,
+                employee.name,
+                employee.phone,
+                employee.employee_type,
+                employee.base_salary or 0,
+                employee.order_rate,
+                employee.commission_rate,
+                employee.active == 1,
+                earnings[employee.id]["total_earned"],
+                earnings[employee.id]["paid_amount"],
+                earnings[employee.id]["remaining_to_pay"],
+                earnings[employee.id]["order_count"],
+                employee.created_at,
+                employee.updated_at or None
+            ] for employee in chunk]
+
+def iter_export_rows(db: Session, export_type: str, filters: Dict[str, Any], chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Пачки строк экспорта для CSV/XLSX: пустые значения заменяются на "-", признаки — на Да/Нет"""
+    for records in iter_export_records(db, export_type, filters, chunk_size):
+        yield [[
+            "-" if value is None else ("Да" if value else "Нет") if isinstance(value, bool) else value
+            for value in record
+        ] for record in records]
+
+def stream_export_csv(export_type: str, filters: Dict[str, Any], chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Генератор CSV: заголовок отдается сразу, далее по одному блоку байт на пачку строк"""
+    db = export_session(filters)
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_HEADERS[export_type])
+        yield buffer.getvalue().encode("utf-8")
+
+        for rows in iter_export_rows(db, export_type, filters, chunk_size):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+# Фоновые задачи экспорта: метаданные и готовые файлы хранятся на диске,
+# поэтому статус задачи виден из любого воркера gunicorn
+EXPORT_JOBS_DIR = os.environ.get("EXPORT_JOBS_DIR", "./export_jobs")
+EXPORT_JOB_TTL_SECONDS = int(os.environ.get("EXPORT_JOB_TTL_SECONDS", 24 * 60 * 60))
+EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS", 2))
+# Выполняемая задача без обновлений дольше этого времени считается прерванной (воркер перезапущен)
+EXPORT_JOB_STALE_SECONDS = 10 * 60
+# Период обновления updated_at выполняемой задачи, даже если новых строк нет
+EXPORT_JOB_HEARTBEAT_SECONDS = 60
+# Задача в очереди живет только в пуле потоков воркера, который ее поставил: она прервана, если воркера
+# больше нет или она ждет дольше этого времени
+EXPORT_JOB_QUEUE_TIMEOUT_SECONDS = 60 * 60
+EXPORT_FILE_BLOCK_SIZE = 64 * 1024
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file"
+}
+
+EXPORT_FORMATS_ERROR = "Неверный формат экспорта. Допустимые значения: csv, xlsx, parquet, arrow"
+
+export_job_executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+# Метаданные задачи обновляют и поток экспорта, и поток heartbeat
+export_job_lock = threading.Lock()
+
+def export_job_path(job_id: str, suffix: str) -> str:
+    return os.path.join(EXPORT_JOBS_DIR, f"{job_id}{suffix}")
+
+def write_export_job(job: Dict[str, Any]):
+    """Атомарная запись метаданных задачи (через временный файл и os.replace)"""
+    path = export_job_path(job["job_id"], ".json")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def update_export_job(job: Dict[str, Any], **changes):
+    with export_job_lock:
+        job.update(changes, updated_at=time.time())
+        write_export_job(job)
+
+def export_job_is_active(job: Dict[str, Any]) -> bool:
+    # Задача в очереди не обновляется, пока ждет свободный поток: она жива, пока жив поставивший ее воркер
+    if job["status"] == "queued":
+        return process_alive(job.get("pid")) and time.time() - job["created_at"] < EXPORT_JOB_QUEUE_TIMEOUT_SECONDS
+    return job["status"] == "running" and time.time() - job["updated_at"] < EXPORT_JOB_STALE_SECONDS
+
+def export_job_heartbeat(job: Dict[str, Any], stop: threading.Event):
+    """Обновление updated_at, пока задача выполняется: долгий подсчет строк или сборка xlsx
+    без новых строк не должны выглядеть как прерванная задача"""
+    while not stop.wait(EXPORT_JOB_HEARTBEAT_SECONDS):
+        update_export_job(job)
+
+def read_export_job(job_id: str) -> Optional[Dict[str, Any]]:
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+        return None
+    try:
+        with open(export_job_path(job_id, ".json"), encoding="utf-8") as f:
+            job = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if job["status"] in ("queued", "running") and not export_job_is_active(job):
+        update_export_job(job, status="failed", error="Задача прервана", finished_at=time.time())
+    return job
+
+def export_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Публичное представление задачи для API"""
+    progress = None
+    if job["status"] == "done":
+        progress = 100
+    elif job.get("rows_total"):
+        progress = round(min(job["rows_written"] / job["rows_total"], 1) * 100, 1)
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "export_type": job["export_type"],
+        "format": job["format"],
+        "rows_written": job["rows_written"],
+        "rows_total": job["rows_total"],
+        "progress": progress,
+        "size": job.get("size"),
+        "error": job.get("error"),
+        "created_at": datetime.fromtimestamp(job["created_at"]).isoformat(),
+        "finished_at": datetime.fromtimestamp(job["finished_at"]).isoformat() if job.get("finished_at") else None,
+        "expires_at": datetime.fromtimestamp(job["finished_at"] + EXPORT_JOB_TTL_SECONDS).isoformat() if job.get("finished_at") else None,
+        "download_url": f"/api/export/jobs/{job['job_id']}/download" if job["status"] == "done" else None
+    }
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def cleanup_export_jobs():
+    """Удаление завершенных задач старше TTL и брошенных временных файлов"""
+    if not os.path.isdir(EXPORT_JOBS_DIR):
+        return
+    now = time.time()
+    for name in os.listdir(EXPORT_JOBS_DIR):
+        path = os.path.join(EXPORT_JOBS_DIR, name)
+        if name.endswith(".json"):
+            job = read_export_job(name[:-len(".json")])
+            if job and not export_job_is_active(job) and now - job["updated_at"] > EXPORT_JOB_TTL_SECONDS:
+                remove_file(export_job_path(job["job_id"], f".{job['format']}"))
+                remove_file(path)
+        elif name.endswith((".part", ".tmp", ".lock")):
+            try:
+                if now - os.path.getmtime(path) > EXPORT_JOB_TTL_SECONDS:
+                    remove_file(path)
+            except FileNotFoundError:
+                pass
+
+def release_export_job_lock(job: Dict[str, Any]):
+    """Снятие блокировки дедупликации, если она все еще принадлежит задаче"""
+    lock_path = os.path.join(EXPORT_JOBS_DIR, f"{job['params_hash']}.lock")
+    try:
+        with open(lock_path, encoding="utf-8") as f:
+            if f.read().strip() == job["job_id"]:
+                remove_file(lock_path)
+    except FileNotFoundError:
+        pass
+
+def submit_export_job(export_type: str, format: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Постановка экспорта в очередь. Пока задача с теми же параметрами
+    в очереди или выполняется, возвращается она же, а не новая.
+    """
+    os.makedirs(EXPORT_JOBS_DIR, exist_ok=True)
+    cleanup_export_jobs()
+
+    # Задача выполняется на базе филиала, который ее поставил, и видна только ему
+    tenant = active_tenant()
+    params = {"tenant": tenant, "export_type": export_type, "format": format, "filters": filters}
+    params_hash = hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    now = time.time()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "tenant": tenant,
+        "params_hash": params_hash,
+        "status": "queued",
+        "pid": os.getpid(),
+        "export_type": export_type,
+        "format": format,
+        "filters": filters,
+        "rows_written": 0,
+        "rows_total": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    write_export_job(job)
+
+    # Блокировка создается через os.link: файл появляется атомарно и сразу с ID задачи
+    lock_path = os.path.join(EXPORT_JOBS_DIR, f"{params_hash}.lock")
+    tmp_lock_path = f"{lock_path}.{job['job_id']}.tmp"
+    with open(tmp_lock_path, "w", encoding="utf-8") as f:
+        f.write(job["job_id"])
+    try:
+        os.link(tmp_lock_path, lock_path)
+    except FileExistsError:
+        with open(lock_path, encoding="utf-8") as f:
+            existing = read_export_job(f.read().strip())
+        if existing and export_job_is_active(existing):
+            remove_file(export_job_path(job["job_id"], ".json"))
+            return existing
+        # Блокировка осталась от завершенной или прерванной задачи
+        os.replace(tmp_lock_path, lock_path)
+    finally:
+        remove_file(tmp_lock_path)
+
+    export_job_executor.submit(run_export_job, job["job_id"])
+    return job
+
+def write_export_csv_file(db: Session, export_type: str, filters: Dict[str, Any], path: str, on_progress):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(EXPORT_HEADERS[export_type])
+        rows_written = 0
+        for rows in iter_export_rows(db, export_type, filters):
+            writer.writerows(rows)
+            rows_written += len(rows)
+            on_progress(rows_written)
+
+def write_export_xlsx_file(db: Session, export_type: str, filters: Dict[str, Any], path, on_progress):
+    """XLSX в режиме write-only (в файл по пути или в файловый объект): ширина столбцов оценивается по первой пачке строк"""
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+
+    titles = {"orders": "Заказы", "clients": "Клиенты", "services": "Услуги", "employees": "Сотрудники"}
+    headers = EXPORT_HEADERS[export_type]
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(titles[export_type])
+
+    def header_row():
+        cells = []
+        for header in headers:
+            cell = WriteOnlyCell(sheet, value=header)
+            cell.font = Font(bold=True)
+            cells.append(cell)
+        return cells
+
+    rows_written = 0
+    for rows in iter_export_rows(db, export_type, filters):
+        if rows_written == 0:
+            for index, header in enumerate(headers, start=1):
+                width = max([len(str(header))] + [len(str(row[index - 1])) for row in rows if row[index - 1]])
+                sheet.column_dimensions[get_column_letter(index)].width = width + 2
+            sheet.append(header_row())
+        for row in rows:
+            sheet.append(row)
+        rows_written += len(rows)
+        on_progress(rows_written)
+
+    if rows_written == 0:
+        sheet.append(header_row())
+    workbook.save(path)
+
+def tenant_export_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Задача филиала текущего запроса: задачи других филиалов не видны"""
+    job = read_export_job(job_id)
+    if job and job.get("tenant", SINGLE_TENANT) != active_tenant():
+        return None
+    return job
+
+def run_export_job(job_id: str):
+    """Выполнение задачи экспорта в пуле потоков (поток не знает филиала запроса — он берется из задачи)"""
+    job = read_export_job(job_id)
+    if not job:
+        return
+    with tenant_scope(job.get("tenant", SINGLE_TENANT)):
+        execute_export_job(job)
+
+def execute_export_job(job: Dict[str, Any]):
+    # Задача уже помечена прерванной (истекло ожидание в очереди)
+    if job["status"] != "queued":
+        return
+
+    job_id = job["job_id"]
+    artifact_path = export_job_path(job_id, f".{job['format']}")
+    part_path = f"{artifact_path}.part"
+    db = export_session(job["filters"])
+    stop_heartbeat = threading.Event()
+    try:
+        update_export_job(job, status="running")
+        threading.Thread(
+            target=export_job_heartbeat, args=(job, stop_heartbeat), name=f"export-heartbeat-{job_id[:8]}", daemon=True
+        ).start()
+        query, _, _, _ = build_export_query(db, job["export_type"], **job["filters"])
+        update_export_job(job, rows_total=query.count())
+
+        on_progress = lambda rows: update_export_job(job, rows_written=rows)
+        if job["format"] == "csv":
+            write_export_csv_file(db, job["export_type"], job["filters"], part_path, on_progress)
+        elif job["format"] == "xlsx":
+            write_export_xlsx_file(db, job["export_type"], job["filters"], part_path, on_progress)
+        else:
+            write_export_arrow_file(db, job["export_type"], job["filters"], part_path, job["format"], on_progress)
+
+        os.replace(part_path, artifact_path)
+        update_export_job(job, status="done", size=os.path.getsize(artifact_path), finished_at=time.time())
+    except Exception as e:
+        remove_file(part_path)
+        update_export_job(job, status="failed", error=str(e), finished_at=time.time())
+    finally:
+        stop_heartbeat.set()
+        db.close()
+        release_export_job_lock(job)
+
+def parse_range_header(range_header: Optional[str], size: int):
+    """
+    Разбор заголовка Range (один диапазон байт). Возвращает (start, end) включительно
+    или None, если нужно отдать файл целиком.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # Суффиксный диапазон: последние N байт
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Запрошенный диапазон недоступен",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def iter_file_range(file, start: int, end: int, block_size: int = EXPORT_FILE_BLOCK_SIZE):
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = file.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
+
+def require_pyarrow():
+    """pyarrow — необязательная зависимость, нужна только для parquet и arrow"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=400, detail="Для экспорта в parquet и arrow требуется пакет pyarrow (pip install pyarrow)")
+
+def parse_export_datetime(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def write_export_arrow_file(db: Session, export_type: str, filters: Dict[str, Any], file, format: str, on_progress=None):
+    """
+    Типизированный экспорт в parquet или arrow (IPC, он же Feather v2).
+    Пачки записей копятся до ARROW_ROW_GROUP_SIZE строк и пишутся одной группой,
+    поэтому в памяти держится не больше одной группы.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("s")
+    }
+    columns = EXPORT_COLUMNS[export_type]
+    schema = pa.schema([(name, arrow_types[column_type]) for name, column_type in columns])
+    timestamp_indexes = [index for index, (_, column_type) in enumerate(columns) if column_type == "timestamp"]
+
+    if format == "parquet":
+        writer = pq.ParquetWriter(file, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(file, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    pending = []
+    pending_rows = rows_written = 0
+    try:
+        for records in iter_export_records(db, export_type, filters):
+            for record in records:
+                for index in timestamp_indexes:
+                    record[index] = parse_export_datetime(record[index])
+            pending.append(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*records), schema)],
+                schema=schema
+            ))
+            pending_rows += len(records)
+            rows_written += len(records)
+            if pending_rows >= ARROW_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_batches(pending).combine_chunks())
+                pending = []
+                pending_rows = 0
+            if on_progress:
+                on_progress(rows_written)
+
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending).combine_chunks())
+    finally:
+        writer.close()
+
+def stream_export_xlsx(export_type: str, filters: Dict[str, Any]):
+    """Генератор XLSX: книга write-only собирается во временном файле (в памяти до EXPORT_SPOOL_MAX_SIZE) и отдается блоками"""
+    db = export_session(filters)
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        write_export_xlsx_file(db, export_type, filters, output, lambda rows: None)
+    except Exception:
+        output.close()
+        raise
+    finally:
+        db.close()
+
+    size = output.tell()
+    yield from iter_file_range(output, 0, size - 1)
+
+def stream_export_arrow(export_type: str, filters: Dict[str, Any], format: str):
+    """Генератор файла parquet/arrow: файл собирается во временном файле и отдается блоками"""
+    db = export_session(filters)
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE)
+    try:
+        write_export_arrow_file(db, export_type, filters, output, format)
+    except Exception:
+        output.close()
+        raise
+    finally:
+        db.close()
+
+    size = output.tell()
+    yield from iter_file_range(output, 0, size - 1)
+
+# Размер предпросмотра экспорта по умолчанию и максимальный
+EXPORT_PREVIEW_LIMIT = 50
+EXPORT_PREVIEW_MAX_LIMIT = 500
+
+# До скольких строк считается итог предпросмотра; дальше итог приблизительный ("больше чем")
+EXPORT_PREVIEW_COUNT_CAP = 10000
+
+def count_export_rows(query, exact: bool = False):
+    """
+    Количество строк запроса экспорта: точное или ограниченное EXPORT_PREVIEW_COUNT_CAP.
+    Возвращает (количество, точно ли оно).
+    """
+    if exact:
+        return query.count(), True
+    capped = query.limit(EXPORT_PREVIEW_COUNT_CAP + 1).count()
+    if capped > EXPORT_PREVIEW_COUNT_CAP:
+        return EXPORT_PREVIEW_COUNT_CAP, False
+    return capped, True
+
+# API-эндпоинт для предпросмотра данных
+@app.get("/api/export/preview")
+@query_budget(10)
+async def preview_data(
+    export_type: str = Query(..., description="Тип данных для экспорта: orders, clients, services, employees"),
+    status: Optional[str] = Query(None),
+    client_name: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    client_source: Optional[str] = Query(None),
+    service_category: Optional[str] = Query(None),
+    employee_type: Optional[str] = Query(None),
+    employee_active: Optional[int] = Query(None),
+    limit: int = Query(EXPORT_PREVIEW_LIMIT, ge=1, le=EXPORT_PREVIEW_MAX_LIMIT, description="Количество строк предпросмотра"),
+    exact_count: bool = Query(False, description="Точный подсчет итога вместо ограниченного"),
+    db: Session = Depends(get_db_since)
+):
+    """
+    Первые limit строк экспорта (в порядке выгрузки) и количество строк всего.
+    Итог считается до EXPORT_PREVIEW_COUNT_CAP строк, если не запрошен exact_count;
+    при превышении total_exact = false, а total — нижняя граница.
+    """
+    query, model, sort_column, descending = build_export_query(
+        db, export_type, status, client_name, date_from, date_to,
+        client_source, service_category, employee_type, employee_active
+    )
+    rows = next(iter_keyset_chunks(query, model, sort_column, descending, chunk_size=limit), [])
+
+    if len(rows) < limit:
+        total, total_exact = len(rows), True
+    else:
+        total, total_exact = count_export_rows(query, exact_count)
+
+    if export_type == "orders":
+        items = get_orders_details_bulk(rows, db)
+
+    elif export_type == "clients":
+        items = [{
+            "id": client.id,
+            "name": client.name,
+            "phone": client.phone,
+            "source": client.source,
+            "created_at": client.created_at,
+            "updated_at": client.updated_at
+        } for client in rows]
+
+    elif export_type == "services":
+        items = [{
+            "id": service.id,
+            "name": service.name,
+            "category": service.category,
+            "material_cost": service.material_cost,
+            "price": service.price,
+            "created_at": service.created_at,
+            "updated_at": service.updated_at
+        } for service in rows]
 
     else:
-        raise HTTPException(status_code=400, detail="Неверный тип экспорта. Допустимые значения: orders, clients, services, employees")
+        earnings = calculate_employees_earnings_bulk(rows, date_from, date_to, db)
+        items = [dict({
+            "id": employee.id,
+            "name": employee.name,
+            "phone": employee.phone,
+            "employee_type": employee.employee_type,
+            "base_salary": employee.base_salary,
+            "order_rate": employee.order_rate,
+            "commission_rate": employee.commission_rate,
+            "active": employee.active,
+            "created_at": employee.created_at,
+            "updated_at": employee.updated_at
+        }, **earnings[employee.id]) for employee in rows]
+
+    # Большой список из простых типов: ответ отдается напрямую, минуя jsonable_encoder
+    return APIResponse({
+        export_type: items,
+        "total": total,
+        "total_exact": total_exact,
+        "limit": limit
+    })
 
 # API-эндпоинт для экспорта данных
 @app.get("/api/export")
+@query_budget(None)
 async def export_data(
     export_type: str = Query(..., description="Тип данных для экспорта: orders, clients, services, employees"),
-    format: str = Query("csv", description="Формат экспорта: csv или xlsx"),
+    format: str = Query("csv", description="Формат экспорта: csv, xlsx, parquet или arrow"),
     status: Optional[str] = Query(None),
     client_name: Optional[str] = Query(None),
     date_from: Optional[str] = Query(None),
@@ -2367,299 +4389,301 @@ async def export_data(
     client_source: Optional[str] = Query(None),
     service_category: Optional[str] = Query(None),
     employee_type: Optional[str] = Query(None),
-    employee_active: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    employee_active: Optional[int] = Query(None)
 ):
     # Формируем имя файла
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"export_{export_type}_{timestamp}.{format}"
 
-    if format == "csv":
-        # Экспорт в CSV
-        output = io.StringIO()
-        writer = csv.writer(output, lineterminator='\n')
+    filters = {
+        "status": status,
+        "client_name": client_name,
+        "date_from": date_from,
+        "date_to": date_to,
+        "client_source": client_source,
+        "service_category": service_category,
+        "employee_type": employee_type,
+        "employee_active": employee_active
+    }
 
-        if export_type == "orders":
-            query = db.query(Order).order_by(Order.order_date.desc())
-            if status:
-                query = query.filter(Order.status == status)
-            if client_name:
-                query = query.filter(Order.client.has(name=client_name))
-            if date_from:
-                query = query.filter(Order.order_date >= date_from)
-            if date_to:
-                query = query.filter(Order.order_date <= date_to)
-            
-            orders = query.all()
-            order_details = []
-            for order in orders:
-                detail = await get_order_details(order.id, db)
-                order_details.append(detail)
-            
-            headers = [
-                "ID", "Клиент", "Основная услуга", "Дополнительные услуги", "Сумма (₽)",
-                "Менеджер", "Первый монтажник", "Второй монтажник", "Дата заказа",
-                "Дата завершения", "Статус", "Примечания"
-            ]
-            writer.writerow(headers)
-            
-            for order in order_details:
-                additional_services = ", ".join([s["name"] for s in order["additional_services"]]) if order["additional_services"] else "-"
-                row = [
-                    order["id"],
-                    order["client"]["name"] if order["client"] else "-",
-                    order["main_service"]["name"] if order["main_service"] else "-",
-                    additional_services,
-                    order["total_price"],
-                    order["manager"]["name"] if order["manager"] else "-",
-                    order["first_installer"]["name"] if order["first_installer"] else "-",
-                    order["second_installer"]["name"] if order["second_installer"] else "-",
-                    order["order_date"] if order["order_date"] else "-",
-                    order["completion_date"] if order["completion_date"] else "-",
-                    order["status"],
-                    order["notes"] if order["notes"] else "-"
-                ]
-                writer.writerow(row)
+    if format == "csv":
+        # Потоковый экспорт в CSV: строки читаются и отдаются пачками,
+        # поэтому память не зависит от объема выгрузки
+        if export_type not in EXPORT_HEADERS:
+            raise HTTPException(status_code=400, detail=EXPORT_TYPES_ERROR)
 
-        elif export_type == "clients":
-            query = db.query(Client).order_by(Client.name)
-            if client_name:
-                query = query.filter(Client.name.ilike(f"%{client_name}%"))
-            if client_source:
-                query = query.filter(Client.source == client_source)
-            
-            clients = query.all()
-            headers = ["ID", "Имя", "Телефон", "Источник", "Дата создания", "Дата обновления"]
-            writer.writerow(headers)
-            
-            for client in clients:
-                row = [
-                    client.id,
-                    client.name,
-                    client.phone,
-                    client.source,
-                    client.created_at,
-                    client.updated_at if client.updated_at else "-"
-                ]
-                writer.writerow(row)
+        return StreamingResponse(
+            stream_export_csv(export_type, filters),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
 
-        elif export_type == "services":
-            query = db.query(Service).order_by(Service.name)
-            if service_category:
-                query = query.filter(Service.category == service_category)
-            
-            services = query.all()
-            headers = ["ID", "Название", "Категория", "Стоимость материалов (₽)", "Цена (₽)", "Дата создания", "Дата обновления"]
-            writer.writerow(headers)
-            
-            for service in services:
-                row = [
-                    service.id,
-                    service.name,
-                    service.category,
-                    service.material_cost,
-                    service.price,
-                    service.created_at,
-                    service.updated_at if service.updated_at else "-"
-                ]
-                writer.writerow(row)
+    elif format in ("parquet", "arrow"):
+        # Типизированный колоночный экспорт для аналитики (pandas, DuckDB)
+        if export_type not in EXPORT_COLUMNS:
+            raise HTTPException(status_code=400, detail=EXPORT_TYPES_ERROR)
+        require_pyarrow()
 
-        elif export_type == "employees":
-            query = db.query(Employee).order_by(Employee.name)
-            if employee_type:
-                query = query.filter(Employee.employee_type == employee_type)
-            if employee_active is not None:
-                query = query.filter(Employee.active == employee_active)
-            
-            employees = query.all()
-            headers = [
-                "ID", "Имя", "Телефон", "Тип сотрудника", "Базовая зарплата (₽)",
-                "Ставка за заказ", "Комиссия (%)", "Активен", "Заработано за период (₽)",
-                "Выплачено (₽)", "Осталось выплатить (₽)", "Количество заказов",
-                "Дата создания", "Дата обновления"
-            ]
-            writer.writerow(headers)
-            
-            for employee in employees:
-                earnings = await calculate_employee_earnings(employee, date_from, date_to, db)
-                row = [
-                    employee.id,
-                    employee.name,
-                    employee.phone,
-                    employee.employee_type,
-                    employee.base_salary if employee.base_salary else 0,
-                    employee.order_rate,
-                    employee.commission_rate,
-                    "Да" if employee.active == 1 else "Нет",
-                    earnings["total_earned"],
-                    earnings["paid_amount"],
-                    earnings["remaining_to_pay"],
-                    earnings["order_count"],
-                    employee.created_at,
-                    employee.updated_at if employee.updated_at else "-"
-                ]
-                writer.writerow(row)
+        return StreamingResponse(
+            stream_export_arrow(export_type, filters, format),
+            media_type=EXPORT_MEDIA_TYPES[format],
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
 
-        else:
-            raise HTTPException(status_code=400, detail="Неверный тип экспорта. Допустимые значения: orders, clients, services, employees")
+    elif format == "xlsx":
+        # Книга в режиме write-only из тех же пачек строк, что и CSV, собирается во временном файле
+        if export_type not in EXPORT_HEADERS:
+            raise HTTPException(status_code=400, detail=EXPORT_TYPES_ERROR)
 
         return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
+            stream_export_xlsx(export_type, filters),
+            media_type=EXPORT_MEDIA_TYPES["xlsx"],
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
 
-    elif format == "xlsx":
-        # Экспорт в Excel
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
+    else:
+        raise HTTPException(status_code=400, detail=EXPORT_FORMATS_ERROR)
 
-        if export_type == "orders":
-            sheet.title = "Заказы"
-            headers = [
-                "ID", "Клиент", "Основная услуга", "Дополнительные услуги", "Сумма (₽)",
-                "Менеджер", "Первый монтажник", "Второй монтажник", "Дата заказа",
-                "Дата завершения", "Статус", "Примечания"
-            ]
-            sheet.append(headers)
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-
-            query = db.query(Order).order_by(Order.order_date.desc())
-            if status:
-                query = query.filter(Order.status == status)
-            if client_name:
-                query = query.filter(Order.client.has(name=client_name))
-            if date_from:
-                query = query.filter(Order.order_date >= date_from)
-            if date_to:
-                query = query.filter(Order.order_date <= date_to)
-            
-            orders = query.all()
-            order_details = []
-            for order in orders:
-                detail = await get_order_details(order.id, db)
-                order_details.append(detail)
-            
-            for order in order_details:
-                additional_services = ", ".join([s["name"] for s in order["additional_services"]]) if order["additional_services"] else "-"
-                row = [
-                    order["id"],
-                    order["client"]["name"] if order["client"] else "-",
-                    order["main_service"]["name"] if order["main_service"] else "-",
-                    additional_services,
-                    order["total_price"],
-                    order["manager"]["name"] if order["manager"] else "-",
-                    order["first_installer"]["name"] if order["first_installer"] else "-",
-                    order["second_installer"]["name"] if order["second_installer"] else "-",
-                    order["order_date"] if order["order_date"] else "-",
-                    order["completion_date"] if order["completion_date"] else "-",
-                    order["status"],
-                    order["notes"] if order["notes"] else "-"
-                ]
-                sheet.append(row)
+# API-эндпоинты фоновых задач экспорта
+@app.post("/api/export/jobs")
+async def create_export_job(
+    export_type: str = Query(..., description="Тип данных для экспорта: orders, clients, services, employees"),
+    format: str = Query("csv", description="Формат экспорта: csv, xlsx, parquet или arrow"),
+    status: Optional[str] = Query(None),
+    client_name: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    client_source: Optional[str] = Query(None),
+    service_category: Optional[str] = Query(None),
+    employee_type: Optional[str] = Query(None),
+    employee_active: Optional[int] = Query(None)
+):
+    if export_type not in EXPORT_HEADERS:
+        raise HTTPException(status_code=400, detail=EXPORT_TYPES_ERROR)
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=EXPORT_FORMATS_ERROR)
+    if format in ("parquet", "arrow"):
+        require_pyarrow()
 
-        elif export_type == "clients":
-            sheet.title = "Клиенты"
-            headers = ["ID", "Имя", "Телефон", "Источник", "Дата создания", "Дата обновления"]
-            sheet.append(headers)
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-
-            query = db.query(Client).order_by(Client.name)
-            if client_name:
-                query = query.filter(Client.name.ilike(f"%{client_name}%"))
-            if client_source:
-                query = query.filter(Client.source == client_source)
-            
-            clients = query.all()
-            for client in clients:
-                row = [
-                    client.id,
-                    client.name,
-                    client.phone,
-                    client.source,
-                    client.created_at,
-                    client.updated_at if client.updated_at else "-"
-                ]
-                sheet.append(row)
+    filters = {
+        "status": status,
+        "client_name": client_name,
+        "date_from": date_from,
+        "date_to": date_to,
+        "client_source": client_source,
+        "service_category": service_category,
+        "employee_type": employee_type,
+        "employee_active": employee_active
+    }
+    job = submit_export_job(export_type, format, filters)
+    return export_job_view(job)
 
-        elif export_type == "services":
-            sheet.title = "Услуги"
-            headers = ["ID", "Название", "Категория", "Стоимость материалов (₽)", "Цена (₽)", "Дата создания", "Дата обновления"]
-            sheet.append(headers)
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-
-            query = db.query(Service).order_by(Service.name)
-            if service_category:
-                query = query.filter(Service.category == service_category)
-            
-            services = query.all()
-            for service in services:
-                row = [
-                    service.id,
-                    service.name,
-                    service.category,
-                    service.material_cost,
-                    service.price,
-                    service.created_at,
-                    service.updated_at if service.updated_at else "-"
-                ]
-                sheet.append(row)
+@app.get("/api/export/jobs/{job_id}")
+async def get_export_job(job_id: str = Path(...)):
+    job = tenant_export_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+    return export_job_view(job)
 
-        elif export_type == "employees":
-            sheet.title = "Сотрудники"
-            headers = [
-                "ID", "Имя", "Телефон", "Тип сотрудника", "Базовая зарплата (₽)",
-                "Ставка за заказ", "Комиссия (%)", "Активен", "Заработано за период (₽)",
-                "Выплачено (₽)", "Осталось выплатить (₽)", "Количество заказов",
-                "Дата создания", "Дата обновления"
-            ]
-            sheet.append(headers)
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-
-            query = db.query(Employee).order_by(Employee.name)
-            if employee_type:
-                query = query.filter(Employee.employee_type == employee_type)
-            if employee_active is not None:
-                query = query.filter(Employee.active == employee_active)
-            
-            employees = query.all()
-            for employee in employees:
-                earnings = await calculate_employee_earnings(employee, date_from, date_to, db)
-                row = [
-                    employee.id,
-                    employee.name,
-                    employee.phone,
-                    employee.employee_type,
-                    employee.base_salary if employee.base_salary else 0,
-                    employee.order_rate,
-                    employee.commission_rate,
-                    "Да" if employee.active == 1 else "Нет",
-                    earnings["total_earned"],
-                    earnings["paid_amount"],
-                    earnings["remaining_to_pay"],
-                    earnings["order_count"],
-                    employee.created_at,
-                    employee.updated_at if employee.updated_at else "-"
-                ]
-                sheet.append(row)
+@app.get("/api/export/jobs/{job_id}/download")
+async def download_export_job(request: Request, job_id: str = Path(...)):
+    job = tenant_export_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Экспорт еще не готов")
 
-        else:
-            raise HTTPException(status_code=400, detail="Неверный тип экспорта. Допустимые значения: orders, clients, services, employees")
+    try:
+        file = open(export_job_path(job_id, f".{job['format']}"), "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл экспорта удален по истечении срока хранения")
 
-        # Сохраняем Excel в поток
-        output = io.BytesIO()
-        workbook.save(output)
-        output.seek(0)
+    size = os.fstat(file.fileno()).st_size
+    created = datetime.fromtimestamp(job["created_at"]).strftime("%Y%m%d_%H%M%S")
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename=export_{job['export_type']}_{created}.{job['format']}"
+    }
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    except HTTPException:
+        file.close()
+        raise
 
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file_range(file, 0, size - 1), media_type=EXPORT_MEDIA_TYPES[job["format"]], headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(file, start, end),
+        status_code=206,
+        media_type=EXPORT_MEDIA_TYPES[job["format"]],
+        headers=headers
+    )
+
+# Служебные эндпоинты /api/admin/* снимают и проверяют копии, показывают SQL-запросы и состояние базы,
+# сводный отчет /api/rollup/summary показывает данные всех филиалов: доступны только с заголовком X-Admin-Token
+# со значением ADMIN_TOKEN, без ADMIN_TOKEN выключены (404)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Без токена администратора или с неверным токеном — 404 (сравнение за постоянное время)"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+# Сводный отчет по всем филиалам: финансовая сводка и клиенты по источникам за период по каждому филиалу
+# и в сумме. Филиалы считаются параллельно в ROLLUP_WORKERS потоках, каждый на своей базе (с архивом,
+# если период начинается раньше его границы); ошибка филиала не прерывает отчет. Только с токеном администратора
+ROLLUP_WORKERS = int(os.getenv("ROLLUP_WORKERS", "4"))
+rollup_executor = ThreadPoolExecutor(max_workers=ROLLUP_WORKERS, thread_name_prefix="rollup")
+
+def tenant_rollup(name: str, date_from: Optional[str], date_to: Optional[str]) -> Dict[str, Any]:
+    with tenant_scope(name):
+        db = HistorySessionLocal() if needs_archive(date_from) else SessionLocal()
+        try:
+            # Эндпоинт сводки не ждет ввода-вывода: отдельный цикл событий в потоке пула
+            finance = asyncio.run(get_finance_summary(date_from=date_from, date_to=date_to, db=db))
+            source_counts = dict(db.query(Client.source, func.count(Client.id)).group_by(Client.source).all())
+        finally:
+            db.close()
+    return {"finance": finance, "clients_by_source": source_counts}
+
+def add_rollup(total: Dict[str, Any], report: Dict[str, Any]):
+    """Сложение отчета филиала с итогом: числа суммируются, вложенные словари — по ключам"""
+    for key, value in report.items():
+        if isinstance(value, dict):
+            add_rollup(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = round(total.get(key, 0) + value, 2)
+
+@app.get("/api/rollup/summary", dependencies=[Depends(require_admin_token)])
+@heavy_report()
+def get_rollup_summary(date_from: Optional[str] = Query(None), date_to: Optional[str] = Query(None)):
+    """Финансовая сводка и клиенты по источникам за период: по каждому филиалу и итог по всем"""
+    started = time.perf_counter()
+    futures = {name: rollup_executor.submit(tenant_rollup, name, date_from, date_to) for name in tenants}
+    by_tenant, errors = {}, {}
+    for name, future in futures.items():
+        try:
+            by_tenant[name] = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+    total: Dict[str, Any] = {}
+    for report in by_tenant.values():
+        add_rollup(total, report)
+    return {"date_from": date_from, "date_to": date_to, "tenants": by_tenant, "total": total, "errors": errors,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """Метрики всех воркеров в текстовом формате Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/maintenance", dependencies=[Depends(require_admin_token)])
+def get_maintenance():
+    """Итоги последнего обслуживания базы филиала: страницы до и после, режим и длительность шагов"""
+    return read_maintenance_state(current_tenant())
 
+@app.get("/api/admin/backups", dependencies=[Depends(require_admin_token)])
+def get_backups():
+    """Хранимые наборы резервных копий базы филиала, новые первыми"""
+    return {"backups": list_backups(current_tenant().hot_path)}
+
+@app.post("/api/admin/backups", dependencies=[Depends(require_admin_token)])
+def post_backup():
+    """Резервная копия базы и архива филиала без остановки приложения (в пуле потоков); ответ — манифест набора"""
+    try:
+        return create_backup()
+    except (BackupError, sqlite3.Error, OSError) as e:
+        raise HTTPException(status_code=500, detail=f"Резервная копия не снята: {e}")
+
+@app.post("/api/admin/backups/{name}/verify", dependencies=[Depends(require_admin_token)])
+def post_verify_backup(name: str):
+    """Проверка набора базы филиала: контрольные суммы файлов и PRAGMA integrity_check распакованных баз"""
+    try:
+        return verify_backup(name, current_tenant().hot_path)
+    except BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/slow-queries", dependencies=[Depends(require_admin_token)])
+def get_slow_queries(limit: int = Query(20, ge=1, le=200)):
+    """Формы SQL-запросов с наибольшим суммарным временем по всем воркерам, с планом и эндпоинтами медленных"""
+    merged: Dict[str, list] = {}
+    for snapshot in collect_metrics_snapshots():
+        for shape, count, total, longest, slow, plan, endpoints in snapshot.get("statements", []):
+            entry = merged.setdefault(shape, [0, 0.0, 0.0, 0, None, []])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+            entry[3] += slow
+            entry[4] = plan or entry[4]
+            entry[5].extend(endpoint for endpoint in endpoints if endpoint not in entry[5])
+    top = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return {"statements": [
+        {"sql": shape, "count": count, "total_ms": round(total * 1000, 3),
+         "mean_ms": round(total * 1000 / count, 3) if count else 0.0, "max_ms": round(longest * 1000, 3),
+         "slow_count": slow, "plan": plan, "endpoints": endpoints}
+        for shape, (count, total, longest, slow, plan, endpoints) in top
+    ]}
+
+@app.get("/api/profiles/{profile_id}/{kind}", include_in_schema=False)
+def get_profile(profile_id: str, kind: str, x_profile_token: Optional[str] = Header(None), profile: Optional[str] = None):
+    """Файл профиля запроса (speedscope.json или sql.json); только с токеном профилирования, иначе 404"""
+    if (not check_profile_token(x_profile_token or profile) or kind not in PROFILE_KINDS
+            or not re.match(r"^\d{8}-\d{6}-[0-9a-f]{8}$", profile_id)):
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{kind}")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="application/json", filename=f"{profile_id}.{kind}")
+
+if __name__ == "__main__":
+    # Филиал команды — переменная TENANT (по умолчанию DEFAULT_TENANT); обслуживание и снятие копий
+    # без TENANT выполняются для всех филиалов по очереди
+    cli_tenant = os.getenv("TENANT", "").lower() or None
+    if cli_tenant is not None and cli_tenant not in tenants:
+        raise SystemExit(f"Филиал {cli_tenant} не найден, известные: {', '.join(tenants)}")
+    cli_tenants = [cli_tenant] if cli_tenant else list(tenants)
+
+    def require_tenant() -> str:
+        if (cli_tenant or DEFAULT_TENANT) is None:
+            raise SystemExit("Укажите филиал: TENANT=<код> python main.py ...")
+        return cli_tenant or DEFAULT_TENANT
+
+    if sys.argv[1:] == ["migrate"]:
+        migrate()
+        print("Схема базы данных обновлена")
+    elif sys.argv[1:2] == ["archive"] and len(sys.argv) <= 3:
+        with tenant_scope(require_tenant()):
+            result = archive_closed_orders(sys.argv[2] if len(sys.argv) == 3 else default_archive_before())
+        print(f"Архив {result['archive_path']}: до {result['before']} перенесено заказов {result['orders']} "
+              f"(услуг {result['order_services']}), выплат {result['payments']} за {result['seconds']} с")
+    elif sys.argv[1:] == ["maintenance"]:
+        results = {name: run_maintenance(tenants[name]) for name in cli_tenants}
+        print(json.dumps(results[cli_tenants[0]] if len(results) == 1 else results, ensure_ascii=False, indent=2))
+    elif sys.argv[1:2] == ["backup"] and (sys.argv[2:] in ([], ["list"]) or len(sys.argv) == 4 and sys.argv[2] in ("verify", "restore")):
+        try:
+            if len(sys.argv) == 2:
+                result = []
+                for name in cli_tenants:
+                    with tenant_scope(name):
+                        result.append(create_backup())
+                result = result[0] if len(result) == 1 else result
+            elif sys.argv[2] == "list":
+                result = [{"name": manifest["name"], "created_at": manifest["created_at"],
+                           "size": sum(item["size"] for item in manifest["files"])}
+                          for manifest in list_backups(tenants[cli_tenant].hot_path if cli_tenant else None)]
+            elif sys.argv[2] == "verify":
+                result = verify_backup(sys.argv[3], tenants[cli_tenant].hot_path if cli_tenant else None)
+            else:
+                with tenant_scope(require_tenant()):
+                    result = restore_backup(sys.argv[3])
+        except (BackupError, sqlite3.Error) as e:
+            raise SystemExit(f"Ошибка: {e}")
+        print(json.dumps(result, ensure_ascii=False, indent=2))
     else:
-        raise HTTPException(status_code=400, detail="Неверный формат экспорта. Допустимые значения: csv, xlsx")
\ No newline at end of file
+        print("Использование: [TENANT=<филиал>] python main.py migrate | archive [YYYY-MM-DD] | maintenance"
+              " | backup [list | verify <имя> | restore <имя>]")
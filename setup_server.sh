@@ -15,7 +15,7 @@ git clone <your-repo-url> crm-cond || mkdir crm-cond
 cd crm-cond
 python3 -m venv venv
 source venv/bin/activate
-pip install fastapi uvicorn gunicorn sqlalchemy python-multipart pydantic
+pip install fastapi uvicorn gunicorn sqlalchemy python-multipart pydantic openpyxl brotli orjson
 "
 
 # Настройка Gunicorn
@@ -29,6 +29,10 @@ User=appuser
 Group=www-data
 WorkingDirectory=/home/appuser/crm-cond
 Environment="PATH=/home/appuser/crm-cond/venv/bin"
+# Каталог снимков метрик воркеров: /metrics суммирует все 4 воркера
+Environment="METRICS_DIR=/home/appuser/crm-cond/metrics"
+# Схема БД создается один раз до запуска воркеров
+ExecStartPre=/home/appuser/crm-cond/venv/bin/python main.py migrate
 ExecStart=/home/appuser/crm-cond/venv/bin/gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app -b 0.0.0.0:8000
 
 [Install]
@@ -51,6 +55,21 @@ server {
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
     }
 
+    # Метрики Prometheus — только для локального сборщика
+    location /metrics {
+        allow 127.0.0.1;
+        deny all;
+        proxy_pass http://127.0.0.1:8000;
+    }
+
+    # Служебные эндпоинты (копии, медленные запросы, обслуживание) — только с сервера и с токеном ADMIN_TOKEN
+    location /api/admin/ {
+        allow 127.0.0.1;
+        deny all;
+        proxy_pass http://127.0.0.1:8000;
+        proxy_set_header Host \$host;
+    }
+
     location /static/ {
         alias /home/appuser/crm-cond/static/;
     }
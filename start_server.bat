@@ -24,7 +24,10 @@ source venv/bin/activate
 
 # Установка зависимостей
 echo "Установка зависимостей..."
-pip install fastapi uvicorn sqlalchemy python-multipart pydantic
+pip install fastapi uvicorn sqlalchemy python-multipart pydantic openpyxl brotli orjson
+
+# Создание таблиц базы данных (однократно перед запуском)
+python main.py migrate
 
 # Запуск сервера
 echo "Запуск сервера на порту $PORT..."
@@ -4,17 +4,33 @@
 from fastapi import FastAPI, Depends, Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import logging
 
 # Импорт настроек
-from config import APP_NAME, APP_VERSION, DEBUG
-from database import init_db, get_db, fill_initial_data
+from config import (
+    APP_NAME, APP_VERSION, DEBUG, STATIC_DIR, STATIC_BUILD_DIR, COMPRESSION_MINIMUM_SIZE, METRICS_DIR, METRICS_FLUSH_SECONDS,
+    QUERY_BUDGET_CHECK, DEFAULT_QUERY_BUDGET, PROFILE_TOKEN, PROFILE_DIR, PROFILE_INTERVAL, ADMIN_TOKEN,
+    SLOW_QUERY_MS, SLOW_QUERY_LOG, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS, SERVER_TIMING,
+    HEAVY_REPORT_CONCURRENCY, HEAVY_REPORT_QUEUE, HEAVY_REPORT_QUEUE_TIMEOUT, HEAVY_REPORT_RETRY_AFTER,
+    MAINTENANCE_WINDOW, MAINTENANCE_CHECK_SECONDS, MAINTENANCE_VACUUM_PAGES, MAINTENANCE_STATE_PATH,
+    BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP, BACKUP_MAX_RESTARTS
+)
+from database import get_db, tenants, on_engine_created
+from core import (
+    build_assets, asset_url_factory, AssetStaticFiles, ASSETS_URL_PREFIX, APIResponse, CompressionMiddleware,
+    MetricsMiddleware, configure_metrics, instrument_engine, configure_query_budget, ProfilingMiddleware,
+    configure_profiling, configure_slow_queries, ServerTimingMiddleware, TimedTemplates,
+    configure_heavy_reports, configure_maintenance, start_maintenance_scheduler, maintenance_collector, metrics_registry,
+    configure_backup, backup_collector, TenantMiddleware, configure_admin_auth
+)
 
 # Импорт роутеров
-from routers import employee_router, client_router, service_router, order_router, finance_router, export_router
+from routers import (
+    employee_router, client_router, service_router, order_router, finance_router, export_router, metrics_router,
+    profiles_router, admin_router, rollup_router
+)
 
 # Инициализация логгера
 logging.basicConfig(
@@ -28,9 +44,13 @@ app = FastAPI(
     title=APP_NAME,
     description="CRM для компании по установке кондиционеров",
     version=APP_VERSION,
-    debug=DEBUG
+    debug=DEBUG,
+    default_response_class=APIResponse
 )
 
+# Сжатие ответов (brotli/gzip по Accept-Encoding)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,13 +60,63 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешить все заголовки
 )
 
-# Подключение статических файлов
+# Профилирование запроса по токену (X-Profile-Token): flamegraph и SQL в PROFILE_DIR.
+# Подключается только при заданном PROFILE_TOKEN и внутри MetricsMiddleware — ему нужна SQL-статистика запроса
+configure_profiling(PROFILE_TOKEN, PROFILE_DIR, PROFILE_INTERVAL)
+if PROFILE_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+
+# Служебные эндпоинты /api/admin/* — только с токеном X-Admin-Token, без ADMIN_TOKEN они выключены
+configure_admin_auth(ADMIN_TOKEN)
+
+# Server-Timing: время SQL, шаблонов, сериализации и Python в DevTools браузера (тоже внутри MetricsMiddleware)
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
+# Метрики /metrics: HTTP-запросы по маршрутам и SQL-запросы на запрос (с проверкой бюджета и журналом медленных).
+# Middleware добавляется последним, то есть внешним: размер ответа — после сжатия
+configure_metrics(METRICS_DIR, METRICS_FLUSH_SECONDS)
+configure_query_budget(QUERY_BUDGET_CHECK, DEFAULT_QUERY_BUDGET)
+configure_heavy_reports(HEAVY_REPORT_CONCURRENCY, HEAVY_REPORT_QUEUE, HEAVY_REPORT_QUEUE_TIMEOUT, HEAVY_REPORT_RETRY_AFTER)
+configure_slow_queries(SLOW_QUERY_MS, SLOW_QUERY_LOG, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS)
+# Движки баз филиалов создаются при первом запросе филиала; метрики SQL подключаются к каждому
+on_engine_created(instrument_engine)
+
+# Филиал запроса (заголовок X-Tenant или поддомен) выбирает базу; внутри MetricsMiddleware — ответ 404 на
+# неизвестный филиал тоже учитывается в метриках
+app.add_middleware(TenantMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# Обслуживание файлов SQLite в тихие часы (ANALYZE, incremental vacuum, checkpoint WAL); размер файлов — в /metrics
+sqlite_tenants = [tenant for tenant in tenants.values() if tenant.hot_path is not None]
+if sqlite_tenants:
+    configure_maintenance(MAINTENANCE_WINDOW, MAINTENANCE_STATE_PATH, MAINTENANCE_CHECK_SECONDS, MAINTENANCE_VACUUM_PAGES)
+    # Движки филиалов создаются лениво, при первом запросе или обслуживании: метрики читают размер из файлов
+    for tenant in sqlite_tenants:
+        metrics_registry.add_collector(maintenance_collector(tenant.hot_path, tenant.label))
+
+    @app.on_event("startup")
+    def start_maintenance():
+        # Поток проверки расписания в каждом воркере; обслуживание выполняет тот, кто захватит блокировку
+        start_maintenance_scheduler({tenant.label: (lambda tenant=tenant: tenant.engine) for tenant in sqlite_tenants})
+
+    # Резервные копии без остановки приложения (backup.py из cron или POST /api/admin/backups); последняя — в /metrics
+    configure_backup(BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP,
+                     BACKUP_MAX_RESTARTS)
+    metrics_registry.add_collector(backup_collector({tenant.label: tenant.hot_path for tenant in sqlite_tenants}))
+
+# Сборка статических файлов: имена с хэшем содержимого, сжатые варианты, долгое кэширование
+asset_manifest = build_assets(STATIC_DIR, STATIC_BUILD_DIR)
+app.mount(ASSETS_URL_PREFIX, AssetStaticFiles(directory=STATIC_BUILD_DIR), name="assets")
+
+# Подключение статических файлов (старые пути без хэша)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/css", StaticFiles(directory="static/css"), name="css")
 app.mount("/js", StaticFiles(directory="static/js"), name="js")
 
-# Загрузка шаблонов
-templates = Jinja2Templates(directory="templates")
+# Загрузка шаблонов (время рендеринга идет в Server-Timing); asset_url() возвращает URL файла с хэшем
+templates = TimedTemplates(directory="templates")
+templates.env.globals["asset_url"] = asset_url_factory(asset_manifest)
 
 # Подключение роутеров
 app.include_router(employee_router)
@@ -55,17 +125,12 @@ app.include_router(service_router)
 app.include_router(order_router)
 app.include_router(finance_router)
 app.include_router(export_router)
+app.include_router(metrics_router)
+app.include_router(profiles_router)
+app.include_router(admin_router)
+app.include_router(rollup_router)
 
-# Инициализация базы данных при запуске
-@app.on_event("startup")
-async def startup_event():
-    """
-    Инициализация базы данных при запуске приложения.
-    """
-    logger.info(f"Инициализация базы данных {APP_NAME}")
-    init_db()
-    fill_initial_data()
-    logger.info(f"База данных {APP_NAME} инициализирована")
+# База данных готовится однократно командой `python migrate.py`, а не при запуске каждого воркера
 
 # Главная страница (дашборд)
 @app.get("/", response_class=HTMLResponse)
@@ -134,4 +199,7 @@ async def salary_page(request: Request, db: Session = Depends(get_db)):
 # Запуск приложения (при запуске скрипта напрямую)
 if __name__ == "__main__":
     import uvicorn
+    from migrate import migrate
+    
+    migrate()
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Перенос старых закрытых заказов в архив (services.archive_service).
+
+Запускается по расписанию (например, раз в месяц из cron) на работающей базе:
+    python archive.py                        # старше ARCHIVE_HORIZON_MONTHS месяцев
+    python archive.py --before 2024-01-01
+    python archive.py --tenant spb           # база филиала (по умолчанию DEFAULT_TENANT)
+Перенос идет короткими транзакциями по --batch-size заказов, поэтому
+приложение продолжает работать.
+"""
+import argparse
+import logging
+from datetime import date
+
+from config import APP_NAME, ARCHIVE_HORIZON_MONTHS, ARCHIVE_BATCH_SIZE, DEFAULT_TENANT
+from core.tenancy import tenant_scope
+from database import SessionLocal, tenants
+from services import ArchiveService
+
+logger = logging.getLogger(APP_NAME)
+
+def default_before(months: int = ARCHIVE_HORIZON_MONTHS) -> str:
+    """
+    Первое число месяца months месяцев назад: месяцы архивируются целиком.
+    """
+    today = date.today()
+    month_index = today.year * 12 + today.month - 1 - months
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}-01"
+
+def archive(before: str, batch_size: int):
+    db = SessionLocal()
+    try:
+        result = ArchiveService.archive_closed_orders(db, before, batch_size)
+    finally:
+        db.close()
+    if "error" in result:
+        raise SystemExit(result["error"])
+    logger.info(
+        f"Архив {result['archive_path']}: до {result['before']} перенесено заказов {result['orders']} "
+        f"(услуг {result['order_services']}, монтажников {result['order_employees']}), "
+        f"выплат {result['payments']}, транзакций {result['transactions']} за {result['seconds']} с"
+    )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Перенос старых закрытых заказов в архив")
+    parser.add_argument("--before", default=default_before(), help="граница архива, YYYY-MM-DD")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--tenant", choices=list(tenants), default=DEFAULT_TENANT, required=DEFAULT_TENANT is None,
+                        help="филиал")
+    args = parser.parse_args()
+    with tenant_scope(args.tenant):
+        archive(args.before, args.batch_size)
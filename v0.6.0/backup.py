@@ -0,0 +1,83 @@
+"""
+Резервные копии базы без остановки приложения (core.backup).
+
+Снятие копии — по расписанию, например из cron раз в сутки:
+    python backup.py create                  # способ BACKUP_METHOD, хранятся BACKUP_KEEP наборов каждой базы
+    python backup.py --tenant spb create     # только база филиала (по умолчанию базы всех филиалов)
+    python backup.py create --method vacuum
+    python backup.py list
+    python backup.py verify aircon_crm-20261019-030000
+Восстановление заменяет содержимое базы и архива; текущее состояние перед
+этим сохраняется копией с меткой pre-restore:
+    python backup.py restore aircon_crm-20261019-030000
+    python backup.py --tenant spb restore aircon_crm_spb-20261019-030000
+После восстановления перезапустите приложение: кэши справочников и отчетов
+держат прежние данные.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+
+from config import (
+    APP_NAME, BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP,
+    BACKUP_MAX_RESTARTS, DEFAULT_TENANT
+)
+from core import BackupError, configure_backup, create_backup, verify_backup, restore_backup, list_backups
+from database import tenants
+
+logger = logging.getLogger(APP_NAME)
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервные копии базы без остановки приложения")
+    parser.add_argument("--tenant", choices=list(tenants), help="база филиала (по умолчанию все филиалы)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create_parser = commands.add_parser("create", help="снять копию базы и архива")
+    create_parser.add_argument("--method", choices=["auto", "backup", "vacuum"], default=BACKUP_METHOD)
+    commands.add_parser("list", help="хранимые наборы копий")
+    verify_parser = commands.add_parser("verify", help="проверить контрольные суммы и целостность набора")
+    verify_parser.add_argument("name")
+    restore_parser = commands.add_parser("restore", help="восстановить базу и архив из набора")
+    restore_parser.add_argument("name")
+    restore_parser.add_argument("--no-safety-copy", action="store_true",
+                                help="не сохранять текущее состояние перед восстановлением")
+    args = parser.parse_args()
+
+    selected = [tenants[args.tenant]] if args.tenant else list(tenants.values())
+    if any(tenant.hot_path is None for tenant in selected):
+        raise SystemExit("Резервные копии поддерживаются только для базы SQLite в файле")
+    configure_backup(BACKUP_DIR, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_METHOD, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP,
+                     BACKUP_MAX_RESTARTS)
+    try:
+        if args.command == "create":
+            for tenant in selected:
+                if not os.path.exists(tenant.hot_path):
+                    raise SystemExit(f"База {tenant.hot_path} не найдена")
+            result = [create_backup(tenant.hot_path, tenant.archive_path, method=args.method) for tenant in selected]
+            if len(result) == 1:
+                result = result[0]
+        elif args.command == "list":
+            result = [
+                {"name": manifest["name"], "created_at": manifest["created_at"],
+                 "size": sum(item["size"] for item in manifest["files"]),
+                 "files": [item["role"] for item in manifest["files"]]}
+                for manifest in list_backups(tenants[args.tenant].hot_path if args.tenant else None)
+            ]
+        elif args.command == "verify":
+            result = verify_backup(args.name, tenants[args.tenant].hot_path if args.tenant else None)
+        else:
+            # Восстановление заменяет базу одного филиала: он должен быть указан явно или по умолчанию
+            name = args.tenant or DEFAULT_TENANT
+            if name is None:
+                raise SystemExit("Укажите филиал: --tenant")
+            tenant = tenants[name]
+            result = restore_backup(args.name, tenant.hot_path, tenant.archive_path,
+                                    safety_copy=not args.no_safety_copy)
+    except (BackupError, sqlite3.Error) as e:
+        raise SystemExit(f"Ошибка: {e}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -10,14 +10,105 @@ BASE_DIR = Path(__file__).resolve().parent
 # Директория базы данных
 DATABASE_DIR = BASE_DIR
 
-# URL базы данных
-DATABASE_URL = f"sqlite:///{DATABASE_DIR}/aircon_crm.db"
+# URL базы данных (в Docker задается переменной окружения DATABASE_URL)
+DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite:///{DATABASE_DIR}/aircon_crm.db")
+
+# Филиалы (core.tenancy): у каждого своя база. TENANTS — коды филиалов через запятую ("msk,spb"); без них
+# филиал один (SINGLE_TENANT) с базой DATABASE_URL. URL базы филиала — TENANT_DATABASE_URL с подстановкой {tenant}.
+# Филиал запроса — заголовок TENANT_HEADER или поддомен (spb.crm.example.ru), иначе DEFAULT_TENANT.
+# Движок базы филиала создается при первом обращении, в пуле до TENANT_POOL_SIZE соединений.
+# Сводные отчеты по всем филиалам (/api/rollup) считаются параллельно в ROLLUP_WORKERS потоках
+SINGLE_TENANT = "default"
+TENANTS = [name.strip().lower() for name in os.environ.get("TENANTS", "").split(",") if name.strip()]
+TENANT_DATABASE_URL = os.environ.get("TENANT_DATABASE_URL", f"sqlite:///{DATABASE_DIR}/aircon_crm_{{tenant}}.db")
+TENANT_HEADER = os.environ.get("TENANT_HEADER", "X-Tenant")
+DEFAULT_TENANT = os.environ.get("DEFAULT_TENANT") or (None if TENANTS else SINGLE_TENANT)
+TENANT_POOL_SIZE = int(os.environ.get("TENANT_POOL_SIZE", 5))
+ROLLUP_WORKERS = int(os.environ.get("ROLLUP_WORKERS", 4))
+
+# Архив закрытых заказов (services.archive_service, python archive.py): завершенные и отмененные заказы старше
+# ARCHIVE_HORIZON_MONTHS месяцев со строками, выплаты и транзакции переносятся в отдельный файл SQLite.
+# По умолчанию файл лежит рядом с основной базой: aircon_crm.db -> aircon_crm_archive.db
+ARCHIVE_DATABASE_PATH = os.environ.get("ARCHIVE_DATABASE_PATH")
+ARCHIVE_HORIZON_MONTHS = int(os.environ.get("ARCHIVE_HORIZON_MONTHS", 24))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 1000))
+
+# Обслуживание базы (core.maintenance): раз в сутки в окно тихих часов MAINTENANCE_WINDOW (местное время,
+# "03:00-05:00"; пустое значение отключает) — ANALYZE/PRAGMA optimize, incremental vacuum шагами по
+# MAINTENANCE_VACUUM_PAGES страниц и checkpoint WAL. Итоги последнего запуска — в MAINTENANCE_STATE_PATH
+MAINTENANCE_WINDOW = os.environ.get("MAINTENANCE_WINDOW", "03:00-05:00")
+MAINTENANCE_CHECK_SECONDS = float(os.environ.get("MAINTENANCE_CHECK_SECONDS", 300))
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get("MAINTENANCE_VACUUM_PAGES", 2000))
+MAINTENANCE_STATE_PATH = Path(os.environ.get("MAINTENANCE_STATE_PATH", BASE_DIR / "logs" / "maintenance.json"))
+
+# Резервные копии (core.backup, backup.py): снимок работающей базы и архива средствами SQLite (BACKUP_METHOD:
+# auto — VACUUM INTO для WAL, иначе backup API шагами по BACKUP_PAGES_PER_STEP страниц), проверка целостности,
+# gzip и SHA-256 в манифесте. В BACKUP_DIR хранятся BACKUP_KEEP последних наборов
+BACKUP_DIR = Path(os.environ.get("BACKUP_DIR", BASE_DIR / "backups"))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", 14))
+BACKUP_COMPRESS = os.environ.get("BACKUP_COMPRESS", "1") == "1"
+BACKUP_METHOD = os.environ.get("BACKUP_METHOD", "auto")
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", 256))
+BACKUP_STEP_SLEEP = float(os.environ.get("BACKUP_STEP_SLEEP", 0.005))
+BACKUP_MAX_RESTARTS = int(os.environ.get("BACKUP_MAX_RESTARTS", 20))
 
 # Настройки приложения
 APP_NAME = "Кондиционеры CRM"
 APP_VERSION = "1.0.0"
 DEBUG = True
 
+# Статические файлы и каталог их сборки (копии с хэшем в имени и сжатые варианты)
+STATIC_DIR = BASE_DIR / "static"
+STATIC_BUILD_DIR = Path(os.environ.get("STATIC_BUILD_DIR", BASE_DIR / "static_build"))
+
+# Сжатие ответов API: ответы меньше этого размера (в байтах) отдаются без сжатия
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 1024))
+
+# Метрики /metrics: при нескольких воркерах (gunicorn) каждый сбрасывает свои значения
+# в METRICS_DIR раз в METRICS_FLUSH_SECONDS, /metrics их суммирует. Без каталога — метрики одного процесса
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 5))
+
+# Бюджет SQL-запросов на HTTP-запрос (core.query_budget): превышения и N+1 пишутся в лог.
+# Эндпоинт без @query_budget(n) получает DEFAULT_QUERY_BUDGET. Проверка запоминает каждый запрос,
+# поэтому по умолчанию выключена; включается QUERY_BUDGET_CHECK=1 (benchmarks/query_budgets.py)
+QUERY_BUDGET_CHECK = os.environ.get("QUERY_BUDGET_CHECK", "0") == "1"
+DEFAULT_QUERY_BUDGET = int(os.environ.get("DEFAULT_QUERY_BUDGET", 20))
+
+# Тяжелые отчеты (core.heavy_reports): одинаковые запросы в работе объединяются, одновременно считается не больше
+# HEAVY_REPORT_CONCURRENCY отчетов эндпоинта, очередь — до HEAVY_REPORT_QUEUE запросов и HEAVY_REPORT_QUEUE_TIMEOUT
+# секунд ожидания, сверх этого — 503 с Retry-After: HEAVY_REPORT_RETRY_AFTER
+HEAVY_REPORT_CONCURRENCY = int(os.environ.get("HEAVY_REPORT_CONCURRENCY", 2))
+HEAVY_REPORT_QUEUE = int(os.environ.get("HEAVY_REPORT_QUEUE", 8))
+HEAVY_REPORT_QUEUE_TIMEOUT = float(os.environ.get("HEAVY_REPORT_QUEUE_TIMEOUT", 30))
+HEAVY_REPORT_RETRY_AFTER = int(os.environ.get("HEAVY_REPORT_RETRY_AFTER", 5))
+
+# Заголовок Server-Timing (core.server_timing): время SQL, рендеринга шаблонов, сериализации и Python на запрос
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+
+# Журнал медленных SQL-запросов (core.slow_queries): запросы дольше SLOW_QUERY_MS с планом EXPLAIN QUERY PLAN
+# пишутся в ротируемый файл SLOW_QUERY_LOG; 0 отключает журнал. Сводка по формам — /api/admin/slow-queries
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))
+SLOW_QUERY_LOG = Path(os.environ.get("SLOW_QUERY_LOG", BASE_DIR / "logs" / "slow_queries.log"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", 5))
+
+# Профилирование запроса по требованию (core.profiling): запрос с заголовком X-Profile-Token
+# (или ?profile=) со значением PROFILE_TOKEN сохраняет flamegraph и список SQL в PROFILE_DIR.
+# Без токена профилирование выключено
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", BASE_DIR / "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.001))
+
+# Служебные эндпоинты /api/admin/* (core.admin_auth): только с заголовком X-Admin-Token со значением
+# ADMIN_TOKEN. Без токена они выключены
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Фоновые задачи экспорта: каталог готовых файлов, срок их хранения и число потоков
+EXPORT_JOBS_DIR = Path(os.environ.get("EXPORT_JOBS_DIR", BASE_DIR / "export_jobs"))
+EXPORT_JOB_TTL_SECONDS = int(os.environ.get("EXPORT_JOB_TTL_SECONDS", 24 * 60 * 60))
+EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS", 2))
+
 # Настройки бизнес-логики
 MANAGER_BASE_SALARY = 30000  # Базовая зарплата менеджера
 MANAGER_ORDER_COMMISSION = 250  # Комиссия менеджера за заказ
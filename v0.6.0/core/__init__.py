@@ -0,0 +1,26 @@
+"""
+Инициализация инфраструктурных модулей приложения.
+"""
+from .assets import build_assets, asset_url_factory, AssetStaticFiles, ASSETS_URL_PREFIX
+from .compression import CompressionMiddleware
+from .responses import APIResponse
+from .rows import fetch_rows
+from .metrics import (
+    MetricsMiddleware, configure_metrics, instrument_engine, record_cache, reset_metrics_dir, process_alive,
+    registry as metrics_registry
+)
+from .profiling import (
+    ProfilingMiddleware, configure_profiling, check_profile_token, profile_path, PROFILES_URL_PREFIX
+)
+from .query_budget import configure_query_budget, query_budget, query_budget_violations
+from .slow_queries import configure_slow_queries, top_statements
+from .heavy_reports import configure_heavy_reports, heavy_report
+from .server_timing import ServerTimingMiddleware, TimedTemplates, server_timing
+from .maintenance import (
+    configure_maintenance, start_maintenance_scheduler, run_maintenance, maintenance_collector, read_state as maintenance_state
+)
+from .backup import (
+    BackupError, configure_backup, create_backup, verify_backup, restore_backup, list_backups, backup_collector
+)
+from .tenancy import TenantMiddleware, configure_tenancy, current_tenant_name, tenant_scope
+from .admin_auth import configure_admin_auth, require_admin_token
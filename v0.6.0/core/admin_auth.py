@@ -0,0 +1,26 @@
+"""
+Доступ к служебным эндпоинтам /api/admin/*.
+
+Эндпоинты снимают и проверяют резервные копии, показывают SQL-запросы
+и состояние базы, поэтому доступны только с заголовком X-Admin-Token
+со значением ADMIN_TOKEN. Без ADMIN_TOKEN они выключены и отвечают 404,
+как будто их нет.
+"""
+import hmac
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+settings = {"token": None}
+
+def configure_admin_auth(token: Optional[str]):
+    settings["token"] = token or None
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    Зависимость роутера администратора: без токена или с неверным токеном — 404
+    (сравнение за постоянное время).
+    """
+    token = settings["token"]
+    if not token or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), token.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
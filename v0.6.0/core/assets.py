@@ -0,0 +1,121 @@
+"""
+Статические файлы с отпечатком содержимого в имени.
+
+При запуске приложения каждый файл из static/ копируется в каталог сборки
+под именем с хэшем содержимого (styles.css -> styles.3f2a9c1b04de.css),
+рядом кладутся сжатые варианты .gz и .br (если установлен пакет brotli).
+Содержимое по такому URL никогда не меняется, поэтому файлы отдаются с
+Cache-Control: immutable, а шаблоны ссылаются на них через asset_url().
+"""
+import os
+import gzip
+import uuid
+import hashlib
+from typing import Dict
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+from .metrics import record_cache
+
+ASSETS_URL_PREFIX = "/assets"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Сжимаются только текстовые форматы: картинки и шрифты уже сжаты
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".json", ".txt", ".html")
+HASH_LENGTH = 12
+
+def build_assets(source_dir: str, build_dir: str) -> Dict[str, str]:
+    """
+    Сборка статических файлов. Возвращает манифест: путь исходного файла
+    относительно source_dir -> путь файла с хэшем относительно build_dir.
+    Уже собранные файлы не пересоздаются, поэтому повторный запуск (и запуск
+    в нескольких воркерах одновременно) только пересчитывает хэши.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = {}
+    for root, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            source_path = os.path.join(root, name)
+            relative_path = os.path.relpath(source_path, source_dir).replace(os.sep, "/")
+            with open(source_path, "rb") as f:
+                content = f.read()
+
+            stem, extension = os.path.splitext(relative_path)
+            digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+            hashed_path = f"{stem}.{digest}{extension}"
+            target_path = os.path.join(build_dir, hashed_path)
+
+            _write_once(target_path, lambda: content)
+            if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+                _write_once(f"{target_path}.gz", lambda: gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write_once(f"{target_path}.br", lambda: brotli.compress(content, quality=11))
+
+            manifest[relative_path] = hashed_path
+    return manifest
+
+def asset_url_factory(manifest: Dict[str, str], fallback_prefix: str = "/static"):
+    """
+    Функция для шаблонов: asset_url("css/styles.css") -> URL файла с хэшем.
+    Файлы, которых нет в манифесте, отдаются по обычному пути.
+    """
+    def asset_url(path: str) -> str:
+        path = path.lstrip("./")
+        hashed_path = manifest.get(path)
+        if hashed_path is None:
+            return f"{fallback_prefix}/{quote(path)}"
+        return f"{ASSETS_URL_PREFIX}/{quote(hashed_path)}"
+    return asset_url
+
+class AssetStaticFiles(StaticFiles):
+    """
+    Отдача собранных файлов: сжатый вариант по Accept-Encoding
+    и Cache-Control: immutable.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in Headers(scope=scope).get("accept-encoding", "").split(",")
+        }
+
+        response = None
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            response.headers["content-encoding"] = encoding
+            break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        response.headers["vary"] = "Accept-Encoding"
+        # Ответ 304 — у браузера актуальная копия (If-None-Match совпал)
+        record_cache("assets", response.status_code == 304)
+        return response
+
+def _write_once(path: str, produce):
+    """
+    Запись файла, если его еще нет. Пишется во временный файл и переносится
+    через os.replace, чтобы параллельный воркер не увидел файл недописанным.
+    """
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(produce())
+    os.replace(tmp_path, path)
@@ -0,0 +1,369 @@
+"""
+Резервные копии файла SQLite без остановки приложения.
+
+Копировать работающую базу через cp нельзя: файл читается, пока в него
+пишут, и копия получается несогласованной (а с WAL в ней нет последних
+транзакций). Копия снимается средствами SQLite на открытой базе:
+- backup — online backup API шагами по BACKUP_PAGES_PER_STEP страниц.
+  Блокировка чтения держится только на время шага, между шагами другие
+  соединения пишут. Если база изменилась, SQLite начинает копирование
+  заново; после BACKUP_MAX_RESTARTS перезапусков копия снимается одним
+  шагом (запись ждет ее окончания);
+- vacuum — VACUUM INTO: снимок одной транзакцией чтения, которая в режиме
+  WAL не мешает писателям. Копия заодно уплотняется;
+- auto (по умолчанию) — vacuum для базы в режиме WAL, иначе backup.
+
+Каждая копия проверяется (PRAGMA integrity_check), сжимается gzip, ее
+контрольная сумма SHA-256 записывается в манифест <имя>.json. Архив
+закрытых заказов (TenantDatabase.archive_path) копируется в тот же набор.
+Манифест пишется последним, поэтому набор без манифеста считается
+незавершенным. Хранятся BACKUP_KEEP последних наборов каждой базы: копии
+баз филиалов лежат в одном каталоге, имя набора начинается с имени файла
+базы, а ротация и список считаются по базе-источнику.
+
+Восстановление (restore_backup) проверяет набор, сохраняет текущее
+состояние отдельной копией и переносит данные в файлы базы тем же backup
+API: другие соединения видят новое содержимое целиком, файл не подменяется
+под открытой базой.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BACKUP_METHODS = ("auto", "backup", "vacuum")
+# Таймаут ожидания блокировок SQLite при копировании и восстановлении, с
+BUSY_TIMEOUT = 30.0
+CHUNK_SIZE = 1024 * 1024
+# Имена наборов: <база>-<дата>-<время>[-метка][~n]; другие имена в путь к файлу не попадают
+_NAME_RE = re.compile(r"[\w-][\w.~-]*")
+
+settings: Dict[str, Any] = {
+    "backup_dir": None, "keep": 14, "compress": True, "method": "auto",
+    "pages_per_step": 256, "step_sleep": 0.005, "max_restarts": 20,
+}
+
+class BackupError(Exception):
+    """
+    Копию нельзя снять, проверить или восстановить.
+    """
+
+class _TooManyRestarts(Exception):
+    pass
+
+def configure_backup(backup_dir: Path, keep: int = 14, compress: bool = True, method: str = "auto",
+                     pages_per_step: int = 256, step_sleep: float = 0.005, max_restarts: int = 20):
+    if method not in BACKUP_METHODS:
+        raise ValueError(f"Способ копирования должен быть одним из: {', '.join(BACKUP_METHODS)}")
+    settings["backup_dir"] = Path(backup_dir)
+    settings["keep"] = keep
+    settings["compress"] = compress
+    settings["method"] = method
+    settings["pages_per_step"] = pages_per_step
+    settings["step_sleep"] = step_sleep
+    settings["max_restarts"] = max_restarts
+
+def _copy_backup_api(source: sqlite3.Connection, target: sqlite3.Connection) -> Dict[str, Any]:
+    """
+    Копирование шагами; перезапуск заметен по росту числа оставшихся страниц.
+    """
+    state = {"steps": 0, "restarts": 0, "remaining": None}
+
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > settings["max_restarts"]:
+                raise _TooManyRestarts()
+        state["remaining"] = remaining
+        # Пауза между шагами: блокировка чтения снята, писатели успевают зафиксировать транзакции
+        time.sleep(settings["step_sleep"])
+
+    try:
+        source.backup(target, pages=settings["pages_per_step"], progress=progress)
+        return {"method": "backup", "steps": state["steps"], "restarts": state["restarts"]}
+    except _TooManyRestarts:
+        source.backup(target, pages=-1)
+        return {"method": "backup", "steps": state["steps"] + 1, "restarts": state["restarts"], "single_step": True}
+
+def _snapshot(database_path: str, target_path: Path, method: str) -> Dict[str, Any]:
+    source = sqlite3.connect(database_path, timeout=BUSY_TIMEOUT)
+    try:
+        journal_mode = source.execute("PRAGMA journal_mode").fetchone()[0].lower()
+        if method == "auto":
+            method = "vacuum" if journal_mode == "wal" else "backup"
+        if method == "vacuum":
+            source.execute("VACUUM INTO ?", (str(target_path),))
+            details = {"method": "vacuum"}
+        else:
+            target = sqlite3.connect(target_path)
+            try:
+                details = _copy_backup_api(source, target)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+    # Копия — самостоятельный файл без журнала WAL рядом
+    copy = sqlite3.connect(target_path)
+    try:
+        copy.execute("PRAGMA journal_mode = DELETE")
+        integrity = copy.execute("PRAGMA integrity_check").fetchone()[0]
+        details["pages"] = copy.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        copy.close()
+    if integrity != "ok":
+        raise BackupError(f"Копия {database_path} не прошла проверку целостности: {integrity}")
+    details["source_journal_mode"] = journal_mode
+    return details
+
+def _store(source_path: Path, target_path: Path, compress: bool) -> str:
+    """
+    Перенос копии в каталог копий (со сжатием); возвращает SHA-256 сохраненного файла.
+    """
+    digest = hashlib.sha256()
+    tmp_path = target_path.with_name(target_path.name + ".tmp")
+    with open(source_path, "rb") as src, open(tmp_path, "wb") as raw:
+        out = gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=6, mtime=0) if compress else raw
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            out.write(chunk)
+        if compress:
+            out.close()
+    with open(tmp_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    os.replace(tmp_path, target_path)
+    return digest.hexdigest()
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _manifest_path(name: str) -> Path:
+    return settings["backup_dir"] / f"{name}.json"
+
+def _same_source(manifest: Dict[str, Any], database_path: str) -> bool:
+    source = next((item["source"] for item in manifest["files"] if item["role"] == "main"), None)
+    return source is not None and os.path.abspath(source) == os.path.abspath(database_path)
+
+def list_backups(database_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Завершенные наборы копий (только базы database_path, если она задана), новые первыми.
+    """
+    backup_dir = settings["backup_dir"]
+    if backup_dir is None or not backup_dir.exists():
+        return []
+    manifests = []
+    for path in backup_dir.glob("*.json"):
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError):
+            logger.warning("Поврежденный манифест копии %s", path)
+    if database_path is not None:
+        manifests = [manifest for manifest in manifests if _same_source(manifest, database_path)]
+    manifests.sort(key=lambda manifest: (manifest["timestamp"], manifest["name"]), reverse=True)
+    return manifests
+
+def _delete_set(manifest: Dict[str, Any]):
+    for item in manifest["files"]:
+        try:
+            (settings["backup_dir"] / item["file"]).unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        _manifest_path(manifest["name"]).unlink()
+    except FileNotFoundError:
+        pass
+
+def rotate_backups(keep: Optional[int] = None, database_path: Optional[str] = None) -> List[str]:
+    """
+    Удаление наборов сверх keep последних (базы database_path, если задана); возвращает имена удаленных.
+    """
+    keep = settings["keep"] if keep is None else keep
+    removed = []
+    for manifest in list_backups(database_path)[max(keep, 1):]:
+        _delete_set(manifest)
+        removed.append(manifest["name"])
+    return removed
+
+def create_backup(database_path: str, archive_path: Optional[str] = None, label: Optional[str] = None,
+                  method: Optional[str] = None, rotate: bool = True) -> Dict[str, Any]:
+    """
+    Набор копий: основная база и (если есть) архив. Возвращает манифест набора.
+    """
+    started = time.perf_counter()
+    backup_dir = settings["backup_dir"]
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    created_at = datetime.now()
+    name = f"{Path(database_path).stem}-{created_at.strftime('%Y%m%d-%H%M%S')}" + (f"-{label}" if label else "")
+    suffix = 2
+    while _manifest_path(name).exists():
+        name = f"{name.rsplit('~', 1)[0]}~{suffix}"
+        suffix += 1
+
+    sources = [("main", database_path)]
+    if archive_path and os.path.exists(archive_path):
+        sources.append(("archive", archive_path))
+    files = []
+    result = "error"
+    try:
+        with tempfile.TemporaryDirectory(dir=backup_dir, prefix=".tmp-") as tmp_dir:
+            for role, path in sources:
+                snapshot_path = Path(tmp_dir) / f"{role}.db"
+                snapshot_started = time.perf_counter()
+                details = _snapshot(path, snapshot_path, method or settings["method"])
+                snapshot_seconds = time.perf_counter() - snapshot_started
+                file_name = f"{name}-{role}.db" + (".gz" if settings["compress"] else "")
+                sha256 = _store(snapshot_path, backup_dir / file_name, settings["compress"])
+                files.append({
+                    "role": role, "file": file_name, "source": str(path), "sha256": sha256,
+                    "size": (backup_dir / file_name).stat().st_size, "db_size": snapshot_path.stat().st_size,
+                    "snapshot_seconds": round(snapshot_seconds, 3), "integrity": "ok", **details,
+                })
+        manifest = {
+            "name": name, "created_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp": created_at.timestamp(), "compressed": settings["compress"],
+            "seconds": round(time.perf_counter() - started, 3), "files": files,
+        }
+        tmp_manifest = _manifest_path(name).with_suffix(".json.tmp")
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_manifest, _manifest_path(name))
+        result = "ok"
+    except Exception:
+        for item in files:
+            try:
+                (backup_dir / item["file"]).unlink()
+            except FileNotFoundError:
+                pass
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe("db_backup_duration_seconds", (), seconds)
+        registry.inc("db_backups_total", (("result", result),))
+
+    manifest["removed"] = rotate_backups(database_path=database_path) if rotate else []
+    logger.info("Резервная копия %s за %.1f с: %s", name, manifest["seconds"],
+                ", ".join(f"{item['role']} {item['size']} Б ({item['method']})" for item in files))
+    return manifest
+
+def _find(name: str) -> Dict[str, Any]:
+    if not _NAME_RE.fullmatch(name):
+        raise BackupError(f"Недопустимое имя копии: {name}")
+    path = _manifest_path(name)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f"Копия {name} не найдена в {settings['backup_dir']}")
+
+def _extract(manifest: Dict[str, Any], tmp_dir: Path) -> Dict[str, Path]:
+    """
+    Проверка набора: контрольные суммы файлов и целостность распакованных баз.
+    Возвращает пути распакованных баз по ролям.
+    """
+    extracted = {}
+    for item in manifest["files"]:
+        stored = settings["backup_dir"] / item["file"]
+        if not stored.exists():
+            raise BackupError(f"Файл копии {stored} не найден")
+        if _file_sha256(stored) != item["sha256"]:
+            raise BackupError(f"Контрольная сумма {stored} не совпадает с манифестом")
+        target = tmp_dir / f"{item['role']}.db"
+        with (gzip.open(stored, "rb") if manifest.get("compressed") else open(stored, "rb")) as src, \
+                open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        conn = sqlite3.connect(target)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        if integrity != "ok":
+            raise BackupError(f"Копия {item['file']} не прошла проверку целостности: {integrity}")
+        extracted[item["role"]] = target
+    return extracted
+
+def verify_backup(name: str, database_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Проверка набора name (только набора базы database_path, если она задана: чужой набор считается ненайденным).
+    """
+    started = time.perf_counter()
+    manifest = _find(name)
+    if database_path is not None and not _same_source(manifest, database_path):
+        raise BackupError(f"Копия {name} не найдена в {settings['backup_dir']}")
+    with tempfile.TemporaryDirectory(dir=settings["backup_dir"], prefix=".tmp-") as tmp_dir:
+        extracted = _extract(manifest, Path(tmp_dir))
+    return {"name": name, "ok": True, "files": sorted(extracted), "seconds": round(time.perf_counter() - started, 3)}
+
+def restore_backup(name: str, database_path: str, archive_path: Optional[str] = None,
+                   safety_copy: bool = True) -> Dict[str, Any]:
+    """
+    Восстановление набора name в файлы базы и архива.
+
+    Перед восстановлением текущее состояние сохраняется копией с меткой
+    pre-restore. Если в наборе нет архива, текущий файл архива удаляется:
+    иначе отчеты сложили бы восстановленные строки с архивными.
+    """
+    started = time.perf_counter()
+    manifest = _find(name)
+    result: Dict[str, Any] = {"name": name, "restored": []}
+    with tempfile.TemporaryDirectory(dir=settings["backup_dir"], prefix=".tmp-") as tmp_dir:
+        extracted = _extract(manifest, Path(tmp_dir))
+        if safety_copy and os.path.exists(database_path):
+            # Без ротации: восстанавливаемый набор может оказаться самым старым
+            result["safety_copy"] = create_backup(database_path, archive_path, label="pre-restore", rotate=False)["name"]
+
+        targets = [("main", database_path)] + ([("archive", archive_path)] if archive_path else [])
+        for role, target_path in targets:
+            if role not in extracted:
+                if os.path.exists(target_path):
+                    os.remove(target_path)
+                    result["removed"] = target_path
+                continue
+            source = sqlite3.connect(extracted[role])
+            target = sqlite3.connect(target_path, timeout=BUSY_TIMEOUT)
+            try:
+                # Один шаг: целевая база заблокирована на запись до конца восстановления
+                source.backup(target, pages=-1)
+            finally:
+                target.close()
+                source.close()
+            result["restored"].append(role)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Восстановлена копия %s за %.1f с", name, result["seconds"])
+    return result
+
+def backup_collector(databases: Optional[Mapping[str, str]] = None):
+    """
+    Показания для /metrics по последнему набору копий (в том числе снятому из cron).
+    databases — пути баз по коду филиала: показания по каждой с меткой tenant.
+    """
+    def collect() -> Iterable[Tuple[str, tuple, float]]:
+        sources = {None: None} if databases is None else databases
+        for name, database_path in sources.items():
+            labels = (("tenant", name),) if name else ()
+            backups = list_backups(database_path)
+            yield "db_backup_sets", labels, len(backups)
+            if backups:
+                latest = backups[0]
+                yield "db_backup_last_success_timestamp_seconds", labels, latest["timestamp"]
+                yield "db_backup_last_size_bytes", labels, sum(item["size"] for item in latest["files"])
+
+    return collect
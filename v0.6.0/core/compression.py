@@ -0,0 +1,104 @@
+"""
+Сжатие ответов API по Accept-Encoding (brotli или gzip).
+
+Сжимаются только ответы, отданные одним блоком (JSON, HTML), не меньше
+минимального размера и текстовых типов. Потоковые выгрузки, ответы на Range
+и уже сжатые файлы (/assets) передаются как есть.
+"""
+import gzip
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+# Уровни для ответов, сжимаемых на каждый запрос: заметно быстрее максимальных при близком размере
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбор кодировки из Accept-Encoding: brotli (если установлен), затем gzip.
+    Кодировки с q=0 не используются.
+    """
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware сжатия ответов целиком, начиная с minimum_size байт.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Заголовки придерживаются до первого блока тела: только тогда известно, сжимать ли ответ
+        start_message: Optional[Message] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or start["status"] in (204, 206, 304)
+                or "content-encoding" in headers
+                or not headers.get("content-type", "").startswith(COMPRESSIBLE_CONTENT_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,162 @@
+"""
+Тяжелые отчеты: объединение одинаковых запросов и ограничение параллельности.
+
+Эндпоинт отчета помечается декоратором @heavy_report(). Для него:
+- одинаковые запросы в работе (тот же филиал, эндпоинт и параметры) объединяются:
+  отчет считает первый запрос, остальные ждут и получают тот же результат
+  (single-flight; например, дашборд за один месяц, открытый несколькими
+  менеджерами утром);
+- одновременно считается не больше HEAVY_REPORT_CONCURRENCY отчетов
+  каждого эндпоинта, следующие ждут в очереди. Если в очереди уже
+  HEAVY_REPORT_QUEUE запросов или место не освободилось за
+  HEAVY_REPORT_QUEUE_TIMEOUT секунд — ответ 503 с Retry-After.
+Синхронный эндпоинт выполняется в пуле потоков, поэтому пока считаются
+отчеты, цикл событий продолжает обслуживать остальные запросы.
+
+Общий расчет не зависит от запроса, который его начал: вместо сессий базы
+этого запроса он открывает свои (та же база, тот же класс сессии) и закрывает
+их сам, поэтому отключение первого клиента не ломает расчет остальным.
+SQL-статистика расчета (метрики, Server-Timing, бюджет запросов) ведется
+отдельно и добавляется каждому запросу, получившему результат.
+
+Учет в памяти процесса: у каждого воркера свои очереди и лимиты.
+"""
+import asyncio
+import functools
+import inspect
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import isolate_db_stats, merge_db_stats, registry
+from .tenancy import current_tenant_name
+
+settings: Dict[str, Any] = {"concurrency": 2, "queue": 8, "queue_timeout": 30.0, "retry_after": 5}
+
+# Отчеты в работе: ключ (эндпоинт и параметры) -> задача расчета
+_in_flight: Dict[tuple, asyncio.Future] = {}
+
+def configure_heavy_reports(concurrency: int, queue: int, queue_timeout: float, retry_after: int):
+    settings["concurrency"] = concurrency
+    settings["queue"] = queue
+    settings["queue_timeout"] = queue_timeout
+    settings["retry_after"] = retry_after
+
+class RouteLimiter:
+    """
+    Лимит одновременных расчетов отчета с ограниченной очередью ожидания.
+    """
+
+    def __init__(self, report: str, limit: Optional[int] = None):
+        self.report = report
+        self.limit = limit
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+
+    def reject(self, reason: str):
+        registry.inc("heavy_report_requests_total", (("report", self.report), ("result", "rejected")))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Сервер занят расчетом отчетов ({reason}), повторите запрос позже",
+            headers={"Retry-After": str(settings["retry_after"])},
+        )
+
+    async def run(self, call: Callable[[], Any]) -> Any:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit or settings["concurrency"])
+        if self.semaphore.locked() and self.waiting >= settings["queue"]:
+            self.reject("очередь заполнена")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), settings["queue_timeout"])
+        except asyncio.TimeoutError:
+            self.reject("истекло время ожидания в очереди")
+        finally:
+            self.waiting -= 1
+        registry.inc("heavy_report_requests_total", (("report", self.report), ("result", "computed")))
+        try:
+            return await call()
+        finally:
+            self.semaphore.release()
+
+def coalesce_key(endpoint: Callable, kwargs: Dict[str, Any]) -> tuple:
+    """
+    Ключ объединения: филиал, эндпоинт и параметры запроса (без сессии базы и объекта запроса).
+    Отчеты разных филиалов считаются по разным базам и не объединяются.
+    """
+    params = tuple(sorted(
+        (name, repr(value)) for name, value in kwargs.items()
+        if not isinstance(value, (Session, Request))
+    ))
+    return (current_tenant_name(), endpoint.__module__, endpoint.__qualname__, params)
+
+def detach_sessions(kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Callable[[], Session]]]:
+    """
+    Параметры эндпоинта без сессий базы запроса и фабрики сессий расчета на их место:
+    сессия того же класса на той же базе (горячей или истории), но своя.
+    """
+    params, sessions = {}, {}
+    for name, value in kwargs.items():
+        if isinstance(value, Session):
+            sessions[name] = functools.partial(type(value), bind=value.get_bind(), autoflush=False)
+        else:
+            params[name] = value
+    return params, sessions
+
+@contextmanager
+def opened_sessions(sessions: Dict[str, Callable[[], Session]]):
+    """
+    Сессии расчета на время вызова эндпоинта.
+    """
+    opened = {name: open_session() for name, open_session in sessions.items()}
+    try:
+        yield opened
+    finally:
+        for db in opened.values():
+            db.close()
+
+def heavy_report(limit: Optional[int] = None) -> Callable:
+    """
+    Декоратор эндпоинта тяжелого отчета (ставится под декоратором маршрута):
+    объединение одинаковых запросов и лимит limit одновременных расчетов
+    (по умолчанию HEAVY_REPORT_CONCURRENCY).
+    """
+    def decorator(endpoint: Callable) -> Callable:
+        report = endpoint.__qualname__
+        limiter = RouteLimiter(report, limit)
+        is_async = inspect.iscoroutinefunction(endpoint)
+
+        def call(params: Dict[str, Any], sessions: Dict[str, Callable[[], Session]]) -> Any:
+            with opened_sessions(sessions) as opened:
+                return endpoint(**params, **opened)
+
+        async def compute(params: Dict[str, Any], sessions: Dict[str, Callable[[], Session]]) -> Any:
+            stats = isolate_db_stats()
+            if is_async:
+                with opened_sessions(sessions) as opened:
+                    result = await endpoint(**params, **opened)
+            else:
+                result = await run_in_threadpool(call, params, sessions)
+            return result, stats
+
+        @functools.wraps(endpoint)
+        async def wrapper(**kwargs):
+            key = coalesce_key(endpoint, kwargs)
+            task = _in_flight.get(key)
+            if task is None:
+                params, sessions = detach_sessions(kwargs)
+                task = asyncio.ensure_future(limiter.run(lambda: compute(params, sessions)))
+                _in_flight[key] = task
+                task.add_done_callback(lambda done: _in_flight.pop(key) if _in_flight.get(key) is done else None)
+            else:
+                registry.inc("heavy_report_requests_total", (("report", report), ("result", "coalesced")))
+            # shield: отмена одного из ожидающих запросов не прерывает общий расчет
+            result, stats = await asyncio.shield(task)
+            merge_db_stats(stats)
+            return result
+
+        return wrapper
+    return decorator
@@ -0,0 +1,315 @@
+"""
+Обслуживание файла SQLite по расписанию.
+
+Удаления и обновления (update_order пересоздает строки услуг заказа,
+delete_order и архивация удаляют строки) оставляют в файле свободные
+страницы, а статистика планировщика (sqlite_stat1) без ANALYZE не
+обновляется. Раз в сутки в тихие часы MAINTENANCE_WINDOW фоновый поток
+воркера выполняет:
+- analyze — ANALYZE при отсутствии статистики, иначе PRAGMA optimize
+  (пересчет только тех таблиц, где статистика устарела);
+- vacuum — PRAGMA incremental_vacuum шагами по MAINTENANCE_VACUUM_PAGES
+  страниц, чтобы не держать блокировку записи долго. Файл без
+  auto_vacuum=INCREMENTAL один раз переводится в этот режим полным VACUUM;
+- checkpoint — PRAGMA wal_checkpoint(TRUNCATE), если база в режиме WAL.
+
+Из нескольких воркеров обслуживание выполняет один: захват — файл
+блокировки рядом с файлом состояния. Итоги последнего запуска (страницы
+до и после, длительности шагов) хранятся в MAINTENANCE_STATE_PATH и видны
+в /api/admin/maintenance. Метрики: длительность шагов, запуски по
+результату, освобожденные страницы; размер файла и время последнего
+успешного обслуживания читаются при каждом запросе /metrics.
+
+У каждого филиала своя база: обслуживается каждая по очереди, состояние
+и блокировка — отдельные файлы с кодом филиала в имени
+(maintenance-spb.json), в метриках — метка tenant.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Повторное обслуживание не раньше чем через столько секунд после успешного
+MAINTENANCE_MIN_INTERVAL = 12 * 60 * 60
+# Блокировка старше этого считается оставшейся от прерванного процесса
+MAINTENANCE_LOCK_TIMEOUT = 60 * 60
+# Лимит строк на индекс для ANALYZE: статистика по выборке, а не по всей таблице
+ANALYSIS_LIMIT = 1000
+
+settings: Dict[str, Any] = {
+    "window": None, "check_seconds": 300.0, "vacuum_pages": 2000, "state_path": None,
+}
+
+_scheduler_pid: Optional[int] = None
+
+def parse_window(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Окно "03:00-05:00" в минутах от полуночи; окно может переходить через полночь.
+    Пустая строка отключает обслуживание по расписанию.
+    """
+    if not value:
+        return None
+    start, end = value.split("-")
+    minutes = []
+    for part in (start, end):
+        hours, mins = part.strip().split(":")
+        minutes.append(int(hours) * 60 + int(mins))
+    return minutes[0], minutes[1]
+
+def configure_maintenance(window: Optional[str], state_path: Path, check_seconds: float = 300.0,
+                          vacuum_pages: int = 2000):
+    settings["window"] = parse_window(window)
+    settings["state_path"] = Path(state_path)
+    settings["check_seconds"] = check_seconds
+    settings["vacuum_pages"] = vacuum_pages
+
+def in_window(now: datetime, window: Tuple[int, int]) -> bool:
+    minute = now.hour * 60 + now.minute
+    start, end = window
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+def state_path(name: Optional[str] = None) -> Path:
+    """
+    Файл состояния базы филиала name; None — единственная база (MAINTENANCE_STATE_PATH как есть).
+    """
+    path = settings["state_path"]
+    return path if name is None else path.with_name(f"{path.stem}-{name}{path.suffix}")
+
+def read_state(name: Optional[str] = None) -> Dict[str, Any]:
+    try:
+        with open(state_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_state(state: Dict[str, Any], name: Optional[str] = None):
+    path = state_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _acquire_lock(name: Optional[str] = None) -> Optional[Path]:
+    """
+    Файл блокировки создается атомарно (O_EXCL); оставшийся от упавшего процесса снимается по возрасту.
+    """
+    lock_path = state_path(name).with_suffix(".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime < MAINTENANCE_LOCK_TIMEOUT:
+                    return None
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return lock_path
+    return None
+
+def file_stats(cursor) -> Dict[str, Any]:
+    return {
+        "page_size": cursor.execute("PRAGMA page_size").fetchone()[0],
+        "page_count": cursor.execute("PRAGMA page_count").fetchone()[0],
+        "freelist_count": cursor.execute("PRAGMA freelist_count").fetchone()[0],
+        "auto_vacuum": cursor.execute("PRAGMA auto_vacuum").fetchone()[0],
+        "journal_mode": cursor.execute("PRAGMA journal_mode").fetchone()[0],
+    }
+
+def _analyze(cursor) -> Dict[str, Any]:
+    has_stats = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    cursor.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    if has_stats:
+        # 0x10002: проверить все таблицы, а не только прочитанные этим соединением
+        cursor.execute("PRAGMA optimize = 0x10002").fetchall()
+        return {"mode": "optimize"}
+    cursor.execute("ANALYZE")
+    return {"mode": "analyze"}
+
+def _vacuum(cursor, vacuum_pages: int) -> Dict[str, Any]:
+    pages = cursor.execute("PRAGMA page_count").fetchone()[0]
+    if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Режим auto_vacuum меняется только полным VACUUM; выполняется один раз
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+        mode = "full"
+    else:
+        # Короткие шаги: между ними другие соединения успевают писать
+        mode = "incremental"
+        freelist = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        while freelist:
+            cursor.execute(f"PRAGMA incremental_vacuum({vacuum_pages})").fetchall()
+            remaining = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= freelist:
+                break
+            freelist = remaining
+    return {"mode": mode, "freed_pages": pages - cursor.execute("PRAGMA page_count").fetchone()[0]}
+
+def _checkpoint(cursor) -> Dict[str, Any]:
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        return {"mode": "skipped"}
+    busy, log_frames, checkpointed = cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"mode": "truncate", "busy": busy, "log_frames": log_frames, "checkpointed_frames": checkpointed}
+
+def run_maintenance(engine, name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Обслуживание базы движка engine (филиала name): шаги analyze, vacuum, checkpoint.
+    Ошибка шага (например, база занята дольше таймаута) не прерывает остальные.
+    Возвращает итоги запуска; они же сохраняются в файл состояния.
+    """
+    started_at = time.time()
+    tenant_labels = (("tenant", name),) if name else ()
+    result: Dict[str, Any] = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "tasks": {}}
+    connection = engine.raw_connection()
+    # Без неявных транзакций драйвера: VACUUM внутри транзакции невозможен
+    dbapi_connection = connection.dbapi_connection
+    isolation_level = dbapi_connection.isolation_level
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    try:
+        result["before"] = file_stats(cursor)
+        steps = (
+            ("analyze", lambda: _analyze(cursor)),
+            ("vacuum", lambda: _vacuum(cursor, settings["vacuum_pages"])),
+            ("checkpoint", lambda: _checkpoint(cursor)),
+        )
+        for task, step in steps:
+            task_started = time.perf_counter()
+            try:
+                details = step()
+                status = "ok"
+            except Exception as e:
+                logger.warning("Обслуживание базы: шаг %s не выполнен: %s", task, e)
+                details, status = {"error": str(e)}, "error"
+            seconds = time.perf_counter() - task_started
+            result["tasks"][task] = {"result": status, "seconds": round(seconds, 3), **details}
+            registry.observe("db_maintenance_duration_seconds", (("task", task),) + tenant_labels, seconds)
+            registry.inc("db_maintenance_runs_total", (("task", task), ("result", status)) + tenant_labels)
+            if details.get("freed_pages"):
+                registry.inc("db_maintenance_freed_pages_total", tenant_labels, details["freed_pages"])
+        result["after"] = file_stats(cursor)
+    finally:
+        cursor.close()
+        dbapi_connection.isolation_level = isolation_level
+        connection.close()
+
+    result["seconds"] = round(time.time() - started_at, 3)
+    result["ok"] = all(task["result"] == "ok" for task in result["tasks"].values())
+    state = read_state(name)
+    state["last_run"] = result
+    if result["ok"]:
+        state["last_success"] = started_at
+    write_state(state, name)
+    logger.info(
+        "Обслуживание базы%s за %.1f с: страниц %s -> %s, свободных %s -> %s",
+        f" филиала {name}" if name else "", result["seconds"], result["before"]["page_count"], result["after"]["page_count"],
+        result["before"]["freelist_count"], result["after"]["freelist_count"],
+    )
+    return result
+
+def maintenance_due(now: Optional[datetime] = None, name: Optional[str] = None) -> bool:
+    """
+    Пора ли обслуживать: идет окно тихих часов и успешного запуска не было MAINTENANCE_MIN_INTERVAL.
+    """
+    window = settings["window"]
+    if window is None or not in_window(now or datetime.now(), window):
+        return False
+    last_success = read_state(name).get("last_success")
+    return last_success is None or time.time() - last_success >= MAINTENANCE_MIN_INTERVAL
+
+def run_if_due(get_engine: Callable[[], Any], name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    if not maintenance_due(name=name):
+        return None
+    lock_path = _acquire_lock(name)
+    if lock_path is None:
+        return None
+    try:
+        # Другой воркер мог закончить обслуживание, пока этот ждал блокировку
+        if not maintenance_due(name=name):
+            return None
+        return run_maintenance(get_engine(), name)
+    finally:
+        try:
+            lock_path.unlink()
+        except FileNotFoundError:
+            pass
+
+def start_maintenance_scheduler(engines: Mapping[Optional[str], Callable[[], Any]]):
+    """
+    Фоновый поток проверки расписания раз в MAINTENANCE_CHECK_SECONDS, один на процесс
+    (запускается при старте каждого воркера, после fork). engines — функции, возвращающие
+    движок, по коду филиала (None — единственная база): движок создается только тогда,
+    когда базу пора обслуживать. Базы обслуживаются по очереди.
+    """
+    global _scheduler_pid
+    if settings["window"] is None or _scheduler_pid == os.getpid():
+        return
+    _scheduler_pid = os.getpid()
+
+    def scheduler_loop():
+        while True:
+            time.sleep(settings["check_seconds"])
+            for name, get_engine in engines.items():
+                try:
+                    run_if_due(get_engine, name)
+                except Exception:
+                    logger.exception("Ошибка обслуживания базы%s", f" филиала {name}" if name else "")
+
+    threading.Thread(target=scheduler_loop, name="db-maintenance", daemon=True).start()
+
+def database_file_pages(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Размер страницы, число страниц и свободных страниц по файлу SQLite без
+    соединения с базой: число страниц — размер файла, остальное — из заголовка.
+    Страницы в WAL до контрольной точки не учитываются. None, если файла нет или это не база SQLite.
+    """
+    try:
+        with open(path, "rb") as database_file:
+            header = database_file.read(100)
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if len(header) < 100 or not header.startswith(b"SQLite format 3\x00"):
+        return None
+    page_size = int.from_bytes(header[16:18], "big")
+    if page_size == 1:
+        page_size = 65536
+    return page_size, size // page_size, int.from_bytes(header[36:40], "big")
+
+def maintenance_collector(path: str, name: Optional[str] = None):
+    """
+    Показания для /metrics, читаемые в момент запроса: размер файла базы path (филиала name) и время
+    последнего успешного обслуживания (одинаковы для всех воркеров, поэтому не суммируются).
+    Размер берется из файла, а не через соединение: сбор метрик не создает движки филиалов.
+    """
+    tenant_labels = (("tenant", name),) if name else ()
+
+    def collect() -> Iterable[Tuple[str, tuple, float]]:
+        pages = database_file_pages(path)
+        if pages is not None:
+            page_size, page_count, freelist = pages
+            yield "db_pages", (("kind", "total"),) + tenant_labels, page_count
+            yield "db_pages", (("kind", "free"),) + tenant_labels, freelist
+            yield "db_page_size_bytes", tenant_labels, page_size
+        last_success = read_state(name).get("last_success")
+        if last_success is not None:
+            yield "db_maintenance_last_success_timestamp_seconds", tenant_labels, last_success
+
+    return collect
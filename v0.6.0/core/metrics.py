@@ -0,0 +1,404 @@
+"""
+Метрики приложения в текстовом формате Prometheus (эндпоинт /metrics).
+
+Собираются без внешних зависимостей:
+- MetricsMiddleware — число запросов, длительность, запросы в работе и
+  размер ответа по шаблону маршрута (/api/orders/{order_id}, а не по URL);
+- instrument_engine — события SQLAlchemy: число SQL-запросов и время в базе
+  на один HTTP-запрос;
+- record_cache — попадания и промахи кэшей;
+- add_collector — показания, читаемые в момент запроса /metrics (размер
+  файла базы из core.maintenance, последняя копия из core.backup).
+Каждый SQL-запрос также передается в core.slow_queries (сводка по формам
+запросов и журнал медленных запросов); сводка входит в снимок воркера.
+
+Каждый воркер считает в памяти. Если задан METRICS_DIR (gunicorn с несколькими
+воркерами), фоновый поток воркера раз в METRICS_FLUSH_SECONDS атомарно
+сбрасывает его снимок в файл worker-<pid>.json, а /metrics складывает снимки
+всех воркеров: счетчики и гистограммы суммируются (в том числе перезапущенных
+воркеров), показания gauge берутся только у живых процессов.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .query_budget import check_query_budget, query_budget_enabled, record_statement
+from .slow_queries import record_query, statements_snapshot
+
+# Имя, тип, описание и границы корзин (для гистограмм) каждой метрики
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+MAINTENANCE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+METRICS = {
+    "http_requests_total": ("counter", "Число HTTP-запросов", None),
+    "http_request_duration_seconds": ("histogram", "Длительность HTTP-запроса, с", LATENCY_BUCKETS),
+    "http_requests_in_progress": ("gauge", "HTTP-запросы в работе", None),
+    "http_response_size_bytes": ("histogram", "Размер тела ответа (после сжатия), байт", SIZE_BUCKETS),
+    "db_queries_per_request": ("histogram", "Число SQL-запросов на HTTP-запрос", QUERY_COUNT_BUCKETS),
+    "db_query_seconds_per_request": ("histogram", "Суммарное время SQL-запросов на HTTP-запрос, с", LATENCY_BUCKETS),
+    "db_queries_total": ("counter", "Число SQL-запросов", None),
+    "cache_requests_total": ("counter", "Обращения к кэшам по результату (hit/miss)", None),
+    "heavy_report_requests_total": ("counter", "Запросы тяжелых отчетов: рассчитан, объединен с таким же, отклонен (503)", None),
+    "db_maintenance_duration_seconds": ("histogram", "Длительность шагов обслуживания базы, с", MAINTENANCE_BUCKETS),
+    "db_maintenance_runs_total": ("counter", "Шаги обслуживания базы по результату (ok/error)", None),
+    "db_maintenance_freed_pages_total": ("counter", "Страницы, возвращенные файловой системе очисткой базы", None),
+    "db_maintenance_last_success_timestamp_seconds": ("gauge", "Время последнего успешного обслуживания базы (unix)", None),
+    "db_backup_duration_seconds": ("histogram", "Длительность снятия резервной копии базы, с", MAINTENANCE_BUCKETS),
+    "db_backups_total": ("counter", "Резервные копии по результату (ok/error)", None),
+    "db_backup_sets": ("gauge", "Число хранимых наборов резервных копий", None),
+    "db_backup_last_success_timestamp_seconds": ("gauge", "Время последней резервной копии (unix)", None),
+    "db_backup_last_size_bytes": ("gauge", "Размер последнего набора резервных копий (сжатого), байт", None),
+    "db_pages": ("gauge", "Страницы файла базы: всего (total) и свободные (free)", None),
+    "db_page_size_bytes": ("gauge", "Размер страницы базы, байт", None),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class MetricsRegistry:
+    """
+    Значения метрик одного процесса. Обновляются из цикла событий и из
+    потоков пула (синхронные эндпоинты), поэтому под блокировкой.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_seconds: float = 5.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_seconds = flush_seconds
+        self.values: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self.lock = threading.Lock()
+        self.flusher_pid: Optional[int] = None
+        # Функции, возвращающие показания в момент запроса /metrics: [(имя, метки, значение)]
+        self.collectors: List[Callable[[], Iterable[Tuple[str, Labels, float]]]] = []
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1.0):
+        with self.lock:
+            key = (name, labels)
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Labels, value: float):
+        buckets = METRICS[name][2]
+        with self.lock:
+            key = (name, labels)
+            # Счетчики по корзинам (последняя — +Inf), затем сумма и количество
+            state = self.histograms.get(key)
+            if state is None:
+                state = self.histograms[key] = [0.0] * (len(buckets) + 3)
+            state[bisect_left(buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "values": [[name, list(labels), value] for (name, labels), value in self.values.items()],
+                "histograms": [[name, list(labels), state[:]] for (name, labels), state in self.histograms.items()],
+                "statements": statements_snapshot(),
+            }
+
+    def flush(self):
+        """
+        Сброс снимка в METRICS_DIR: запись во временный файл и os.replace,
+        чтобы читатель не увидел файл наполовину.
+        """
+        path = self.directory / f"worker-{os.getpid()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json.dumps(self.snapshot()))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def start_flusher(self):
+        """
+        Фоновый поток сброса раз в flush_seconds. Запускается при первом
+        запросе в каждом процессе (после fork воркера gunicorn).
+        """
+        if self.directory is None or self.flusher_pid == os.getpid():
+            return
+        self.flusher_pid = os.getpid()
+
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_seconds)
+                self.flush()
+
+        threading.Thread(target=flush_loop, name="metrics-flush", daemon=True).start()
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, Labels, float]]]):
+        """
+        Показания, общие для всех воркеров (например, размер файла базы): читаются
+        процессом, отвечающим на /metrics, и не суммируются по снимкам.
+        """
+        self.collectors.append(collector)
+
+    def collect_snapshots(self) -> List[dict]:
+        """
+        Снимок текущего процесса и сохраненные снимки остальных воркеров.
+        """
+        own = self.snapshot()
+        snapshots = [own]
+        if self.directory is None or not self.directory.is_dir():
+            return snapshots
+        for path in self.directory.glob("worker-*.json"):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("pid") == own["pid"]:
+                continue
+            snapshot["alive"] = process_alive(snapshot.get("pid"))
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self) -> str:
+        """
+        Сумма снимков всех воркеров в текстовом формате Prometheus.
+        """
+        values: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        for snapshot in self.collect_snapshots():
+            for name, labels, value in snapshot["values"]:
+                if name not in METRICS:
+                    continue
+                if METRICS[name][0] == "gauge" and not snapshot.get("alive", True):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                values[key] = values.get(key, 0.0) + value
+            for name, labels, state in snapshot["histograms"]:
+                if name not in METRICS or len(state) != len(METRICS[name][2]) + 3:
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.setdefault(key, [0.0] * len(state))
+                for index, value in enumerate(state):
+                    total[index] += value
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    values[(name, labels)] = value
+            except Exception:
+                continue
+
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (metric, labels), state in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0.0
+                    for bound, count in zip(list(buckets) + ["+Inf"], state[:-2]):
+                        cumulative += count
+                        bucket_labels = labels + (("le", str(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {_format_value(state[-1])}")
+            else:
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def process_alive(pid) -> bool:
+    """
+    Жив ли процесс pid (воркер со снимком метрик, процесс задачи экспорта).
+    """
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+def reset_metrics_dir(directory: Optional[str]):
+    """
+    Удаление снимков прошлого запуска. Вызывается однократно до старта
+    воркеров (migrate), иначе счетчики продолжатся с прошлых значений.
+    """
+    if not directory:
+        return
+    for path in Path(directory).glob("worker-*.*"):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+# Реестр процесса; настраивается configure_metrics() при создании приложения
+registry = MetricsRegistry()
+
+def configure_metrics(directory: Optional[str], flush_seconds: float = 5.0):
+    registry.directory = Path(directory) if directory else None
+    registry.flush_seconds = flush_seconds
+
+def record_cache(cache: str, hit: bool):
+    """
+    Учет обращения к кэшу: доля попаданий = hit / (hit + miss).
+    """
+    registry.inc("cache_requests_total", (("cache", cache), ("result", "hit" if hit else "miss")))
+
+# SQL-статистика текущего HTTP-запроса: [число запросов, секунды, формы запросов
+# (только при включенной проверке бюджета, иначе None), все запросы с временем (только
+# при профилировании, иначе None)]. Список изменяемый, поэтому запросы из потоков пула (копия контекста) видны middleware.
+_request_db_stats: ContextVar[Optional[List[Any]]] = ContextVar("request_db_stats", default=None)
+# scope текущего HTTP-запроса: эндпоинт для журнала медленных запросов
+_request_scope: ContextVar[Optional[Scope]] = ContextVar("request_scope", default=None)
+
+def instrument_engine(engine):
+    """
+    Подсчет SQL-запросов и времени в базе через события движка.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        registry.inc("db_queries_total")
+        record_query(conn, statement, parameters, elapsed, _request_scope.get())
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+            if stats[2] is not None:
+                record_statement(stats[2], statement, parameters)
+            if stats[3] is not None:
+                stats[3].append((statement, parameters, elapsed))
+
+def current_db_stats() -> Optional[Tuple[int, float]]:
+    """
+    Число SQL-запросов и секунды в базе с начала текущего HTTP-запроса.
+    """
+    stats = _request_db_stats.get()
+    if stats is None:
+        return None
+    return stats[0], stats[1]
+
+def isolate_db_stats() -> List[Any]:
+    """
+    Отдельная SQL-статистика для текущего контекста (задача общего расчета
+    тяжелого отчета): его запросы не записываются на HTTP-запрос, который
+    начал расчет, а добавляются каждому получателю результата через merge_db_stats.
+    """
+    stats = [0, 0.0, {} if query_budget_enabled() else None, []]
+    _request_db_stats.set(stats)
+    return stats
+
+def merge_db_stats(shared: List[Any]):
+    """
+    Добавление статистики общего расчета к статистике текущего HTTP-запроса.
+    """
+    stats = _request_db_stats.get()
+    if stats is None:
+        return
+    stats[0] += shared[0]
+    stats[1] += shared[1]
+    if stats[2] is not None and shared[2] is not None:
+        for statement, (count, params) in shared[2].items():
+            entry = stats[2].setdefault(statement, [0, set()])
+            entry[0] += count
+            entry[1] |= params
+    if stats[3] is not None:
+        stats[3].extend(shared[3])
+
+def capture_request_sql() -> Optional[List[Tuple[str, Any, float]]]:
+    """
+    Запись всех SQL текущего HTTP-запроса (текст, параметры, секунды) —
+    для профилирования. None вне запроса, учтенного MetricsMiddleware.
+    """
+    stats = _request_db_stats.get()
+    if stats is None:
+        return None
+    stats[3] = []
+    return stats[3]
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware учета HTTP-запросов. Подключается последним (внешним),
+    чтобы размер ответа учитывался уже после сжатия.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.route_paths: Optional[Dict[int, str]] = None
+
+    def route_label(self, scope: Scope) -> str:
+        """
+        Шаблон пути маршрута по обработчику, который роутер записал в scope.
+        """
+        if self.route_paths is None:
+            self.route_paths = {}
+            for route in getattr(scope.get("app"), "routes", []):
+                handler = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                if handler is not None:
+                    self.route_paths.setdefault(id(handler), route.path)
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        return self.route_paths.get(id(endpoint), "unmatched")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        db_stats = [0, 0.0, {} if query_budget_enabled() else None, None]
+        token = _request_db_stats.set(db_stats)
+        scope_token = _request_scope.set(scope)
+        status_code = 500
+        response_size = 0
+
+        async def send_with_metrics(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        registry.start_flusher()
+        registry.inc("http_requests_in_progress", (("method", method),))
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            registry.inc("http_requests_in_progress", (("method", method),), -1)
+            _request_db_stats.reset(token)
+            _request_scope.reset(scope_token)
+            route = self.route_label(scope)
+            labels = (("method", method), ("route", route))
+            registry.inc("http_requests_total", labels + (("status", str(status_code)),))
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            registry.observe("http_response_size_bytes", labels, response_size)
+            registry.observe("db_queries_per_request", labels, db_stats[0])
+            registry.observe("db_query_seconds_per_request", labels, db_stats[1])
+            if db_stats[2] is not None:
+                check_query_budget(scope.get("endpoint"), method, route, db_stats[0], db_stats[2])
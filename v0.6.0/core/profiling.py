@@ -0,0 +1,273 @@
+"""
+Профилирование отдельного HTTP-запроса по требованию.
+
+Запрос с заголовком X-Profile-Token (или параметром ?profile=) со значением
+PROFILE_TOKEN выполняется под сэмплирующим профилировщиком: отдельный поток
+раз в PROFILE_INTERVAL секунд снимает стеки всех занятых потоков воркера —
+цикла событий и пула потоков, где идут потоковые выгрузки. Простаивающие
+потоки (ожидание в threading, selectors, queue) в профиль не попадают.
+После ответа в PROFILE_DIR сохраняются:
+- <id>.speedscope.json — профиль для https://www.speedscope.app (flamegraph);
+- <id>.sql.json — выполненные SQL-запросы с параметрами и временем.
+Ссылки на файлы возвращаются в заголовках X-Profile-Url и X-Profile-Sql-Url,
+скачиваются они с тем же токеном (routers/profiles.py).
+
+Сэмплируется весь процесс, поэтому одновременные запросы того же воркера
+тоже попадут в профиль. Без PROFILE_TOKEN middleware не подключается;
+с токеном запрос без него стоит одного просмотра заголовков.
+"""
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import capture_request_sql
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile-token"
+PROFILE_QUERY_PARAM = "profile"
+PROFILES_URL_PREFIX = "/api/profiles"
+PROFILE_ID_PATTERN = r"^\d{8}-\d{6}-[0-9a-f]{8}$"
+PROFILE_KINDS = ("speedscope.json", "sql.json")
+
+# Сколько последних профилей хранить в каталоге
+PROFILE_KEEP = 200
+
+# Файлы, в которых поток ждет (блокировки, select цикла событий, очередь пула) — такие стеки пропускаются
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+settings: Dict[str, Any] = {"token": None, "dir": None, "interval": 0.001}
+
+def configure_profiling(token: Optional[str], directory: Path, interval: float = 0.001):
+    settings["token"] = token or None
+    settings["dir"] = Path(directory)
+    settings["interval"] = interval
+
+def profiling_enabled() -> bool:
+    return settings["token"] is not None
+
+def check_profile_token(value: Optional[str]) -> bool:
+    """
+    Совпадает ли переданный токен с PROFILE_TOKEN (сравнение за постоянное время).
+    """
+    token = settings["token"]
+    if not token or not value:
+        return False
+    return hmac.compare_digest(value.encode(), token.encode())
+
+def requested_token(scope: Scope) -> Optional[str]:
+    """
+    Токен профилирования из заголовка X-Profile-Token или параметра ?profile=.
+    """
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            return value.decode("latin-1")
+    query = scope.get("query_string", b"")
+    if b"profile=" in query:
+        values = parse_qs(query.decode("latin-1")).get(PROFILE_QUERY_PARAM)
+        if values:
+            return values[0]
+    return None
+
+def profile_path(profile_id: str, kind: str) -> Optional[Path]:
+    """
+    Путь к файлу профиля; None для недопустимого id или типа файла.
+    """
+    if not re.match(PROFILE_ID_PATTERN, profile_id) or kind not in PROFILE_KINDS:
+        return None
+    return settings["dir"] / f"{profile_id}.{kind}"
+
+class StackSampler:
+    """
+    Поток, снимающий стеки остальных потоков процесса раз в interval секунд.
+    Вес сэмпла — фактическое время с предыдущего снимка.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Dict[int, List[Tuple[tuple, float]]] = defaultdict(list)
+        self.thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+    def _run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[thread_id].append((tuple(stack), weight))
+
+def speedscope_document(name: str, sampler: StackSampler) -> Dict[str, Any]:
+    """
+    Профиль в формате speedscope: по одному сэмплированному профилю на поток.
+    """
+    frames: List[Dict[str, Any]] = []
+    frame_indexes: Dict[tuple, int] = {}
+    profiles = []
+    for thread_id, samples in sampler.samples.items():
+        stacks, weights = [], []
+        for stack, weight in samples:
+            indexes = []
+            for key in stack:
+                index = frame_indexes.get(key)
+                if index is None:
+                    index = frame_indexes[key] = len(frames)
+                    frames.append({"name": key[0], "file": key[1], "line": key[2]})
+                indexes.append(index)
+            stacks.append(indexes)
+            weights.append(round(weight * 1000, 3))
+        profiles.append({
+            "type": "sampled",
+            "name": sampler.thread_names.get(thread_id, str(thread_id)),
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": stacks,
+            "weights": weights,
+        })
+    # Первым открывается поток, где запрос провел больше всего времени
+    profiles.sort(key=lambda profile: profile["endValue"], reverse=True)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "aircon-crm",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
+
+def sql_document(name: str, status_code: int, seconds: float,
+                 statements: Optional[List[Tuple[str, Any, float]]]) -> Dict[str, Any]:
+    """
+    Выполненные SQL-запросы по порядку и сводка по формам запроса (самые дорогие первыми).
+    """
+    statements = statements or []
+    shapes: Dict[str, List[float]] = {}
+    executed = []
+    for statement, parameters, elapsed in statements:
+        text = " ".join(statement.split())
+        executed.append({"sql": text, "params": repr(parameters)[:500], "ms": round(elapsed * 1000, 3)})
+        shape = shapes.setdefault(text, [0, 0.0])
+        shape[0] += 1
+        shape[1] += elapsed
+    by_shape = [
+        {"sql": text, "count": count, "total_ms": round(total * 1000, 3)}
+        for text, (count, total) in sorted(shapes.items(), key=lambda item: item[1][1], reverse=True)
+    ]
+    return {
+        "request": name,
+        "status": status_code,
+        "duration_ms": round(seconds * 1000, 3),
+        "sql_count": len(executed),
+        "sql_ms": round(sum(elapsed for _, _, elapsed in statements) * 1000, 3),
+        "by_shape": by_shape,
+        "statements": executed,
+    }
+
+def prune_profiles(directory: Path, keep: int = PROFILE_KEEP):
+    """
+    Удаление самых старых профилей сверх keep.
+    """
+    profiles = sorted(directory.glob("*.speedscope.json"), key=lambda path: path.name)
+    for path in profiles[:-keep]:
+        for kind in PROFILE_KINDS:
+            try:
+                os.remove(directory / path.name.replace("speedscope.json", kind))
+            except FileNotFoundError:
+                pass
+
+def save_profile(profile_id: str, name: str, status_code: int, seconds: float, sampler: StackSampler,
+                 statements: Optional[List[Tuple[str, Any, float]]]):
+    directory = settings["dir"]
+    os.makedirs(directory, exist_ok=True)
+    documents = {
+        "speedscope.json": speedscope_document(name, sampler),
+        "sql.json": sql_document(name, status_code, seconds, statements),
+    }
+    for kind, document in documents.items():
+        # Временный файл и os.replace: ссылка из заголовка не откроет файл наполовину
+        path = directory / f"{profile_id}.{kind}"
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    prune_profiles(directory)
+    logger.info("Профиль %s: %s, %.0f мс, сохранен в %s", profile_id, name, seconds * 1000, directory)
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware профилирования по токену. Подключается внутри
+    MetricsMiddleware: список SQL берется из его статистики запроса.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http" or scope["path"].startswith(PROFILES_URL_PREFIX)
+                or not check_profile_token(requested_token(scope))):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        name = f"{scope['method']} {scope['path']}"
+        # Токен из ?profile= не попадает в имя профиля, которое сохраняется в файлах профиля
+        query = "&".join(
+            part for part in scope.get("query_string", b"").decode("latin-1").split("&")
+            if part and part.split("=", 1)[0] != "profile"
+        )
+        if query:
+            name += f"?{query}"
+        status_code = 500
+
+        async def send_with_links(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Profile-Url"] = f"{PROFILES_URL_PREFIX}/{profile_id}/speedscope.json"
+                headers["X-Profile-Sql-Url"] = f"{PROFILES_URL_PREFIX}/{profile_id}/sql.json"
+            await send(message)
+
+        statements = capture_request_sql()
+        sampler = StackSampler(settings["interval"])
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_links)
+        finally:
+            sampler.stop()
+            seconds = time.perf_counter() - started
+            await run_in_threadpool(save_profile, profile_id, name, status_code, seconds, sampler, statements)
@@ -0,0 +1,89 @@
+"""
+Бюджет SQL-запросов на HTTP-запрос и поиск N+1.
+
+Эндпоинт объявляет допустимое число запросов декоратором @query_budget(n),
+остальным достается DEFAULT_QUERY_BUDGET. Потоковые выгрузки (@query_budget(None))
+не проверяются: число запросов растет с объемом данных, а пачки по ключу
+повторяют одну форму с разными параметрами. Когда проверка включена
+(QUERY_BUDGET_CHECK), события движка из core.metrics запоминают каждый
+выполненный запрос: текст с плейсхолдерами (форма запроса) и параметры.
+По окончании HTTP-запроса превышение бюджета и формы, выполненные
+несколько раз с разными параметрами (цикл с запросом на каждый элемент),
+пишутся в лог и в query_budget_violations — их проверяет
+benchmarks/query_budgets.py.
+"""
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз форма запроса должна повториться с разными параметрами, чтобы считаться N+1
+N_PLUS_ONE_MIN_REPEATS = 3
+
+settings = {"enabled": False, "default_budget": 20}
+
+# Последние нарушения бюджета (для проверочных скриптов и отладки)
+query_budget_violations: Deque[Dict[str, Any]] = deque(maxlen=1000)
+
+def configure_query_budget(enabled: bool, default_budget: int = 20):
+    settings["enabled"] = enabled
+    settings["default_budget"] = default_budget
+
+def query_budget_enabled() -> bool:
+    return settings["enabled"]
+
+def query_budget(limit: Optional[int]) -> Callable:
+    """
+    Декоратор эндпоинта: не больше limit SQL-запросов на HTTP-запрос (None — без проверки).
+    Ставится под декоратором маршрута (@router.get(...)).
+    """
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = limit
+        return endpoint
+    return decorator
+
+def record_statement(statements: Dict[str, List], statement: str, parameters):
+    """
+    Учет выполненного запроса: число выполнений формы и различные наборы параметров.
+    """
+    entry = statements.get(statement)
+    if entry is None:
+        entry = statements[statement] = [0, set()]
+    entry[0] += 1
+    try:
+        entry[1].add(hash(repr(parameters)))
+    except TypeError:
+        pass
+
+def check_query_budget(endpoint: Optional[Callable], method: str, route: str, query_count: int,
+                       statements: Dict[str, List]) -> Optional[Dict[str, Any]]:
+    """
+    Отчет о запросах HTTP-запроса, если бюджет превышен или найден N+1, иначе None.
+    """
+    budget = getattr(endpoint, "query_budget", settings["default_budget"])
+    if budget is None:
+        return None
+    repeated = [
+        {"statement": " ".join(statement.split())[:300], "count": count, "distinct_params": len(params)}
+        for statement, (count, params) in statements.items()
+        if count >= N_PLUS_ONE_MIN_REPEATS and len(params) > 1
+    ]
+    if query_count <= budget and not repeated:
+        return None
+
+    repeated.sort(key=lambda item: item["count"], reverse=True)
+    report = {
+        "method": method,
+        "route": route,
+        "queries": query_count,
+        "budget": budget,
+        "over_budget": query_count > budget,
+        "repeated": repeated,
+    }
+    query_budget_violations.append(report)
+    logger.warning(
+        "%s %s: %d SQL-запросов при бюджете %d%s", method, route, query_count, budget,
+        "".join(f"\n  N+1 ({item['count']} раз): {item['statement']}" for item in repeated[:3])
+    )
+    return report
@@ -0,0 +1,22 @@
+"""
+Класс JSON-ответов API по умолчанию.
+
+Если установлен orjson, ответы сериализуются им (в несколько раз быстрее
+стандартного json); без него используется обычный JSONResponse. Время
+сериализации попадает в заголовок Server-Timing (ser).
+"""
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from .server_timing import server_timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_BaseResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+class APIResponse(_BaseResponse):
+    def render(self, content) -> bytes:
+        with server_timing("ser"):
+            return super().render(content)
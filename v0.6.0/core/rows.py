@@ -0,0 +1,20 @@
+"""
+Чтение списков без ORM-объектов.
+
+Для эндпоинтов только на чтение выбираются нужные колонки, строки Core
+сразу превращаются в словари ответа: без создания экземпляров моделей,
+отслеживания в identity map и ручного копирования атрибутов.
+"""
+from typing import Any, Dict, List
+
+from sqlalchemy.orm import Query, Session
+
+def fetch_rows(db: Session, query) -> List[Dict[str, Any]]:
+    """
+    Выполнение запроса по колонкам (Query или select) и преобразование
+    строк в словари. Ключи — имена колонок или их метки (label).
+    """
+    statement = query.statement if isinstance(query, Query) else query
+    result = db.execute(statement)
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
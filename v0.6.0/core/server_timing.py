@@ -0,0 +1,99 @@
+"""
+Заголовок Server-Timing: из чего складывается время ответа.
+
+ServerTimingMiddleware заводит на каждый HTTP-запрос словарь времен в
+контекстной переменной; участки кода добавляют в него время через
+server_timing(name). В заголовок попадают:
+- db — время SQL-запросов и их число (из статистики MetricsMiddleware);
+- render — рендеринг шаблонов Jinja (TimedTemplates);
+- ser — сериализация JSON-ответа (APIResponse);
+- app — остальное время до отправки заголовков: код эндпоинтов и сервисов;
+- total — все время до отправки заголовков.
+Браузер показывает эти значения в DevTools (Network → Timing) для каждого
+fetch со страниц. У потоковых ответов учитывается только время до первого блока.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import current_db_stats
+
+# Участки, которые вычитаются из общего времени, и их описания в заголовке
+TIMED_PARTS = (("render", "jinja"), ("ser", "json"))
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+@contextmanager
+def server_timing(name: str):
+    """
+    Учет времени блока в Server-Timing текущего запроса (вне запроса — без учета).
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+class TimedTemplates(Jinja2Templates):
+    """
+    Шаблоны Jinja с учетом времени рендеринга (шаблон рендерится при создании ответа).
+    """
+
+    def TemplateResponse(self, *args, **kwargs):
+        with server_timing("render"):
+            return super().TemplateResponse(*args, **kwargs)
+
+def format_server_timing(timings: Dict[str, float], total: float, db_count: int, db_seconds: float) -> str:
+    """
+    Значение заголовка: db;dur=12.3;desc="7 queries", ..., total;dur=20.1 (миллисекунды).
+    """
+    parts = [f'db;dur={db_seconds * 1000:.1f};desc="{db_count} queries"']
+    spent = db_seconds
+    for name, description in TIMED_PARTS:
+        if name in timings:
+            parts.append(f'{name};dur={timings[name] * 1000:.1f};desc="{description}"')
+            spent += timings[name]
+    parts.append(f'app;dur={max(total - spent, 0.0) * 1000:.1f};desc="python"')
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+class ServerTimingMiddleware:
+    """
+    ASGI-middleware заголовка Server-Timing. Подключается внутри
+    MetricsMiddleware: время SQL берется из его статистики запроса.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                db_count, db_seconds = current_db_stats() or (0, 0.0)
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", format_server_timing(
+                    timings, time.perf_counter() - started, db_count, db_seconds
+                ))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
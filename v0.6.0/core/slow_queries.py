@@ -0,0 +1,193 @@
+"""
+Журнал медленных SQL-запросов и сводка по формам запросов.
+
+События движка из core.metrics передают сюда каждый выполненный запрос.
+Запрос приводится к форме (normalize_sql): литералы и списки IN заменяются
+плейсхолдерами, пробелы схлопываются. По каждой форме копятся число
+выполнений, суммарное и максимальное время — сводка попадает в снимок
+метрик воркера, поэтому /api/admin/slow-queries показывает все воркеры.
+
+Запрос дольше SLOW_QUERY_MS пишется в ротируемый файл SLOW_QUERY_LOG одной
+JSON-строкой: форма, текст, параметры, эндпоинт и план EXPLAIN QUERY PLAN
+(выполняется на том же соединении, план кэшируется по тексту запроса).
+Время — до получения первых строк результата: выборка остальных строк
+в него не входит, поэтому полные сканирования с сортировкой видны сразу,
+а построчная выдача большого результата — нет.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Отдельный логгер файла медленных запросов (не дублируется в общий лог)
+slow_query_log = logging.getLogger("slow_queries")
+slow_query_log.propagate = False
+
+# Сколько форм запросов хранить; новые формы сверх лимита не учитываются
+MAX_SHAPES = 2000
+# Сколько эндпоинтов запоминать для формы медленного запроса
+MAX_ENDPOINTS = 5
+# Запросы, для которых SQLite строит план
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+settings: Dict[str, Any] = {"threshold": 0.1}
+
+_lock = threading.Lock()
+# Форма -> [выполнений, секунд всего, максимум, медленных, план, эндпоинты]
+_shapes: Dict[str, List[Any]] = {}
+_plans: Dict[str, List[str]] = {}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"IN \((?:\?, )+\?\)", re.IGNORECASE)
+
+def configure_slow_queries(threshold_ms: float, log_path: Optional[Path], max_bytes: int = 10 * 1024 * 1024,
+                           backups: int = 5):
+    """
+    Порог медленного запроса и ротируемый файл журнала. threshold_ms <= 0
+    отключает журнал; сводка по формам собирается в любом случае.
+    """
+    settings["threshold"] = threshold_ms / 1000 if threshold_ms > 0 else None
+    for handler in list(slow_query_log.handlers):
+        slow_query_log.removeHandler(handler)
+        handler.close()
+    if settings["threshold"] is None or log_path is None:
+        return
+    log_path = Path(log_path)
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    slow_query_log.addHandler(handler)
+    slow_query_log.setLevel(logging.INFO)
+
+@lru_cache(maxsize=4096)
+def normalize_sql(statement: str) -> str:
+    """
+    Форма запроса: строки и числа заменены на ?, списки IN (?, ?, ...) — на IN (...).
+    """
+    text = " ".join(statement.split())
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    return _IN_LIST_RE.sub("IN (...)", text)
+
+def endpoint_name(scope: Optional[dict]) -> Optional[str]:
+    """
+    Метод и обработчик HTTP-запроса (GET routers.orders.get_orders); None вне запроса.
+    """
+    if scope is None:
+        return None
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return f"{scope['method']} {scope['path']}"
+    return f"{scope['method']} {endpoint.__module__}.{endpoint.__qualname__}"
+
+def explain_query_plan(conn, statement: str, parameters) -> List[str]:
+    """
+    План SQLite для запроса в виде дерева строк ("SCAN orders", "  SEARCH ...").
+    Выполняется прямым курсором драйвера, мимо событий движка.
+    """
+    if conn.dialect.name != "sqlite" or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    plan = _plans.get(statement)
+    if plan is not None:
+        return plan
+    if isinstance(parameters, list):
+        parameters = parameters[0] if parameters else ()
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+    except Exception as e:
+        return [f"EXPLAIN QUERY PLAN не выполнен: {e}"]
+    finally:
+        cursor.close()
+    depth = {0: -1}
+    plan = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    if len(_plans) < MAX_SHAPES:
+        _plans[statement] = plan
+    return plan
+
+def record_query(conn, statement: str, parameters, elapsed: float, scope: Optional[dict] = None):
+    """
+    Учет выполненного запроса в сводке; медленный запрос — еще и в журнал.
+    """
+    shape = normalize_sql(statement)
+    threshold = settings["threshold"]
+    slow = threshold is not None and elapsed >= threshold
+    with _lock:
+        entry = _shapes.get(shape)
+        if entry is None and len(_shapes) < MAX_SHAPES:
+            entry = _shapes[shape] = [0, 0.0, 0.0, 0, None, []]
+        if entry is not None:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+    if not slow:
+        return
+
+    endpoint = endpoint_name(scope)
+    plan = explain_query_plan(conn, statement, parameters)
+    if entry is not None:
+        with _lock:
+            entry[3] += 1
+            entry[4] = plan
+            if endpoint and endpoint not in entry[5] and len(entry[5]) < MAX_ENDPOINTS:
+                entry[5].append(endpoint)
+    path = None
+    if scope is not None:
+        path = scope["path"] + (f"?{scope['query_string'].decode('latin-1')}" if scope.get("query_string") else "")
+    slow_query_log.info(json.dumps({
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ms": round(elapsed * 1000, 3),
+        "shape": shape,
+        "sql": " ".join(statement.split()),
+        "params": repr(parameters)[:500],
+        "endpoint": endpoint,
+        "path": path,
+        "plan": plan,
+    }, ensure_ascii=False))
+
+def statements_snapshot() -> List[List[Any]]:
+    """
+    Сводка процесса для снимка метрик воркера.
+    """
+    with _lock:
+        return [[shape, *entry[:4], entry[4], entry[5][:]] for shape, entry in _shapes.items()]
+
+def top_statements(snapshots: List[dict], limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Формы запросов с наибольшим суммарным временем по снимкам всех воркеров.
+    """
+    merged: Dict[str, List[Any]] = {}
+    for snapshot in snapshots:
+        for shape, count, total, longest, slow, plan, endpoints in snapshot.get("statements", []):
+            entry = merged.get(shape)
+            if entry is None:
+                entry = merged[shape] = [0, 0.0, 0.0, 0, None, []]
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+            entry[3] += slow
+            entry[4] = plan or entry[4]
+            entry[5].extend(endpoint for endpoint in endpoints if endpoint not in entry[5])
+    top = sorted(merged.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [
+        {
+            "sql": shape,
+            "count": count,
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total * 1000 / count, 3) if count else 0.0,
+            "max_ms": round(longest * 1000, 3),
+            "slow_count": slow,
+            "plan": plan,
+            "endpoints": endpoints,
+        }
+        for shape, (count, total, longest, slow, plan, endpoints) in top
+    ]
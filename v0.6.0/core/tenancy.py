@@ -0,0 +1,80 @@
+"""
+Филиалы (города): у каждого своя база, запрос обслуживается базой своего филиала.
+
+TenantMiddleware определяет филиал запроса:
+- заголовок TENANT_HEADER (X-Tenant: spb) — для API-клиентов;
+- иначе первая часть имени хоста (spb.crm.example.ru) — для браузера;
+- иначе филиал по умолчанию (DEFAULT_TENANT), если он задан.
+Неизвестный филиал в заголовке — ответ 404. Запрос без филиала не
+отклоняется сразу: статике и /metrics база не нужна, а сессия базы без
+филиала вернет 400 (database.get_db).
+
+Филиал хранится в contextvar и виден во всем запросе, в том числе в пуле
+потоков синхронных эндпоинтов. Фоновые задачи и CLI выбирают филиал явно
+через tenant_scope.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+_current_tenant: ContextVar[Optional[str]] = ContextVar("tenant", default=None)
+
+settings: Dict[str, Any] = {"tenants": frozenset(), "header": "x-tenant", "default": None}
+
+def configure_tenancy(tenants: Iterable[str], header: str = "X-Tenant", default: Optional[str] = None):
+    settings["tenants"] = frozenset(tenants)
+    settings["header"] = header.lower()
+    settings["default"] = default
+
+def current_tenant_name() -> Optional[str]:
+    """
+    Филиал текущего запроса или задачи; None — не выбран.
+    """
+    return _current_tenant.get() or settings["default"]
+
+@contextmanager
+def tenant_scope(name: Optional[str]):
+    """
+    Работа от имени филиала name вне запроса (фоновые задачи, расчет сводных отчетов, CLI).
+    """
+    token = _current_tenant.set(name)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+def resolve_tenant(headers: Headers) -> Optional[str]:
+    """
+    Филиал по заголовку или поддомену; пустая строка — заголовок с неизвестным филиалом.
+    """
+    tenants = settings["tenants"]
+    name = headers.get(settings["header"])
+    if name is not None:
+        name = name.strip().lower()
+        return name if name in tenants else ""
+    subdomain = headers.get("host", "").split(":", 1)[0].split(".", 1)[0].lower()
+    return subdomain if subdomain in tenants else None
+
+class TenantMiddleware:
+    """
+    ASGI middleware выбора филиала запроса.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = resolve_tenant(Headers(scope=scope))
+        if name == "":
+            response = JSONResponse({"detail": "Филиал не найден"}, status_code=404)
+            await response(scope, receive, send)
+            return
+        with tenant_scope(name):
+            await self.app(scope, receive, send)
@@ -1,19 +1,228 @@
 """
 Настройки базы данных для CRM-системы кондиционеров.
+
+У каждого филиала (core.tenancy) своя база: TenantDatabase держит ее движок
+с отдельным пулом соединений, путь к архиву и движок истории. Движки
+создаются при первом обращении к филиалу. SessionLocal и HistorySessionLocal
+открывают сессию базы филиала текущего запроса, поэтому роутеры и сервисы
+не знают о филиалах. Без TENANTS филиал один — база DATABASE_URL.
+
+Кроме основной (горячей) базы есть архив закрытых заказов — отдельный файл
+SQLite, куда services.archive_service переносит старые заказы, их строки,
+выплаты и транзакции. Повседневные запросы работают только с горячей базой.
+Отчеты за период, который начинается раньше границы архива, получают сессию
+истории (get_db_since, get_db_for_month): в ней каждая таблица — временное
+представление UNION ALL горячей таблицы и архивной, поэтому запросы сервисов
+не меняются. Сессия истории только для чтения.
 """
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
 
-# Создаем движок SQLAlchemy для SQLite
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Необходимо для SQLite
+from fastapi import HTTPException, Query
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from config import (
+    DATABASE_URL, ARCHIVE_DATABASE_PATH, TENANTS, TENANT_DATABASE_URL, TENANT_HEADER, TENANT_POOL_SIZE, SINGLE_TENANT,
+    DEFAULT_TENANT
 )
+from core.tenancy import configure_tenancy, current_tenant_name, tenant_scope
+
+# Вызываются для каждого созданного движка, в том числе созданного позже при первом запросе филиала
+_engine_hooks: List[Callable[[Engine], None]] = []
+
+class TenantDatabase:
+    """
+    Базы филиала: основная (горячая), архив закрытых заказов и движок истории.
+    """
+
+    def __init__(self, name: str, url: str, archive_path: Optional[str] = None, label: Optional[str] = None):
+        self.name = name
+        # Код филиала в метках метрик и именах файлов состояния; None — база единственная, имена прежние
+        self.label = label
+        self.url = make_url(url)
+        self._lock = threading.Lock()
+        self._engine: Optional[Engine] = None
+        self._history_engine: Optional[Engine] = None
+        # Граница архива из его метаданных; перечитывается, когда меняется файл архива
+        self._archive_state = {"mtime": None, "archived_before": None}
 
-# Создаем фабрику сессий
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Файл архива: из настроек или рядом с основной базой (aircon_crm.db -> aircon_crm_archive.db).
+        # Архив есть только у SQLite-базы в файле
+        database = self.url.database if self.url.get_backend_name() == "sqlite" else None
+        if not database or database == ":memory:":
+            self.hot_path: Optional[str] = None
+            self.archive_path: Optional[str] = None
+        else:
+            self.hot_path = database
+            self.archive_path = str(archive_path or Path(database).with_name(f"{Path(database).stem}_archive.db"))
+
+    def _create(self, factory: Callable[[], Engine]) -> Engine:
+        engine = factory()
+        for hook in _engine_hooks:
+            hook(engine)
+        return engine
+
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = self._create(lambda: create_engine(
+                        self.url,
+                        pool_size=TENANT_POOL_SIZE,
+                        connect_args={"check_same_thread": False}  # Необходимо для SQLite
+                    ))
+        return self._engine
+
+    @property
+    def history_engine(self) -> Engine:
+        """
+        Движок истории: пустая база в памяти, к которой подключены горячая база и архив.
+        """
+        if self._history_engine is None:
+            with self._lock:
+                if self._history_engine is None:
+                    engine = create_engine("sqlite://", poolclass=QueuePool, connect_args={"check_same_thread": False})
+                    event.listen(engine, "connect", self._create_history_views)
+                    self._history_engine = self._create(lambda: engine)
+        return self._history_engine
+
+    def _create_history_views(self, dbapi_connection, connection_record):
+        """
+        Временные представления с именами таблиц: горячие строки и архивные одним набором.
+        Имена без схемы ищутся сначала во временной схеме, поэтому ORM-запросы читают представления.
+        """
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("ATTACH DATABASE ? AS hot", (self.hot_path,))
+            cursor.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            hot_tables = [row[0] for row in cursor.execute(
+                "SELECT name FROM hot.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )]
+            archived = {row[0] for row in cursor.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+            for table in hot_tables:
+                select = f'SELECT * FROM hot."{table}"'
+                if table in archived:
+                    select += f' UNION ALL SELECT * FROM archive."{table}"'
+                cursor.execute(f'CREATE TEMP VIEW "{table}" AS {select}')
+        finally:
+            cursor.close()
+
+    def archived_before(self) -> Optional[str]:
+        """
+        Дата (YYYY-MM-DD), раньше которой закрытые заказы, выплаты и транзакции
+        могут лежать в архиве; None, если архива нет.
+        """
+        if self.archive_path is None:
+            return None
+        try:
+            mtime = os.stat(self.archive_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._archive_state["mtime"]:
+            value = None
+            try:
+                with sqlite3.connect(f"file:{self.archive_path}?mode=ro", uri=True) as conn:
+                    row = conn.execute("SELECT value FROM archive_meta WHERE key = 'archived_before'").fetchone()
+                    value = row[0] if row else None
+            except sqlite3.Error:
+                pass
+            self._archive_state.update(mtime=mtime, archived_before=value)
+        return self._archive_state["archived_before"]
+
+# Филиалы: коды из TENANTS с базами по шаблону TENANT_DATABASE_URL или один филиал с базой DATABASE_URL
+if TENANTS:
+    tenants: Dict[str, TenantDatabase] = {
+        name: TenantDatabase(name, TENANT_DATABASE_URL.format(tenant=name), label=name) for name in TENANTS
+    }
+else:
+    tenants = {SINGLE_TENANT: TenantDatabase(SINGLE_TENANT, DATABASE_URL, ARCHIVE_DATABASE_PATH)}
+if DEFAULT_TENANT is not None and DEFAULT_TENANT not in tenants:
+    raise ValueError(f"DEFAULT_TENANT={DEFAULT_TENANT} нет среди филиалов TENANTS")
+
+# Филиалы известны middleware и скриптам, которые импортируют только database (CLI, бенчмарки)
+configure_tenancy(tenants, TENANT_HEADER, DEFAULT_TENANT)
+
+def on_engine_created(hook: Callable[[Engine], None]):
+    """
+    Регистрация хука движков (например, метрик SQL): вызывается для уже созданных и для будущих движков.
+    """
+    _engine_hooks.append(hook)
+    for tenant in tenants.values():
+        for engine in (tenant._engine, tenant._history_engine):
+            if engine is not None:
+                hook(engine)
+
+def get_tenant(name: str) -> TenantDatabase:
+    try:
+        return tenants[name]
+    except KeyError:
+        raise ValueError(f"Филиал {name} не найден, известные: {', '.join(tenants)}")
+
+def current_tenant() -> TenantDatabase:
+    """
+    База филиала текущего запроса (или выбранного tenant_scope).
+    """
+    name = current_tenant_name()
+    if name is None:
+        raise HTTPException(status_code=400, detail=f"Не указан филиал: заголовок {TENANT_HEADER} или поддомен")
+    return tenants[name]
+
+class TenantSession(Session):
+    """
+    Сессия базы филиала текущего запроса: движок выбирается при создании сессии.
+    """
+
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or current_tenant().engine, **kwargs)
+
+class HistorySession(Session):
+    """
+    Сессия истории (горячая база и архив) филиала текущего запроса.
+    """
+
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind or current_tenant().history_engine, **kwargs)
+
+# Фабрики сессий
+SessionLocal = sessionmaker(class_=TenantSession, autocommit=False, autoflush=False)
+HistorySessionLocal = sessionmaker(class_=HistorySession, autocommit=False, autoflush=False)
+
+def archived_before() -> Optional[str]:
+    """
+    Граница архива филиала текущего запроса; None, если архива нет.
+    """
+    return current_tenant().archived_before()
+
+def needs_archive(period_start: Optional[str]) -> bool:
+    """
+    Нужен ли архив для периода с period_start (None — весь период).
+    """
+    boundary = archived_before()
+    return boundary is not None and (period_start is None or period_start < boundary)
+
+@contextmanager
+def session_with_archive(db: Session):
+    """
+    Сессия для проверки ссылок на запись перед удалением (клиент, услуга): при наличии архива —
+    сессия истории, иначе db. Иначе запись, на которую ссылаются только архивные заказы,
+    удалилась бы, и отчеты за прошлые периоды потеряли бы ее выручку.
+    """
+    if archived_before() is None:
+        yield db
+        return
+    history_db = HistorySessionLocal()
+    try:
+        yield history_db
+    finally:
+        history_db.close()
 
 # Базовый класс для моделей
 Base = declarative_base()
@@ -30,24 +239,63 @@ def get_db():
     finally:
         db.close()
 
+def get_db_since(date_from: Optional[str] = Query(None)):
+    """
+    Сессия для отчета за период с date_from: горячая база, если период
+    новее архива, иначе — сессия истории (горячая база и архив).
+    """
+    db = HistorySessionLocal() if needs_archive(date_from) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_db_if_archived(date_from: Optional[str] = Query(None)):
+    """
+    Сессия для рабочих списков: история — только если date_from явно задан раньше
+    границы архива; без фильтра список показывает горячие записи.
+    """
+    db = HistorySessionLocal() if date_from and needs_archive(date_from) else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_db_for_month(month: Optional[str] = Query(None)):
+    """
+    Сессия для отчета за месяц (YYYY-MM, по умолчанию текущий): история — только для месяцев до границы архива.
+    """
+    db = HistorySessionLocal() if month and needs_archive(f"{month}-01") else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Функция для инициализации базы данных
 def init_db():
     """
-    Создает все таблицы базы данных на основе моделей.
+    Создает все таблицы базы данных на основе моделей в базах всех филиалов.
     """
     from models import base  # Импортируем сюда для предотвращения цикличных импортов
-    Base.metadata.create_all(bind=engine)
+    for tenant in tenants.values():
+        if tenant.engine.dialect.name == "sqlite":
+            # Новая база сразу создается с incremental vacuum (у существующей режим меняет только VACUUM, см. core.maintenance)
+            with tenant.engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        Base.metadata.create_all(bind=tenant.engine)
 
 # Функция для заполнения базы данных начальными данными
 def fill_initial_data():
     """
-    Заполняет базу данных начальными данными (если необходимо).
+    Заполняет базы филиалов начальными данными (если необходимо).
     """
-    db = SessionLocal()
-    
-    # Здесь можно добавить код для создания начальных данных:
-    # - базовых услуг
-    # - владельца бизнеса
-    # - категорий расходов и т.д.
-    
-    db.close()
\ No newline at end of file
+    for name in tenants:
+        with tenant_scope(name):
+            db = SessionLocal()
+
+            # Здесь можно добавить код для создания начальных данных:
+            # - базовых услуг
+            # - владельца бизнеса
+            # - категорий расходов и т.д.
+
+            db.close()
\ No newline at end of file
@@ -0,0 +1,38 @@
+"""
+Обслуживание базы вне расписания (core.maintenance): ANALYZE/PRAGMA optimize,
+incremental vacuum и checkpoint WAL.
+
+Запускается вручную или из cron, если приложение работает без окна
+MAINTENANCE_WINDOW:
+    python maintenance.py                    # базы всех филиалов по очереди
+    python maintenance.py --tenant spb
+Первый запуск на базе без auto_vacuum=INCREMENTAL выполняет полный VACUUM
+(файл переписывается целиком, запись в базу на это время блокируется).
+"""
+import argparse
+import json
+import logging
+import os
+
+from config import APP_NAME, MAINTENANCE_STATE_PATH, MAINTENANCE_VACUUM_PAGES
+from core import configure_maintenance, run_maintenance
+from database import tenants
+
+logger = logging.getLogger(APP_NAME)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Обслуживание базы вне расписания")
+    parser.add_argument("--tenant", choices=list(tenants), help="только база филиала (по умолчанию все)")
+    args = parser.parse_args()
+    selected = [tenants[args.tenant]] if args.tenant else list(tenants.values())
+    for tenant in selected:
+        if tenant.hot_path is None:
+            raise SystemExit("Обслуживание поддерживается только для базы SQLite в файле")
+        if not os.path.exists(tenant.hot_path):
+            raise SystemExit(f"База {tenant.hot_path} не найдена")
+    configure_maintenance(None, MAINTENANCE_STATE_PATH, vacuum_pages=MAINTENANCE_VACUUM_PAGES)
+    results = {tenant.name: run_maintenance(tenant.engine, tenant.label) for tenant in selected}
+    print(json.dumps(results[selected[0].name] if len(results) == 1 else results, ensure_ascii=False, indent=2))
+    if not all(result["ok"] for result in results.values()):
+        raise SystemExit(1)
@@ -0,0 +1,29 @@
+"""
+Однократная подготовка базы данных: создание таблиц и начальные данные.
+
+Запускается один раз перед стартом приложения (в Docker — перед uvicorn),
+чтобы каждый воркер не выполнял это при своем запуске:
+    python migrate.py
+"""
+import logging
+
+from config import APP_NAME, METRICS_DIR
+from core import reset_metrics_dir
+from database import init_db, fill_initial_data
+
+logger = logging.getLogger(APP_NAME)
+
+def migrate():
+    """
+    Создание недостающих таблиц и заполнение начальными данными.
+    Снимки метрик прошлого запуска удаляются до старта воркеров.
+    """
+    reset_metrics_dir(METRICS_DIR)
+    logger.info(f"Инициализация базы данных {APP_NAME}")
+    init_db()
+    fill_initial_data()
+    logger.info(f"База данных {APP_NAME} инициализирована")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    migrate()
@@ -7,6 +7,10 @@ from .services import router as service_router
 from .orders import router as order_router
 from .finance import router as finance_router
 from .export import router as export_router
+from .metrics import router as metrics_router
+from .profiles import router as profiles_router
+from .admin import router as admin_router
+from .rollup import router as rollup_router
 
 # Список роутеров для упрощения импорта
 __all__ = [
@@ -15,5 +19,9 @@ __all__ = [
     'service_router',
     'order_router',
     'finance_router',
-    'export_router'
+    'export_router',
+    'metrics_router',
+    'profiles_router',
+    'admin_router',
+    'rollup_router'
 ]
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Роутер служебных эндпоинтов администратора.
+"""
+import sqlite3
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from core import (
+    metrics_registry, top_statements, maintenance_state, BackupError, create_backup, verify_backup, list_backups,
+    require_admin_token
+)
+from core.backup import settings as backup_settings
+from database import current_tenant
+
+# Все эндпоинты роутера — только с токеном администратора (X-Admin-Token)
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin_token)])
+
+@router.get("/slow-queries", response_model=dict)
+def get_slow_queries(limit: int = Query(20, ge=1, le=200)):
+    """
+    Формы SQL-запросов с наибольшим суммарным временем по всем воркерам:
+    число выполнений, среднее и максимальное время, число медленных выполнений,
+    план EXPLAIN QUERY PLAN и эндпоинты, где запрос был медленным.
+    """
+    return {"statements": top_statements(metrics_registry.collect_snapshots(), limit)}
+
+@router.get("/maintenance", response_model=dict)
+def get_maintenance():
+    """
+    Итоги последнего обслуживания базы филиала: страницы до и после, свободные страницы,
+    режим и длительность шагов analyze, vacuum, checkpoint.
+    """
+    return maintenance_state(current_tenant().label)
+
+@router.get("/backups", response_model=dict)
+def get_backups():
+    """
+    Хранимые наборы резервных копий базы филиала, новые первыми: файлы, размеры, контрольные суммы, способ снятия.
+    """
+    tenant = current_tenant()
+    return {"backups": list_backups(tenant.hot_path) if tenant.hot_path else []}
+
+@router.post("/backups", response_model=dict)
+def post_backup():
+    """
+    Снятие резервной копии базы и архива филиала без остановки приложения.
+    Выполняется в пуле потоков; ответ — манифест набора.
+    """
+    tenant = current_tenant()
+    if tenant.hot_path is None or backup_settings["backup_dir"] is None:
+        raise HTTPException(status_code=400, detail="Резервные копии поддерживаются только для базы SQLite в файле")
+    try:
+        return create_backup(tenant.hot_path, tenant.archive_path)
+    except (BackupError, sqlite3.Error, OSError) as e:
+        raise HTTPException(status_code=500, detail=f"Резервная копия не снята: {e}")
+
+@router.post("/backups/{name}/verify", response_model=dict)
+def post_verify_backup(name: str):
+    """
+    Проверка набора базы филиала: контрольные суммы файлов и PRAGMA integrity_check распакованных баз.
+    """
+    tenant = current_tenant()
+    if tenant.hot_path is None or backup_settings["backup_dir"] is None:
+        raise HTTPException(status_code=400, detail="Резервные копии поддерживаются только для базы SQLite в файле")
+    try:
+        return verify_backup(name, tenant.hot_path)
+    except BackupError as e:
+        raise HTTPException(status_code=400, detail=str(e))
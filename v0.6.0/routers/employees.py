@@ -7,7 +7,8 @@ from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime
 
-from database import get_db
+from core import heavy_report
+from database import get_db, get_db_for_month
 from services import EmployeeService
 from schemas import EmployeeCreate, EmployeeUpdate
 
@@ -26,11 +27,13 @@ async def get_employees(
     """
     return EmployeeService.get_employees(db, employee_type, active, page, limit)
 
+# Тяжелый отчет: синхронный обработчик считается в пуле потоков под лимитом heavy_report
 @router.get("/list", response_model=dict)
-async def get_employees_with_salary(
+@heavy_report()
+def get_employees_with_salary(
     employee_type: Optional[str] = Query(None),
     month: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_for_month)
 ):
     """
     Получение списка сотрудников с расчетом зарплаты за месяц.
@@ -38,11 +41,11 @@ async def get_employees_with_salary(
     # Получаем всех сотрудников
     employees_data = EmployeeService.get_employees(db, employee_type=employee_type, active=1, page=1, limit=100)
     
-    # Добавляем информацию о зарплате
+    # Добавляем информацию о зарплате: расчет для всех сотрудников сразу
+    salaries = EmployeeService.calculate_salaries(db, [employee["id"] for employee in employees_data["employees"]], month)
     employees_with_salary = []
     for employee in employees_data["employees"]:
-        # Вычисляем зарплату для каждого сотрудника
-        salary_data = EmployeeService.calculate_salary(db, employee["id"], month)
+        salary_data = salaries.get(employee["id"])
         
         employee_info = employee.copy()
         if salary_data:
@@ -128,8 +131,8 @@ async def deactivate_employee(employee_id: int = Path(...), db: Session = Depend
 @router.get("/{employee_id}/salary", response_model=dict)
 async def get_employee_salary(
     employee_id: int = Path(...),
-    month: Optional[str] = None,
-    db: Session = Depends(get_db)
+    month: Optional[str] = Query(None),
+    db: Session = Depends(get_db_for_month)
 ):
     """
     Получение зарплаты сотрудника за месяц.
@@ -1,37 +1,51 @@
 """
 Роутер для экспорта данных.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 
-from database import get_db
-from services import ExportService
+from core import query_budget
+from database import get_db, get_db_since, get_db_for_month
+from services import ExportService, ExportJobService
 
 router = APIRouter(prefix="/api/export", tags=["export"])
 
+def _export_response(result: dict) -> StreamingResponse:
+    """
+    Ответ с файлом экспорта. Данные сервиса — готовая строка/байты
+    или итератор блоков (потоковая отдача).
+    """
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    
+    data = result["data"]
+    content = iter([data]) if isinstance(data, (str, bytes)) else data
+    
+    return StreamingResponse(
+        content,
+        media_type=result["media_type"],
+        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
+    )
+
+# Потоковая выгрузка пачками по ключу: число запросов растет с объемом данных
 @router.get("/orders")
+@query_budget(None)
 async def export_orders(
     format: str = Query("csv"),
     status: Optional[str] = Query(None),
     client_name: Optional[str] = Query(None),
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_since)
 ):
     """
     Экспорт данных о заказах.
     """
     result = ExportService.export_orders(db, format, status, client_name, date_from, date_to)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    
-    return StreamingResponse(
-        iter([result["data"]]),
-        media_type=result["media_type"],
-        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
-    )
+    return _export_response(result)
 
 @router.get("/clients")
 async def export_clients(
@@ -44,14 +58,7 @@ async def export_clients(
     Экспорт данных о клиентах.
     """
     result = ExportService.export_clients(db, format, search, source)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    
-    return StreamingResponse(
-        iter([result["data"]]),
-        media_type=result["media_type"],
-        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
-    )
+    return _export_response(result)
 
 @router.get("/services")
 async def export_services(
@@ -64,14 +71,7 @@ async def export_services(
     Экспорт данных об услугах.
     """
     result = ExportService.export_services(db, format, search, category)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    
-    return StreamingResponse(
-        iter([result["data"]]),
-        media_type=result["media_type"],
-        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
-    )
+    return _export_response(result)
 
 @router.get("/employees")
 async def export_employees(
@@ -79,37 +79,155 @@ async def export_employees(
     employee_type: Optional[str] = Query(None),
     active: Optional[int] = Query(None),
     month: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_for_month)
 ):
     """
     Экспорт данных о сотрудниках.
     """
     result = ExportService.export_employees(db, format, employee_type, active, month)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
-    
-    return StreamingResponse(
-        iter([result["data"]]),
-        media_type=result["media_type"],
-        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
-    )
+    return _export_response(result)
 
+# Потоковая выгрузка пачками по ключу: число запросов растет с объемом данных
 @router.get("/finances")
+@query_budget(None)
 async def export_finances(
     format: str = Query("csv"),
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_since)
 ):
     """
     Экспорт финансовых данных.
     """
     result = ExportService.export_finances(db, format, date_from, date_to)
-    if "error" in result:
-        raise HTTPException(status_code=400, detail=result["error"])
+    return _export_response(result)
+
+@router.post("/jobs/{kind}", response_model=dict)
+async def create_export_job(
+    kind: str = Path(..., description="Тип экспорта: orders, clients, services, employees, finances"),
+    format: str = Query("csv"),
+    status: Optional[str] = Query(None),
+    client_name: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    source: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    employee_type: Optional[str] = Query(None),
+    active: Optional[int] = Query(None),
+    month: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None)
+):
+    """
+    Постановка экспорта в фоновую очередь. Фильтры те же, что у синхронного экспорта.
+    """
+    filters = {
+        "status": status,
+        "client_name": client_name,
+        "search": search,
+        "source": source,
+        "category": category,
+        "employee_type": employee_type,
+        "active": active,
+        "month": month,
+        "date_from": date_from,
+        "date_to": date_to
+    }
+    job = ExportJobService.submit_job(kind, format, filters)
+    if "error" in job:
+        raise HTTPException(status_code=400, detail=job["error"])
+    return ExportJobService.job_to_dict(job)
+
+@router.get("/jobs/{job_id}", response_model=dict)
+async def get_export_job(job_id: str = Path(...)):
+    """
+    Статус фоновой задачи экспорта и количество выгруженных строк.
+    """
+    job = ExportJobService.get_tenant_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+    return ExportJobService.job_to_dict(job)
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(request: Request, job_id: str = Path(...)):
+    """
+    Скачивание результата фоновой задачи с поддержкой Range (докачка).
+    """
+    job = ExportJobService.get_tenant_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача экспорта не найдена")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail="Экспорт еще не готов")
     
+    try:
+        file = open(ExportJobService.artifact_path(job), "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Файл экспорта удален по истечении срока хранения")
+    
+    size = os.fstat(file.fileno()).st_size
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={job['filename']}"
+    }
+    try:
+        byte_range = _parse_range_header(request.headers.get("range"), size)
+    except HTTPException:
+        file.close()
+        raise
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file_range(file, 0, size - 1), media_type=job["media_type"], headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
     return StreamingResponse(
-        iter([result["data"]]),
-        media_type=result["media_type"],
-        headers={"Content-Disposition": f"attachment; filename={result['filename']}"}
-    )
\ No newline at end of file
+        _iter_file_range(file, start, end),
+        status_code=206,
+        media_type=job["media_type"],
+        headers=headers
+    )
+
+def _parse_range_header(range_header: Optional[str], size: int):
+    """
+    Разбор заголовка Range (один диапазон байт). Возвращает (start, end) включительно
+    или None, если нужно отдать файл целиком.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # Суффиксный диапазон: последние N байт
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Запрошенный диапазон недоступен",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def _iter_file_range(file, start: int, end: int, block_size: int = 64 * 1024):
+    """
+    Чтение диапазона файла блоками с закрытием файла в конце.
+    """
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = file.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        file.close()
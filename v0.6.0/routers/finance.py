@@ -6,17 +6,20 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 
-from database import get_db
+from core import heavy_report
+from database import get_db, get_db_since, get_db_if_archived
 from services import FinanceService
 from schemas import ExpenseCreate, CompanyBalanceCreate, FinanceSummaryResponse
 
 router = APIRouter(prefix="/api/finance", tags=["finance"])
 
+# Тяжелые отчеты: синхронный обработчик считается в пуле потоков под лимитом heavy_report
 @router.get("/summary", response_model=dict)
-async def get_finance_summary(
+@heavy_report()
+def get_finance_summary(
     date_from: Optional[str] = Query(None),
     date_to: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_since)
 ):
     """
     Получение финансовой сводки за период.
@@ -30,7 +33,7 @@ async def get_transactions(
     transaction_type: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_if_archived)
 ):
     """
     Получение истории финансовых транзакций с фильтрацией и пагинацией.
@@ -38,7 +41,8 @@ async def get_transactions(
     return FinanceService.get_transaction_history(db, date_from, date_to, transaction_type, page, limit)
 
 @router.get("/forecast", response_model=dict)
-async def get_cash_flow_forecast(
+@heavy_report()
+def get_cash_flow_forecast(
     months_ahead: int = Query(3, ge=1, le=12),
     db: Session = Depends(get_db)
 ):
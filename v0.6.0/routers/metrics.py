@@ -0,0 +1,20 @@
+"""
+Роутер метрик в формате Prometheus.
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core import metrics_registry
+
+router = APIRouter(tags=["metrics"])
+
+# Версия текстового формата экспозиции Prometheus
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """
+    Метрики всех воркеров: запросы и их длительность по маршрутам,
+    запросы в работе, SQL на запрос, кэши, размеры ответов.
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
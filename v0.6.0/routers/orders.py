@@ -6,7 +6,7 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 
-from database import get_db
+from database import get_db, get_db_if_archived, archived_before, HistorySessionLocal
 from services import OrderService as OrderServiceClass
 from schemas import OrderCreate, OrderUpdate, OrderResponse, OrderProfitResponse
 
@@ -20,7 +20,7 @@ async def get_orders(
     date_to: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db_if_archived)
 ):
     """
     Получение списка заказов с фильтрацией и пагинацией.
@@ -33,6 +33,10 @@ async def get_order(order_id: int = Path(...), db: Session = Depends(get_db)):
     Получение информации о конкретном заказе.
     """
     order = OrderServiceClass.get_order_details(db, order_id)
+    if not order and archived_before():
+        # Закрытый заказ мог быть перенесен в архив
+        with HistorySessionLocal() as history_db:
+            order = OrderServiceClass.get_order_details(history_db, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Заказ не найден")
     return order
@@ -77,6 +81,9 @@ async def get_order_profit(order_id: int = Path(...), db: Session = Depends(get_
     Расчет прибыли по заказу.
     """
     result = OrderServiceClass.calculate_order_profit(db, order_id)
+    if "error" in result and archived_before():
+        with HistorySessionLocal() as history_db:
+            result = OrderServiceClass.calculate_order_profit(history_db, order_id)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
\ No newline at end of file
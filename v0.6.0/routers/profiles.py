@@ -0,0 +1,27 @@
+"""
+Роутер файлов профилирования запросов (core/profiling.py).
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+
+from core import check_profile_token, profile_path, PROFILES_URL_PREFIX
+
+router = APIRouter(prefix=PROFILES_URL_PREFIX, tags=["profiles"])
+
+@router.get("/{profile_id}/{kind}", include_in_schema=False)
+def get_profile(
+    profile_id: str,
+    kind: str,
+    x_profile_token: Optional[str] = Header(None),
+    profile: Optional[str] = Query(None, description="Токен профилирования (вместо заголовка)")
+):
+    """
+    Flamegraph (speedscope.json) или список SQL (sql.json) профиля запроса.
+    Доступен только с токеном профилирования; без него — 404, как будто профилей нет.
+    """
+    path = profile_path(profile_id, kind) if check_profile_token(x_profile_token or profile) else None
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="application/json", filename=path.name)
@@ -0,0 +1,23 @@
+"""
+Роутер сводных отчетов по всем филиалам.
+"""
+from fastapi import APIRouter, Depends, Query
+from typing import Optional
+
+from core import heavy_report, require_admin_token
+from services import RollupService
+
+# Сводка показывает данные всех филиалов — только с токеном администратора (X-Admin-Token)
+router = APIRouter(prefix="/api/rollup", tags=["rollup"], dependencies=[Depends(require_admin_token)])
+
+@router.get("/summary", response_model=dict)
+@heavy_report()
+def get_rollup_summary(
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None)
+):
+    """
+    Финансовая сводка и клиенты по источникам за период: по каждому филиалу и итог по всем.
+    Филиалы считаются параллельно, каждый на своей базе.
+    """
+    return RollupService.get_summary(date_from, date_to)
@@ -6,4 +6,7 @@ from .client_service import ClientService
 from .service_service import ServiceService
 from .order_service import OrderService
 from .finance_service import FinanceService
-from .export_service import ExportService
\ No newline at end of file
+from .export_service import ExportService
+from .export_job_service import ExportJobService
+from .archive_service import ArchiveService
+from .rollup_service import RollupService
@@ -0,0 +1,193 @@
+"""
+Сервис архивации закрытых заказов.
+
+Завершенные и отмененные заказы старше границы вместе с услугами и
+монтажниками заказа, а также выплаты и финансовые транзакции старше границы
+переносятся из основной базы филиала в его файл архива (TenantDatabase.archive_path).
+Клиенты, сотрудники, услуги и расходы остаются в основной базе.
+
+Перенос идет пачками по ARCHIVE_BATCH_SIZE заказов: копирование в архив и
+удаление из основной базы — одна транзакция на оба файла (в режиме журнала
+rollback SQLite фиксирует их атомарно). В режиме WAL атомарности между
+файлами нет, поэтому сначала фиксируется копия, затем удаление: после сбоя
+строка может временно оказаться в обоих файлах, повторный запуск это
+исправляет (INSERT OR REPLACE).
+
+Строка с наибольшим id каждой таблицы в архив не переносится: у таблиц нет
+AUTOINCREMENT, и SQLite выдал бы ее id новой записи, совпадающей с архивной.
+"""
+import re
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy.orm import Session
+
+from config import ARCHIVE_BATCH_SIZE
+from database import current_tenant
+from models import Order, OrderService, OrderEmployee, Payment, FinancialTransaction
+
+# Закрытые заказы: их суммы и зарплаты больше не меняются
+CLOSED_ORDER_STATUSES = ("завершен", "отменен")
+
+# Таблицы архива в порядке переноса
+ARCHIVED_TABLES = [
+    Order.__tablename__, OrderService.__tablename__, OrderEmployee.__tablename__,
+    Payment.__tablename__, FinancialTransaction.__tablename__,
+]
+
+_CREATE_TABLE_RE = re.compile(r"^CREATE TABLE\s+(\"?\w+\"?)", re.IGNORECASE)
+_CREATE_INDEX_RE = re.compile(r"^CREATE (UNIQUE )?INDEX\s+(\"?\w+\"?)", re.IGNORECASE)
+
+class ArchiveService:
+    """
+    Сервис для переноса старых закрытых заказов в архив.
+    """
+
+    @staticmethod
+    def _table_columns(conn, schema: str, table: str) -> List[str]:
+        return [row[1] for row in conn.exec_driver_sql(f'PRAGMA {schema}.table_info("{table}")')]
+
+    @staticmethod
+    def _ensure_archive_schema(conn):
+        """
+        Таблицы и индексы архива по схеме основной базы; новые столбцы основной
+        базы добавляются в архив в том же порядке (представления истории
+        объединяют таблицы через SELECT *).
+        """
+        conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS archive.archive_meta (key TEXT PRIMARY KEY, value TEXT)")
+        for table in ARCHIVED_TABLES:
+            table_sql = conn.exec_driver_sql(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).scalar()
+            conn.exec_driver_sql(_CREATE_TABLE_RE.sub(f'CREATE TABLE IF NOT EXISTS archive."{table}"', table_sql))
+            archived_columns = ArchiveService._table_columns(conn, "archive", table)
+            for column, column_type in [
+                (row[1], row[2]) for row in conn.exec_driver_sql(f'PRAGMA main.table_info("{table}")')
+            ]:
+                if column not in archived_columns:
+                    conn.exec_driver_sql(f'ALTER TABLE archive."{table}" ADD COLUMN "{column}" {column_type}')
+            for (index_sql,) in conn.exec_driver_sql(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,)
+            ).fetchall():
+                conn.exec_driver_sql(_CREATE_INDEX_RE.sub(
+                    lambda match: f"CREATE {match.group(1) or ''}INDEX IF NOT EXISTS archive.{match.group(2)}",
+                    index_sql
+                ))
+
+    @staticmethod
+    def _move_batch(conn, wal: bool, moves: List[tuple]) -> List[int]:
+        """
+        Перенос строк, выбранных условиями moves [(таблица, условие WHERE)], одной пачкой.
+        Возвращает число перенесенных строк каждой таблицы.
+        """
+        counts = []
+        for table, where in moves:
+            columns = ", ".join(f'"{column}"' for column in ArchiveService._table_columns(conn, "main", table))
+            counts.append(conn.exec_driver_sql(
+                f'INSERT OR REPLACE INTO archive."{table}" ({columns}) SELECT {columns} FROM main."{table}" WHERE {where}'
+            ).rowcount)
+        if wal:
+            conn.exec_driver_sql("COMMIT")
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        for table, where in reversed(moves):
+            conn.exec_driver_sql(f'DELETE FROM main."{table}" WHERE {where}')
+        conn.exec_driver_sql("COMMIT")
+        return counts
+
+    @staticmethod
+    def archive_closed_orders(db: Session, before: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, Any]:
+        """
+        Перенос в архив закрытых заказов с датой раньше before (YYYY-MM-DD),
+        их услуг и монтажников, выплат и транзакций раньше before.
+        """
+        archive_path = current_tenant().archive_path
+        if archive_path is None:
+            return {"error": "Архив поддерживается только для базы SQLite в файле"}
+
+        started = time.perf_counter()
+        # Отдельное соединение с явными транзакциями: ATTACH нельзя выполнить внутри транзакции
+        conn = db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT")
+        wal = conn.exec_driver_sql("PRAGMA main.journal_mode").scalar().lower() == "wal"
+        conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (archive_path,))
+        try:
+            ArchiveService._ensure_archive_schema(conn)
+            # Граница записывается до переноса: отчеты за старый период сразу читают обе базы
+            boundary = conn.exec_driver_sql(
+                "SELECT value FROM archive.archive_meta WHERE key = 'archived_before'"
+            ).scalar()
+            conn.exec_driver_sql(
+                "INSERT OR REPLACE INTO archive.archive_meta (key, value) VALUES ('archived_before', ?)",
+                (max(boundary or before, before),)
+            )
+
+            guard = {
+                table: conn.exec_driver_sql(f'SELECT coalesce(max(id), 0) FROM main."{table}"').scalar()
+                for table in ARCHIVED_TABLES
+            }
+            # Заказы, которым принадлежат строки с наибольшим id, остаются вместе с этими строками
+            kept_orders = {guard[Order.__tablename__]} | {
+                conn.exec_driver_sql(f'SELECT order_id FROM main."{table}" WHERE id = ?', (guard[table],)).scalar()
+                for table in (OrderService.__tablename__, OrderEmployee.__tablename__)
+            }
+            kept_orders.discard(None)
+
+            conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+            batch = "SELECT id FROM temp.archive_batch"
+            statuses = ", ".join(f"'{status}'" for status in CLOSED_ORDER_STATUSES)
+            kept = ", ".join(str(order_id) for order_id in kept_orders) or "NULL"
+            counts = dict.fromkeys(ARCHIVED_TABLES, 0)
+
+            # Пачки: таблицы, выборка id пачки и условия строк каждой таблицы
+            selections = [
+                ([Order.__tablename__, OrderService.__tablename__, OrderEmployee.__tablename__],
+                 f'SELECT id FROM main."{Order.__tablename__}" WHERE status IN ({statuses}) '
+                 f"AND order_date < ? AND id NOT IN ({kept}) ORDER BY id LIMIT ?",
+                 [f"id IN ({batch})", f"order_id IN ({batch})", f"order_id IN ({batch})"]),
+                ([Payment.__tablename__],
+                 f'SELECT id FROM main."{Payment.__tablename__}" WHERE payment_date < ? '
+                 f"AND id <> {guard[Payment.__tablename__]} ORDER BY id LIMIT ?",
+                 [f"id IN ({batch})"]),
+                ([FinancialTransaction.__tablename__],
+                 f'SELECT id FROM main."{FinancialTransaction.__tablename__}" WHERE transaction_date < ? '
+                 f"AND id <> {guard[FinancialTransaction.__tablename__]} ORDER BY id LIMIT ?",
+                 [f"id IN ({batch})"]),
+            ]
+            for tables, select_ids, conditions in selections:
+                while True:
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    conn.exec_driver_sql("DELETE FROM temp.archive_batch")
+                    selected = conn.exec_driver_sql(
+                        f"INSERT INTO temp.archive_batch {select_ids}", (before, batch_size)
+                    ).rowcount
+                    if not selected:
+                        conn.exec_driver_sql("COMMIT")
+                        break
+                    moved = ArchiveService._move_batch(conn, wal, list(zip(tables, conditions)))
+                    for table, count in zip(tables, moved):
+                        counts[table] += count
+
+            conn.exec_driver_sql(
+                "INSERT OR REPLACE INTO archive.archive_meta (key, value) VALUES ('archived_at', ?)",
+                (time.strftime("%Y-%m-%d %H:%M:%S"),)
+            )
+            conn.exec_driver_sql("ANALYZE archive")
+        except Exception:
+            if conn.connection.dbapi_connection.in_transaction:
+                conn.exec_driver_sql("ROLLBACK")
+            raise
+        finally:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS temp.archive_batch")
+            conn.exec_driver_sql("DETACH DATABASE archive")
+            conn.close()
+
+        return {
+            "before": before,
+            "archive_path": archive_path,
+            "orders": counts[Order.__tablename__],
+            "order_services": counts[OrderService.__tablename__],
+            "order_employees": counts[OrderEmployee.__tablename__],
+            "payments": counts[Payment.__tablename__],
+            "transactions": counts[FinancialTransaction.__tablename__],
+            "seconds": round(time.perf_counter() - started, 3),
+        }
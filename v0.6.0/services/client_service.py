@@ -4,8 +4,10 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_, and_
+from sqlalchemy import desc, or_, and_, func
 
+from core import fetch_rows
+from database import session_with_archive
 from models import Client, Order
 from schemas import ClientCreate, ClientUpdate
 
@@ -25,7 +27,9 @@ class ClientService:
         """
         Получение списка клиентов с фильтрацией и пагинацией.
         """
-        query = db.query(Client).order_by(desc(Client.created_at))
+        query = db.query(
+            Client.id, Client.name, Client.phone, Client.source, Client.created_at, Client.updated_at
+        ).order_by(desc(Client.created_at))
         
         # Поиск по имени или телефону
         if search:
@@ -43,25 +47,15 @@ class ClientService:
         # Получаем общее количество записей
         total_count = query.count()
         
-        # Применяем пагинацию
-        clients = query.offset((page - 1) * limit).limit(limit).all()
+        # Применяем пагинацию: строки сразу в словари, без ORM-объектов
+        clients_with_orders = fetch_rows(db, query.offset((page - 1) * limit).limit(limit))
         
-        # Подсчет заказов для каждого клиента
-        clients_with_orders = []
-        for client in clients:
-            order_count = db.query(Order).filter(Order.client_id == client.id).count()
-            
-            client_dict = {
-                "id": client.id,
-                "name": client.name,
-                "phone": client.phone,
-                "source": client.source,
-                "created_at": client.created_at,
-                "updated_at": client.updated_at,
-                "order_count": order_count
-            }
-            
-            clients_with_orders.append(client_dict)
+        # Количество заказов для всей страницы одним запросом
+        order_counts = dict(db.query(Order.client_id, func.count(Order.id)).filter(
+            Order.client_id.in_([client["id"] for client in clients_with_orders])
+        ).group_by(Order.client_id).all()) if clients_with_orders else {}
+        for client in clients_with_orders:
+            client["order_count"] = order_counts.get(client["id"], 0)
         
         # Общее количество страниц
         total_pages = (total_count + limit - 1) // limit
@@ -188,8 +182,9 @@ class ClientService:
         if not client:
             return {"error": "Клиент не найден"}
         
-        # Проверяем, есть ли у клиента заказы
-        has_orders = db.query(Order).filter(Order.client_id == client_id).first()
+        # Проверяем, есть ли у клиента заказы (в том числе перенесенные в архив)
+        with session_with_archive(db) as orders_db:
+            has_orders = orders_db.query(Order.id).filter(Order.client_id == client_id).first()
         if has_orders:
             return {"error": "Нельзя удалить клиента с существующими заказами"}
         
@@ -209,11 +204,7 @@ class ClientService:
         from sqlalchemy import func
         from config import CLIENT_SOURCES
         
-        stats = {}
-        
-        # Подсчитываем количество клиентов по каждому источнику
-        for source in CLIENT_SOURCES:
-            count = db.query(func.count(Client.id)).filter(Client.source == source).scalar()
-            stats[source] = count
+        # Количество клиентов по всем источникам одним запросом
+        counts = dict(db.query(Client.source, func.count(Client.id)).group_by(Client.source).all())
         
-        return stats
\ No newline at end of file
+        return {source: counts.get(source, 0) for source in CLIENT_SOURCES}
\ No newline at end of file
@@ -6,6 +6,7 @@ from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, or_
 
+from core import fetch_rows
 from models import Employee, Order, OrderService, OrderEmployee, Payment, Service
 from schemas import EmployeeCreate, EmployeeUpdate
 from config import MANAGER_BASE_SALARY, MANAGER_ORDER_COMMISSION, DEFAULT_MOUNT_PRICE, MANAGER_MOUNT_UPSELL_PERCENT
@@ -28,7 +29,10 @@ class EmployeeService:
         """
         Получение списка сотрудников с фильтрацией и пагинацией.
         """
-        query = db.query(Employee)
+        query = db.query(
+            Employee.id, Employee.name, Employee.phone, Employee.employee_type,
+            Employee.base_salary, Employee.active, Employee.created_at, Employee.updated_at
+        )
         
         if employee_type:
             query = query.filter(Employee.employee_type == employee_type)
@@ -41,22 +45,8 @@ class EmployeeService:
         # Получаем общее количество записей
         total_count = query.count()
         
-        # Применяем пагинацию
-        employees = query.offset((page - 1) * limit).limit(limit).all()
-        
-        # Преобразуем в словари для правильной сериализации
-        employees_dict = []
-        for emp in employees:
-            employees_dict.append({
-                "id": emp.id,
-                "name": emp.name,
-                "phone": emp.phone,
-                "employee_type": emp.employee_type,
-                "base_salary": emp.base_salary,
-                "active": emp.active,
-                "created_at": emp.created_at,
-                "updated_at": emp.updated_at
-            })
+        # Применяем пагинацию: строки сразу в словари, без ORM-объектов
+        employees_dict = fetch_rows(db, query.offset((page - 1) * limit).limit(limit))
         
         # Общее количество страниц
         total_pages = (total_count + limit - 1) // limit
@@ -224,14 +214,70 @@ class EmployeeService:
         """
         Расчет зарплаты сотрудника за указанный месяц.
         """
+        return EmployeeService.calculate_salaries(db, [employee_id], month).get(employee_id)
+    
+    @staticmethod
+    def calculate_salaries(db: Session, employee_ids: List[int], month: Optional[str] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Расчет зарплаты сотрудников за указанный месяц: id сотрудника -> расчет
+        (несуществующие сотрудники пропускаются). Заказы, услуги, монтажники и
+        выплаты месяца загружаются для всех сотрудников сразу — число запросов
+        не зависит от числа сотрудников и заказов.
+        """
         # Если месяц не указан, используем текущий
         if not month:
             month = datetime.now().strftime("%Y-%m")
         
-        employee = db.query(Employee).filter(Employee.id == employee_id).first()
+        employees = db.query(Employee).filter(Employee.id.in_(employee_ids)).all() if employee_ids else []
+        if not employees:
+            return {}
+        ids = [employee.id for employee in employees]
+        month_completed = (Order.order_date.like(f"{month}%"), Order.status == "завершен")
+        
+        # Все завершенные заказы за месяц, их услуги и справочник услуг
+        orders = db.query(Order).filter(*month_completed).all()
+        orders_by_id = {order.id: order for order in orders}
+        order_services: Dict[int, List[OrderService]] = {}
+        for os in db.query(OrderService).join(Order, Order.id == OrderService.order_id).filter(*month_completed):
+            order_services.setdefault(os.order_id, []).append(os)
+        services = {service.id: service for service in db.query(Service).all()}
+        
+        # Участие монтажников в заказах месяца
+        installer_orders: Dict[int, List[OrderEmployee]] = {}
+        for order_emp in db.query(OrderEmployee).filter(
+            OrderEmployee.employee_id.in_(ids),
+            OrderEmployee.employee_type == "монтажник"
+        ).join(Order).filter(*month_completed):
+            installer_orders.setdefault(order_emp.employee_id, []).append(order_emp)
+        
+        # Выплаты и штрафы за месяц
+        payments: Dict[int, List[Payment]] = {}
+        for payment in db.query(Payment).filter(Payment.employee_id.in_(ids), Payment.payment_date.like(f"{month}%")):
+            payments.setdefault(payment.employee_id, []).append(payment)
         
-        if not employee:
-            return None
+        return {
+            employee.id: EmployeeService._employee_salary(
+                employee, month, orders, orders_by_id, order_services, services,
+                installer_orders.get(employee.id, []), payments.get(employee.id, [])
+            )
+            for employee in employees
+        }
+    
+    @staticmethod
+    def _employee_salary(
+        employee: Employee,
+        month: str,
+        orders: List[Order],
+        orders_by_id: Dict[int, Order],
+        order_services: Dict[int, List[OrderService]],
+        services: Dict[int, Service],
+        installer_orders: List[OrderEmployee],
+        payments: List[Payment]
+    ) -> Dict[str, Any]:
+        """
+        Расчет зарплаты одного сотрудника по уже загруженным данным месяца.
+        """
+        employee_id = employee.id
         
         # Инициализация результата
         result = {
@@ -261,15 +307,9 @@ class EmployeeService:
             result["salary"] += employee.base_salary
             result["details"]["base_salary"] = employee.base_salary
         
-        # Получаем все завершенные заказы за месяц
-        orders_query = db.query(Order).filter(
-            Order.order_date.like(f"{month}%"),
-            Order.status == "завершен"
-        )
-        
         # Расчет для менеджера
         if employee.employee_type == "менеджер":
-            manager_orders = orders_query.filter(Order.manager_id == employee_id).all()
+            manager_orders = [order for order in orders if order.manager_id == employee_id]
             
             for order in manager_orders:
                 order_data = {
@@ -283,15 +323,15 @@ class EmployeeService:
                 result["salary"] += MANAGER_ORDER_COMMISSION
                 result["details"]["order_payments"] += MANAGER_ORDER_COMMISSION
                 
-                # Получаем все услуги заказа, чтобы определить тип кондиционера
-                order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
+                # Услуги заказа, чтобы определить тип кондиционера
+                services_of_order = order_services.get(order.id, [])
                 
                 # Определяем стандартную стоимость монтажа в зависимости от типа кондиционера
                 standard_mount_price = DEFAULT_MOUNT_PRICE_7_9  # По умолчанию для 7 и 9 БТЮ
                 ac_power = None
                 
-                for os in order_services:
-                    service = db.query(Service).filter(Service.id == os.service_id).first()
+                for os in services_of_order:
+                    service = services.get(os.service_id)
                     if service and service.category == "Кондиционер":
                         if service.power_type in ["12 БТЮ", "18 БТЮ"]:
                             standard_mount_price = DEFAULT_MOUNT_PRICE_12_18
@@ -308,9 +348,9 @@ class EmployeeService:
                     order_data["amount"] += mount_bonus
                     order_data["type"] += f", Повышение цены монтажа ({ac_power if ac_power else 'стандарт'}): {mount_bonus:.2f}"
                 
-                # Получаем все услуги заказа
-                for os in order_services:
-                    service = db.query(Service).filter(Service.id == os.service_id).first()
+                # Все услуги заказа
+                for os in services_of_order:
+                    service = services.get(os.service_id)
                     
                     if service:
                         profit = os.selling_price - (service.purchase_price or 0)
@@ -337,19 +377,9 @@ class EmployeeService:
         
         # Расчет для монтажника
         elif employee.employee_type == "монтажник":
-            # Получаем заказы, где сотрудник был монтажником
-            installer_orders_query = db.query(OrderEmployee).filter(
-                OrderEmployee.employee_id == employee_id,
-                OrderEmployee.employee_type == "монтажник"
-            ).join(Order).filter(
-                Order.order_date.like(f"{month}%"),
-                Order.status == "завершен"
-            )
-            
-            installer_orders = installer_orders_query.all()
-            
+            # Заказы, где сотрудник был монтажником
             for order_emp in installer_orders:
-                order = db.query(Order).filter(Order.id == order_emp.order_id).first()
+                order = orders_by_id.get(order_emp.order_id)
                 
                 if order:
                     # Убедимся, что мы используем правильную сумму - 1500
@@ -366,14 +396,11 @@ class EmployeeService:
                     result["salary"] += base_payment
                     result["details"]["order_payments"] += base_payment
                     
-                    # Получаем услуги, проданные монтажником
-                    services_sold = db.query(OrderService).filter(
-                        OrderService.order_id == order.id,
-                        OrderService.sold_by_id == employee_id
-                    ).all()
+                    # Услуги, проданные монтажником
+                    services_sold = [os for os in order_services.get(order.id, []) if os.sold_by_id == employee_id]
                     
                     for os in services_sold:
-                        service = db.query(Service).filter(Service.id == os.service_id).first()
+                        service = services.get(os.service_id)
                         
                         if service and not service.is_manager_bonus:
                             # Фиксированная оплата за продажу услуги - 250 рублей
@@ -388,8 +415,8 @@ class EmployeeService:
         
         # Расчет для владельца
         elif employee.employee_type == "владелец":
-            # Находим все заказы за месяц
-            owner_orders = orders_query.all()
+            # Все заказы за месяц
+            owner_orders = orders
             
             for order in owner_orders:
                 # 1500 за каждый монтаж
@@ -406,12 +433,7 @@ class EmployeeService:
                 result["details"]["breakdown"]["orders"].append(order_data)
         
         # Учитываем выплаты и штрафы
-        payments_query = db.query(Payment).filter(
-            Payment.employee_id == employee_id,
-            Payment.payment_date.like(f"{month}%")
-        )
-        
-        for payment in payments_query.all():
+        for payment in payments:
             result["paid"] += payment.amount
             
             result["details"]["breakdown"]["payments"].append({
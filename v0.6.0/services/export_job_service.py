@@ -0,0 +1,323 @@
+"""
+Сервис фоновых задач экспорта.
+
+Задача ставится в очередь, выполняется в пуле потоков, а готовый файл
+сохраняется на диск и хранится EXPORT_JOB_TTL_SECONDS. Метаданные задач
+лежат рядом с файлами в JSON, поэтому статус виден из любого процесса.
+Задача выполняется на базе филиала, который ее поставил, и видна только ему.
+"""
+import os
+import re
+import json
+import time
+import threading
+import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+from config import EXPORT_JOBS_DIR, EXPORT_JOB_TTL_SECONDS, EXPORT_JOB_WORKERS, SINGLE_TENANT
+from core import process_alive
+from core.tenancy import current_tenant_name, tenant_scope
+from database import SessionLocal, HistorySessionLocal, needs_archive
+from services.export_service import ExportService, export_progress
+
+# Выполняемая задача без обновлений дольше этого времени считается прерванной (процесс перезапущен)
+EXPORT_JOB_STALE_SECONDS = 10 * 60
+# Период обновления updated_at выполняемой задачи, даже если новых строк нет
+EXPORT_JOB_HEARTBEAT_SECONDS = 60
+# Задача в очереди живет только в пуле потоков процесса, который ее поставил: она прервана, если процесса
+# больше нет или она ждет дольше этого времени
+EXPORT_JOB_QUEUE_TIMEOUT_SECONDS = 60 * 60
+
+# Типы экспорта: метод ExportService и принимаемые им фильтры
+EXPORT_JOB_KINDS = {
+    "orders": (ExportService.export_orders, ["status", "client_name", "date_from", "date_to"]),
+    "clients": (ExportService.export_clients, ["search", "source"]),
+    "services": (ExportService.export_services, ["search", "category"]),
+    "employees": (ExportService.export_employees, ["employee_type", "active", "month"]),
+    "finances": (ExportService.export_finances, ["date_from", "date_to"]),
+}
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+# Метаданные задачи обновляют и поток экспорта, и поток heartbeat
+_job_lock = threading.Lock()
+
+class ExportJobService:
+    """
+    Сервис для постановки, выполнения и выдачи результатов фоновых экспортов.
+    """
+
+    @staticmethod
+    def submit_job(kind: str, format: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Постановка экспорта в очередь. Пока задача с теми же параметрами
+        в очереди или выполняется, возвращается она же, а не новая.
+        Фильтры, которые не относятся к типу экспорта, отбрасываются.
+        """
+        if kind not in EXPORT_JOB_KINDS:
+            return {"error": f"Неизвестный тип экспорта. Допустимые значения: {', '.join(EXPORT_JOB_KINDS)}"}
+        if format not in ("csv", "xlsx", "parquet", "arrow"):
+            return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx, parquet, arrow"}
+        if format in ("parquet", "arrow") and kind != "finances":
+            return {"error": "Форматы parquet и arrow доступны только для экспорта финансов"}
+
+        _, filter_names = EXPORT_JOB_KINDS[kind]
+        params = {"format": format}
+        params.update({name: filters.get(name) for name in filter_names})
+
+        os.makedirs(EXPORT_JOBS_DIR, exist_ok=True)
+        ExportJobService.cleanup_expired_jobs()
+
+        tenant = current_tenant_name()
+        params_hash = hashlib.sha256(
+            json.dumps({"tenant": tenant, "kind": kind, "params": params}, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "tenant": tenant,
+            "params_hash": params_hash,
+            "status": "queued",
+            "pid": os.getpid(),
+            "kind": kind,
+            "params": params,
+            "rows_written": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        ExportJobService._write_job(job)
+
+        # Блокировка создается через os.link: файл появляется атомарно и сразу с ID задачи
+        lock_path = os.path.join(EXPORT_JOBS_DIR, f"{params_hash}.lock")
+        tmp_lock_path = f"{lock_path}.{job['job_id']}.tmp"
+        with open(tmp_lock_path, "w", encoding="utf-8") as f:
+            f.write(job["job_id"])
+        try:
+            os.link(tmp_lock_path, lock_path)
+        except FileExistsError:
+            with open(lock_path, encoding="utf-8") as f:
+                existing = ExportJobService.get_job(f.read().strip())
+            if existing and ExportJobService._is_active(existing):
+                ExportJobService._remove_file(ExportJobService._path(job["job_id"], ".json"))
+                return existing
+            # Блокировка осталась от завершенной или прерванной задачи
+            os.replace(tmp_lock_path, lock_path)
+        finally:
+            ExportJobService._remove_file(tmp_lock_path)
+
+        _executor.submit(ExportJobService._run_job, job["job_id"])
+        return job
+
+    @staticmethod
+    def _session_for(params: Dict[str, Any]):
+        """
+        Сессия истории (горячая база и архив), если период выгрузки захватывает архив.
+        """
+        if "date_from" in params and needs_archive(params["date_from"]):
+            return HistorySessionLocal()
+        if params.get("month") and needs_archive(f"{params['month']}-01"):
+            return HistorySessionLocal()
+        return SessionLocal()
+
+    @staticmethod
+    def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Получение задачи по ID. Зависшая задача помечается как прерванная.
+        """
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id or ""):
+            return None
+        try:
+            with open(ExportJobService._path(job_id, ".json"), encoding="utf-8") as f:
+                job = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if job["status"] in ("queued", "running") and not ExportJobService._is_active(job):
+            ExportJobService._update_job(job, status="failed", error="Задача прервана", finished_at=time.time())
+        return job
+
+    @staticmethod
+    def get_tenant_job(job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Задача филиала текущего запроса: задачи других филиалов не видны.
+        """
+        job = ExportJobService.get_job(job_id)
+        if job and job.get("tenant", SINGLE_TENANT) != current_tenant_name():
+            return None
+        return job
+
+    @staticmethod
+    def job_to_dict(job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Представление задачи для API.
+        """
+        finished_at = job.get("finished_at")
+        return {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "kind": job["kind"],
+            "format": job["params"]["format"],
+            "rows_written": job["rows_written"],
+            "size": job.get("size"),
+            "filename": job.get("filename"),
+            "error": job.get("error"),
+            "created_at": datetime.fromtimestamp(job["created_at"]).isoformat(),
+            "finished_at": datetime.fromtimestamp(finished_at).isoformat() if finished_at else None,
+            "expires_at": datetime.fromtimestamp(finished_at + EXPORT_JOB_TTL_SECONDS).isoformat() if finished_at else None,
+            "download_url": f"/api/export/jobs/{job['job_id']}/download" if job["status"] == "done" else None
+        }
+
+    @staticmethod
+    def artifact_path(job: Dict[str, Any]) -> str:
+        """
+        Путь к готовому файлу задачи.
+        """
+        return ExportJobService._path(job["job_id"], f".{job['params']['format']}")
+
+    @staticmethod
+    def cleanup_expired_jobs():
+        """
+        Удаление завершенных задач старше TTL и брошенных временных файлов.
+        """
+        if not os.path.isdir(EXPORT_JOBS_DIR):
+            return
+
+        now = time.time()
+        for name in os.listdir(EXPORT_JOBS_DIR):
+            path = os.path.join(EXPORT_JOBS_DIR, name)
+            if name.endswith(".json"):
+                job = ExportJobService.get_job(name[:-len(".json")])
+                if job and not ExportJobService._is_active(job) and now - job["updated_at"] > EXPORT_JOB_TTL_SECONDS:
+                    ExportJobService._remove_file(ExportJobService.artifact_path(job))
+                    ExportJobService._remove_file(path)
+            elif name.endswith((".part", ".tmp", ".lock")):
+                try:
+                    if now - os.path.getmtime(path) > EXPORT_JOB_TTL_SECONDS:
+                        ExportJobService._remove_file(path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _run_job(job_id: str):
+        """
+        Выполнение задачи экспорта в потоке пула.
+        """
+        job = ExportJobService.get_job(job_id)
+        if not job:
+            return
+        # Поток пула не знает филиала запроса: задача выполняется на базе своего филиала
+        with tenant_scope(job.get("tenant", SINGLE_TENANT)):
+            ExportJobService._execute_job(job)
+
+    @staticmethod
+    def _execute_job(job: Dict[str, Any]):
+        # Задача уже помечена прерванной (истекло ожидание в очереди)
+        if job["status"] != "queued":
+            return
+
+        artifact_path = ExportJobService.artifact_path(job)
+        part_path = f"{artifact_path}.part"
+
+        def on_progress(rows: int):
+            ExportJobService._update_job(job, rows_written=job["rows_written"] + rows)
+
+        db = ExportJobService._session_for(job["params"])
+        token = export_progress.set(on_progress)
+        stop_heartbeat = threading.Event()
+        try:
+            ExportJobService._update_job(job, status="running")
+            threading.Thread(
+                target=ExportJobService._heartbeat, args=(job, stop_heartbeat),
+                name=f"export-heartbeat-{job['job_id'][:8]}", daemon=True
+            ).start()
+            export, _ = EXPORT_JOB_KINDS[job["kind"]]
+            result = export(db, **job["params"])
+            if "error" in result:
+                raise ValueError(result["error"])
+
+            data = result["data"]
+            with open(part_path, "wb") as f:
+                if isinstance(data, str):
+                    f.write(data.encode("utf-8"))
+                elif isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    for block in data:
+                        f.write(block)
+
+            os.replace(part_path, artifact_path)
+            ExportJobService._update_job(
+                job,
+                status="done",
+                filename=result["filename"],
+                media_type=result["media_type"],
+                size=os.path.getsize(artifact_path),
+                finished_at=time.time()
+            )
+        except Exception as e:
+            ExportJobService._remove_file(part_path)
+            ExportJobService._update_job(job, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            stop_heartbeat.set()
+            export_progress.reset(token)
+            db.close()
+            ExportJobService._release_lock(job)
+
+    @staticmethod
+    def _heartbeat(job: Dict[str, Any], stop: threading.Event):
+        """
+        Обновление updated_at, пока задача выполняется: долгий запрос или сборка
+        xlsx без новых строк не должны выглядеть как прерванная задача.
+        """
+        while not stop.wait(EXPORT_JOB_HEARTBEAT_SECONDS):
+            ExportJobService._update_job(job)
+
+    @staticmethod
+    def _path(job_id: str, suffix: str) -> str:
+        return os.path.join(EXPORT_JOBS_DIR, f"{job_id}{suffix}")
+
+    @staticmethod
+    def _is_active(job: Dict[str, Any]) -> bool:
+        # Задача в очереди не обновляется, пока ждет свободный поток: она жива, пока жив поставивший ее процесс
+        if job["status"] == "queued":
+            return process_alive(job.get("pid")) and time.time() - job["created_at"] < EXPORT_JOB_QUEUE_TIMEOUT_SECONDS
+        return job["status"] == "running" and time.time() - job["updated_at"] < EXPORT_JOB_STALE_SECONDS
+
+    @staticmethod
+    def _write_job(job: Dict[str, Any]):
+        """
+        Атомарная запись метаданных задачи (через временный файл и os.replace).
+        """
+        path = ExportJobService._path(job["job_id"], ".json")
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _update_job(job: Dict[str, Any], **changes):
+        with _job_lock:
+            job.update(changes, updated_at=time.time())
+            ExportJobService._write_job(job)
+
+    @staticmethod
+    def _release_lock(job: Dict[str, Any]):
+        """
+        Снятие блокировки дедупликации, если она все еще принадлежит задаче.
+        """
+        lock_path = os.path.join(EXPORT_JOBS_DIR, f"{job['params_hash']}.lock")
+        try:
+            with open(lock_path, encoding="utf-8") as f:
+                if f.read().strip() == job["job_id"]:
+                    ExportJobService._remove_file(lock_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -3,18 +3,48 @@
 """
 import io
 import csv
-import openpyxl
-from openpyxl.styles import Font
+import tempfile
+from contextvars import ContextVar
+from itertools import chain, islice
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func
 
 from models import Order, Client, Service, Employee, Expense, Payment
 from services.order_service import OrderService as OrderSvc
 from services.employee_service import EmployeeService
 from services.finance_service import FinanceService
 
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Количество первых строк листа, по которым оценивается ширина столбцов
+XLSX_WIDTH_SAMPLE_ROWS = 200
+
+# Размер XLSX-файла в памяти, после которого он сбрасывается во временный файл на диске
+XLSX_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+ARROW_MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file"
+}
+
+# Строк в одной группе parquet (в одном пакете arrow)
+ARROW_ROW_GROUP_SIZE = 64 * 1024
+
+# Количество строк CSV в одном блоке потоковой отдачи
+CSV_BLOCK_ROWS = 1000
+
+# Размер блока при отдаче готового XLSX-файла клиенту
+XLSX_STREAM_BLOCK_SIZE = 64 * 1024
+
+# Обработчик прогресса (получает число новых выгруженных строк).
+# Задается фоновой задачей экспорта, при обычном запросе не используется
+export_progress: ContextVar[Optional[Callable[[int], None]]] = ContextVar("export_progress", default=None)
+
+# Через сколько строк сообщать о прогрессе
+EXPORT_PROGRESS_STEP = 500
+
 class ExportService:
     """
     Сервис для экспорта данных в различные форматы.
@@ -36,41 +66,27 @@ class ExportService:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"export_orders_{timestamp}.{format}"
         
-        # Получаем заказы с фильтрацией
-        orders_data = OrderSvc.get_orders(
-            db=db,
-            status=status,
-            client_name=client_name,
-            date_from=date_from,
-            date_to=date_to,
-            page=1,
-            limit=1000  # Для экспорта берем максимум 1000 заказов
-        )
+        # Заказы читаются пачками, строки отдаются по мере чтения,
+        # поэтому объем выгрузки не ограничен и не держится в памяти целиком
+        headers = [
+            "ID", "Клиент", "Телефон", "Менеджер", "Монтажники",
+            "Дата заказа", "Дата завершения", "Статус", "Стоимость монтажа (₽)",
+            "Услуги", "Общая сумма (₽)", "Примечания"
+        ]
         
-        orders = orders_data["orders"]
+        def orders():
+            for chunk in OrderSvc.iter_orders_details(db, status, client_name, date_from, date_to):
+                yield from chunk
         
-        if format == "csv":
-            # Экспорт в CSV
-            output = io.StringIO()
-            writer = csv.writer(output, lineterminator='\n')
-            
-            # Заголовки
-            headers = [
-                "ID", "Клиент", "Телефон", "Менеджер", "Монтажники",
-                "Дата заказа", "Дата завершения", "Статус", "Стоимость монтажа (₽)",
-                "Услуги", "Общая сумма (₽)", "Примечания"
-            ]
-            writer.writerow(headers)
-            
-            # Данные
-            for order in orders:
+        def rows():
+            for order in ExportService._track(orders()):
                 # Формируем строку монтажников
                 installers = ", ".join([emp["name"] for emp in order["employees"] if emp["employee_type"] == "монтажник"])
                 
                 # Формируем строку услуг
                 services = ", ".join([svc["name"] for svc in order["services"]])
                 
-                row = [
+                yield [
                     order["id"],
                     order["client"]["name"] if order["client"] else "-",
                     order["client"]["phone"] if order["client"] else "-",
@@ -84,72 +100,18 @@ class ExportService:
                     order["total_price"],
                     order["notes"] if order["notes"] else "-"
                 ]
-                writer.writerow(row)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "text/csv"}
+        
+        if format == "csv":
+            # Экспорт в CSV
+            return {"data": ExportService._iter_csv(headers, rows()), "filename": filename, "media_type": "text/csv"}
         
         elif format == "xlsx":
-            # Экспорт в Excel
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Заказы"
-            
-            # Заголовки
-            headers = [
-                "ID", "Клиент", "Телефон", "Менеджер", "Монтажники",
-                "Дата заказа", "Дата завершения", "Статус", "Стоимость монтажа (₽)",
-                "Услуги", "Общая сумма (₽)", "Примечания"
-            ]
-            sheet.append(headers)
-            
-            # Выделяем заголовки жирным
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-            
-            # Данные
-            for order in orders:
-                # Формируем строку монтажников
-                installers = ", ".join([emp["name"] for emp in order["employees"] if emp["employee_type"] == "монтажник"])
-                
-                # Формируем строку услуг
-                services = ", ".join([svc["name"] for svc in order["services"]])
-                
-                row = [
-                    order["id"],
-                    order["client"]["name"] if order["client"] else "-",
-                    order["client"]["phone"] if order["client"] else "-",
-                    order["manager"]["name"] if order["manager"] else "-",
-                    installers,
-                    order["order_date"],
-                    order["completion_date"] if order["completion_date"] else "-",
-                    order["status"],
-                    order["mount_price"],
-                    services,
-                    order["total_price"],
-                    order["notes"] if order["notes"] else "-"
-                ]
-                sheet.append(row)
-            
-            # Автоматическая ширина столбцов
-            for column in sheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    if cell.value:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                adjusted_width = (max_length + 2)
-                sheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Сохраняем в буфер
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+            # Экспорт в Excel: строки пишутся потоково, книга не строится в памяти
+            return {
+                "data": ExportService._build_xlsx([("Заказы", headers, rows())]),
+                "filename": filename,
+                "media_type": XLSX_MEDIA_TYPE
+            }
         
         else:
             return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx"}
@@ -190,6 +152,9 @@ class ExportService:
         # Получаем данные
         clients = query.all()
         
+        # Количество заказов всех клиентов одним сгруппированным запросом
+        order_counts = dict(db.query(Order.client_id, func.count(Order.id)).group_by(Order.client_id).all())
+        
         if format == "csv":
             # Экспорт в CSV
             output = io.StringIO()
@@ -200,9 +165,8 @@ class ExportService:
             writer.writerow(headers)
             
             # Данные
-            for client in clients:
-                # Подсчет заказов клиента
-                order_count = db.query(Order).filter(Order.client_id == client.id).count()
+            for client in ExportService._track(clients):
+                order_count = order_counts.get(client.id, 0)
                 
                 row = [
                     client.id,
@@ -218,55 +182,28 @@ class ExportService:
             return {"data": output.getvalue(), "filename": filename, "media_type": "text/csv"}
         
         elif format == "xlsx":
-            # Экспорт в Excel
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Клиенты"
-            
-            # Заголовки
+            # Экспорт в Excel: строки пишутся потоково, книга не строится в памяти
             headers = ["ID", "Имя", "Телефон", "Источник", "Дата регистрации", "Дата обновления", "Количество заказов"]
-            sheet.append(headers)
-            
-            # Выделяем заголовки жирным
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-            
-            # Данные
-            for client in clients:
-                # Подсчет заказов клиента
-                order_count = db.query(Order).filter(Order.client_id == client.id).count()
-                
-                row = [
-                    client.id,
-                    client.name,
-                    client.phone,
-                    client.source,
-                    client.created_at,
-                    client.updated_at if client.updated_at else "-",
-                    order_count
-                ]
-                sheet.append(row)
-            
-            # Автоматическая ширина столбцов
-            for column in sheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    if cell.value:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                adjusted_width = (max_length + 2)
-                sheet.column_dimensions[column_letter].width = adjusted_width
             
-            # Сохраняем в буфер
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+            def rows():
+                for client in ExportService._track(clients):
+                    order_count = order_counts.get(client.id, 0)
+                    
+                    yield [
+                        client.id,
+                        client.name,
+                        client.phone,
+                        client.source,
+                        client.created_at,
+                        client.updated_at if client.updated_at else "-",
+                        order_count
+                    ]
+            
+            return {
+                "data": ExportService._build_xlsx([("Клиенты", headers, rows())]),
+                "filename": filename,
+                "media_type": XLSX_MEDIA_TYPE
+            }
         
         else:
             return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx"}
@@ -315,7 +252,7 @@ class ExportService:
             writer.writerow(headers)
             
             # Данные
-            for service in services:
+            for service in ExportService._track(services):
                 row = [
                     service.id,
                     service.name,
@@ -334,60 +271,32 @@ class ExportService:
             return {"data": output.getvalue(), "filename": filename, "media_type": "text/csv"}
         
         elif format == "xlsx":
-            # Экспорт в Excel
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Услуги"
-            
-            # Заголовки
+            # Экспорт в Excel: строки пишутся потоково, книга не строится в памяти
             headers = [
                 "ID", "Название", "Категория", "Закупочная цена (₽)", "Продажная цена (₽)",
                 "Базовая цена", "Бонус менеджеру", "Бонус монтажнику (₽)", "Процент прибыли",
                 "Дата создания", "Дата обновления"
             ]
-            sheet.append(headers)
-            
-            # Выделяем заголовки жирным
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-            
-            # Данные
-            for service in services:
-                row = [
-                    service.id,
-                    service.name,
-                    service.category,
-                    service.purchase_price,
-                    service.selling_price,
-                    service.default_price if service.default_price else "-",
-                    "Да" if service.is_manager_bonus else "Нет",
-                    service.installer_bonus_fixed,
-                    f"{service.profit_margin_percent * 100:.0f}%",
-                    service.created_at,
-                    service.updated_at if service.updated_at else "-"
-                ]
-                sheet.append(row)
-            
-            # Автоматическая ширина столбцов
-            for column in sheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    if cell.value:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                adjusted_width = (max_length + 2)
-                sheet.column_dimensions[column_letter].width = adjusted_width
             
-            # Сохраняем в буфер
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+            rows = ([
+                service.id,
+                service.name,
+                service.category,
+                service.purchase_price,
+                service.selling_price,
+                service.default_price if service.default_price else "-",
+                "Да" if service.is_manager_bonus else "Нет",
+                service.installer_bonus_fixed,
+                f"{service.profit_margin_percent * 100:.0f}%",
+                service.created_at,
+                service.updated_at if service.updated_at else "-"
+            ] for service in ExportService._track(services))
+            
+            return {
+                "data": ExportService._build_xlsx([("Услуги", headers, rows)]),
+                "filename": filename,
+                "media_type": XLSX_MEDIA_TYPE
+            }
         
         else:
             return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx"}
@@ -427,11 +336,11 @@ class ExportService:
         # Получаем данные
         employees = query.all()
         
-        # Рассчитываем зарплаты
+        # Рассчитываем зарплаты всех сотрудников сразу
+        salaries = EmployeeService.calculate_salaries(db, [employee.id for employee in employees], month)
         employees_with_salary = []
         for employee in employees:
-            # Расчет зарплаты
-            salary_data = EmployeeService.calculate_salary(db, employee.id, month)
+            salary_data = salaries.get(employee.id)
             
             # Если не удалось рассчитать зарплату, пропускаем
             if not salary_data:
@@ -466,7 +375,7 @@ class ExportService:
             writer.writerow(headers)
             
             # Данные
-            for employee in employees_with_salary:
+            for employee in ExportService._track(employees_with_salary):
                 row = [
                     employee["id"],
                     employee["name"],
@@ -486,61 +395,33 @@ class ExportService:
             return {"data": output.getvalue(), "filename": filename, "media_type": "text/csv"}
         
         elif format == "xlsx":
-            # Экспорт в Excel
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Сотрудники"
-            
-            # Заголовки
+            # Экспорт в Excel: строки пишутся потоково, книга не строится в памяти
             headers = [
                 "ID", "Имя", "Телефон", "Тип сотрудника", "Базовая зарплата (₽)",
                 "Активен", "Заработано (₽)", "Выплачено (₽)", "К выплате (₽)",
                 "Количество заказов", "Дата создания", "Дата обновления"
             ]
-            sheet.append(headers)
-            
-            # Выделяем заголовки жирным
-            for cell in sheet[1]:
-                cell.font = Font(bold=True)
-            
-            # Данные
-            for employee in employees_with_salary:
-                row = [
-                    employee["id"],
-                    employee["name"],
-                    employee["phone"],
-                    employee["employee_type"],
-                    employee["base_salary"],
-                    "Да" if employee["active"] == 1 else "Нет",
-                    employee["salary"],
-                    employee["paid"],
-                    employee["to_pay"],
-                    employee["order_count"],
-                    employee["created_at"],
-                    employee["updated_at"] if employee["updated_at"] else "-"
-                ]
-                sheet.append(row)
             
-            # Автоматическая ширина столбцов
-            for column in sheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    if cell.value:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                adjusted_width = (max_length + 2)
-                sheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Сохраняем в буфер
-            output = io.BytesIO()
-            workbook.save(output)
-            output.seek(0)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+            rows = ([
+                employee["id"],
+                employee["name"],
+                employee["phone"],
+                employee["employee_type"],
+                employee["base_salary"],
+                "Да" if employee["active"] == 1 else "Нет",
+                employee["salary"],
+                employee["paid"],
+                employee["to_pay"],
+                employee["order_count"],
+                employee["created_at"],
+                employee["updated_at"] if employee["updated_at"] else "-"
+            ] for employee in ExportService._track(employees_with_salary))
+            
+            return {
+                "data": ExportService._build_xlsx([("Сотрудники", headers, rows)]),
+                "filename": filename,
+                "media_type": XLSX_MEDIA_TYPE
+            }
         
         else:
             return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx"}
@@ -559,29 +440,37 @@ class ExportService:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"export_finances_{timestamp}.{format}"
         
+        # Все транзакции за период читаются пачками по мере записи файла
+        def transactions():
+            for chunk in FinanceService.iter_transactions(db, date_from, date_to):
+                yield from chunk
+        
+        if format in ("parquet", "arrow"):
+            # Типизированная выгрузка транзакций для аналитики (без сводки)
+            def records():
+                for chunk in FinanceService.iter_transactions(db, date_from, date_to):
+                    yield [[
+                        transaction["id"],
+                        transaction["transaction_date"],
+                        transaction["transaction_type"],
+                        transaction["source_type"],
+                        transaction["source_id"],
+                        transaction["amount"],
+                        transaction["description"]
+                    ] for transaction in ExportService._track(chunk)]
+            
+            columns = [
+                ("id", "int64"), ("transaction_date", "timestamp"), ("transaction_type", "string"),
+                ("source_type", "string"), ("source_id", "int64"), ("amount", "float64"),
+                ("description", "string")
+            ]
+            return ExportService._arrow_result(columns, records(), format, filename)
+        
         # Получаем финансовую сводку
         summary = FinanceService.get_finance_summary(db, date_from, date_to)
         
-        # Получаем историю транзакций
-        transactions_data = FinanceService.get_transaction_history(
-            db=db,
-            date_from=date_from,
-            date_to=date_to,
-            page=1,
-            limit=1000  # Для экспорта берем максимум 1000 транзакций
-        )
-        
-        transactions = transactions_data["transactions"]
-        
         if format == "csv":
-            # Экспорт в CSV
-            output = io.StringIO()
-            writer = csv.writer(output, lineterminator='\n')
-            
-            # Заголовки для сводки
-            headers = ["Период", "", ""]
-            writer.writerow(headers)
-            
+            # Экспорт в CSV: сводка, затем транзакции потоком
             if date_from and date_to:
                 period = f"с {date_from} по {date_to}"
             elif date_from:
@@ -591,60 +480,44 @@ class ExportService:
             else:
                 period = "весь период"
             
-            writer.writerow([period, "", ""])
-            writer.writerow(["", "", ""])
-            
-            # Данные сводки
-            writer.writerow(["Выручка (₽)", summary["total_revenue"], ""])
-            writer.writerow(["Расходы (₽)", summary["total_expenses"], ""])
-            writer.writerow(["Комиссии (₽)", summary["total_commissions"], ""])
-            writer.writerow(["Прибыль (₽)", summary["total_profit"], ""])
-            writer.writerow(["Текущий баланс (₽)", summary["current_balance"], ""])
-            writer.writerow(["", "", ""])
-            
-            # Заголовки для расходов по категориям
-            writer.writerow(["Расходы по категориям", "", ""])
-            for category, amount in summary["expenses_by_category"].items():
-                writer.writerow([category, amount, ""])
-            
-            writer.writerow(["", "", ""])
-            
-            # Заголовки для доходов по источникам
-            writer.writerow(["Доходы по источникам", "", ""])
-            for source, amount in summary["revenue_by_source"].items():
-                writer.writerow([source, amount, ""])
-            
-            writer.writerow(["", "", ""])
-            
-            # Заголовки для транзакций
-            writer.writerow(["История транзакций", "", ""])
-            trans_headers = ["ID", "Дата", "Тип", "Источник", "Сумма (₽)", "Описание"]
-            writer.writerow(trans_headers)
-            
-            # Данные транзакций
-            for transaction in transactions:
-                row = [
-                    transaction.id,
-                    transaction.transaction_date,
-                    transaction.transaction_type,
-                    transaction.source_type,
-                    transaction.amount,
-                    transaction.description or "-"
-                ]
-                writer.writerow(row)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "text/csv"}
+            # Сводка, расходы по категориям и доходы по источникам
+            summary_rows = [
+                [period, "", ""],
+                ["", "", ""],
+                ["Выручка (₽)", summary["total_revenue"], ""],
+                ["Расходы (₽)", summary["total_expenses"], ""],
+                ["Комиссии (₽)", summary["total_commissions"], ""],
+                ["Прибыль (₽)", summary["total_profit"], ""],
+                ["Текущий баланс (₽)", summary["current_balance"], ""],
+                ["", "", ""],
+                ["Расходы по категориям", "", ""]
+            ]
+            summary_rows.extend([category, amount, ""] for category, amount in summary["expenses_by_category"].items())
+            summary_rows.append(["", "", ""])
+            summary_rows.append(["Доходы по источникам", "", ""])
+            summary_rows.extend([source, amount, ""] for source, amount in summary["revenue_by_source"].items())
+            summary_rows.append(["", "", ""])
+            
+            # Заголовки и данные транзакций
+            summary_rows.append(["История транзакций", "", ""])
+            summary_rows.append(["ID", "Дата", "Тип", "Источник", "Сумма (₽)", "Описание"])
+            trans_rows = ([
+                transaction["id"],
+                transaction["transaction_date"],
+                transaction["transaction_type"],
+                transaction["source_type"],
+                transaction["amount"],
+                transaction["description"] or "-"
+            ] for transaction in ExportService._track(transactions()))
+            
+            return {
+                "data": ExportService._iter_csv(["Период", "", ""], chain(summary_rows, trans_rows)),
+                "filename": filename,
+                "media_type": "text/csv"
+            }
         
         elif format == "xlsx":
-            # Экспорт в Excel
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Финансы"
-            
-            # Заголовки для сводки
-            headers = ["Период", "", ""]
-            sheet.append(headers)
-            
+            # Экспорт в Excel: строки пишутся потоково, книга не строится в памяти
             if date_from and date_to:
                 period = f"с {date_from} по {date_to}"
             elif date_from:
@@ -654,76 +527,237 @@ class ExportService:
             else:
                 period = "весь период"
             
-            sheet.append([period, "", ""])
-            sheet.append(["", "", ""])
-            
-            # Данные сводки
-            sheet.append(["Выручка (₽)", summary["total_revenue"], ""])
-            sheet.append(["Расходы (₽)", summary["total_expenses"], ""])
-            sheet.append(["Комиссии (₽)", summary["total_commissions"], ""])
-            sheet.append(["Прибыль (₽)", summary["total_profit"], ""])
-            sheet.append(["Текущий баланс (₽)", summary["current_balance"], ""])
-            sheet.append(["", "", ""])
-            
-            # Заголовки для расходов по категориям
-            sheet.append(["Расходы по категориям", "", ""])
-            for category, amount in summary["expenses_by_category"].items():
-                sheet.append([category, amount, ""])
-            
-            sheet.append(["", "", ""])
-            
-            # Заголовки для доходов по источникам
-            sheet.append(["Доходы по источникам", "", ""])
-            for source, amount in summary["revenue_by_source"].items():
-                sheet.append([source, amount, ""])
-            
-            sheet.append(["", "", ""])
-            
-            # Создаем второй лист для транзакций
-            trans_sheet = workbook.create_sheet(title="Транзакции")
+            # Лист сводки (без выделенной строки заголовков)
+            summary_rows = [
+                ["Период", "", ""],
+                [period, "", ""],
+                ["", "", ""],
+                ["Выручка (₽)", summary["total_revenue"], ""],
+                ["Расходы (₽)", summary["total_expenses"], ""],
+                ["Комиссии (₽)", summary["total_commissions"], ""],
+                ["Прибыль (₽)", summary["total_profit"], ""],
+                ["Текущий баланс (₽)", summary["current_balance"], ""],
+                ["", "", ""],
+                ["Расходы по категориям", "", ""]
+            ]
+            summary_rows.extend([category, amount, ""] for category, amount in summary["expenses_by_category"].items())
+            summary_rows.append(["", "", ""])
+            summary_rows.append(["Доходы по источникам", "", ""])
+            summary_rows.extend([source, amount, ""] for source, amount in summary["revenue_by_source"].items())
+            summary_rows.append(["", "", ""])
             
-            # Заголовки для транзакций
+            # Лист транзакций
             trans_headers = ["ID", "Дата", "Тип", "Источник", "Сумма (₽)", "Описание"]
-            trans_sheet.append(trans_headers)
-            
-            # Выделяем заголовки жирным
-            for cell in trans_sheet[1]:
-                cell.font = Font(bold=True)
-            
-            # Данные транзакций
-            for transaction in transactions:
-                row = [
-                    transaction.id,
-                    transaction.transaction_date,
-                    transaction.transaction_type,
-                    transaction.source_type,
-                    transaction.amount,
-                    transaction.description or "-"
-                ]
-                trans_sheet.append(row)
-            
-            # Автоматическая ширина столбцов для обоих листов
-            for sheet_name in workbook.sheetnames:
-                current_sheet = workbook[sheet_name]
-                for column in current_sheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        if cell.value:
-                            try:
-                                if len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                    adjusted_width = (max_length + 2)
-                    current_sheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Сохраняем в буфер
-            output = io.BytesIO()
+            trans_rows = ([
+                transaction["id"],
+                transaction["transaction_date"],
+                transaction["transaction_type"],
+                transaction["source_type"],
+                transaction["amount"],
+                transaction["description"] or "-"
+            ] for transaction in ExportService._track(transactions()))
+            
+            return {
+                "data": ExportService._build_xlsx([
+                    ("Финансы", None, summary_rows),
+                    ("Транзакции", trans_headers, trans_rows)
+                ]),
+                "filename": filename,
+                "media_type": XLSX_MEDIA_TYPE
+            }
+        
+        else:
+            return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx, parquet, arrow"}
+    
+    @staticmethod
+    def _build_xlsx(sheets: List[Tuple[str, Optional[List[str]], Iterable[list]]]) -> Iterator[bytes]:
+        """
+        Построение XLSX в режиме write-only.
+        
+        sheets — список (название листа, заголовки или None, итератор строк).
+        Строки пишутся по мере чтения, ширина столбцов оценивается по первым
+        XLSX_WIDTH_SAMPLE_ROWS строкам. Готовый файл буферизуется во временном
+        файле и отдается блоками.
+        """
+        # openpyxl загружается при первом экспорте, а не при старте приложения
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+        from openpyxl.utils import get_column_letter
+        
+        workbook = openpyxl.Workbook(write_only=True)
+        
+        for title, headers, rows in sheets:
+            sheet = workbook.create_sheet(title=title)
+            rows = iter(rows)
+            sample = list(islice(rows, XLSX_WIDTH_SAMPLE_ROWS))
+            
+            # Ширину столбцов нужно задать до записи первой строки
+            widths = {}
+            for row in chain([headers] if headers else [], sample):
+                for index, value in enumerate(row, start=1):
+                    if value is not None and value != "":
+                        widths[index] = max(widths.get(index, 0), len(str(value)))
+            for index, width in widths.items():
+                sheet.column_dimensions[get_column_letter(index)].width = width + 2
+            
+            # Заголовки выделяем жирным
+            if headers:
+                header_cells = []
+                for value in headers:
+                    cell = WriteOnlyCell(sheet, value=value)
+                    cell.font = Font(bold=True)
+                    header_cells.append(cell)
+                sheet.append(header_cells)
+            
+            for row in chain(sample, rows):
+                sheet.append(row)
+        
+        output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+        try:
             workbook.save(output)
-            output.seek(0)
-            
-            return {"data": output.getvalue(), "filename": filename, "media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
         
+        return ExportService._iter_file(output)
+    
+    @staticmethod
+    def _arrow_result(columns: List[Tuple[str, str]], chunks: Iterable[List[list]], format: str, filename: str) -> Dict[str, Any]:
+        """
+        Результат экспорта в parquet или arrow (IPC, он же Feather v2).
+        
+        columns — список (имя, тип), тип: int64, float64, string, bool, timestamp.
+        chunks — пачки строк со значениями в порядке columns (None — пусто).
+        pyarrow — необязательная зависимость, без нее возвращается ошибка.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return {"error": "Для экспорта в parquet и arrow требуется пакет pyarrow (pip install pyarrow)"}
+        
+        return {
+            "data": ExportService._build_arrow(columns, chunks, format),
+            "filename": filename,
+            "media_type": ARROW_MEDIA_TYPES[format]
+        }
+    
+    @staticmethod
+    def _build_arrow(columns: List[Tuple[str, str]], chunks: Iterable[List[list]], format: str) -> Iterator[bytes]:
+        """
+        Построение файла parquet/arrow. Пачки копятся до ARROW_ROW_GROUP_SIZE строк
+        и пишутся одной группой строк, готовый файл отдается блоками.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        arrow_types = {
+            "int64": pa.int64(),
+            "float64": pa.float64(),
+            "string": pa.string(),
+            "bool": pa.bool_(),
+            "timestamp": pa.timestamp("s")
+        }
+        schema = pa.schema([(name, arrow_types[column_type]) for name, column_type in columns])
+        timestamp_indexes = [index for index, (_, column_type) in enumerate(columns) if column_type == "timestamp"]
+        
+        output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+        if format == "parquet":
+            writer = pq.ParquetWriter(output, schema, compression="zstd")
         else:
-            return {"error": "Неподдерживаемый формат экспорта. Поддерживаются: csv, xlsx"}
\ No newline at end of file
+            writer = pa.ipc.new_file(output, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        
+        try:
+            pending = []
+            pending_rows = 0
+            for rows in chunks:
+                if not rows:
+                    continue
+                for row in rows:
+                    for index in timestamp_indexes:
+                        row[index] = ExportService._parse_datetime(row[index])
+                pending.append(pa.record_batch(
+                    [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                    schema=schema
+                ))
+                pending_rows += len(rows)
+                if pending_rows >= ARROW_ROW_GROUP_SIZE:
+                    writer.write_table(pa.Table.from_batches(pending).combine_chunks())
+                    pending = []
+                    pending_rows = 0
+            
+            if pending:
+                writer.write_table(pa.Table.from_batches(pending).combine_chunks())
+            writer.close()
+        except Exception:
+            output.close()
+            raise
+        output.seek(0)
+        
+        return ExportService._iter_file(output)
+    
+    @staticmethod
+    def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+    
+    @staticmethod
+    def _iter_csv(headers: List[str], rows: Iterable[list], block_rows: int = CSV_BLOCK_ROWS) -> Iterator[bytes]:
+        """
+        Потоковый CSV: заголовок и далее блоки по block_rows строк в UTF-8.
+        """
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(headers)
+        
+        rows = iter(rows)
+        while True:
+            block = list(islice(rows, block_rows))
+            writer.writerows(block)
+            data = output.getvalue()
+            if data:
+                yield data.encode("utf-8")
+            if len(block) < block_rows:
+                return
+            output.seek(0)
+            output.truncate()
+    
+    @staticmethod
+    def _iter_file(file, block_size: int = XLSX_STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+        """
+        Чтение файла блоками с закрытием после отдачи последнего блока.
+        """
+        try:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                yield block
+        finally:
+            file.close()
+    
+    @staticmethod
+    def _track(rows: Iterable) -> Iterator:
+        """
+        Передача строк дальше с отчетом о прогрессе фоновой задаче экспорта.
+        Без обработчика прогресса строки отдаются как есть.
+        """
+        on_progress = export_progress.get()
+        if on_progress is None:
+            yield from rows
+            return
+        
+        pending = 0
+        for row in rows:
+            yield row
+            pending += 1
+            if pending == EXPORT_PROGRESS_STEP:
+                on_progress(pending)
+                pending = 0
+        if pending:
+            on_progress(pending)
@@ -2,7 +2,7 @@
 Сервис для работы с финансами.
 """
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func, and_, or_
 
@@ -10,6 +10,14 @@ from models import CompanyBalance, Order, Expense, FinancialTransaction
 from models import Payment, Service, OrderService, OrderEmployee, Employee, Client
 from schemas import CompanyBalanceCreate
 from config import TRANSACTION_TYPES, TRANSACTION_SOURCE_TYPES
+from core import fetch_rows
+
+# Колонки транзакции в списках и выгрузках (в порядке полей ответа)
+TRANSACTION_LIST_COLUMNS = (
+    FinancialTransaction.id, FinancialTransaction.transaction_date, FinancialTransaction.amount,
+    FinancialTransaction.transaction_type, FinancialTransaction.source_type, FinancialTransaction.source_id,
+    FinancialTransaction.description, FinancialTransaction.created_at, FinancialTransaction.updated_at
+)
 
 class FinanceService:
     """
@@ -202,7 +210,7 @@ class FinanceService:
         """
         Получение истории финансовых транзакций с фильтрацией и пагинацией.
         """
-        query = db.query(FinancialTransaction).order_by(desc(FinancialTransaction.transaction_date))
+        query = db.query(*TRANSACTION_LIST_COLUMNS).order_by(desc(FinancialTransaction.transaction_date))
         
         if date_from:
             query = query.filter(FinancialTransaction.transaction_date >= date_from)
@@ -214,23 +222,8 @@ class FinanceService:
         # Получаем общее количество записей
         total_count = query.count()
         
-        # Применяем пагинацию
-        transactions = query.offset((page - 1) * limit).limit(limit).all()
-        
-        # Преобразуем модели SQLAlchemy в словари для сериализации
-        transactions_list = []
-        for transaction in transactions:
-            transactions_list.append({
-                "id": transaction.id,
-                "transaction_date": transaction.transaction_date,
-                "amount": transaction.amount,
-                "transaction_type": transaction.transaction_type,
-                "source_type": transaction.source_type,
-                "source_id": transaction.source_id,
-                "description": transaction.description,
-                "created_at": transaction.created_at,
-                "updated_at": transaction.updated_at
-            })
+        # Применяем пагинацию: строки сразу в словари, без ORM-объектов
+        transactions_list = fetch_rows(db, query.offset((page - 1) * limit).limit(limit))
         
         return {
             "transactions": transactions_list,
@@ -239,6 +232,45 @@ class FinanceService:
             "limit": limit
         }
     
+    @staticmethod
+    def iter_transactions(
+        db: Session,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        chunk_size: int = 1000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Все транзакции за период (в порядке get_transaction_history) пачками по chunk_size.
+        Пачки читаются по ключу (transaction_date, id) без OFFSET.
+        """
+        query = db.query(*TRANSACTION_LIST_COLUMNS)
+        
+        if date_from:
+            query = query.filter(FinancialTransaction.transaction_date >= date_from)
+        if date_to:
+            query = query.filter(FinancialTransaction.transaction_date <= date_to)
+        
+        last_date = last_id = None
+        while True:
+            chunk_query = query
+            if last_id is not None:
+                chunk_query = chunk_query.filter(or_(
+                    FinancialTransaction.transaction_date < last_date,
+                    and_(FinancialTransaction.transaction_date == last_date, FinancialTransaction.id < last_id)
+                ))
+            transactions = fetch_rows(db, chunk_query.order_by(
+                desc(FinancialTransaction.transaction_date), desc(FinancialTransaction.id)
+            ).limit(chunk_size))
+            if not transactions:
+                return
+            
+            last_date = transactions[-1]["transaction_date"]
+            last_id = transactions[-1]["id"]
+            yield transactions
+            
+            if len(transactions) < chunk_size:
+                return
+    
     @staticmethod
     def get_finance_summary(db: Session, date_from: Optional[str] = None, date_to: Optional[str] = None):
         """
@@ -271,8 +303,28 @@ class FinanceService:
             orders_query = orders_query.filter(Order.order_date <= date_to)
             expenses_query = expenses_query.filter(Expense.expense_date <= date_to)
         
-        # Получаем заказы и их услуги
+        # Получаем заказы, а их услуги, монтажников и клиентов — одним запросом на таблицу
+        # (заказы отбираются подзапросом, без длинного списка id в параметрах)
         orders = orders_query.all()
+        order_ids = orders_query.with_entities(Order.id)
+        
+        services_by_order: Dict[int, List[OrderService]] = {}
+        for order_service in db.query(OrderService).filter(
+            OrderService.order_id.in_(order_ids)
+        ).order_by(OrderService.id).all():
+            services_by_order.setdefault(order_service.order_id, []).append(order_service)
+        
+        employees_by_order: Dict[int, List[OrderEmployee]] = {}
+        for order_emp in db.query(OrderEmployee).filter(
+            OrderEmployee.order_id.in_(order_ids)
+        ).order_by(OrderEmployee.id).all():
+            employees_by_order.setdefault(order_emp.order_id, []).append(order_emp)
+        
+        services = {service.id: service for service in db.query(Service).all()}
+        clients = {
+            client.id: client
+            for client in db.query(Client).filter(Client.id.in_(orders_query.with_entities(Order.client_id))).all()
+        }
         
         # Рассчитываем выручку и комиссии по заказам
         for order in orders:
@@ -291,11 +343,11 @@ class FinanceService:
                 manager_mount_bonus = (order.mount_price - DEFAULT_MOUNT_PRICE) * MANAGER_MOUNT_UPSELL_PERCENT
                 summary["total_commissions"] += manager_mount_bonus
             
-            # Получаем все услуги заказа
-            order_services = db.query(OrderService).filter(OrderService.order_id == order.id).all()
+            # Все услуги заказа
+            order_services = services_by_order.get(order.id, [])
             
             for order_service in order_services:
-                service = db.query(Service).filter(Service.id == order_service.service_id).first()
+                service = services.get(order_service.service_id)
                 if service:
                     # Добавляем к выручке
                     summary["total_revenue"] += order_service.selling_price
@@ -318,12 +370,11 @@ class FinanceService:
                         summary["total_commissions"] += service.installer_bonus_fixed
             
             # Комиссии монтажникам за монтаж
-            order_employees = db.query(OrderEmployee).filter(OrderEmployee.order_id == order.id).all()
-            for order_emp in order_employees:
+            for order_emp in employees_by_order.get(order.id, []):
                 summary["total_commissions"] += order_emp.base_payment  # 1500 каждому
             
             # Добавляем к статистике по источникам
-            client = db.query(Client).filter(Client.id == order.client_id).first()
+            client = clients.get(order.client_id)
             if client:
                 if client.source not in summary["revenue_by_source"]:
                     summary["revenue_by_source"][client.source] = 0
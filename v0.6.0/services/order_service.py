@@ -2,7 +2,7 @@
 Сервис для работы с заказами.
 """
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 
@@ -15,6 +15,9 @@ from config import MANAGER_ORDER_COMMISSION, DEFAULT_MOUNT_PRICE, MANAGER_MOUNT_
 from config import MANAGER_CONDITIONER_COMMISSION_PERCENT, MANAGER_ADDON_COMMISSION_PERCENT
 from config import INSTALLER_BASE_PAYMENT, OWNER_MOUNT_COMMISSION, DEFAULT_MOUNT_PRICE_7_9, DEFAULT_MOUNT_PRICE_12_18
 
+# Размер пачки заказов при последовательном чтении всех заказов (экспорт)
+ORDERS_CHUNK_SIZE = 1000
+
 class OrderService:
     """
     Сервис для работы с заказами.
@@ -53,11 +56,8 @@ class OrderService:
         # Применяем пагинацию
         orders = query.offset((page - 1) * limit).limit(limit).all()
         
-        # Получаем детали для каждого заказа
-        order_details = []
-        for order in orders:
-            detail = OrderService.get_order_details(db, order.id)
-            order_details.append(detail)
+        # Детали всей страницы за фиксированное число запросов
+        order_details = OrderService.get_orders_details_bulk(db, orders)
         
         # Общее количество страниц
         total_pages = (total_count + limit - 1) // limit
@@ -154,6 +154,163 @@ class OrderService:
             "updated_at": order.updated_at
         }
     
+    @staticmethod
+    def iter_orders_details(
+        db: Session,
+        status: Optional[str] = None,
+        client_name: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        chunk_size: int = ORDERS_CHUNK_SIZE
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Все заказы по фильтрам (как в get_orders) пачками по chunk_size, новые первыми.
+        Пачки читаются по первичному ключу id без OFFSET (id растет вместе с created_at,
+        а по created_at нет индекса), детали каждой пачки подгружаются фиксированным числом запросов.
+        """
+        query = db.query(Order)
+        
+        if status:
+            query = query.filter(Order.status == status)
+        
+        if client_name:
+            query = query.join(Client).filter(Client.name.ilike(f"%{client_name}%"))
+        
+        if date_from:
+            query = query.filter(Order.order_date >= date_from)
+        
+        if date_to:
+            query = query.filter(Order.order_date <= date_to)
+        
+        last_id = None
+        while True:
+            chunk_query = query
+            if last_id is not None:
+                chunk_query = chunk_query.filter(Order.id < last_id)
+            orders = chunk_query.order_by(Order.id.desc()).limit(chunk_size).all()
+            if not orders:
+                return
+            
+            last_id = orders[-1].id
+            yield OrderService.get_orders_details_bulk(db, orders)
+            
+            if len(orders) < chunk_size:
+                return
+            # Не держим уже выгруженные объекты в identity map сессии
+            db.expunge_all()
+    
+    @staticmethod
+    def get_orders_details_bulk(db: Session, orders: List[Order]) -> List[Dict[str, Any]]:
+        """
+        Детали для списка заказов в том же формате, что и get_order_details,
+        но за фиксированное число запросов вместо нескольких на каждый заказ.
+        """
+        if not orders:
+            return []
+        
+        order_ids = [order.id for order in orders]
+        
+        order_employees = db.query(OrderEmployee).filter(OrderEmployee.order_id.in_(order_ids)).all()
+        order_services = db.query(OrderServiceModel).filter(OrderServiceModel.order_id.in_(order_ids)).all()
+        
+        # Все сотрудники, на которых ссылаются заказы: менеджеры, монтажники, продавцы услуг
+        employee_ids = {order.manager_id for order in orders}
+        employee_ids.update(emp.employee_id for emp in order_employees)
+        employee_ids.update(svc.sold_by_id for svc in order_services if svc.sold_by_id)
+        employees = {
+            employee.id: employee
+            for employee in db.query(Employee).filter(Employee.id.in_(employee_ids)).all()
+        }
+        
+        client_ids = {order.client_id for order in orders}
+        clients = {
+            client.id: client
+            for client in db.query(Client).filter(Client.id.in_(client_ids)).all()
+        }
+        
+        service_ids = {svc.service_id for svc in order_services}
+        services = {
+            service.id: service
+            for service in db.query(Service).filter(Service.id.in_(service_ids)).all()
+        } if service_ids else {}
+        
+        employees_by_order = {}
+        for emp in order_employees:
+            employees_by_order.setdefault(emp.order_id, []).append(emp)
+        
+        services_by_order = {}
+        for svc in order_services:
+            services_by_order.setdefault(svc.order_id, []).append(svc)
+        
+        result = []
+        for order in orders:
+            client = clients.get(order.client_id)
+            manager = employees.get(order.manager_id)
+            
+            employees_data = []
+            for emp in employees_by_order.get(order.id, []):
+                employee = employees.get(emp.employee_id)
+                if employee:
+                    employees_data.append({
+                        "id": employee.id,
+                        "name": employee.name,
+                        "employee_type": emp.employee_type,
+                        "base_payment": emp.base_payment
+                    })
+            
+            services_data = []
+            total_price = order.mount_price  # Начинаем с цены монтажа
+            
+            for svc in services_by_order.get(order.id, []):
+                service = services.get(svc.service_id)
+                sold_by = None
+                if svc.sold_by_id:
+                    sold_by_emp = employees.get(svc.sold_by_id)
+                    if sold_by_emp:
+                        sold_by = {
+                            "id": sold_by_emp.id,
+                            "name": sold_by_emp.name
+                        }
+                
+                if service:
+                    services_data.append({
+                        "id": service.id,
+                        "name": service.name,
+                        "category": service.category,
+                        "selling_price": svc.selling_price,
+                        "is_manager_bonus": service.is_manager_bonus,
+                        "sold_by": sold_by
+                    })
+                    
+                    # Добавляем к общей стоимости
+                    total_price += svc.selling_price
+            
+            result.append({
+                "id": order.id,
+                "client": {
+                    "id": client.id,
+                    "name": client.name,
+                    "phone": client.phone
+                } if client else None,
+                "manager": {
+                    "id": manager.id,
+                    "name": manager.name
+                } if manager else None,
+                "order_date": order.order_date,
+                "completion_date": order.completion_date,
+                "status": order.status,
+                "notes": order.notes,
+                "mount_price": order.mount_price,
+                "owner_commission": order.owner_commission,
+                "employees": employees_data,
+                "services": services_data,
+                "total_price": total_price,
+                "created_at": order.created_at,
+                "updated_at": order.updated_at
+            })
+        
+        return result
+    
     @staticmethod
     def create_order(db: Session, order_data: OrderCreate):
         """
@@ -404,7 +561,7 @@ class OrderService:
         total_commissions = order.owner_commission  # Комиссия владельца
         
         # Получаем все услуги заказа
-        order_services = db.query(OrderService).filter(OrderService.order_id == order_id).all()
+        order_services = db.query(OrderServiceModel).filter(OrderServiceModel.order_id == order_id).all()
         
         # Определяем стандартную стоимость монтажа в зависимости от типа кондиционера
         standard_mount_price = DEFAULT_MOUNT_PRICE_7_9  # По умолчанию для 7 и 9 БТЮ
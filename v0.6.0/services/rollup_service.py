@@ -0,0 +1,80 @@
+"""
+Сервис сводных отчетов по всем филиалам.
+
+Отчет каждого филиала считается теми же методами, что и в его разделах,
+на базе филиала (с архивом, если период начинается раньше его границы).
+Филиалы считаются параллельно в пуле из ROLLUP_WORKERS потоков: у каждой
+базы свой пул соединений, поэтому медленная база одного филиала не
+задерживает остальные. Результат — отчеты по филиалам и их сумма.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+from config import ROLLUP_WORKERS
+from core.tenancy import tenant_scope
+from database import SessionLocal, HistorySessionLocal, needs_archive, tenants
+from services.finance_service import FinanceService
+from services.client_service import ClientService
+
+_executor = ThreadPoolExecutor(max_workers=ROLLUP_WORKERS, thread_name_prefix="rollup")
+
+class RollupService:
+    """
+    Сервис для расчета сводных отчетов по филиалам.
+    """
+
+    @staticmethod
+    def _tenant_summary(name: str, date_from: Optional[str], date_to: Optional[str]) -> Dict[str, Any]:
+        """
+        Сводка одного филиала; выполняется в потоке пула от имени филиала.
+        """
+        with tenant_scope(name):
+            db = HistorySessionLocal() if needs_archive(date_from) else SessionLocal()
+            try:
+                return {
+                    "finance": FinanceService.get_finance_summary(db, date_from, date_to),
+                    "clients_by_source": ClientService.get_clients_by_source(db),
+                }
+            finally:
+                db.close()
+
+    @staticmethod
+    def _add(total: Dict[str, Any], report: Dict[str, Any]):
+        """
+        Сложение отчета филиала с итогом: числа суммируются, вложенные словари — по ключам.
+        """
+        for key, value in report.items():
+            if isinstance(value, dict):
+                RollupService._add(total.setdefault(key, {}), value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+
+    @staticmethod
+    def get_summary(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Финансовая сводка и клиенты по источникам за период по каждому филиалу и в сумме.
+        Ошибка одного филиала не прерывает отчет: филиал попадает в errors.
+        """
+        started = time.perf_counter()
+        futures = {
+            name: _executor.submit(RollupService._tenant_summary, name, date_from, date_to) for name in tenants
+        }
+        by_tenant, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                by_tenant[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+
+        total: Dict[str, Any] = {}
+        for report in by_tenant.values():
+            RollupService._add(total, report)
+        return {
+            "date_from": date_from,
+            "date_to": date_to,
+            "tenants": by_tenant,
+            "total": total,
+            "errors": errors,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
@@ -6,7 +6,8 @@ from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
 
-from models import Service, Order, OrderService
+from database import session_with_archive
+from models import Service, OrderService
 from schemas import ServiceCreate, ServiceUpdate
 
 class ServiceService:
@@ -41,11 +42,17 @@ class ServiceService:
         # Применяем пагинацию
         services = query.offset((page - 1) * limit).limit(limit).all()
         
-        # Подсчет использования каждой услуги
+        # Использование услуг страницы в заказах одним запросом
+        usage_by_service = dict(
+            db.query(OrderService.service_id, func.count(OrderService.id))
+            .filter(OrderService.service_id.in_([service.id for service in services]))
+            .group_by(OrderService.service_id)
+            .all()
+        ) if services else {}
+        
         services_with_usage = []
         for service in services:
-            # Подсчет использования услуги в заказах
-            usage = db.query(OrderService).filter(OrderService.service_id == service.id).count()
+            usage = usage_by_service.get(service.id, 0)
             
             service_dict = {
                 "id": service.id,
@@ -186,11 +193,11 @@ class ServiceService:
         if not service:
             return {"error": "Услуга не найдена"}
         
-        # Проверяем, используется ли услуга в заказах
-        used_in_orders = db.query(Order).filter(Order.service_id == service_id).first()
-        used_in_additional = db.query(OrderService).filter(OrderService.service_id == service_id).first()
+        # Проверяем, используется ли услуга в заказах (в том числе перенесенных в архив)
+        with session_with_archive(db) as orders_db:
+            used_in_orders = orders_db.query(OrderService.id).filter(OrderService.service_id == service_id).first()
         
-        if used_in_orders or used_in_additional:
+        if used_in_orders:
             return {"error": "Нельзя удалить услугу, она используется в заказах"}
         
         try:
@@ -209,16 +216,20 @@ class ServiceService:
         from sqlalchemy import func
         from config import SERVICE_CATEGORIES
         
-        stats = {}
+        # Количество и средняя цена услуг по всем категориям одним запросом
+        rows = {
+            row.category: row
+            for row in db.query(
+                Service.category, func.count(Service.id).label("count"), func.avg(Service.selling_price).label("avg_price")
+            ).group_by(Service.category).all()
+        }
         
-        # Подсчитываем количество услуг по каждой категории
+        stats = {}
         for category in SERVICE_CATEGORIES:
-            count = db.query(func.count(Service.id)).filter(Service.category == category).scalar()
-            avg_price = db.query(func.avg(Service.selling_price)).filter(Service.category == category).scalar() or 0
-            
+            row = rows.get(category)
             stats[category] = {
-                "count": count,
-                "avg_price": round(avg_price, 2)
+                "count": row.count if row else 0,
+                "avg_price": round(row.avg_price or 0, 2) if row else 0
             }
         
         return stats
\ No newline at end of file